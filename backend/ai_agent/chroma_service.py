@@ -4,9 +4,10 @@ Giúp AI Agent tìm kiếm sản phẩm bằng semantic search (tìm kiếm theo
 """
 
 import os
+import hashlib
 import logging
 import chromadb
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional
 from django.conf import settings
 from products.models import Product
 
@@ -232,6 +233,55 @@ class ChromaDBService:
         document = " | ".join(parts)
         return document
     
+    def document_hash(self, product: Product) -> str:
+        """Hash của document sản phẩm - đổi hash nghĩa là embedding cần tính lại"""
+        return hashlib.sha1(self._create_product_document(product).encode('utf-8')).hexdigest()
+
+    def _create_product_metadata(self, product: Product) -> Dict:
+        return {
+            "product_id": str(product.id),
+            "name": product.name,
+            "category": product.category.name if product.category else "Unknown",
+            "price": str(product.price),
+            "status": product.status,
+        }
+
+    def upsert_products(self, products: Iterable[Product]) -> int:
+        """Upsert embeddings cho nhiều sản phẩm trong một lần gọi ChromaDB"""
+        products = list(products)
+        if not products:
+            return 0
+        self.collection.upsert(
+            ids=[f"product_{product.id}" for product in products],
+            documents=[self._create_product_document(product) for product in products],
+            metadatas=[self._create_product_metadata(product) for product in products],
+        )
+        return len(products)
+
+    def delete_products(self, product_ids: Iterable[int]) -> int:
+        """Xóa embeddings của nhiều sản phẩm"""
+        ids = [f"product_{product_id}" for product_id in product_ids]
+        if ids:
+            self.collection.delete(ids=ids)
+        return len(ids)
+
+    def get_product_embeddings(self) -> Dict[int, List[float]]:
+        """
+        Lấy vector đã lưu của mọi sản phẩm trong collection.
+
+        Returns:
+            {product_id: embedding}
+        """
+        result = self.collection.get(include=['embeddings'])
+        embeddings = {}
+        for chroma_id, vector in zip(result.get('ids') or [], result.get('embeddings') or []):
+            try:
+                product_id = int(str(chroma_id).replace('product_', '', 1))
+            except ValueError:
+                continue
+            embeddings[product_id] = [float(value) for value in vector]
+        return embeddings
+
     def delete_product_embedding(self, product_id: int):
         """Xóa embedding của 1 sản phẩm (khi sản phẩm bị xóa)"""
         try:
@@ -247,13 +297,7 @@ class ChromaDBService:
         try:
             product_id = f"product_{product.id}"
             doc_text = self._create_product_document(product)
-            metadata = {
-                "product_id": str(product.id),
-                "name": product.name,
-                "category": product.category.name if product.category else "Unknown",
-                "price": str(product.price),
-                "status": product.status,
-            }
+            metadata = self._create_product_metadata(product)
             
             # Upsert (update hoặc insert)
             self.collection.upsert(
@@ -0,0 +1,64 @@
+"""
+Management command: python manage.py benchmark_message_analyzer
+Micro-benchmark bộ phân tích tin nhắn trên corpus câu hỏi tiếng Việt thật
+(ai_agent/fixtures/vietnamese_queries.json)
+"""
+
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+DEFAULT_CORPUS = Path(__file__).resolve().parents[2] / 'fixtures' / 'vietnamese_queries.json'
+
+
+class Command(BaseCommand):
+    help = 'Đo thời gian phân tích intent/keyword cho mỗi tin nhắn'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=str(DEFAULT_CORPUS), help='File JSON chứa danh sách câu hỏi')
+        parser.add_argument('--rounds', type=int, default=200, help='Số vòng lặp qua toàn bộ corpus')
+
+    def handle(self, *args, **options):
+        from ai_agent.message_analyzer import _analyze_normalized
+        from ai_agent.services import AIAgentService
+
+        with open(options['corpus'], encoding='utf-8') as corpus_file:
+            queries = json.load(corpus_file)
+
+        rounds = max(1, options['rounds'])
+        total = len(queries) * rounds
+        # Không khởi tạo system prompt (cần DB) vì benchmark chỉ đo phần phân tích
+        service = AIAgentService.__new__(AIAgentService)
+
+        def _per_message_stages(message: str):
+            # Các bước mà một lượt chat cần từ phần phân tích tin nhắn
+            service._extract_keywords_from_message(message)
+            service._extract_customer_preferences(message)
+            service._is_catalog_discovery_query(message)
+            service._is_specific_product_focus_query(message)
+            service._is_price_query(message)
+            service._extract_price_focus_keywords(message)
+            service._parse_budget_from_message(message)
+            service._should_show_recommendation_list(message.lower())
+
+        # 1) Phân tích không cache: chi phí thật của một tin nhắn mới
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for query in queries:
+                _analyze_normalized.__wrapped__(query.lower().strip())
+        uncached = (time.perf_counter() - started) / total * 1e6
+
+        # 2) Toàn bộ các bước của một lượt chat với tin nhắn mới
+        started = time.perf_counter()
+        for _ in range(rounds):
+            _analyze_normalized.cache_clear()
+            for query in queries:
+                _per_message_stages(query)
+        per_turn = (time.perf_counter() - started) / total * 1e6
+
+        self.stdout.write(f"📚 Corpus: {len(queries)} câu hỏi x {rounds} vòng")
+        self.stdout.write(f"⏱️  analyze_message (không cache): {uncached:.1f} µs/tin nhắn")
+        self.stdout.write(f"⏱️  Tất cả bước phân tích của 1 lượt chat: {per_turn:.1f} µs/tin nhắn")
+        self.stdout.write(self.style.SUCCESS('✅ Hoàn tất benchmark'))
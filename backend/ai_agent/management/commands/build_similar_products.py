@@ -0,0 +1,33 @@
+"""
+Management command: python manage.py build_similar_products
+Tính sẵn top-K sản phẩm tương tự (semantic) từ embedding trong ChromaDB.
+Mặc định chỉ tính lại phần bị ảnh hưởng bởi sản phẩm đổi hash document.
+"""
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Cập nhật chỉ mục sản phẩm tương tự (semantic neighbors) từ embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Upsert lại mọi embedding và tính lại toàn bộ chỉ mục',
+        )
+        parser.add_argument('--top-k', type=int, default=None, help='Ghi đè SEMANTIC_NEIGHBORS_TOP_K')
+
+    def handle(self, *args, **options):
+        try:
+            from ai_agent.semantic_neighbors import build_semantic_neighbors
+
+            result = build_semantic_neighbors(full=options['full'], top_k=options['top_k'])
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Lỗi: {str(e)}"))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {result['changed']} sản phẩm đổi hash, {result['removed']} bị gỡ, "
+            f"{result['recomputed']} danh sách được tính lại ({result['rows']} dòng)"
+        ))
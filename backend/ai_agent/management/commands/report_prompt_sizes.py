@@ -0,0 +1,75 @@
+"""
+Management command: python manage.py report_prompt_sizes
+So sánh kích thước prompt trước/sau khi dùng rolling summary + ngân sách token
+trên bộ hội thoại mẫu (ai_agent/fixtures/prompt_size_conversations.json)
+"""
+
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+DEFAULT_FIXTURE = Path(__file__).resolve().parents[2] / 'fixtures' / 'prompt_size_conversations.json'
+
+
+class Command(BaseCommand):
+    help = 'Báo cáo kích thước prompt (token ước lượng) trước/sau khi áp dụng rolling summary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture', default=str(DEFAULT_FIXTURE), help='File JSON chứa các hội thoại mẫu')
+        parser.add_argument('--max-tokens', type=int, default=None, help='Ghi đè AI_AGENT_PROMPT_MAX_TOKENS')
+
+    def handle(self, *args, **options):
+        from ai_agent.prompt_builder import (
+            DEFAULT_HISTORY_WINDOW,
+            DEFAULT_SUMMARY_MAX_TOKENS,
+            PromptBuilder,
+            estimate_tokens,
+            merge_summary,
+        )
+        from ai_agent.services import AIAgentService
+
+        with open(options['fixture'], encoding='utf-8') as fixture_file:
+            conversations = json.load(fixture_file)
+
+        service = AIAgentService()
+        builder = PromptBuilder(max_tokens=options['max_tokens'])
+
+        self.stdout.write(f"{'Hội thoại':<14}{'Messages':>10}{'Trước':>10}{'Sau':>10}{'Giảm':>8}")
+        total_before = 0
+        total_after = 0
+        for conversation in conversations:
+            user_message = conversation['user_message']
+            messages = conversation['messages'] + [{'role': 'user', 'content': user_message}]
+            grounding = service._build_runtime_grounding_context(user_message)
+
+            # Cách cũ: system prompt + grounding + 10 message thô gần nhất
+            legacy_history = ''.join(
+                f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+                for msg in messages[-10:]
+            )
+            before = estimate_tokens(service.system_prompt) + estimate_tokens(grounding) + \
+                estimate_tokens(legacy_history) + estimate_tokens(user_message)
+
+            folded_end = max(len(messages) - DEFAULT_HISTORY_WINDOW, 0)
+            summary = merge_summary('', messages[:folded_end], DEFAULT_SUMMARY_MAX_TOKENS)
+            prompt = builder.build(
+                system_prompt=service.system_prompt,
+                grounding=grounding,
+                summary=summary,
+                messages=messages[folded_end:],
+                user_message=user_message,
+            )
+            after = prompt.estimated_tokens
+
+            total_before += before
+            total_after += after
+            reduction = (1 - after / before) * 100 if before else 0
+            self.stdout.write(
+                f"{conversation['name']:<14}{len(messages):>10}{before:>10}{after:>10}{reduction:>7.1f}%"
+            )
+
+        reduction = (1 - total_after / total_before) * 100 if total_before else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Tổng: {total_before} -> {total_after} token (giảm {reduction:.1f}%, trần {builder.max_tokens})"
+        ))
@@ -0,0 +1,427 @@
+"""
+Bộ phân tích tin nhắn một lượt (single-pass) cho AI Agent.
+
+Toàn bộ danh sách từ khóa nhận diện ý định (khám phá catalog, hỏi giá, so sánh,
+màu/size/chất liệu/dịp tặng, ngân sách...) được biên dịch một lần lúc import
+thành một automaton regex duy nhất chạy trên text đã bỏ dấu. Mỗi tin nhắn chỉ
+được chuẩn hóa + quét một lần, kết quả là một MessageAnalysis bất biến mà mọi
+bước sau (grounding, lọc sản phẩm, build response) dùng chung.
+
+Lưu ý: bỏ dấu chỉ dùng để gom biến thể có dấu/không dấu của cùng một từ khóa
+vào một pattern. Mỗi vị trí khớp đều được đối chiếu lại với dạng gốc trong
+text, nên kết quả giữ nguyên ngữ nghĩa "keyword in text" như trước (vd "hãy"
+không bị coi là "hay") và các term trả về giữ đúng dạng khách đã gõ.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+# ============== TỪ ĐIỂN TỪ KHÓA ==============
+
+KEYWORD_CATEGORIES: Dict[str, List[str]] = {
+    'discovery': [
+        'co nhung san pham nao', 'có những sản phẩm nào', 'co gi', 'có gì',
+        'tat ca san pham', 'tất cả sản phẩm', 'toan bo san pham', 'toàn bộ sản phẩm',
+        'danh muc', 'danh mục', 'menu', 'catalog', 'catalogue',
+        'goi y chung', 'gợi ý chung', 'tu van tong quan', 'tư vấn tổng quan'
+    ],
+    'compare_marker': ['so sanh', 'so sánh', 'vs', 'voi', 'với', 'hay', 'giua', 'giữa'],
+    'list_marker': [
+        'goi y', 'gợi ý', 'danh sach', 'danh sách', 'nhieu mau', 'nhiều mẫu',
+        'tu van', 'tư vấn', 'san pham nao', 'sản phẩm nào', 'co gi', 'có gì'
+    ],
+    'named_cue': ['bear', 'teddy', 'panda', 'bunny'],
+    'question_form': ['co', 'có', 'khong', 'không', 'xem', 'lay', 'lấy'],
+    'price_marker': [
+        'gia', 'giá', 'bao nhieu', 'bao nhiêu', 'bn', 'nhiu tien', 'nhiêu tiền',
+        'muc gia', 'mức giá', 'price', 'bao tien', 'bao tiền'
+    ],
+    'recommendation': [
+        'goi y', 'gợi ý', 'de xuat', 'đề xuất', 'tu van san pham', 'tư vấn sản phẩm',
+        'xem san pham', 'xem mẫu', 'xem mau', 'mau nao', 'mẫu nào', 'list',
+        'danh sach', 'danh sách', 'chon giup', 'chọn giúp', 'recommend',
+        'chon san pham', 'chọn sản phẩm', 'nen mua', 'nên mua', 'mau phu hop', 'mẫu phù hợp',
+        'san pham nao', 'sản phẩm nào', 'co san pham nao', 'có sản phẩm nào',
+        'co mau nao', 'có mẫu nào', 'co loai nao', 'có loại nào'
+    ],
+    'yes_no_plain': ['co', 'khong'],
+    'yes_no_accented': ['có', 'không'],
+    'which': ['nao', 'nào'],
+    'product_context': ['san pham', 'sản phẩm', 'mau', 'mẫu', 'gau bong', 'gấu bông'],
+    'gift_context': ['tang', 'tặng', 'qua', 'quà', 'nguoi yeu', 'người yêu'],
+    'color': ['hong', 'hồng', 'trang', 'trắng', 'nau', 'nâu', 'xam', 'xám', 'den', 'đen', 'xanh', 'do', 'đỏ'],
+    'size': ['to', 'lon', 'lớn', 'mini', 'nho', 'nhỏ', 'size m', 'size l', 'size xl'],
+    'material': ['mem', 'mềm', 'nhung', 'bong min', 'bông mịn', 'om', 'ôm'],
+    'occasion': ['sinh nhat', 'sinh nhật', 'valentine', 'ky niem', 'kỷ niệm', 'tot nghiep', 'tốt nghiệp', 'noel'],
+    'gift_for_love': ['nguoi yeu', 'người yêu', 'ban gai', 'bạn gái', 'ban trai', 'bạn trai'],
+    'gift_for_child': ['be', 'bé', 'tre em', 'trẻ em'],
+    'budget_low': ['duoi', 'dưới', 'toi da', 'tối đa', 'khong qua', 'không quá', '<=', '<'],
+    'budget_high': ['tren', 'trên', 'tu', 'từ', 'it nhat', 'ít nhất', '>=', '>'],
+}
+
+# Các nhóm cần biết vị trí khớp (để xét ngữ cảnh quanh số tiền)
+POSITIONAL_CATEGORIES = ('budget_low', 'budget_high')
+
+COMMON_WORDS = frozenset({
+    'la', 'là', 'toi', 'tôi', 'minh', 'mình', 'ban', 'bạn', 'cho',
+    'xin', 'nho', 'nhờ', 'giup', 'giúp', 'voi', 'với', 'toi_can',
+    'can', 'cần', 'muon', 'muốn', 'tim', 'tìm', 'san', 'sản',
+    'pham', 'phẩm', 'co', 'có', 'khong', 'không', 'nao', 'nào',
+    'va', 'và', 'hoac', 'hoặc', 'nhung', 'nhưng', 'de', 'để',
+    'trong', 'ngoai', 'ngoài', 'gi', 'gì', 'duoc', 'được', 'ah',
+    'a', 'ạ', 'nhe', 'nhé', 'nha', 'nhà', 'em', 'anh', 'chi', 'chị',
+    'gia', 'giá', 'tu', 'từ', 'den', 'đến', 'khoang', 'khoảng',
+    'tam', 'tầm', 'ngan', 'ngàn', 'nghin', 'nghìn', 'tr', 'trieu',
+    'triệu', 'vnd', 'đ', 'dong', 'đồng'
+})
+
+GENERIC_KEYWORDS = frozenset({
+    'gau', 'gấu', 'bong', 'bông', 'gau bong', 'gấu bông',
+    'qua', 'quà', 'tang', 'tặng', 'qua tang', 'quà tặng',
+    'shop', 'mua', 'tim', 'tìm', 'san pham', 'sản phẩm'
+})
+
+PRICE_NOISE_WORDS = frozenset({
+    'gia', 'giá', 'bao', 'nhieu', 'nhiêu', 'bn', 'tien', 'tiền',
+    'muc', 'mức', 'price', 'sp', 'san', 'sản', 'pham', 'phẩm',
+    'nay', 'này', 'kia', 'đó', 'do', 'co', 'có', 'la', 'là',
+    'khong', 'không', 'duoc', 'được', 'khuyen', 'khuyến', 'mai', 'sale'
+})
+
+MAX_KEYWORDS = 8
+MAX_PRICE_FOCUS_KEYWORDS = 6
+
+# ============== BỎ DẤU (1 ký tự -> 1 ký tự) ==============
+
+
+def _build_fold_table() -> Dict[int, str]:
+    table = {ord('đ'): 'd', ord('Đ'): 'D'}
+    # Latin-1, Latin Extended A/B và Latin Extended Additional (chữ Việt)
+    for start, end in ((0x00C0, 0x0250), (0x1E00, 0x1F00)):
+        for code in range(start, end):
+            char = chr(code)
+            base = unicodedata.normalize('NFD', char)[0]
+            if base != char and len(base) == 1:
+                table.setdefault(code, base)
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt, giữ nguyên độ dài chuỗi để vị trí khớp map ngược được"""
+    return text.translate(_FOLD_TABLE)
+
+
+# ============== AUTOMATON ==============
+
+
+def _trie_to_regex(patterns: Sequence[str]) -> str:
+    """
+    Dựng regex dạng trie (gom tiền tố chung) để tại mỗi vị trí regex engine chỉ
+    rẽ nhánh theo ký tự tiếp theo thay vì thử lần lượt từng từ khóa.
+    Nhánh dài hơn được thử trước (quantifier ? tham lam) nên luôn khớp dài nhất.
+    """
+    trie: Dict = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def _build(node: Dict) -> str:
+        branches = [
+            re.escape(char) + _build(child)
+            for char, child in sorted(node.items())
+            if char != ''
+        ]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return _build(trie)
+
+
+def _compile_automaton():
+    """
+    Biên dịch mọi từ khóa thành một regex trie duy nhất trên text đã bỏ dấu.
+
+    Lookahead (?=(...)) trả về pattern dài nhất khớp tại mỗi vị trí; các pattern
+    ngắn hơn khớp cùng vị trí chắc chắn là tiền tố của nó nên được tra từ bảng
+    prefix đã tính sẵn.
+    """
+    # folded pattern -> {surface keyword -> [(category, thứ tự trong danh sách)]}
+    surface_index: Dict[str, Dict[str, List[Tuple[str, int]]]] = defaultdict(lambda: defaultdict(list))
+    for category, terms in KEYWORD_CATEGORIES.items():
+        for order, term in enumerate(terms):
+            surface_index[fold_diacritics(term)][term].append((category, order))
+
+    patterns = sorted(surface_index, key=len, reverse=True)
+    prefixes = {
+        pattern: [other for other in patterns if pattern.startswith(other)]
+        for pattern in patterns
+    }
+    regex = re.compile('(?=(' + _trie_to_regex(patterns) + '))')
+    frozen_index = {
+        pattern: {surface: tuple(targets) for surface, targets in surfaces.items()}
+        for pattern, surfaces in surface_index.items()
+    }
+    return regex, prefixes, frozen_index
+
+
+_AUTOMATON, _PREFIXES, _SURFACE_INDEX = _compile_automaton()
+
+_NON_WORD_RE = re.compile(r"[^\w\s]", flags=re.UNICODE)
+_DIGIT_RE = re.compile(r"\d")
+
+_MONEY_UNIT = r"(k|nghin|nghìn|ngan|ngàn|tr|triệu|m|đ|vnd)"
+_RANGE_RE = re.compile(
+    r"tu\s+(\d[\d\.,]*)\s*" + _MONEY_UNIT + r"?\s+"
+    r"(?:den|đến)\s+(\d[\d\.,]*)\s*" + _MONEY_UNIT + r"?"
+)
+_DASH_RANGE_RE = re.compile(
+    r"(\d[\d\.,]*)\s*" + _MONEY_UNIT + r"?\s*[-–~]\s*"
+    r"(\d[\d\.,]*)\s*" + _MONEY_UNIT + r"?"
+)
+_MONEY_RE = re.compile(r"(\d[\d\.,]*)\s*" + _MONEY_UNIT)
+
+
+def _scan(text: str, folded: str):
+    """Quét một lượt, trả về (matches theo nhóm, vị trí khớp của nhóm positional)"""
+    found: Dict[str, Dict[int, str]] = defaultdict(dict)
+    positions: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    for match in _AUTOMATON.finditer(folded):
+        start = match.start()
+        for pattern in _PREFIXES[match.group(1)]:
+            end = start + len(pattern)
+            surface = text[start:end]
+            targets = _SURFACE_INDEX[pattern].get(surface)
+            if not targets:
+                continue
+            for category, order in targets:
+                found[category][order] = surface
+                if category in POSITIONAL_CATEGORIES:
+                    positions[category].append((start, end))
+
+    matches = {
+        category: tuple(by_order[order] for order in sorted(by_order))
+        for category, by_order in found.items()
+    }
+    return matches, positions
+
+
+def _extract_keywords(text: str) -> Tuple[str, ...]:
+    normalized = _NON_WORD_RE.sub(" ", text)
+    keywords: List[str] = []
+    seen = set()
+    for word in normalized.split():
+        # Chỉ loại các từ chức năng, giữ lại từ mô tả nhu cầu như "bé", "mềm", "quà"...
+        if len(word) < 2 or word in COMMON_WORDS:
+            continue
+        # Bỏ token có chữ số (giá/budget) để tránh khóa vào giá trị tiền tệ.
+        if _DIGIT_RE.search(word):
+            continue
+        if word not in seen:
+            seen.add(word)
+            keywords.append(word)
+    return tuple(keywords[:MAX_KEYWORDS])
+
+
+def _to_vnd(raw_amount: str, unit: str = '') -> Optional[int]:
+    if not raw_amount:
+        return None
+
+    value_text = raw_amount.strip().replace(' ', '')
+    try:
+        # Hỗ trợ dạng 1.5tr / 1,5tr
+        if ('.' in value_text or ',' in value_text) and unit in {'tr', 'triệu', 'm'}:
+            value = float(value_text.replace(',', '.'))
+        else:
+            value = float(value_text.replace('.', '').replace(',', ''))
+    except ValueError:
+        return None
+
+    unit = (unit or '').strip()
+    if unit in {'k', 'nghin', 'nghìn', 'ngan', 'ngàn'}:
+        value *= 1000
+    elif unit in {'tr', 'triệu', 'm'}:
+        value *= 1000000
+
+    return int(value)
+
+
+def _parse_budget(text: str, positions: Mapping[str, Sequence[Tuple[int, int]]]) -> Tuple[Optional[int], Optional[int]]:
+    # Ưu tiên parse khoảng giá: "từ X đến Y"
+    range_match = _RANGE_RE.search(text)
+    if range_match:
+        min_price = _to_vnd(range_match.group(1), range_match.group(2) or '')
+        max_price = _to_vnd(range_match.group(3), range_match.group(4) or '')
+        if min_price is not None and max_price is not None:
+            return (min(min_price, max_price), max(min_price, max_price))
+
+    # Parse dạng "200k - 500k" hoặc "200k-500k"
+    dash_range_match = _DASH_RANGE_RE.search(text)
+    if dash_range_match:
+        unit_left = dash_range_match.group(2) or ''
+        unit_right = dash_range_match.group(4) or unit_left
+        min_price = _to_vnd(dash_range_match.group(1), unit_left)
+        max_price = _to_vnd(dash_range_match.group(3), unit_right)
+        if min_price is not None and max_price is not None:
+            return (min(min_price, max_price), max(min_price, max_price))
+
+    min_price = None
+    max_price = None
+
+    def _in_context(category: str, context_start: int, context_end: int) -> bool:
+        return any(
+            start >= context_start and end <= context_end
+            for start, end in positions.get(category, ())
+        )
+
+    # Parse tất cả giá trị tiền tệ trong câu
+    for match in _MONEY_RE.finditer(text):
+        price_val = _to_vnd(match.group(1), match.group(2))
+        if price_val is None:
+            continue
+
+        context_start = max(match.start() - 16, 0)
+        context_end = min(match.end() + 8, len(text))
+
+        if _in_context('budget_low', context_start, context_end):
+            max_price = price_val if max_price is None else min(max_price, price_val)
+            continue
+
+        if _in_context('budget_high', context_start, context_end):
+            min_price = price_val if min_price is None else max(min_price, price_val)
+            continue
+
+        # Mặc định nếu không xác định được ngữ nghĩa, coi là ngân sách trần
+        max_price = price_val if max_price is None else min(max_price, price_val)
+
+    return (min_price, max_price)
+
+
+# ============== KẾT QUẢ PHÂN TÍCH ==============
+
+
+@dataclass(frozen=True)
+class MessageAnalysis:
+    """Kết quả phân tích bất biến của một tin nhắn"""
+    text: str
+    folded: str
+    keywords: Tuple[str, ...]
+    specific_keywords: Tuple[str, ...]
+    price_focus_keywords: Tuple[str, ...]
+    matches: Mapping[str, Tuple[str, ...]]
+    budget: Tuple[Optional[int], Optional[int]]
+
+    def has(self, category: str) -> bool:
+        return category in self.matches
+
+    def terms(self, category: str) -> Tuple[str, ...]:
+        return self.matches.get(category, ())
+
+    @property
+    def is_catalog_discovery(self) -> bool:
+        return self.has('discovery')
+
+    @property
+    def is_price_query(self) -> bool:
+        return bool(self.text) and self.has('price_marker')
+
+    @property
+    def has_budget(self) -> bool:
+        return self.budget[0] is not None or self.budget[1] is not None
+
+    @property
+    def gift_for_love(self) -> bool:
+        return self.has('gift_for_love')
+
+    @property
+    def gift_for_child(self) -> bool:
+        return self.has('gift_for_child')
+
+    @property
+    def constraint_terms(self) -> Tuple[str, ...]:
+        return tuple(dict.fromkeys(
+            self.specific_keywords
+            + self.terms('color')
+            + self.terms('size')
+            + self.terms('material')
+            + self.terms('occasion')
+        ))
+
+    def is_specific_focus(self, keywords: Optional[Sequence[str]] = None) -> bool:
+        """
+        Câu hỏi tập trung vào một mẫu cụ thể (vd: "gấu bear").
+        Mặc định dùng toàn bộ keywords của câu như hàm cũ.
+        """
+        if not self.text:
+            return False
+        if self.has('compare_marker') or self.has('list_marker'):
+            return False
+
+        keywords = keywords or self.keywords
+        if not keywords:
+            return False
+
+        # Câu ngắn có 1-2 từ khóa đặc thù thường là hỏi đích danh 1 mẫu.
+        return (len(keywords) <= 2 and self.has('question_form')) or self.has('named_cue')
+
+    @property
+    def wants_recommendation_list(self) -> bool:
+        if self.has('recommendation') or self.is_price_query:
+            return True
+        if self.has('product_context') and self.has('gift_context'):
+            return True
+        return (
+            len(self.terms('yes_no_plain')) == 2
+            or len(self.terms('yes_no_accented')) == 2
+            or self.has('which')
+        )
+
+    def preferences(self) -> Dict:
+        """Dict tiêu chí khách hàng (định dạng cũ của _extract_customer_preferences)"""
+        return {
+            'specific_keywords': list(self.specific_keywords),
+            'color_terms': list(self.terms('color')),
+            'size_terms': list(self.terms('size')),
+            'material_terms': list(self.terms('material')),
+            'occasion_terms': list(self.terms('occasion')),
+            'gift_for_love': self.gift_for_love,
+            'gift_for_child': self.gift_for_child,
+            'constraint_terms': list(self.constraint_terms),
+        }
+
+
+def analyze_message(message: str) -> MessageAnalysis:
+    """
+    Chuẩn hóa + quét tin nhắn một lượt. Kết quả được cache theo text đã chuẩn
+    hóa nên các bước trong cùng một lượt chat gọi lại không tốn thêm chi phí.
+    """
+    return _analyze_normalized((message or '').lower().strip())
+
+
+@lru_cache(maxsize=2048)
+def _analyze_normalized(text: str) -> MessageAnalysis:
+    folded = fold_diacritics(text)
+    matches, positions = _scan(text, folded)
+    keywords = _extract_keywords(text)
+
+    return MessageAnalysis(
+        text=text,
+        folded=folded,
+        keywords=keywords,
+        specific_keywords=tuple(k for k in keywords if k not in GENERIC_KEYWORDS),
+        price_focus_keywords=tuple(
+            k for k in keywords if k not in PRICE_NOISE_WORDS
+        )[:MAX_PRICE_FOCUS_KEYWORDS],
+        matches=MappingProxyType(matches),
+        budget=_parse_budget(text, positions),
+    )
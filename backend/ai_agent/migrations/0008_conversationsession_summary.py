@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent', '0007_remove_automatedorder_and_extend_recommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsession',
+            name='summary',
+            field=models.TextField(blank=True, default='', help_text='Tóm tắt các lượt chat đã rơi ra khỏi cửa sổ gần nhất'),
+        ),
+        migrations.AddField(
+            model_name='conversationsession',
+            name='summary_message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Số message đầu tiên đã được gộp vào summary'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent', '0008_conversationsession_summary'),
+        ('products', '0009_productneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductEmbeddingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_hash', models.CharField(max_length=40)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding_state', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Trạng thái embedding sản phẩm',
+                'verbose_name_plural': 'Trạng thái embedding sản phẩm',
+            },
+        ),
+    ]
@@ -14,6 +14,8 @@ class ConversationSession(models.Model):
     customer_phone = models.CharField(max_length=20, blank=True, null=True, help_text='SĐT khách hàng (nếu là vãng lai)')
     customer_email = models.EmailField(blank=True, null=True, help_text='Email khách hàng (nếu là vãng lai)')
     context = models.TextField(blank=True, help_text="JSON context for conversation history")
+    summary = models.TextField(blank=True, default='', help_text='Tóm tắt các lượt chat đã rơi ra khỏi cửa sổ gần nhất')
+    summary_message_count = models.PositiveIntegerField(default=0, help_text='Số message đầu tiên đã được gộp vào summary')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
@@ -170,3 +172,17 @@ class AIRecommendation(models.Model):
         self.created_order_code = order_code
         self.converted_at = timezone.now()
         self.save(update_fields=['is_selected_for_order', 'created_order_code', 'converted_at'])
+
+
+class ProductEmbeddingState(models.Model):
+    """Hash document của sản phẩm tại lần tính lân cận semantic gần nhất"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='embedding_state')
+    document_hash = models.CharField(max_length=40)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Trạng thái embedding sản phẩm'
+        verbose_name_plural = 'Trạng thái embedding sản phẩm'
+
+    def __str__(self):
+        return f"{self.product_id} - {self.document_hash[:8]}"
@@ -0,0 +1,252 @@
+"""
+Dựng prompt cho LLM theo ngân sách token.
+
+Prompt gồm: system prompt + grounding + tóm tắt hội thoại (rolling summary)
++ các lượt chat gần nhất + câu hỏi hiện tại. Tổng kích thước luôn bị chặn bởi
+AI_AGENT_PROMPT_MAX_TOKENS; phần nào vượt ngân sách sẽ bị cắt bớt theo thứ tự
+ưu tiên (turn cũ nhất -> grounding -> tóm tắt).
+
+Các lượt chat rơi ra khỏi cửa sổ gần nhất được gộp dần vào
+ConversationSession.summary (tóm tắt trích xuất, không gọi LLM).
+"""
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ~4 ký tự / token là ước lượng đủ tốt cho cả tiếng Việt có dấu và tiếng Anh
+CHARS_PER_TOKEN = 4
+
+DEFAULT_PROMPT_MAX_TOKENS = 6000
+DEFAULT_HISTORY_WINDOW = 6
+DEFAULT_SUMMARY_MAX_TOKENS = 300
+DEFAULT_TURN_MAX_TOKENS = 120
+
+SUMMARY_LINE_MAX_CHARS = 160
+# Phần khung cố định của prompt (tiêu đề, nhãn vai trò)
+PROMPT_OVERHEAD_TOKENS = 32
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một đoạn text"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cắt text để không vượt quá max_tokens (cắt ở ranh giới từ nếu được)"""
+    if max_tokens <= 0 or not text:
+        return ''
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 3]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut + '...'
+
+
+def _setting(name: str, default: int) -> int:
+    try:
+        return int(getattr(settings, name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def summarize_turn(message: Dict) -> str:
+    """Tóm tắt một message thành 1 dòng ngắn"""
+    content = re.sub(r'\s+', ' ', message.get('content') or '').strip()
+    if message.get('role') == 'user':
+        return f"- Khách: {truncate_to_tokens(content, SUMMARY_LINE_MAX_CHARS // CHARS_PER_TOKEN)}"
+
+    # Với câu trả lời của trợ lý chỉ giữ câu đầu + tên sản phẩm đã gợi ý
+    first_sentence = re.split(r'(?<=[.!?])\s', content, maxsplit=1)[0]
+    line = f"- Trợ lý: {truncate_to_tokens(first_sentence, SUMMARY_LINE_MAX_CHARS // CHARS_PER_TOKEN)}"
+    product_names = [p.get('name') for p in (message.get('products') or []) if p.get('name')]
+    if product_names:
+        line += f" (đã gợi ý: {', '.join(product_names[:5])})"
+    return line
+
+
+def merge_summary(summary: str, messages: List[Dict], max_tokens: int) -> str:
+    """Gộp thêm các message vào tóm tắt, bỏ các dòng cũ nhất nếu vượt ngân sách"""
+    lines = [line for line in (summary or '').split('\n') if line.strip()]
+    lines.extend(summarize_turn(message) for message in messages)
+    while lines and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def load_history(conversation, window: int = None) -> Dict:
+    """
+    Lấy cửa sổ message gần nhất và cập nhật rolling summary cho các message
+    đã rơi ra khỏi cửa sổ (chỉ xử lý phần mới, không tóm tắt lại từ đầu).
+
+    Returns:
+        {'summary': str, 'messages': List[Dict]}
+    """
+    from .models import ConversationSession
+
+    if window is None:
+        window = _setting('AI_AGENT_HISTORY_WINDOW', DEFAULT_HISTORY_WINDOW)
+
+    message_qs = conversation.messages.order_by('created_at', 'id')
+    total = message_qs.count()
+    if total:
+        recent = [m.to_context_message() for m in message_qs[max(total - window, 0):]]
+        folded_end = max(total - window, 0)
+        pending = []
+        if folded_end > conversation.summary_message_count:
+            pending = [
+                m.to_context_message()
+                for m in message_qs[conversation.summary_message_count:folded_end]
+            ]
+    else:
+        # Hội thoại cũ chỉ có messages trong context JSON
+        legacy_messages = conversation.get_context().get('messages', [])
+        total = len(legacy_messages)
+        folded_end = max(total - window, 0)
+        recent = legacy_messages[folded_end:]
+        pending = legacy_messages[conversation.summary_message_count:folded_end]
+
+    if pending:
+        conversation.summary = merge_summary(
+            conversation.summary,
+            pending,
+            _setting('AI_AGENT_SUMMARY_MAX_TOKENS', DEFAULT_SUMMARY_MAX_TOKENS)
+        )
+        conversation.summary_message_count = folded_end
+        # Dùng update() để không ghi đè context đang được add_message cập nhật
+        ConversationSession.objects.filter(pk=conversation.pk).update(
+            summary=conversation.summary,
+            summary_message_count=conversation.summary_message_count
+        )
+
+    return {
+        'summary': conversation.summary or '',
+        'messages': recent,
+    }
+
+
+@dataclass
+class BudgetedPrompt:
+    """Kết quả dựng prompt sau khi áp ngân sách token"""
+    system_prompt: str
+    grounding: str
+    summary: str
+    user_message: str
+    turns: List[Dict] = field(default_factory=list)
+    dropped_turns: int = 0
+
+    @property
+    def context_text(self) -> str:
+        """System prompt + grounding + tóm tắt dưới dạng một khối text"""
+        blocks = [self.system_prompt, self.grounding]
+        if self.summary:
+            blocks.append(f"Tóm tắt hội thoại trước đó:\n{self.summary}")
+        return '\n\n'.join(block for block in blocks if block)
+
+    @property
+    def history_text(self) -> str:
+        history_text = ''
+        for msg in self.turns:
+            role = 'User' if msg['role'] == 'user' else 'Assistant'
+            history_text += f"{role}: {msg['content']}\n"
+        return history_text
+
+    def to_gemini_prompt(self) -> str:
+        return f"""{self.context_text}
+
+Lịch sử trò chuyện:
+{self.history_text}
+
+Khách hàng: {self.user_message}
+
+Trợ lý:"""
+
+    def to_openai_messages(self) -> List[Dict]:
+        messages = [{'role': 'system', 'content': self.system_prompt}]
+        if self.grounding:
+            messages.append({'role': 'system', 'content': self.grounding})
+        if self.summary:
+            messages.append({'role': 'system', 'content': f"Tóm tắt hội thoại trước đó:\n{self.summary}"})
+        for msg in self.turns:
+            messages.append({'role': msg['role'], 'content': msg['content']})
+        messages.append({'role': 'user', 'content': self.user_message})
+        return messages
+
+    @property
+    def estimated_tokens(self) -> int:
+        return sum(estimate_tokens(m['content']) for m in self.to_openai_messages())
+
+
+class PromptBuilder:
+    """Dựng prompt có chặn cứng số token"""
+
+    def __init__(self, max_tokens: int = None, turn_max_tokens: int = None):
+        self.max_tokens = max_tokens or _setting('AI_AGENT_PROMPT_MAX_TOKENS', DEFAULT_PROMPT_MAX_TOKENS)
+        self.turn_max_tokens = turn_max_tokens or _setting('AI_AGENT_TURN_MAX_TOKENS', DEFAULT_TURN_MAX_TOKENS)
+
+    def build(self, system_prompt: str, grounding: str, summary: str, messages: List[Dict], user_message: str) -> BudgetedPrompt:
+        """
+        Args:
+            messages: Các lượt gần nhất (message cuối có thể là câu hỏi hiện tại)
+            user_message: Câu hỏi hiện tại, luôn được giữ nguyên
+        """
+        budget = self.max_tokens - PROMPT_OVERHEAD_TOKENS
+        # System prompt và câu hỏi hiện tại là bắt buộc, chỉ cắt khi tự chúng đã vượt trần
+        user_message = truncate_to_tokens(user_message or '', budget // 4)
+        system_prompt = truncate_to_tokens(system_prompt or '', budget // 2)
+        budget -= estimate_tokens(system_prompt) + estimate_tokens(user_message)
+
+        summary = truncate_to_tokens(summary or '', min(max(budget, 0) // 4, _setting(
+            'AI_AGENT_SUMMARY_MAX_TOKENS', DEFAULT_SUMMARY_MAX_TOKENS
+        )))
+        budget -= estimate_tokens(summary)
+
+        # Grounding được tối đa 2/3 phần còn lại, phần sau dành cho lịch sử
+        grounding = self._truncate_lines(grounding or '', max(budget, 0) * 2 // 3)
+        budget -= estimate_tokens(grounding)
+
+        history = list(messages or [])
+        if history and history[-1].get('role') == 'user' and history[-1].get('content') == user_message:
+            history.pop()
+
+        turns = []
+        for msg in reversed(history):
+            content = truncate_to_tokens(msg.get('content') or '', self.turn_max_tokens)
+            cost = estimate_tokens(content)
+            if cost > budget:
+                break
+            turns.insert(0, {'role': msg['role'], 'content': content})
+            budget -= cost
+
+        return BudgetedPrompt(
+            system_prompt=system_prompt,
+            grounding=grounding,
+            summary=summary,
+            user_message=user_message,
+            turns=turns,
+            dropped_turns=len(history) - len(turns),
+        )
+
+    @staticmethod
+    def _truncate_lines(text: str, max_tokens: int) -> str:
+        """Cắt grounding theo dòng để không làm vỡ block sản phẩm giữa chừng"""
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        kept = []
+        used = 0
+        for line in text.split('\n'):
+            cost = estimate_tokens(line + '\n')
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        return '\n'.join(kept)
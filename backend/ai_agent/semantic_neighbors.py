@@ -0,0 +1,193 @@
+"""
+Chỉ mục "sản phẩm tương tự" (semantic) tính sẵn từ embedding trong ChromaDB.
+
+Thay vì mỗi lần xem sản phẩm lại query vector + hydrate từ MySQL, job offline
+tính top-K lân cận (cosine) cho mọi sản phẩm và lưu vào ProductNeighbor
+(kind='semantic'). API chỉ còn một truy vấn theo index (product, kind, rank).
+
+Tính tăng dần theo hash document (ProductEmbeddingState):
+- Sản phẩm đổi hash (hoặc mới): upsert lại embedding, tính lại toàn bộ danh sách
+- Sản phẩm khác chỉ tính lại khi danh sách hiện tại chứa sản phẩm đã đổi/bị gỡ,
+  hoặc một sản phẩm đổi hash nay có điểm vượt ngưỡng top-K của nó
+"""
+import logging
+import math
+import operator
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from products.models import Product, ProductNeighbor
+from products.neighbors import load_neighbor_scores, rank_neighbors, replace_neighbor_lists
+from .models import ProductEmbeddingState
+
+logger = logging.getLogger(__name__)
+
+KIND = 'semantic'
+ROW_CHUNK_SIZE = 256
+
+
+def _top_k() -> int:
+    return int(getattr(settings, 'SEMANTIC_NEIGHBORS_TOP_K', 10))
+
+
+def _normalize(vector: Iterable[float]) -> List[float]:
+    values = [float(value) for value in vector]
+    norm = math.sqrt(sum(value * value for value in values))
+    if not norm:
+        return values
+    return [value / norm for value in values]
+
+
+def _similarity_rows(row_ids: List[int], unit: Dict[int, List[float]], ids: List[int]) -> Dict[int, List[float]]:
+    """
+    Cosine giữa các sản phẩm row_ids và toàn bộ ids (vector đã chuẩn hóa).
+    Dùng numpy (đi kèm chromadb) theo từng khối dòng, thiếu thì tính thuần Python.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    result: Dict[int, List[float]] = {}
+    if np is None:
+        for row_id in row_ids:
+            row = unit[row_id]
+            result[row_id] = [sum(map(operator.mul, row, unit[other_id])) for other_id in ids]
+        return result
+
+    matrix = np.asarray([unit[other_id] for other_id in ids], dtype=np.float32)
+    for start in range(0, len(row_ids), ROW_CHUNK_SIZE):
+        chunk = row_ids[start:start + ROW_CHUNK_SIZE]
+        scores = np.asarray([unit[row_id] for row_id in chunk], dtype=np.float32) @ matrix.T
+        for index, row_id in enumerate(chunk):
+            result[row_id] = scores[index].tolist()
+    return result
+
+
+def compute_neighbor_lists(
+    embeddings: Dict[int, Iterable[float]],
+    changed_ids: Set[int],
+    removed_ids: Set[int],
+    current_lists: Dict[int, Dict[int, float]],
+    top_k: int,
+    full: bool = False,
+) -> Dict[int, List[Tuple[int, float]]]:
+    """
+    Xác định các sản phẩm cần tính lại và trả về danh sách lân cận mới của chúng.
+
+    Args:
+        embeddings: {product_id: vector} của các sản phẩm đang bán
+        changed_ids: sản phẩm có hash document thay đổi (kể cả sản phẩm mới)
+        removed_ids: sản phẩm bị gỡ khỏi chỉ mục (ngừng bán / bị xóa)
+        current_lists: danh sách đang lưu {product_id: {neighbor_id: score}}
+        full: True thì tính lại toàn bộ
+
+    Returns:
+        {product_id: [(neighbor_id, score), ...]} chỉ gồm các sản phẩm được tính lại
+    """
+    unit = {product_id: _normalize(vector) for product_id, vector in embeddings.items()}
+    ids = sorted(unit)
+    changed = sorted(set(changed_ids) & unit.keys())
+
+    if full:
+        dirty = set(ids)
+    else:
+        dirty = set(changed)
+        stale = set(changed) | set(removed_ids)
+        for product_id, neighbors in current_lists.items():
+            if product_id in unit and stale.intersection(neighbors):
+                dirty.add(product_id)
+
+        # Sản phẩm đổi hash có thể chen vào top-K của sản phẩm khác
+        if changed:
+            changed_scores = _similarity_rows(changed, unit, ids)
+            for position, product_id in enumerate(ids):
+                if product_id in dirty:
+                    continue
+                neighbors = current_lists.get(product_id, {})
+                floor = min(neighbors.values()) if len(neighbors) >= top_k else -math.inf
+                if any(
+                    changed_id != product_id and changed_scores[changed_id][position] > floor
+                    for changed_id in changed
+                ):
+                    dirty.add(product_id)
+
+    rows = _similarity_rows(sorted(dirty), unit, ids)
+    return {
+        product_id: rank_neighbors({
+            other_id: score
+            for other_id, score in zip(ids, scores)
+            if other_id != product_id
+        }, top_k)
+        for product_id, scores in rows.items()
+    }
+
+
+def build_semantic_neighbors(chroma_service=None, full: bool = False, top_k: Optional[int] = None) -> Dict[str, int]:
+    """
+    Đồng bộ embedding theo hash document rồi cập nhật chỉ mục sản phẩm tương tự.
+
+    Args:
+        chroma_service: ChromaDBService (mặc định tạo mới)
+        full: True thì upsert lại mọi embedding và tính lại toàn bộ danh sách
+
+    Returns:
+        Thống kê số sản phẩm đổi hash / bị gỡ / được tính lại và số dòng đã ghi
+    """
+    if chroma_service is None:
+        from .chroma_service import ChromaDBService
+        chroma_service = ChromaDBService()
+    top_k = top_k or _top_k()
+
+    products = {
+        product.id: product
+        for product in Product.objects.filter(status='active').select_related('category')
+    }
+    hashes = {product_id: chroma_service.document_hash(product) for product_id, product in products.items()}
+    stored_hashes = dict(ProductEmbeddingState.objects.values_list('product_id', 'document_hash'))
+
+    # Lần chạy đầu (chưa có trạng thái) tương đương tính lại toàn bộ
+    full = full or not stored_hashes
+    changed_ids = {
+        product_id for product_id, document_hash in hashes.items()
+        if full or stored_hashes.get(product_id) != document_hash
+    }
+    removed_ids = set(stored_hashes) - set(products)
+
+    if not changed_ids and not removed_ids:
+        return {'changed': 0, 'removed': 0, 'recomputed': 0, 'rows': 0}
+
+    chroma_service.upsert_products(products[product_id] for product_id in changed_ids)
+    chroma_service.delete_products(removed_ids)
+
+    embeddings = {
+        product_id: vector
+        for product_id, vector in chroma_service.get_product_embeddings().items()
+        if product_id in products
+    }
+    current_lists = {} if full else load_neighbor_scores(KIND, embeddings.keys())
+    lists = compute_neighbor_lists(embeddings, changed_ids, removed_ids, current_lists, top_k, full=full)
+
+    with transaction.atomic():
+        rows = replace_neighbor_lists(KIND, lists, full_rebuild=full)
+        if removed_ids:
+            ProductNeighbor.objects.filter(kind=KIND, product_id__in=removed_ids).delete()
+            ProductEmbeddingState.objects.filter(product_id__in=removed_ids).delete()
+        ProductEmbeddingState.objects.filter(product_id__in=changed_ids).delete()
+        ProductEmbeddingState.objects.bulk_create([
+            ProductEmbeddingState(product_id=product_id, document_hash=hashes[product_id])
+            for product_id in changed_ids
+        ], batch_size=1000)
+
+    logger.info(
+        f"🧭 Semantic neighbors: {len(changed_ids)} changed, {len(removed_ids)} removed, "
+        f"{len(lists)} recomputed"
+    )
+    return {
+        'changed': len(changed_ids),
+        'removed': len(removed_ids),
+        'recomputed': len(lists),
+        'rows': rows,
+    }
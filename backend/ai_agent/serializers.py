@@ -2,7 +2,6 @@ from rest_framework import serializers
 from .models import ConversationSession
 from products.models import Product, ProductVariant
 from orders.models import Cart, CartItem
-import json
 
 
 class ConversationSessionSerializer(serializers.ModelSerializer):
@@ -75,6 +74,7 @@ class ProductDetailsChatbotSerializer(serializers.ModelSerializer):
     """Serializer để hiển thị chi tiết sản phẩm trong chatbot"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     main_image_url = serializers.SerializerMethodField()
+    main_image_srcset = serializers.SerializerMethodField()
     images_list = serializers.SerializerMethodField()
     specifications_dict = serializers.SerializerMethodField()
     variants = ProductVariantChatbotSerializer(many=True, read_only=True)
@@ -86,7 +86,7 @@ class ProductDetailsChatbotSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'category_name',
             'price', 'old_price', 'discount_percentage', 'stock', 'unit',
             'rating', 'reviews_count', 'sold_count',
-            'main_image_url', 'images_list', 'description', 'detail_description',
+            'main_image_url', 'main_image_srcset', 'images_list', 'description', 'detail_description',
             'specifications_dict', 'origin', 'guarantee', 'variants',
             'status', 'created_at', 'updated_at'
         ]
@@ -106,25 +106,22 @@ class ProductDetailsChatbotSerializer(serializers.ModelSerializer):
             return image_url
         return None
     
+    def get_main_image_srcset(self, obj):
+        """Ảnh thu nhỏ WebP/JPEG cho srcset"""
+        from django.conf import settings
+        from products.images import image_srcset
+        return image_srcset(
+            obj.main_image_variants, self.context.get('request'),
+            base_url=getattr(settings, 'SITE_URL', 'http://localhost:8000'),
+        )
+    
     def get_images_list(self, obj):
         """Lấy danh sách hình ảnh"""
-        try:
-            if obj.images:
-                images = json.loads(obj.images) if isinstance(obj.images, str) else obj.images
-                return images if isinstance(images, list) else []
-        except (json.JSONDecodeError, TypeError):
-            pass
-        return []
+        return obj.images_list
     
     def get_specifications_dict(self, obj):
         """Lấy thông số kỹ thuật"""
-        try:
-            if obj.specifications:
-                specs = json.loads(obj.specifications) if isinstance(obj.specifications, str) else obj.specifications
-                return specs if isinstance(specs, dict) else {}
-        except (json.JSONDecodeError, TypeError):
-            pass
-        return {}
+        return obj.specifications_dict
     
     def get_discount_percentage(self, obj):
         """Tính phần trăm giảm giá"""
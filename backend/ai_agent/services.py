@@ -1,5 +1,4 @@
 import os
-import json
 import uuid
 import logging
 import re
@@ -8,9 +7,14 @@ from typing import List, Dict, Optional
 import requests
 from django.conf import settings
 from django.db import models
-from django.db.models import Q, Max
+from django.db.models import Q, Max, prefetch_related_objects
 from .models import ConversationSession
-from products.models import Product
+from .stage_scheduler import StageScheduler
+from .prompt_builder import PromptBuilder, BudgetedPrompt, load_history
+from .message_analyzer import analyze_message
+from products.inventory import available_stock, overlay_sharded_stock
+from products.models import Product, ProductNeighbor
+from products.neighbors import get_neighbor_products
 
 # Try to import google.genai (new package)
 try:
@@ -84,7 +88,7 @@ DỮ LIỆU CATALOG THAM KHẢO:
             if not products.exists():
                 return ""
             
-            products_list = list(products)
+            products_list = overlay_sharded_stock(products)
             category_buckets = defaultdict(list)
             prices = []
             in_stock_count = 0
@@ -155,62 +159,21 @@ DỮ LIỆU CATALOG THAM KHẢO:
         """
         Nhận diện câu hỏi dạng khám phá catalog tổng quát.
         """
-        text = (message or '').lower().strip()
-        discovery_keywords = [
-            'co nhung san pham nao', 'có những sản phẩm nào', 'co gi', 'có gì',
-            'tat ca san pham', 'tất cả sản phẩm', 'toan bo san pham', 'toàn bộ sản phẩm',
-            'danh muc', 'danh mục', 'menu', 'catalog', 'catalogue',
-            'goi y chung', 'gợi ý chung', 'tu van tong quan', 'tư vấn tổng quan'
-        ]
-        return any(keyword in text for keyword in discovery_keywords)
+        return analyze_message(message).is_catalog_discovery
 
     def _is_specific_product_focus_query(self, message: str, specific_keywords: Optional[List[str]] = None) -> bool:
         """
         Nhận diện câu hỏi tập trung vào một mẫu cụ thể (vd: "gấu bear").
         Khi đó chỉ nên hiển thị sản phẩm đang hỏi, không tự đẩy thêm sản phẩm liên quan.
         """
-        text = (message or '').lower().strip()
-        if not text:
-            return False
-
-        compare_markers = ['so sanh', 'so sánh', 'vs', 'voi', 'với', 'hay', 'giua', 'giữa']
-        if any(marker in text for marker in compare_markers):
-            return False
-
-        list_markers = [
-            'goi y', 'gợi ý', 'danh sach', 'danh sách', 'nhieu mau', 'nhiều mẫu',
-            'tu van', 'tư vấn', 'san pham nao', 'sản phẩm nào', 'co gi', 'có gì'
-        ]
-        if any(marker in text for marker in list_markers):
-            return False
-
-        keywords = specific_keywords or self._extract_keywords_from_message(text)
-        if not keywords:
-            return False
-
-        # Câu ngắn có 1-2 từ khóa đặc thù thường là hỏi đích danh 1 mẫu.
-        strong_product_cues = ['bear', 'teddy', 'panda', 'bunny']
-        has_named_cue = any(cue in text for cue in strong_product_cues)
-        has_question_form = any(marker in text for marker in ['co', 'có', 'khong', 'không', 'xem', 'lay', 'lấy'])
-
-        return (len(keywords) <= 2 and has_question_form) or has_named_cue
-
-    def _safe_json_loads(self, raw_text: str):
-        if not raw_text:
-            return None
-        try:
-            return json.loads(raw_text) if isinstance(raw_text, str) else raw_text
-        except (json.JSONDecodeError, TypeError):
-            return None
+        return analyze_message(message).is_specific_focus(specific_keywords)
 
     def _format_product_grounding_block(self, product: Product) -> List[str]:
         """
         Chuẩn hóa dữ liệu sản phẩm thành block ngắn gọn để đưa vào prompt runtime.
         """
         category_name = product.category.name if product.category else 'Khác'
-        total_stock = product.stock
-        if product.variants.exists():
-            total_stock = sum(v.stock for v in product.variants.all())
+        total_stock = self._calculate_total_stock(product)
 
         stock_status = 'Còn hàng' if total_stock > 0 else 'Hết hàng'
 
@@ -223,16 +186,16 @@ DỮ LIỆU CATALOG THAM KHẢO:
             for variant in product.variants.all():
                 variant_price = int(variant.price) if variant.price else int(product.price)
                 variant_prices.append(variant_price)
-                variant_lines.append(f"{variant.size}: {variant_price:,}đ (stock {variant.stock})")
+                variant_lines.append(f"{variant.size}: {variant_price:,}đ (stock {self._variant_stock(product, variant)})")
 
             if variant_prices:
                 min_variant_price = min(variant_prices + [int(product.price)])
                 max_variant_price = max(variant_prices + [int(product.price)])
             variant_summary = '; '.join(variant_lines[:3])
 
-        specs = self._safe_json_loads(product.specifications)
+        specs = product.specifications_dict
         spec_summary = ''
-        if isinstance(specs, dict) and specs:
+        if specs:
             compact_specs = []
             for key, value in list(specs.items())[:4]:
                 compact_specs.append(f"{key}: {value}")
@@ -294,6 +257,10 @@ DỮ LIỆU CATALOG THAM KHẢO:
     def chat(self, conversation: ConversationSession, user_message: str, user_products: Optional[List[Dict]] = None) -> Dict:
         """
         Gửi tin nhắn đến AI và nhận phản hồi
+
+        Các bước độc lập được chạy song song qua StageScheduler:
+        - Truy xuất sản phẩm/grounding song song với tải lịch sử hội thoại
+        - Gọi LLM song song với hydrate trước các sản phẩm ứng viên
         
         Returns:
             {
@@ -303,26 +270,21 @@ DỮ LIỆU CATALOG THAM KHẢO:
         """
         # Lưu tin nhắn từ user (hỗ trợ kèm thẻ sản phẩm phía client)
         conversation.add_message('user', user_message, products=user_products or [])
-        
-        # Ưu tiên Gemini nếu có API key
-        if self.gemini_api_key and GENAI_AVAILABLE:
+
+        use_gemini = bool(self.gemini_api_key and GENAI_AVAILABLE)
+        use_openai = bool(self.openai_api_key)
+
+        if use_gemini or use_openai:
             try:
-                response = self._call_gemini_api(conversation, user_message)
-                # Lưu phản hồi từ AI với products
-                conversation.add_message('assistant', response['ai_response'], products=response.get('products', []))
-                return response
+                response = self._chat_with_llm(user_message, conversation, use_gemini, use_openai)
             except Exception as e:
-                logger.error(f"Error calling Gemini API: {str(e)}")
-        
-        # Fallback to OpenAI
-        if self.openai_api_key:
-            try:
-                response = self._call_openai_api(conversation, user_message)
+                # Lỗi dựng prompt / xử lý phản hồi: dùng chế độ tìm theo từ khóa như khi LLM lỗi
+                logger.exception(f"❌ Error in LLM chat pipeline: {str(e)}")
+                response = None
+            if response is not None:
                 # Lưu phản hồi từ AI với products
                 conversation.add_message('assistant', response['ai_response'], products=response.get('products', []))
                 return response
-            except Exception as e:
-                logger.error(f"Error calling OpenAI API: {str(e)}")
         
         # Fallback: Search products based on user message keywords
         logger.warning("No API keys available - using fallback mode with keyword search")
@@ -331,33 +293,119 @@ DỮ LIỆU CATALOG THAM KHẢO:
         
         return response
 
-    def _call_openai_api(self, conversation: ConversationSession, user_message: str) -> Dict:
-        """Gọi OpenAI API"""
+    def _chat_with_llm(self, user_message: str, conversation: ConversationSession, use_gemini: bool, use_openai: bool) -> Optional[Dict]:
+        """Chạy pipeline LLM theo stage; None nếu không provider nào trả lời"""
+        scheduler = StageScheduler()
+
+        # Stage 1: grounding + lịch sử
+        prepared = scheduler.run({
+            'retrieval': lambda: self._retrieve_grounding(user_message),
+            'history': lambda: self._load_history_window(conversation),
+        })
+        intent_products, grounding_context = prepared['retrieval']
+        history = prepared['history']
+
+        # Stage 2: gọi LLM + hydrate sản phẩm ứng viên (speculative)
+        generated = scheduler.run({
+            'llm': lambda: self._generate_llm_response(
+                self._build_prompt(user_message, grounding_context, history),
+                use_gemini,
+                use_openai
+            ),
+            'candidates': lambda: self._hydrate_candidate_products(intent_products),
+        })
+
+        ai_response = generated['llm']
+        if ai_response is None:
+            return None
+        cleaned_response, products = self._extract_products_from_response(
+            ai_response,
+            user_message,
+            intent_products=intent_products,
+            candidate_payloads=generated['candidates'],
+        )
+        return {
+            'ai_response': cleaned_response,
+            'products': products
+        }
+
+    def _retrieve_grounding(self, user_message: str) -> tuple:
+        """Truy xuất sản phẩm theo intent và dựng grounding context từ kết quả đó"""
+        try:
+            intent_products = self._filter_products_by_intent('', user_message)
+        except Exception as e:
+            logger.warning(f"Error retrieving intent products: {str(e)}")
+            intent_products = []
+        grounding_context = self._build_runtime_grounding_context(user_message, related_products=intent_products)
+        return intent_products, grounding_context
+
+    def _load_history_window(self, conversation: ConversationSession) -> Dict:
+        """Lấy các message gần đây + rolling summary của phần hội thoại cũ hơn"""
+        try:
+            return load_history(conversation)
+        except Exception as e:
+            # Thiếu lịch sử vẫn trả lời được lượt hiện tại
+            logger.warning(f"Error loading conversation history: {str(e)}")
+            return {'summary': '', 'messages': []}
+
+    def _build_prompt(self, user_message: str, grounding_context: str, history: Dict) -> BudgetedPrompt:
+        """Dựng prompt theo ngân sách token (system + grounding + tóm tắt + lượt gần nhất)"""
+        return PromptBuilder().build(
+            system_prompt=self.system_prompt,
+            grounding=grounding_context,
+            summary=history.get('summary', ''),
+            messages=history.get('messages', []),
+            user_message=user_message,
+        )
+
+    def _hydrate_candidate_products(self, intent_products: List[Dict]) -> Dict[int, Dict]:
+        """Build payload trước cho các sản phẩm ứng viên, trả về {product_id: payload}"""
+        if not intent_products:
+            return {}
+        try:
+            product_map = {
+                p.id: p
+                for p in Product.objects.filter(
+                    id__in=[item['id'] for item in intent_products]
+                ).prefetch_related('variants')
+            }
+            return {
+                item['id']: self._build_product_payload(product_map[item['id']], extra=item, quantity=1)
+                for item in intent_products
+                if item['id'] in product_map
+            }
+        except Exception as e:
+            logger.warning(f"Error hydrating candidate products: {str(e)}")
+            return {}
+
+    def _generate_llm_response(self, prompt: BudgetedPrompt, use_gemini: bool, use_openai: bool) -> Optional[str]:
+        """Gọi Gemini trước, lỗi thì fallback OpenAI. Trả về None nếu cả hai đều lỗi"""
+        # Ưu tiên Gemini nếu có API key
+        if use_gemini:
+            try:
+                return self._request_gemini_completion(prompt)
+            except Exception as e:
+                logger.error(f"Error calling Gemini API: {str(e)}")
+
+        # Fallback to OpenAI
+        if use_openai:
+            try:
+                return self._request_openai_completion(prompt)
+            except Exception as e:
+                logger.error(f"Error calling OpenAI API: {str(e)}")
+
+        return None
+
+    def _request_openai_completion(self, prompt: BudgetedPrompt) -> str:
+        """Gửi request tới OpenAI, trả về text phản hồi"""
         headers = {
             'Authorization': f'Bearer {self.openai_api_key}',
             'Content-Type': 'application/json'
         }
-
-        runtime_grounding_context = self._build_runtime_grounding_context(user_message)
-        
-        # Prepare messages from conversation history
-        messages = [
-            {'role': 'system', 'content': self.system_prompt},
-            {'role': 'system', 'content': runtime_grounding_context}
-        ]
-        
-        ctx = conversation.get_context()
-        if 'messages' in ctx:
-            # Lấy 10 message gần đây để giữ context
-            for msg in ctx['messages'][-10:]:
-                messages.append({
-                    'role': msg['role'],
-                    'content': msg['content']
-                })
         
         payload = {
             'model': self.openai_model,
-            'messages': messages,
+            'messages': prompt.to_openai_messages(),
             'temperature': 0.2,
             'max_tokens': 1000
         }
@@ -372,10 +420,33 @@ DỮ LIỆU CATALOG THAM KHẢO:
         response.raise_for_status()
         result = response.json()
         
-        ai_response = result['choices'][0]['message']['content']
+        return result['choices'][0]['message']['content']
+
+    def _request_gemini_completion(self, prompt: BudgetedPrompt) -> str:
+        """Gửi request tới Gemini, trả về text phản hồi"""
+        client = genai.Client(api_key=self.gemini_api_key)
+        
+        # Call Gemini API
+        response = client.models.generate_content(
+            model=self.gemini_model,
+            contents=prompt.to_gemini_prompt()
+        )
+        
+        return response.text if response.text else "Không thể tạo phản hồi"
+
+    def _call_openai_api(self, conversation: ConversationSession, user_message: str) -> Dict:
+        """Gọi OpenAI API"""
+        intent_products, runtime_grounding_context = self._retrieve_grounding(user_message)
+        ai_response = self._request_openai_completion(self._build_prompt(
+            user_message,
+            runtime_grounding_context,
+            self._load_history_window(conversation)
+        ))
         
         # Trích xuất sản phẩm từ response và clean text
-        cleaned_response, products = self._extract_products_from_response(ai_response, user_message)
+        cleaned_response, products = self._extract_products_from_response(
+            ai_response, user_message, intent_products=intent_products
+        )
         
         return {
             'ai_response': cleaned_response,
@@ -384,58 +455,36 @@ DỮ LIỆU CATALOG THAM KHẢO:
 
     def _call_gemini_api(self, conversation: ConversationSession, user_message: str) -> Dict:
         """Gọi Gemini API"""
-        try:
-            client = genai.Client(api_key=self.gemini_api_key)
-            runtime_grounding_context = self._build_runtime_grounding_context(user_message)
-            
-            # Prepare conversation history
-            history_text = ""
-            ctx = conversation.get_context()
-            if 'messages' in ctx:
-                for msg in ctx['messages'][-10:]:
-                    role = "User" if msg['role'] == "user" else "Assistant"
-                    history_text += f"{role}: {msg['content']}\n"
-            
-            # Prepare the full prompt
-            full_prompt = f"""{self.system_prompt}
-
-{runtime_grounding_context}
-
-Lịch sử trò chuyện:
-{history_text}
-
-Khách hàng: {user_message}
-
-Trợ lý:"""
-            
-            # Call Gemini API
-            response = client.models.generate_content(
-                model=self.gemini_model,
-                contents=full_prompt
-            )
-            
-            ai_response = response.text if response.text else "Không thể tạo phản hồi"
-            
-            # Trích xuất sản phẩm từ response và clean text
-            cleaned_response, products = self._extract_products_from_response(ai_response, user_message)
-            
-            return {
-                'ai_response': cleaned_response,
-                'products': products
-            }
-            
-        except Exception as e:
-            raise e
+        intent_products, runtime_grounding_context = self._retrieve_grounding(user_message)
+        ai_response = self._request_gemini_completion(self._build_prompt(
+            user_message,
+            runtime_grounding_context,
+            self._load_history_window(conversation)
+        ))
+        
+        # Trích xuất sản phẩm từ response và clean text
+        cleaned_response, products = self._extract_products_from_response(
+            ai_response, user_message, intent_products=intent_products
+        )
+        
+        return {
+            'ai_response': cleaned_response,
+            'products': products
+        }
 
-    def _build_runtime_grounding_context(self, user_message: str) -> str:
+    def _build_runtime_grounding_context(self, user_message: str, related_products: Optional[List[Dict]] = None) -> str:
         """
         Tạo context dữ liệu sản phẩm liên quan theo thời gian thực để giảm hallucination.
+
+        Args:
+            related_products: Kết quả _filter_products_by_intent đã tính sẵn (nếu có)
         """
         try:
             preferences = self._extract_customer_preferences(user_message)
             preference_summary = self._build_preference_summary(preferences)
             is_discovery_query = self._is_catalog_discovery_query(user_message)
-            related_products = self._filter_products_by_intent('', user_message)
+            if related_products is None:
+                related_products = self._filter_products_by_intent('', user_message)
             if not related_products and not is_discovery_query:
                 return (
                     "DỮ LIỆU TRUY XUẤT REALTIME: Không tìm thấy sản phẩm phù hợp trực tiếp với câu hỏi. "
@@ -629,45 +678,7 @@ Trợ lý:"""
         Returns:
             List các keywords
         """
-        try:
-            normalized = re.sub(r"[^\w\s]", " ", (message or "").lower(), flags=re.UNICODE)
-            words = [w.strip() for w in normalized.split() if w.strip()]
-
-            # Chỉ loại các từ chức năng, giữ lại từ mô tả nhu cầu như "bé", "mềm", "quà"...
-            common_words = {
-                'la', 'là', 'toi', 'tôi', 'minh', 'mình', 'ban', 'bạn', 'cho',
-                'xin', 'nho', 'nhờ', 'giup', 'giúp', 'voi', 'với', 'toi_can',
-                'can', 'cần', 'muon', 'muốn', 'tim', 'tìm', 'san', 'sản',
-                'pham', 'phẩm', 'co', 'có', 'khong', 'không', 'nao', 'nào',
-                'va', 'và', 'hoac', 'hoặc', 'nhung', 'nhưng', 'de', 'để',
-                'trong', 'ngoai', 'ngoài', 'gi', 'gì', 'duoc', 'được', 'ah',
-                'a', 'ạ', 'nhe', 'nhé', 'nha', 'nhà', 'em', 'anh', 'chi', 'chị',
-                'gia', 'giá', 'tu', 'từ', 'den', 'đến', 'khoang', 'khoảng',
-                'tam', 'tầm', 'ngan', 'ngàn', 'nghin', 'nghìn', 'tr', 'trieu',
-                'triệu', 'vnd', 'đ', 'dong', 'đồng'
-            }
-
-            keywords: List[str] = []
-            seen = set()
-            for word in words:
-                if len(word) < 2:
-                    continue
-                if word in common_words:
-                    continue
-                # Bỏ token có chữ số (giá/budget) để tránh khóa vào giá trị tiền tệ.
-                if re.search(r"\d", word):
-                    continue
-                # Bỏ token thuần số để tránh nhiễu (giá sẽ được parse riêng)
-                if re.fullmatch(r"\d+", word):
-                    continue
-                if word not in seen:
-                    seen.add(word)
-                    keywords.append(word)
-
-            return keywords[:8]
-        except Exception as e:
-            logger.error(f"Error extracting keywords: {str(e)}")
-            return []
+        return list(analyze_message(message).keywords)
 
     def _parse_budget_from_message(self, message: str) -> tuple:
         """
@@ -676,126 +687,19 @@ Trợ lý:"""
         Returns:
             (min_price, max_price) theo đơn vị VND
         """
-        text = (message or '').lower()
-
-        def _to_vnd(raw_amount: str, unit: str = '') -> Optional[int]:
-            if not raw_amount:
-                return None
-
-            value_text = raw_amount.strip().replace(' ', '')
-            try:
-                # Hỗ trợ dạng 1.5tr / 1,5tr
-                if ('.' in value_text or ',' in value_text) and unit in {'tr', 'triệu', 'm'}:
-                    value = float(value_text.replace(',', '.'))
-                else:
-                    value = float(value_text.replace('.', '').replace(',', ''))
-            except ValueError:
-                return None
-
-            unit = (unit or '').strip()
-            if unit in {'k', 'nghin', 'nghìn', 'ngan', 'ngàn'}:
-                value *= 1000
-            elif unit in {'tr', 'triệu', 'm'}:
-                value *= 1000000
-
-            return int(value)
-
-        # Ưu tiên parse khoảng giá: "từ X đến Y"
-        range_match = re.search(
-            r"tu\s+(\d[\d\.,]*)\s*(k|nghin|nghìn|ngan|ngàn|tr|triệu|m|đ|vnd)?\s+"
-            r"(?:den|đến)\s+(\d[\d\.,]*)\s*(k|nghin|nghìn|ngan|ngàn|tr|triệu|m|đ|vnd)?",
-            text
-        )
-        if range_match:
-            min_price = _to_vnd(range_match.group(1), range_match.group(2) or '')
-            max_price = _to_vnd(range_match.group(3), range_match.group(4) or '')
-            if min_price is not None and max_price is not None:
-                return (min(min_price, max_price), max(min_price, max_price))
-
-        # Parse dạng "200k - 500k" hoặc "200k-500k"
-        dash_range_match = re.search(
-            r"(\d[\d\.,]*)\s*(k|nghin|nghìn|ngan|ngàn|tr|triệu|m|đ|vnd)?\s*[-–~]\s*"
-            r"(\d[\d\.,]*)\s*(k|nghin|nghìn|ngan|ngàn|tr|triệu|m|đ|vnd)?",
-            text
-        )
-        if dash_range_match:
-            unit_left = dash_range_match.group(2) or ''
-            unit_right = dash_range_match.group(4) or unit_left
-            min_price = _to_vnd(dash_range_match.group(1), unit_left)
-            max_price = _to_vnd(dash_range_match.group(3), unit_right)
-            if min_price is not None and max_price is not None:
-                return (min(min_price, max_price), max(min_price, max_price))
-
-        # Parse tất cả giá trị tiền tệ trong câu
-        money_matches = list(re.finditer(
-            r"(\d[\d\.,]*)\s*(k|nghin|nghìn|ngan|ngàn|tr|triệu|m|đ|vnd)",
-            text
-        ))
-        if not money_matches:
-            return (None, None)
-
-        min_price = None
-        max_price = None
-        low_keywords = ['duoi', 'dưới', 'toi da', 'tối đa', 'khong qua', 'không quá', '<=', '<']
-        high_keywords = ['tren', 'trên', 'tu', 'từ', 'it nhat', 'ít nhất', '>=', '>']
-
-        for match in money_matches:
-            price_val = _to_vnd(match.group(1), match.group(2))
-            if price_val is None:
-                continue
-
-            context_start = max(match.start() - 16, 0)
-            context_end = min(match.end() + 8, len(text))
-            context = text[context_start:context_end]
-
-            if any(keyword in context for keyword in low_keywords):
-                max_price = price_val if max_price is None else min(max_price, price_val)
-                continue
-
-            if any(keyword in context for keyword in high_keywords):
-                min_price = price_val if min_price is None else max(min_price, price_val)
-                continue
-
-            # Mặc định nếu không xác định được ngữ nghĩa, coi là ngân sách trần
-            max_price = price_val if max_price is None else min(max_price, price_val)
-
-        return (min_price, max_price)
+        return analyze_message(message).budget
 
     def _is_price_query(self, message: str) -> bool:
         """
         Nhận diện câu hỏi đang hỏi giá sản phẩm.
         """
-        text = (message or '').lower().strip()
-        if not text:
-            return False
-
-        price_markers = [
-            'gia', 'giá', 'bao nhieu', 'bao nhiêu', 'bn', 'nhiu tien', 'nhiêu tiền',
-            'muc gia', 'mức giá', 'price', 'bao tien', 'bao tiền'
-        ]
-        return any(marker in text for marker in price_markers)
+        return analyze_message(message).is_price_query
 
     def _extract_price_focus_keywords(self, message: str) -> List[str]:
         """
         Tách từ khóa tên sản phẩm trong câu hỏi giá, loại bỏ token nhiễu kiểu "giá bao nhiêu".
         """
-        keywords = self._extract_keywords_from_message(message)
-        noise_words = {
-            'gia', 'giá', 'bao', 'nhieu', 'nhiêu', 'bn', 'tien', 'tiền',
-            'muc', 'mức', 'price', 'sp', 'san', 'sản', 'pham', 'phẩm',
-            'nay', 'này', 'kia', 'đó', 'do', 'co', 'có', 'la', 'là',
-            'khong', 'không', 'duoc', 'được', 'khuyen', 'khuyến', 'mai', 'sale'
-        }
-
-        focus_keywords = []
-        for keyword in keywords:
-            if keyword in noise_words:
-                continue
-            if len(keyword) < 2:
-                continue
-            focus_keywords.append(keyword)
-
-        return focus_keywords[:6]
+        return list(analyze_message(message).price_focus_keywords)
 
     def _build_exact_price_line(self, product: Dict) -> str:
         """
@@ -823,7 +727,13 @@ Trợ lý:"""
 
         return f"{product_name}: {min_price:,}đ - {max_price:,}đ"
 
-    def _extract_products_from_response(self, ai_response: str, user_message: str = None) -> tuple:
+    def _extract_products_from_response(
+        self,
+        ai_response: str,
+        user_message: str = None,
+        intent_products: Optional[List[Dict]] = None,
+        candidate_payloads: Optional[Dict[int, Dict]] = None
+    ) -> tuple:
         """
         Trích xuất tên sản phẩm từ response của AI
         Sử dụng cải tiến fuzzy matching + intent-based filtering
@@ -832,6 +742,8 @@ Trợ lý:"""
         Args:
             ai_response: Response từ AI
             user_message: Câu hỏi của khách hàng (tùy chọn)
+            intent_products: Kết quả lọc theo intent đã tính sẵn (tránh lọc lại)
+            candidate_payloads: Payload đã hydrate sẵn theo product_id
             
         Returns:
             Tuple: (cleaned_response, products_list)
@@ -854,10 +766,14 @@ Trợ lý:"""
 
             response_seed = self._clean_response_text(ai_response, [p['name'] for p in products])
         else:
-            result = self.improve_product_extraction(ai_response, user_message)
+            result = self.improve_product_extraction(ai_response, user_message, intent_products=intent_products)
+            candidate_payloads = candidate_payloads or {}
             
             # Format products cho return
             for product in result['products']:
+                if product['id'] in candidate_payloads:
+                    products.append(candidate_payloads[product['id']])
+                    continue
                 prod_obj = Product.objects.filter(id=product['id']).prefetch_related('variants').first()
                 if prod_obj:
                     products.append(self._build_product_payload(prod_obj, extra=product, quantity=1))
@@ -962,40 +878,7 @@ Trợ lý:"""
         """
         Chỉ hiển thị danh sách sản phẩm khi khách hàng thể hiện rõ nhu cầu xem gợi ý.
         """
-        explicit_intent_keywords = [
-            'goi y', 'gợi ý', 'de xuat', 'đề xuất', 'tu van san pham', 'tư vấn sản phẩm',
-            'xem san pham', 'xem mẫu', 'xem mau', 'mau nao', 'mẫu nào', 'list',
-            'danh sach', 'danh sách', 'chon giup', 'chọn giúp', 'recommend',
-            'chon san pham', 'chọn sản phẩm', 'nen mua', 'nên mua', 'mau phu hop', 'mẫu phù hợp',
-            'san pham nao', 'sản phẩm nào', 'co san pham nao', 'có sản phẩm nào',
-            'co mau nao', 'có mẫu nào', 'co loai nao', 'có loại nào'
-        ]
-        if any(keyword in message_text for keyword in explicit_intent_keywords):
-            return True
-
-        if self._is_price_query(message_text):
-            return True
-
-        # Câu hỏi dạng xin tư vấn chọn sản phẩm theo nhu cầu cụ thể.
-        question_patterns = [
-            ('co', 'khong'),
-            ('có', 'không'),
-            ('nao',),
-            ('nào',),
-        ]
-        has_product_context = any(
-            k in message_text
-            for k in ['san pham', 'sản phẩm', 'mau', 'mẫu', 'gau bong', 'gấu bông']
-        )
-        has_gift_context = any(
-            k in message_text
-            for k in ['tang', 'tặng', 'qua', 'quà', 'nguoi yeu', 'người yêu']
-        )
-
-        if has_product_context and has_gift_context:
-            return True
-
-        return any(all(token in message_text for token in pattern) for pattern in question_patterns)
+        return analyze_message(message_text).wants_recommendation_list
 
     def _build_product_reason(self, product: Dict, message_text: str, preferences: Optional[Dict] = None) -> str:
         """
@@ -1039,45 +922,7 @@ Trợ lý:"""
         """
         Trích xuất các tiêu chí quan trọng từ câu hỏi khách hàng để lọc sản phẩm sát hơn.
         """
-        text = (message or '').lower()
-        keywords = self._extract_keywords_from_message(text)
-
-        generic_keywords = {
-            'gau', 'gấu', 'bong', 'bông', 'gau bong', 'gấu bông',
-            'qua', 'quà', 'tang', 'tặng', 'qua tang', 'quà tặng',
-            'shop', 'mua', 'tim', 'tìm', 'san pham', 'sản phẩm'
-        }
-
-        color_terms = [
-            term for term in ['hong', 'hồng', 'trang', 'trắng', 'nau', 'nâu', 'xam', 'xám', 'den', 'đen', 'xanh', 'do', 'đỏ']
-            if term in text
-        ]
-        size_terms = [
-            term for term in ['to', 'lon', 'lớn', 'mini', 'nho', 'nhỏ', 'size m', 'size l', 'size xl']
-            if term in text
-        ]
-        material_terms = [
-            term for term in ['mem', 'mềm', 'nhung', 'bong min', 'bông mịn', 'om', 'ôm']
-            if term in text
-        ]
-        occasion_terms = [
-            term for term in ['sinh nhat', 'sinh nhật', 'valentine', 'ky niem', 'kỷ niệm', 'tot nghiep', 'tốt nghiệp', 'noel']
-            if term in text
-        ]
-
-        specific_keywords = [k for k in keywords if k not in generic_keywords]
-        constraint_terms = list(dict.fromkeys(specific_keywords + color_terms + size_terms + material_terms + occasion_terms))
-
-        return {
-            'specific_keywords': specific_keywords,
-            'color_terms': color_terms,
-            'size_terms': size_terms,
-            'material_terms': material_terms,
-            'occasion_terms': occasion_terms,
-            'gift_for_love': any(k in text for k in ['nguoi yeu', 'người yêu', 'ban gai', 'bạn gái', 'ban trai', 'bạn trai']),
-            'gift_for_child': any(k in text for k in ['be', 'bé', 'tre em', 'trẻ em']),
-            'constraint_terms': constraint_terms,
-        }
+        return analyze_message(message).preferences()
 
     def _build_preference_summary(self, preferences: Dict) -> str:
         """
@@ -1173,7 +1018,7 @@ Trợ lý:"""
                         'id': v.id,
                         'size': v.size,
                         'price': int(v.price) if v.price else int(product.price),
-                        'stock': v.stock
+                        'stock': self._variant_stock(product, v)
                     }
                     for v in product.variants.all()
                 ]
@@ -1196,21 +1041,9 @@ Trợ lý:"""
                         'order': img.order
                     })
             
-            # Lấy hình ảnh từ images field (legacy)
-            images = []
-            try:
-                if product.images:
-                    images = json.loads(product.images) if isinstance(product.images, str) else product.images
-            except (json.JSONDecodeError, TypeError):
-                pass
-            
-            # Lấy thông số kỹ thuật
-            specs = {}
-            try:
-                if product.specifications:
-                    specs = json.loads(product.specifications) if isinstance(product.specifications, str) else product.specifications
-            except (json.JSONDecodeError, TypeError):
-                pass
+            # Hình ảnh từ images field (legacy) và thông số kỹ thuật: cột JSON đã giải mã sẵn
+            images = product.images_list
+            specs = product.specifications_dict
             
             # Xây dựng response
             main_image_url = None
@@ -1246,6 +1079,7 @@ Trợ lý:"""
                 'detail_description': product.detail_description or '',
                 'main_image': product.main_image.url if product.main_image else None,
                 'main_image_url': main_image_url,
+                'main_image_srcset': self._get_product_image_srcset(product),
                 'images': images,
                 'product_images': product_images,
                 'specifications': specs,
@@ -1288,16 +1122,18 @@ Trợ lý:"""
                         'error': f'Kích thước {unit} không tồn tại',
                         'success': False
                     }
-                if variant.stock < quantity:
+                stock = available_stock(product.id, unit, variant.stock)
+                if stock < quantity:
                     return {
-                        'error': f'Số lượng tồn kho không đủ. Tồn kho: {variant.stock}',
+                        'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}',
                         'success': False
                     }
                 item_price = int(variant.price) if variant.price else int(product.price)
             else:
-                if product.stock < quantity:
+                stock = available_stock(product.id, fallback=product.stock)
+                if stock < quantity:
                     return {
-                        'error': f'Số lượng tồn kho không đủ. Tồn kho: {product.stock}',
+                        'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}',
                         'success': False
                     }
                 item_price = int(product.price)
@@ -1330,9 +1166,7 @@ Trợ lý:"""
                     'message': f'Đã thêm {quantity} {product.name} vào giỏ hàng',
                     'product_id': product_id,
                     'quantity': cart_item.quantity,
-                    'total_items': sum(
-                        item.quantity for item in CartItem.objects.filter(cart=cart)
-                    )
+                    'total_items': Cart.objects.filter(pk=cart.pk).values_list('total_quantity', flat=True).get()
                 }
             else:
                 # Reference for anonymous user to add to cart locally
@@ -1383,12 +1217,14 @@ Trợ lý:"""
                 variant = product.variants.filter(size=unit).first()
                 if not variant:
                     return {'error': f'Kích thước {unit} không tồn tại', 'success': False}
-                if variant.stock < quantity:
-                    return {'error': f'Số lượng tồn kho không đủ. Tồn kho: {variant.stock}', 'success': False}
+                stock = available_stock(product.id, unit, variant.stock)
+                if stock < quantity:
+                    return {'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}', 'success': False}
                 item_price = int(variant.price) if variant.price else int(product.price)
             else:
-                if product.stock < quantity:
-                    return {'error': f'Số lượng tồn kho không đủ. Tồn kho: {product.stock}', 'success': False}
+                stock = available_stock(product.id, fallback=product.stock)
+                if stock < quantity:
+                    return {'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}', 'success': False}
                 item_price = int(product.price)
             
             # Thêm vào giỏ hàng
@@ -1414,7 +1250,7 @@ Trợ lý:"""
                 )
             
             # Tính tổng items trong giỏ
-            total_items = sum(item.quantity for item in CartItem.objects.filter(cart=cart))
+            total_items = Cart.objects.filter(pk=cart.pk).values_list('total_quantity', flat=True).get()
             
             return {
                 'success': True,
@@ -1441,6 +1277,11 @@ Trợ lý:"""
             return image_url
         return None
 
+    def _get_product_image_srcset(self, product) -> Optional[dict]:
+        """Ảnh thu nhỏ WebP/JPEG cho thẻ sản phẩm trong chat (None nếu chưa xử lý)"""
+        from products.images import image_srcset
+        return image_srcset(product.main_image_variants, base_url=getattr(settings, 'SITE_URL', 'http://localhost:8000'))
+
     def _get_product_price_range(self, product: Product) -> tuple:
         prices = [int(product.price)]
         if product.variants.exists():
@@ -1454,10 +1295,19 @@ Trợ lý:"""
         min_price, max_price = self._get_product_price_range(product)
         return max_price >= min_target and min_price <= max_target
 
+    def _shard_stock(self, product: Product) -> Dict[str, int]:
+        """{size: tổng shard} của các key đang bật shard (đọc một lần, lưu trên instance)"""
+        if not hasattr(product, 'shard_stock'):
+            overlay_sharded_stock([product])
+        return product.shard_stock
+
+    def _variant_stock(self, product: Product, variant) -> int:
+        return self._shard_stock(product).get(variant.size, variant.stock)
+
     def _calculate_total_stock(self, product: Product) -> int:
         if product.variants.exists():
-            return sum(v.stock for v in product.variants.all())
-        return int(product.stock or 0)
+            return sum(self._variant_stock(product, v) for v in product.variants.all())
+        return int(self._shard_stock(product).get('', product.stock) or 0)
 
     def _build_variants_payload(self, product: Product) -> List[Dict]:
         if not product.variants.exists():
@@ -1467,7 +1317,7 @@ Trợ lý:"""
                 'id': v.id,
                 'size': v.size,
                 'price': int(v.price) if v.price else int(product.price),
-                'stock': v.stock
+                'stock': self._variant_stock(product, v)
             }
             for v in product.variants.all()
         ]
@@ -1503,6 +1353,7 @@ Trợ lý:"""
             'stock': total_stock,
             'total_stock': total_stock,
             'image_url': self._get_product_image_url(product),
+            'image_srcset': self._get_product_image_srcset(product),
             'unit': product.unit if hasattr(product, 'unit') else '',
             'variants': variants,
             'rating': float(product.rating),
@@ -1588,7 +1439,8 @@ Trợ lý:"""
     def get_product_recommendations(self, product_id: int = None, limit: int = 5) -> List[Dict]:
         """
         Lấy danh sách sản phẩm được độc giả gợi ý
-        Nếu có product_id, lấy các sản phẩm liên quan
+        Nếu có product_id, lấy các sản phẩm thường được mua cùng (chỉ mục co-purchase),
+        thiếu thì bổ sung sản phẩm cùng danh mục
         Nếu không, lấy các sản phẩm bán chạy nhất
         
         Args:
@@ -1600,23 +1452,26 @@ Trợ lý:"""
         """
         try:
             if product_id:
-                # Lấy product hiện tại
-                try:
-                    current_product = Product.objects.get(id=product_id, status='active')
+                products = get_neighbor_products(product_id, 'co_purchase', limit)
+                if len(products) < limit:
                     # Lấy sản phẩm cùng danh mục
-                    products = Product.objects.filter(
+                    exclude_ids = [product_id] + [p.id for p in products]
+                    same_category = Product.objects.filter(
                         status='active',
-                        category=current_product.category
-                    ).exclude(id=product_id).order_by('-sold_count', '-rating')[:limit]
-                except Product.DoesNotExist:
-                    products = Product.objects.filter(
+                        category__products__id=product_id
+                    ).exclude(id__in=exclude_ids).select_related('category').order_by('-sold_count', '-rating')
+                    products.extend(same_category[:limit - len(products)])
+                if not products and not Product.objects.filter(id=product_id, status='active').exists():
+                    products = list(Product.objects.filter(
                         status='active'
-                    ).order_by('-sold_count', '-rating')[:limit]
+                    ).select_related('category').order_by('-sold_count', '-rating')[:limit])
             else:
                 # Lấy sản phẩm bán chạy nhất
-                products = Product.objects.filter(
+                products = list(Product.objects.filter(
                     status='active'
-                ).order_by('-sold_count', '-rating')[:limit]
+                ).select_related('category').order_by('-sold_count', '-rating')[:limit])
+
+            prefetch_related_objects(products, 'variants')
             
             result = []
             for product in products:
@@ -1630,6 +1485,30 @@ Trợ lý:"""
         except Exception as e:
             logger.error(f"Error getting recommendations: {str(e)}")
             return []
+
+    def _get_related_pool(self, selected_ids, limit: int = 8) -> List[Product]:
+        """
+        Sản phẩm bổ sung khi danh sách gợi ý còn ít: ưu tiên sản phẩm thường được
+        mua cùng (đọc từ chỉ mục có sẵn), chưa có dữ liệu thì lấy cùng danh mục.
+        """
+        related_pool = [
+            row.neighbor
+            for row in ProductNeighbor.objects.filter(
+                product_id__in=selected_ids,
+                kind='co_purchase',
+                neighbor__status='active'
+            ).exclude(
+                neighbor_id__in=selected_ids
+            ).select_related('neighbor').order_by('-score', 'rank')[:limit * 2]
+        ]
+        related_pool = list({p.id: p for p in related_pool}.values())[:limit]
+        if related_pool:
+            return related_pool
+
+        return list(Product.objects.filter(
+            status='active',
+            category__products__id__in=selected_ids
+        ).exclude(id__in=selected_ids).distinct().order_by('-sold_count', '-rating')[:limit])
     
     def get_all_products_dict(self) -> Dict[str, List]:
         """
@@ -1680,21 +1559,18 @@ Trợ lý:"""
             Danh sách sản phẩm đã được lọc (tối đa 5)
         """
         try:
-            query_text = (user_message or '').lower().strip()
-            keywords = self._extract_keywords_from_message(query_text)
-            preferences = self._extract_customer_preferences(query_text)
-            is_discovery_query = self._is_catalog_discovery_query(query_text)
-            generic_keywords = {
-                'gau', 'gấu', 'bong', 'bông', 'gau bong', 'gấu bông',
-                'qua', 'quà', 'tang', 'tặng', 'qua tang', 'quà tặng',
-                'shop', 'mua', 'tim', 'tìm'
-            }
-            specific_keywords = [k for k in keywords if k not in generic_keywords]
-            is_specific_focus_query = self._is_specific_product_focus_query(query_text, specific_keywords)
-            is_price_query = self._is_price_query(query_text)
-            price_focus_keywords = self._extract_price_focus_keywords(query_text)
+            # Phân tích tin nhắn một lượt, các bước bên dưới dùng chung kết quả
+            analysis = analyze_message(user_message)
+            query_text = analysis.text
+            keywords = list(analysis.keywords)
+            preferences = analysis.preferences()
+            is_discovery_query = analysis.is_catalog_discovery
+            specific_keywords = list(analysis.specific_keywords)
+            is_specific_focus_query = analysis.is_specific_focus(specific_keywords)
+            is_price_query = analysis.is_price_query
+            price_focus_keywords = list(analysis.price_focus_keywords)
             constraint_terms = preferences.get('constraint_terms', [])
-            min_price, max_price = self._parse_budget_from_message(query_text)
+            min_price, max_price = analysis.budget
 
             target_budget = None
             if min_price is not None and max_price is not None:
@@ -1980,13 +1856,7 @@ Trợ lý:"""
                     selected = products_scored[:5]
                     if len(selected) < 3:
                         selected_ids = {item['id'] for item in selected}
-                        category_ids = list(
-                            Product.objects.filter(id__in=selected_ids).values_list('category_id', flat=True)
-                        )
-                        related_pool = Product.objects.filter(
-                            status='active',
-                            category_id__in=category_ids
-                        ).exclude(id__in=selected_ids).order_by('-sold_count', '-rating')[:8]
+                        related_pool = self._get_related_pool(selected_ids)
 
                         for related_product in related_pool:
                             if len(selected) >= 5:
@@ -2033,13 +1903,7 @@ Trợ lý:"""
 
                 if len(selected) < 3:
                     selected_ids = {item['id'] for item in selected}
-                    category_ids = list(
-                        Product.objects.filter(id__in=selected_ids).values_list('category_id', flat=True)
-                    )
-                    related_pool = Product.objects.filter(
-                        status='active',
-                        category_id__in=category_ids
-                    ).exclude(id__in=selected_ids).order_by('-sold_count', '-rating')[:8]
+                    related_pool = self._get_related_pool(selected_ids)
 
                     for related_product in related_pool:
                         if len(selected) >= 5:
@@ -2069,7 +1933,12 @@ Trợ lý:"""
             # Không trả sản phẩm fallback để tránh gợi ý lệch yêu cầu.
             return []
 
-    def improve_product_extraction(self, ai_response: str, user_message: str = None) -> Dict:
+    def improve_product_extraction(
+        self,
+        ai_response: str,
+        user_message: str = None,
+        intent_products: Optional[List[Dict]] = None
+    ) -> Dict:
         """
         Cải tiến việc trích xuất sản phẩm từ response
         Sử dụng fuzzy matching + intent-based filtering
@@ -2090,7 +1959,10 @@ Trợ lý:"""
             
             # Sử dụng intent-based filtering
             if user_message:
-                products = self._filter_products_by_intent(ai_response, user_message)
+                if intent_products is not None:
+                    products = intent_products
+                else:
+                    products = self._filter_products_by_intent(ai_response, user_message)
             else:
                 # Fallback: dùng phương thức cũ
                 products = []
@@ -2215,6 +2087,7 @@ Trợ lý:"""
                     'rating': float(product.rating),
                     'stock': product.stock,
                     'image_url': self._get_product_image_url(product),
+                    'image_srcset': self._get_product_image_srcset(product),
                     'variants': variants,
                     'chroma_similarity_score': similarity_score  # ChromaDB score
                 })
@@ -0,0 +1,90 @@
+"""
+Stage scheduler cho pipeline chat của AI Agent.
+
+Cho phép chạy song song các bước độc lập (truy xuất grounding, tải lịch sử,
+gọi LLM, hydrate sản phẩm ứng viên) trên một thread pool giới hạn. Mỗi thread
+dùng DB connection riêng của nó và đóng connection khi bước kết thúc.
+
+Khi không thể/không nên chạy song song (đang trong transaction.atomic như
+TestCase, hoặc AI_AGENT_STAGE_WORKERS = 0) thì các bước chạy tuần tự theo đúng
+thứ tự khai báo để kết quả luôn xác định.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from django.conf import settings
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_max_workers() -> int:
+    try:
+        return max(0, int(getattr(settings, 'AI_AGENT_STAGE_WORKERS', 4)))
+    except (TypeError, ValueError):
+        return 4
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=_get_max_workers(),
+                    thread_name_prefix='ai-stage'
+                )
+    return _executor
+
+
+def _run_in_worker(func: Callable, *args, **kwargs):
+    """Chạy một stage trong worker thread rồi đóng connection của thread đó"""
+    try:
+        return func(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+class StageScheduler:
+    """
+    Chạy một nhóm stage độc lập và trả về kết quả theo tên stage.
+
+    Ví dụ:
+        results = StageScheduler().run({
+            'grounding': lambda: ...,
+            'history': lambda: ...,
+        })
+    """
+
+    def __init__(self, parallel: bool = None):
+        if parallel is None:
+            parallel = self.can_run_parallel()
+        self.parallel = parallel
+
+    @staticmethod
+    def can_run_parallel() -> bool:
+        # Dữ liệu chưa commit trong atomic block không nhìn thấy được từ
+        # connection của thread khác -> phải chạy tuần tự
+        if _get_max_workers() < 2:
+            return False
+        return not connection.in_atomic_block
+
+    def run(self, stages: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+        """
+        Chạy các stage, trả về dict {tên stage: kết quả}.
+        Exception của stage nào sẽ được raise lại khi lấy kết quả của stage đó.
+        """
+        if not self.parallel or len(stages) < 2:
+            return {name: func() for name, func in stages.items()}
+
+        executor = _get_executor()
+        futures = {
+            name: executor.submit(_run_in_worker, func)
+            for name, func in stages.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 
@@ -266,3 +268,286 @@ class AIAgentServiceScenarioTest(TestCase):
         self.assertIn('products', response)
         self.assertGreaterEqual(len(response['products']), 1)
         self.assertTrue(any(item['price'] <= 350000 for item in response['products']))
+
+
+class StageSchedulerTest(TestCase):
+    def test_runs_sequentially_inside_atomic_block(self):
+        from .stage_scheduler import StageScheduler
+
+        order = []
+        scheduler = StageScheduler()
+        results = scheduler.run({
+            'first': lambda: order.append('first') or 1,
+            'second': lambda: order.append('second') or 2,
+        })
+
+        self.assertFalse(scheduler.parallel)
+        self.assertEqual(results, {'first': 1, 'second': 2})
+        self.assertEqual(order, ['first', 'second'])
+
+    def test_parallel_stages_run_concurrently(self):
+        import threading
+        from .stage_scheduler import StageScheduler
+
+        # Cả hai stage phải cùng chờ barrier -> chỉ qua được nếu chạy song song
+        barrier = threading.Barrier(2, timeout=5)
+        results = StageScheduler(parallel=True).run({
+            'retrieval': lambda: barrier.wait() is not None and 'retrieval',
+            'history': lambda: barrier.wait() is not None and 'history',
+        })
+
+        self.assertEqual(results, {'retrieval': 'retrieval', 'history': 'history'})
+
+    def test_chat_reuses_retrieval_for_reply_products(self):
+        category = Category.objects.create(name='Gau Bong')
+        product = Product.objects.create(
+            name='Gau Teddy Nau 60cm',
+            category=category,
+            price=300000,
+            stock=10,
+            sold_count=50,
+            description='Gau teddy mau nau de thuong',
+            status='active'
+        )
+        user = User.objects.create_user(username='stageuser', email='stage@example.com', password='testpass123')
+
+        service = AIAgentService()
+        service.gemini_api_key = ''
+        service.openai_api_key = 'test-key'
+        service.search_products_with_chroma = lambda *args, **kwargs: []
+        service._request_openai_completion = lambda prompt: 'Ban tham khao mau nay nhe.'
+
+        calls = []
+        original_filter = service._filter_products_by_intent
+
+        def counting_filter(*args, **kwargs):
+            calls.append(args)
+            return original_filter(*args, **kwargs)
+
+        service._filter_products_by_intent = counting_filter
+
+        conversation = service.start_conversation(user)
+        response = service.chat(conversation, 'Toi muon mua gau teddy')
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([item['id'] for item in response['products']], [product.id])
+        self.assertEqual(conversation.messages.count(), 2)
+
+    def test_chat_falls_back_to_keyword_search_when_pipeline_fails(self):
+        user = User.objects.create_user(username='stageuser', email='stage@example.com', password='testpass123')
+        service = AIAgentService()
+        service.gemini_api_key = ''
+        service.openai_api_key = 'test-key'
+        service.search_products_with_chroma = lambda *args, **kwargs: []
+        service._request_openai_completion = lambda prompt: 'Ban tham khao mau nay nhe.'
+        fallback = {'ai_response': 'Ket qua tim theo tu khoa', 'products': []}
+        service._get_fallback_response = lambda message: fallback
+
+        def broken(*args, **kwargs):
+            raise ValueError('broken')
+
+        conversation = service.start_conversation(user)
+        with mock.patch('ai_agent.services.load_history', side_effect=broken):
+            service._extract_products_from_response = broken
+            response = service.chat(conversation, 'Toi muon mua gau teddy')
+
+        self.assertEqual(response, fallback)
+        self.assertEqual(
+            list(conversation.messages.values_list('role', flat=True).order_by('id')), ['user', 'assistant']
+        )
+
+
+class PromptBudgetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='budgetuser', email='budget@example.com', password='testpass123')
+        self.service = AIAgentService()
+        self.conversation = self.service.start_conversation(self.user)
+
+    def test_summary_folds_only_messages_outside_window(self):
+        from .prompt_builder import load_history
+
+        for index in range(8):
+            self.conversation.add_message('user', f'Cau hoi so {index}')
+            self.conversation.add_message('assistant', f'Tra loi so {index}. Chi tiet rat dai.')
+
+        history = load_history(self.conversation, window=6)
+        self.conversation.refresh_from_db()
+
+        self.assertEqual(len(history['messages']), 6)
+        self.assertEqual(self.conversation.summary_message_count, 10)
+        self.assertIn('Cau hoi so 0', self.conversation.summary)
+        self.assertNotIn('Chi tiet rat dai', self.conversation.summary)
+
+        # Lần sau chỉ gộp thêm phần mới rơi khỏi cửa sổ
+        self.conversation.add_message('user', 'Cau hoi moi')
+        load_history(self.conversation, window=6)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary_message_count, 11)
+        self.assertEqual(self.conversation.summary.count('Cau hoi so 0'), 1)
+
+    def test_prompt_respects_hard_token_cap(self):
+        from .prompt_builder import PromptBuilder
+
+        messages = [
+            {'role': 'assistant' if index % 2 else 'user', 'content': 'noi dung rat dai ' * 200}
+            for index in range(10)
+        ]
+        prompt = PromptBuilder(max_tokens=800).build(
+            system_prompt='he thong ' * 500,
+            grounding='\n'.join(['- San pham mau'] * 300),
+            summary='- Khach: hoi ve gau bong',
+            messages=messages,
+            user_message='Toi nen mua mau nao?',
+        )
+
+        self.assertLessEqual(prompt.estimated_tokens, 800)
+        self.assertEqual(prompt.to_openai_messages()[-1]['content'], 'Toi nen mua mau nao?')
+
+
+class MessageAnalyzerTest(TestCase):
+    def test_folded_matching_keeps_surface_semantics(self):
+        from .message_analyzer import analyze_message
+
+        analysis = analyze_message('Hãy gợi ý gấu Hồng mềm tầm 300k')
+
+        self.assertEqual(analysis.folded, 'hay goi y gau hong mem tam 300k')
+        # "hãy" không phải marker so sánh "hay"
+        self.assertFalse(analysis.has('compare_marker'))
+        # Term trả về giữ nguyên dạng có dấu khách đã gõ (dùng cho truy vấn DB)
+        self.assertEqual(analysis.terms('color'), ('hồng',))
+        self.assertEqual(analysis.terms('material'), ('mềm',))
+        self.assertEqual(analysis.budget, (None, 300000))
+        self.assertTrue(analysis.wants_recommendation_list)
+
+    def test_analysis_is_shared_and_immutable(self):
+        from dataclasses import FrozenInstanceError
+        from .message_analyzer import analyze_message
+
+        first = analyze_message('Gia Gau Bear Brown 70cm bao nhieu?')
+        second = analyze_message('  gia gau bear brown 70cm bao nhieu?')
+
+        self.assertIs(first, second)
+        self.assertTrue(first.is_price_query)
+        with self.assertRaises(FrozenInstanceError):
+            first.text = 'khac'
+        with self.assertRaises(TypeError):
+            first.matches['color'] = ('do',)
+
+    def test_budget_context_keywords(self):
+        service = AIAgentService.__new__(AIAgentService)
+
+        self.assertEqual(service._parse_budget_from_message('Co mau nao duoi 200k khong'), (None, 200000))
+        self.assertEqual(service._parse_budget_from_message('Tren 500k co mau nao'), (500000, None))
+        self.assertEqual(service._parse_budget_from_message('tu 200k den 500k'), (200000, 500000))
+        self.assertEqual(service._parse_budget_from_message('150k - 250k'), (150000, 250000))
+
+
+class FakeChromaService:
+    """Thay ChromaDB trong test: embedding = vector đếm từ khóa trong mô tả"""
+    AXES = ('hong', 'nau', 'trang', 'lon')
+
+    def __init__(self):
+        self.vectors = {}
+        self.upserted = []
+
+    def document_hash(self, product):
+        return f"{product.name}|{product.description}"[:40]
+
+    def upsert_products(self, products):
+        products = list(products)
+        for product in products:
+            words = product.description.lower().split()
+            self.vectors[product.id] = [words.count(axis) + 0.01 for axis in self.AXES]
+        self.upserted.append(sorted(product.id for product in products))
+        return len(products)
+
+    def delete_products(self, product_ids):
+        for product_id in product_ids:
+            self.vectors.pop(product_id, None)
+        return 0
+
+    def get_product_embeddings(self):
+        return dict(self.vectors)
+
+
+class SemanticNeighborsTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Gau Bong')
+        self.products = {
+            name: Product.objects.create(
+                name=name, category=category, price=200000, stock=5,
+                description=description, status='active'
+            )
+            for name, description in [
+                ('Gau Hong A', 'hong hong'),
+                ('Gau Hong B', 'hong hong lon'),
+                ('Gau Nau A', 'nau nau'),
+                ('Gau Nau B', 'nau nau lon'),
+                ('Gau Trang', 'trang trang'),
+            ]
+        }
+        self.chroma = FakeChromaService()
+
+    def _neighbor_ids(self, name):
+        from products.models import ProductNeighbor
+
+        return list(ProductNeighbor.objects.filter(
+            product=self.products[name], kind='semantic'
+        ).order_by('rank').values_list('neighbor__name', flat=True))
+
+    def test_incremental_rebuild_only_touches_affected_products(self):
+        from .semantic_neighbors import build_semantic_neighbors
+
+        first = build_semantic_neighbors(self.chroma, top_k=1)
+        self.assertEqual(first['changed'], 5)
+        self.assertEqual(self._neighbor_ids('Gau Hong A'), ['Gau Hong B'])
+        self.assertEqual(self._neighbor_ids('Gau Trang'), ['Gau Hong B'])
+
+        # Không đổi hash -> không làm gì
+        self.assertEqual(build_semantic_neighbors(self.chroma, top_k=1)['recomputed'], 0)
+
+        # "Gau Trang" đổi mô tả thành gấu nâu: chen vào top-1 của nhóm nâu
+        product = self.products['Gau Trang']
+        product.description = 'nau nau nau'
+        product.save()
+        result = build_semantic_neighbors(self.chroma, top_k=1)
+
+        self.assertEqual(result['changed'], 1)
+        self.assertEqual(self.chroma.upserted[-1], [product.id])
+        self.assertEqual(self._neighbor_ids('Gau Trang'), ['Gau Nau A'])
+        self.assertEqual(self._neighbor_ids('Gau Nau A'), ['Gau Trang'])
+        # Chỉ tính lại sản phẩm đổi hash và sản phẩm nó chen vào top-1
+        self.assertEqual(result['recomputed'], 2)
+        self.assertEqual(self._neighbor_ids('Gau Nau B'), ['Gau Nau A'])
+        self.assertEqual(self._neighbor_ids('Gau Hong A'), ['Gau Hong B'])
+
+    def test_inactive_product_is_removed_from_lists(self):
+        from .semantic_neighbors import build_semantic_neighbors
+
+        build_semantic_neighbors(self.chroma, top_k=2)
+        hidden = self.products['Gau Hong B']
+        hidden.status = 'inactive'
+        hidden.save()
+        result = build_semantic_neighbors(self.chroma, top_k=2)
+
+        self.assertEqual(result['removed'], 1)
+        self.assertEqual(self._neighbor_ids('Gau Hong B'), [])
+        self.assertNotIn('Gau Hong B', self._neighbor_ids('Gau Hong A'))
+
+    def test_similar_action_uses_single_query(self):
+        from .semantic_neighbors import build_semantic_neighbors
+
+        build_semantic_neighbors(self.chroma, top_k=2)
+        product = self.products['Gau Nau A']
+
+        # Lân cận (join sản phẩm + danh mục) + biến thể
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/products/{product.slug}/similar/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.json()], ['Gau Nau B', 'Gau Hong B'])
+        item = response.json()[0]
+        for field in ('category_name', 'main_image_srcset', 'in_stock', 'variants', 'similarity_score'):
+            self.assertIn(field, item)
+
+        response = self.client.get(f'/api/products/{product.id}/similar/?limit=1')
+        self.assertEqual([item['slug'] for item in response.json()], [self.products['Gau Nau B'].slug])
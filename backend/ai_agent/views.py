@@ -2,10 +2,12 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from django.conf import settings
 from django.db.models import Q
 from django.db.models import OuterRef, Subquery
 from django.db.models import Case, When, Value, IntegerField
 from django.utils import timezone
+from orders.idempotency import idempotent
 from .models import ConversationSession
 from .serializers import (
     ConversationSessionSerializer, 
@@ -609,6 +611,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['post'], url_path='add_to_cart')
+    @idempotent('chatbot.add_to_cart')
     def add_to_cart(self, request, session_id=None):
         """[Thêm giỏ hàng] Thêm sản phẩm vào giỏ hàng từ chatbot"""
         try:
@@ -653,6 +656,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['post'], url_path='buy_now')
+    @idempotent('chatbot.buy_now')
     def buy_now(self, request, session_id=None):
         """[Mua ngay] Tạo đơn hàng ngay từ chatbot"""
         try:
@@ -799,8 +803,13 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        service = AIAgentService()
-        products_by_category = service.get_all_products_dict()
+        # Giống nhau cho mọi hội thoại: cache dùng chung, tồn kho trễ tối đa CATALOG_CACHE_MAX_AGE giây
+        from backend.response_cache import cached_value
+        products_by_category = cached_value(
+            'ai_agent.get_all_products', ('product', 'category'),
+            lambda: AIAgentService().get_all_products_dict(),
+            timeout=getattr(settings, 'CATALOG_CACHE_MAX_AGE', 60),
+        )
         
         # Tính tổng số sản phẩm
         total_products = sum(len(products) for products in products_by_category.values())
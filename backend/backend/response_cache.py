@@ -0,0 +1,177 @@
+"""
+Cache phản hồi phía server cho các API đọc nhiều, vô hiệu hóa theo tag.
+
+Mỗi tag ('product', 'category', 'order') có một số phiên bản trong cache; khóa
+của mục cache chứa phiên bản các tag nó phụ thuộc. invalidate_tags() chỉ tăng
+số phiên bản: mục cũ không bao giờ được đọc lại và tự hết hạn theo TTL, không
+cần lưu danh sách khóa theo tag.
+
+Chống dồn request khi cache trống (stampede): chỉ request giành được khóa
+cache.add() tính lại, các request khác chờ kết quả trong RESPONSE_CACHE_WAIT_SECONDS
+rồi mới tự tính nếu vẫn chưa có.
+
+Số lần hit / miss / chờ-được (coalesced) theo endpoint đếm trong cache, xem
+response_cache_stats() và GET /api/cache-stats/.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+TAG_PREFIX = 'rc:tag:'
+STATS_PREFIX = 'rc:stats:'
+STAT_KINDS = ('hits', 'misses', 'coalesced')
+POLL_INTERVAL = 0.05
+
+# Tên các endpoint đã khai báo cache (dùng cho thống kê)
+_endpoints = set()
+
+
+def _initial_version() -> int:
+    # Theo thời gian (ms) thay vì 1: tag bị evict rồi tạo lại không trùng phiên bản cũ
+    return int(time.time() * 1000)
+
+
+def _tag_versions(tags) -> str:
+    keys = [f"{TAG_PREFIX}{tag}" for tag in tags]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _initial_version(), timeout=None)
+            found[key] = cache.get(key)
+    return '.'.join(str(found[key]) for key in keys)
+
+
+def _bump(tags):
+    for tag in tags:
+        key = f"{TAG_PREFIX}{tag}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), timeout=None)
+
+
+def invalidate_tags(*tags):
+    """
+    Vô hiệu hóa các mục cache gắn các tag này.
+
+    Tăng phiên bản ngay và thêm một lần sau commit: request đọc dữ liệu cũ
+    trong lúc transaction chưa commit không để lại mục cache sai.
+    """
+    _bump(tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(tags))
+
+
+def _count(endpoint: str, kind: str):
+    key = f"{STATS_PREFIX}{endpoint}:{kind}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_or_compute(endpoint: str, tags, key_parts: str, compute, timeout: int = None):
+    """
+    Lấy giá trị từ cache hoặc tính bằng compute() (single-flight).
+
+    compute() trả về (value, cacheable).
+    """
+    timeout = timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+    digest = hashlib.md5(f"{key_parts}|{_tag_versions(tags)}".encode('utf-8')).hexdigest()
+    key = f"rc:{endpoint}:{digest}"
+
+    entry = cache.get(key)
+    if entry is not None:
+        _count(endpoint, 'hits')
+        return entry
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, timeout=getattr(settings, 'RESPONSE_CACHE_LOCK_SECONDS', 30)):
+        # Request khác đang tính: chờ kết quả của nó
+        deadline = time.monotonic() + getattr(settings, 'RESPONSE_CACHE_WAIT_SECONDS', 5)
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                _count(endpoint, 'coalesced')
+                return entry
+        lock_key = None
+
+    _count(endpoint, 'misses')
+    try:
+        value, cacheable = compute()
+        if cacheable:
+            cache.set(key, value, timeout)
+        return value
+    finally:
+        if lock_key:
+            cache.delete(lock_key)
+
+
+def cached_value(endpoint: str, tags, compute, timeout: int = None, key_parts: str = ''):
+    """Cache kết quả một hàm (vd payload get_all_products của chatbot)"""
+    _endpoints.add(endpoint)
+    return get_or_compute(endpoint, tags, key_parts, lambda: (compute(), True), timeout)
+
+
+def cached_response(endpoint: str, tags, timeout=None, condition=None):
+    """
+    Decorator cho action GET của ViewSet: cache status + data của phản hồi 200 theo URL.
+
+    Chỉ dùng cho phản hồi không phụ thuộc người dùng (hoặc chặn bằng condition).
+
+    Args:
+        tags: tag phụ thuộc, vd ('product', 'category')
+        timeout: số giây hoặc hàm không tham số trả về số giây (mặc định RESPONSE_CACHE_TIMEOUT)
+        condition: hàm(request) -> bool; False thì bỏ qua cache (vd endpoint chỉ cho admin)
+    """
+    _endpoints.add(endpoint)
+
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method != 'GET' or (condition is not None and not condition(request)):
+                return view_method(self, request, *args, **kwargs)
+
+            def compute():
+                response = view_method(self, request, *args, **kwargs)
+                cacheable = response.status_code == 200 and hasattr(response, 'data')
+                return response, cacheable
+
+            result = get_or_compute(
+                endpoint, tags, request.build_absolute_uri(),
+                lambda: _freeze(compute()),
+                timeout() if callable(timeout) else timeout,
+            )
+            if isinstance(result, Response):
+                return result
+            return Response(result['data'], status=result['status'])
+        return wrapper
+    return decorator
+
+
+def _freeze(result):
+    """Chỉ lưu status + data (Response đã render không pickle được ổn định)"""
+    response, cacheable = result
+    if not cacheable:
+        return response, False
+    return {'status': response.status_code, 'data': response.data}, True
+
+
+def response_cache_stats() -> dict:
+    """{endpoint: {hits, misses, coalesced, hit_rate}}"""
+    keys = [f"{STATS_PREFIX}{endpoint}:{kind}" for endpoint in sorted(_endpoints) for kind in STAT_KINDS]
+    values = cache.get_many(keys)
+    stats = {}
+    for endpoint in sorted(_endpoints):
+        counts = {kind: values.get(f"{STATS_PREFIX}{endpoint}:{kind}", 0) for kind in STAT_KINDS}
+        total = sum(counts.values())
+        counts['hit_rate'] = round((counts['hits'] + counts['coalesced']) / total, 4) if total else None
+        stats[endpoint] = counts
+    return stats
@@ -193,6 +193,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
@@ -256,3 +257,88 @@ PAYOS_CANCEL_URL = config('PAYOS_CANCEL_URL', default='http://localhost:3000/cus
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
 GEMINI_MODEL = config('GEMINI_MODEL', default='gemini-3-flash-preview')
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
+# Số thread tối đa để chạy song song các bước của chatbot (0/1 = chạy tuần tự)
+AI_AGENT_STAGE_WORKERS = config('AI_AGENT_STAGE_WORKERS', default=4, cast=int)
+# Ngân sách prompt cho chatbot (token ước lượng ~ 4 ký tự/token)
+AI_AGENT_PROMPT_MAX_TOKENS = config('AI_AGENT_PROMPT_MAX_TOKENS', default=6000, cast=int)
+AI_AGENT_HISTORY_WINDOW = config('AI_AGENT_HISTORY_WINDOW', default=6, cast=int)
+AI_AGENT_SUMMARY_MAX_TOKENS = config('AI_AGENT_SUMMARY_MAX_TOKENS', default=300, cast=int)
+AI_AGENT_TURN_MAX_TOKENS = config('AI_AGENT_TURN_MAX_TOKENS', default=120, cast=int)
+
+# Gợi ý sản phẩm: số lân cận lưu sẵn cho mỗi sản phẩm
+CO_PURCHASE_TOP_K = config('CO_PURCHASE_TOP_K', default=10, cast=int)
+SEMANTIC_NEIGHBORS_TOP_K = config('SEMANTIC_NEIGHBORS_TOP_K', default=10, cast=int)
+
+# Report jobs: xuất báo cáo chạy trong process pool riêng (không chiếm web worker)
+REPORT_JOB_WORKERS = config('REPORT_JOB_WORKERS', default=2, cast=int)
+# True: chạy job ngay trong process hiện tại (test / môi trường không hỗ trợ multiprocessing)
+REPORT_JOBS_RUN_INLINE = config('REPORT_JOBS_RUN_INLINE', default=False, cast=bool)
+REPORT_JOB_TIMEOUT_SECONDS = config('REPORT_JOB_TIMEOUT_SECONDS', default=1800, cast=int)
+REPORT_STORAGE_ROOT = BASE_DIR / 'private_reports'
+
+# Giữ hàng cho đơn thanh toán online (MoMo / chuyển khoản): quá hạn chưa thanh toán
+# thì lệnh release_expired_reservations (cron mỗi phút) trả hàng về kho và hủy đơn
+STOCK_RESERVATION_TTL_MINUTES = config('STOCK_RESERVATION_TTL_MINUTES', default=20, cast=int)
+
+# Webhook thanh toán: ghi vào hộp thư rồi trả lời cổng ngay, worker áp dụng sau.
+# True: xử lý ngay sau commit trong request (test / dev không chạy worker nền)
+PAYMENT_EVENTS_RUN_INLINE = config('PAYMENT_EVENTS_RUN_INLINE', default=False, cast=bool)
+# Số lần thử lại một sự kiện thanh toán khi lưu đơn lỗi tạm thời, quá thì đánh dấu failed
+PAYMENT_EVENT_MAX_ATTEMPTS = config('PAYMENT_EVENT_MAX_ATTEMPTS', default=10, cast=int)
+
+# Đối soát thanh toán online: job reconcile_payments hỏi cổng với backoff tăng dần
+# (từ BASE đến MAX giây), bỏ theo dõi đơn quá GIVE_UP_HOURS giờ
+PAYMENT_RECONCILE_BASE_SECONDS = config('PAYMENT_RECONCILE_BASE_SECONDS', default=5, cast=int)
+PAYMENT_RECONCILE_MAX_SECONDS = config('PAYMENT_RECONCILE_MAX_SECONDS', default=300, cast=int)
+PAYMENT_RECONCILE_GIVE_UP_HOURS = config('PAYMENT_RECONCILE_GIVE_UP_HOURS', default=24, cast=int)
+# Cache ngắn cho endpoint kiểm tra trạng thái thanh toán (checkout page poll liên tục)
+PAYMENT_STATUS_CACHE_SECONDS = config('PAYMENT_STATUS_CACHE_SECONDS', default=3, cast=int)
+
+# Idempotency-Key cho create_order / chatbot: thời gian lưu kết quả để phát lại,
+# và thời gian request trùng chờ request gốc đang chạy xong
+IDEMPOTENCY_KEY_TTL_HOURS = config('IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=int)
+IDEMPOTENCY_WAIT_SECONDS = config('IDEMPOTENCY_WAIT_SECONDS', default=10, cast=float)
+# Hạn giữ key của request đang chạy: worker chết giữa chừng thì sau chừng này giây
+# request gửi lại được chạy thay (phải dài hơn thời gian xử lý một đơn)
+IDEMPOTENCY_LEASE_SECONDS = config('IDEMPOTENCY_LEASE_SECONDS', default=60, cast=int)
+
+# Ảnh sản phẩm: các độ rộng (px) của ảnh thu nhỏ WebP/JPEG sinh khi upload.
+# IMAGE_PROCESSING_RUN_INLINE=True xử lý ngay sau commit thay vì ở thread nền (test / dev)
+PRODUCT_IMAGE_WIDTHS = config('PRODUCT_IMAGE_WIDTHS', default='200,400,800', cast=lambda v: [int(w) for w in v.split(',') if w.strip()])
+IMAGE_PROCESSING_RUN_INLINE = config('IMAGE_PROCESSING_RUN_INLINE', default=False, cast=bool)
+
+# HTTP cache cho các endpoint đọc catalog (sản phẩm / danh mục): max-age cho CDN /
+# trình duyệt, đồng thời là độ trễ tối đa của tồn kho / lượt bán hiển thị trong ETag
+CATALOG_CACHE_MAX_AGE = config('CATALOG_CACHE_MAX_AGE', default=60, cast=int)
+CATALOG_CACHE_STALE_WHILE_REVALIDATE = config('CATALOG_CACHE_STALE_WHILE_REVALIDATE', default=300, cast=int)
+
+# Cache dùng chung: Redis khi có REDIS_URL (production, nhiều worker dùng chung
+# cache phản hồi / khóa single-flight / thống kê), không thì LocMem theo từng process (dev / test)
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'web_cnpm',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'web-cnpm',
+        }
+    }
+
+# Cache phản hồi phía server cho API đọc nhiều (backend/response_cache.py): TTL mặc định,
+# thời gian giữ khóa tính lại và thời gian request trùng chờ kết quả trước khi tự tính
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)
+RESPONSE_CACHE_LOCK_SECONDS = config('RESPONSE_CACHE_LOCK_SECONDS', default=30, cast=int)
+RESPONSE_CACHE_WAIT_SECONDS = config('RESPONSE_CACHE_WAIT_SECONDS', default=5, cast=float)
+
+# Lọc theo facet (/api/products/facets/): các mốc chia khoảng giá (VND)
+FACET_PRICE_BUCKETS = config('FACET_PRICE_BUCKETS', default='100000,200000,500000,1000000', cast=lambda v: [int(p) for p in v.split(',') if p.strip()])
+
+# Import sản phẩm hàng loạt (products/bulk_io.py): số dòng mỗi lô / transaction
+PRODUCT_IMPORT_CHUNK_SIZE = config('PRODUCT_IMPORT_CHUNK_SIZE', default=500, cast=int)
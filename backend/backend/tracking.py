@@ -0,0 +1,98 @@
+"""
+Theo dõi thay đổi field của model trong bộ nhớ (không tốn truy vấn).
+
+Giá trị được chụp lại khi instance được nạp từ DB (from_db) và sau mỗi lần
+save(), nên trong pre_save/post_save có thể hỏi "field nào đã đổi, giá trị
+trước đó là gì" mà không cần SELECT lại bản ghi:
+
+    class Order(FieldTrackerMixin, models.Model):
+        tracked_fields = ('status', 'payment_status')
+
+    @receiver(post_save, sender=Order)
+    def on_order_saved(sender, instance, created, **kwargs):
+        if instance.has_changed('status'):
+            old_status = instance.previous('status')
+"""
+import copy
+from typing import Dict, Iterable, Optional
+
+from django.db import models
+
+_UNSET = object()
+
+
+class FieldTrackerMixin(models.Model):
+    """
+    Mixin cho model cần biết field nào đã đổi so với lần nạp / lưu gần nhất.
+
+    tracked_fields: tên các field cần theo dõi (rỗng = mọi field thường, trừ pk).
+    Instance mới tạo (chưa từng lưu) coi như chưa có giá trị trước: previous()
+    trả về None và has_changed() luôn True.
+    """
+    tracked_fields: Iterable[str] = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    @classmethod
+    def _tracked_attnames(cls) -> Dict[str, str]:
+        cache_name = '_tracked_attnames_cache'
+        # Cache theo từng class (không dùng của class cha)
+        if cache_name not in cls.__dict__:
+            names = set(cls.tracked_fields)
+            attnames = {
+                field.name: field.attname
+                for field in cls._meta.concrete_fields
+                if not field.primary_key and (not names or field.name in names)
+            }
+            setattr(cls, cache_name, attnames)
+        return cls.__dict__[cache_name]
+
+    def _snapshot_tracked_fields(self, field_names: Optional[Iterable[str]] = None):
+        snapshot = self.__dict__.setdefault('_tracked_snapshot', {})
+        attnames = self._tracked_attnames()
+        names = attnames.keys() if field_names is None else [name for name in field_names if name in attnames]
+        for name in names:
+            attname = attnames[name]
+            # Field bị defer (only()/defer()) thì không có giá trị để so sánh
+            if attname in self.__dict__:
+                snapshot[name] = copy.copy(self.__dict__[attname])
+
+    def previous(self, field_name: str):
+        """Giá trị của field tại lần nạp / lưu gần nhất (None nếu chưa biết)"""
+        value = self.__dict__.get('_tracked_snapshot', {}).get(field_name, _UNSET)
+        return None if value is _UNSET else value
+
+    def has_changed(self, field_name: str) -> bool:
+        attname = self._tracked_attnames()[field_name]
+        value = self.__dict__.get('_tracked_snapshot', {}).get(field_name, _UNSET)
+        if value is _UNSET:
+            return True
+        return self.__dict__.get(attname) != value
+
+    @property
+    def dirty_fields(self) -> Dict[str, object]:
+        """{field: giá trị trước} cho các field đã đổi"""
+        return {
+            name: self.previous(name)
+            for name in self._tracked_attnames()
+            if self.has_changed(name)
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Sau khi lưu (và sau post_save), giá trị hiện tại thành mốc so sánh mới
+        update_fields = kwargs.get('update_fields')
+        self._snapshot_tracked_fields(None if update_fields is None else update_fields)
+
+    save.alters_data = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot_tracked_fields(fields)
@@ -19,6 +19,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .views import ResponseCacheStatsView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('users.urls')),
@@ -26,6 +28,7 @@ urlpatterns = [
     path('api/', include('products.urls')),
     path('api/orders/', include('orders.urls')),
     path('api/ai/', include('ai_agent.urls')),
+    path('api/cache-stats/', ResponseCacheStatsView.as_view(), name='response-cache-stats'),
 ]
 
 # Serve media files in development
@@ -0,0 +1,14 @@
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from users.views import IsAdminUser
+
+from .response_cache import response_cache_stats
+
+
+class ResponseCacheStatsView(APIView):
+    """Admin - Tỉ lệ hit của cache phản hồi phía server theo endpoint"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache_stats())
@@ -1,3 +1,83 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from backend.response_cache import get_or_compute, response_cache_stats
+
+from .models import Category
+
+User = get_user_model()
+
+
+class CatalogConditionalGetTest(TestCase):
+    def setUp(self):
+        Category.objects.create(name='Gau Bong')
+        self.client = APIClient()
+
+    def test_matching_etag_short_circuits_and_writes_invalidate(self):
+        response = self.client.get('/api/categories/active/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        # Chỉ đọc phiên bản catalog, không chạy queryset danh mục
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/categories/active/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # URL khác có ETag khác
+        self.assertNotEqual(self.client.get('/api/categories/')['ETag'], etag)
+
+        Category.objects.create(name='Gau Truc')
+        response = self.client.get('/api/categories/active/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Gau Bong')
+        self.client = APIClient()
+
+    def test_hit_serves_without_queryset_and_tag_write_invalidates(self):
+        self.assertEqual(len(self.client.get('/api/categories/active/').data), 1)
+
+        # Chỉ còn câu đọc phiên bản catalog cho ETag
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/categories/active/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['name'], 'Gau Bong')
+        self.assertEqual(response_cache_stats()['categories.active']['hits'], 1)
+
+        self.category.name = 'Gau Truc'
+        self.category.save()
+        self.assertEqual(self.client.get('/api/categories/active/').data[0]['name'], 'Gau Truc')
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'payload', True
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_compute('test.single', ('product',), 'k', compute)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-# Create your tests here.
+        self.assertEqual(results, ['payload'] * 4)
+        self.assertEqual(len(calls), 1)
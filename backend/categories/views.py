@@ -4,6 +4,8 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, BasePermission
 from django.db.models import Q
 from django.db import IntegrityError
+from backend.response_cache import cached_response
+from products.catalog import catalog_cached
 from .models import Category
 from .serializers import CategorySerializer
 import logging
@@ -45,6 +47,8 @@ class CategoryViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
     
+    @catalog_cached
+    @cached_response('categories.list', ('category', 'product'))
     def list(self, request, *args, **kwargs):
         """Lấy danh sách danh mục với tìm kiếm và lọc"""
         queryset = self.filter_queryset(self.get_queryset())
@@ -185,6 +189,8 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Lỗi máy chủ khi xóa danh mục', 'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     @action(detail=False, methods=['get'])
+    @catalog_cached
+    @cached_response('categories.active', ('category', 'product'))
     def active(self, request):
         """Lấy danh sách các danh mục đang hoạt động"""
         categories = self.queryset.filter(status='active')
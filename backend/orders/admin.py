@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem, Cart, CartItem
+from .models import Order, OrderItem, Cart, CartItem, IdempotencyKey, PaymentCheck, PaymentEvent, StockReservation
 
 
 class OrderItemInline(admin.TabularInline):
@@ -52,3 +52,37 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product_name', 'quantity', 'unit', 'product_price']
     list_filter = ['order__created_at']
     search_fields = ['product_name']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'product', 'size', 'quantity', 'status', 'expires_at', 'closed_at']
+    list_filter = ['status']
+    search_fields = ['order__order_code']
+    raw_id_fields = ['order', 'product']
+    readonly_fields = ['order', 'product', 'size', 'quantity', 'status', 'expires_at', 'created_at', 'closed_at']
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'provider', 'transaction_id', 'status', 'attempts', 'order', 'received_at', 'processed_at']
+    list_filter = ['provider', 'status']
+    search_fields = ['transaction_id', 'order__order_code']
+    raw_id_fields = ['order']
+    readonly_fields = ['provider', 'transaction_id', 'payload', 'order', 'received_at', 'processed_at']
+
+
+@admin.register(PaymentCheck)
+class PaymentCheckAdmin(admin.ModelAdmin):
+    list_display = ['order', 'attempts', 'next_check_at', 'last_checked_at']
+    search_fields = ['order__order_code']
+    raw_id_fields = ['order']
+    readonly_fields = ['last_result']
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['scope', 'owner', 'key', 'status', 'response_status', 'created_at', 'expires_at']
+    list_filter = ['scope', 'status']
+    search_fields = ['key', 'owner']
+    readonly_fields = ['fingerprint', 'response_body']
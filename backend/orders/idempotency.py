@@ -0,0 +1,180 @@
+"""
+Idempotency-Key cho các endpoint tạo đơn / thêm giỏ hàng.
+
+Mạng di động hay gửi lại POST khi mất phản hồi; không có lớp này mỗi lần gửi
+lại là một đơn mới, một lần trừ kho và một lần gọi cổng thanh toán nữa.
+
+- Request mới: ghi dòng 'in_progress' (unique (owner, scope, key)) rồi chạy view,
+  lưu status + body của phản hồi. Phản hồi 5xx / exception thì xóa dòng để
+  client thử lại được - trừ phản hồi 5xx view đánh dấu mark_committed() (vd đơn
+  đã tạo nhưng gọi cổng thanh toán lỗi): phản hồi đó được lưu và phát lại, chạy
+  lại view sẽ tạo đơn / trừ kho lần nữa.
+- Dòng 'in_progress' chỉ giữ trong IDEMPOTENCY_LEASE_SECONDS (expires_at là hạn
+  thuê): worker bị kill không kịp xóa dòng thì hết hạn thuê request gửi lại chạy
+  thay. Xong thì expires_at kéo dài thành IDEMPOTENCY_KEY_TTL_HOURS để phát lại.
+- Request trùng đã xong: phát lại phản hồi đã lưu, không chạy view.
+- Request trùng khi bản gốc còn chạy: chờ (poll) đến khi bản gốc xong, quá
+  IDEMPOTENCY_WAIT_SECONDS thì trả 409.
+- Cùng key nhưng nội dung khác: 422.
+"""
+import functools
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+POLL_INTERVAL = 0.1
+
+
+def _owner(request, kwargs) -> str:
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    if kwargs.get('session_id'):
+        return f"conversation:{kwargs['session_id']}"
+    return ''
+
+
+def _fingerprint(request) -> str:
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode('utf-8')).hexdigest()
+
+
+def mark_committed(response: Response) -> Response:
+    """Đánh dấu phản hồi lỗi sinh ra sau khi dữ liệu đã commit: lưu để phát lại, không nhả key"""
+    response.idempotency_committed = True
+    return response
+
+
+def _replay(record: IdempotencyKey) -> Response:
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _lease_until(now):
+    return now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LEASE_SECONDS', 60))
+
+
+def _claim(owner: str, scope: str, key: str, fingerprint: str):
+    """Trả về (record, True nếu request này được chạy view)"""
+    now = timezone.now()
+    expires_at = _lease_until(now)
+    lookup = {'owner': owner, 'scope': scope, 'key': key}
+
+    record = IdempotencyKey.objects.filter(**lookup).first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(fingerprint=fingerprint, expires_at=expires_at, **lookup), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.get(**lookup)
+
+    if record.expires_at <= now:
+        # Key hết hạn chưa bị dọn, hoặc request gốc chết khi đang giữ key (hết hạn thuê):
+        # coi như mới; UPDATE có điều kiện để chỉ một request thắng
+        claimed = IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).update(
+            fingerprint=fingerprint, status='in_progress', response_status=None,
+            response_body=None, expires_at=expires_at,
+        )
+        if claimed:
+            record.refresh_from_db()
+            return record, True
+        record.refresh_from_db()
+    return record, False
+
+
+def _wait_for(record: IdempotencyKey):
+    deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+    while record.status == 'in_progress' and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            # Request gốc lỗi và đã nhả key
+            return None
+    return record
+
+
+def idempotent(scope: str):
+    """
+    Decorator cho action của ViewSet: bật idempotency khi request có header Idempotency-Key.
+
+    Request không có header (hoặc không xác định được chủ sở hữu) chạy như cũ.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = (request.headers.get(HEADER) or '').strip()
+            owner = _owner(request, kwargs)
+            if not key or not owner:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > 128:
+                return Response(
+                    {'error': f'{HEADER} quá dài (tối đa 128 ký tự)'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = _fingerprint(request)
+            record, owns = _claim(owner, scope, key, fingerprint)
+            if not owns:
+                if record.fingerprint != fingerprint:
+                    return Response(
+                        {'error': f'{HEADER} đã được dùng cho một request khác'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                record = _wait_for(record)
+                if record is None or (record.status == 'in_progress' and record.expires_at <= timezone.now()):
+                    # Request gốc đã nhả key hoặc hết hạn thuê: chạy lại từ đầu
+                    return wrapper(self, request, *args, **kwargs)
+                if record.status == 'completed':
+                    return _replay(record)
+                return Response(
+                    {'error': 'Request trùng đang được xử lý, vui lòng thử lại sau'},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                IdempotencyKey.objects.filter(pk=record.pk).delete()
+                raise
+
+            committed = getattr(response, 'idempotency_committed', False)
+            if not hasattr(response, 'data') or (response.status_code >= 500 and not committed):
+                IdempotencyKey.objects.filter(pk=record.pk).delete()
+                return response
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status='completed', response_status=response.status_code, response_body=response.data,
+                expires_at=timezone.now() + timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24)),
+            )
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(chunk_size: int = 1000) -> int:
+    """Xóa key hết hạn theo từng lô (index expires_at). Trả về số dòng đã xóa."""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+    if deleted:
+        logger.info(f"🧹 Purged {deleted} expired idempotency keys")
+    return deleted
@@ -0,0 +1,58 @@
+import time
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+
+def synthetic_order_rows(count):
+    """Dòng giống sheet doanh thu, sinh tại chỗ (không cần DB)"""
+    start = datetime(2024, 1, 1)
+    for index in range(count):
+        yield [
+            f'DH{index:07d}',
+            f'Khach hang {index % 5000}',
+            (start + timedelta(minutes=index)).strftime('%d/%m/%Y'),
+            float(150000 + (index % 40) * 10000),
+            'Đã giao',
+            'Thanh toán khi nhận hàng (COD)',
+        ]
+
+
+class Command(BaseCommand):
+    help = 'Measure peak memory of the streaming Excel export on synthetic orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='Synthetic order counts to export')
+
+    def handle(self, *args, **options):
+        from orders.reports import SheetSpec, write_workbook
+
+        # Lần chạy nhỏ để nạp module openpyxl trước khi đo
+        with tempfile.TemporaryFile() as output:
+            write_workbook(output, [SheetSpec(title='warmup', heading='', headers=[], widths=[], rows=synthetic_order_rows(10))])
+
+        for count in options['rows']:
+            sheet = SheetSpec(
+                title='Doanh Thu',
+                heading='BÁO CÁO DOANH THU - WEB_TEDDY',
+                headers=['Mã ĐH', 'Khách hàng', 'Ngày', 'Tổng tiền', 'Trạng thái', 'Thanh toán'],
+                widths=[20] * 6,
+                rows=synthetic_order_rows(count),
+            )
+            with tempfile.TemporaryFile() as output:
+                tracemalloc.start()
+                started = time.perf_counter()
+                write_workbook(output, [sheet])
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                size = output.tell()
+
+            self.stdout.write(
+                f"{count:>9} orders: peak {peak / 1024 / 1024:6.2f} MiB, "
+                f"{elapsed:7.1f}s, file {size / 1024 / 1024:6.1f} MiB"
+            )
+        self.stdout.write(self.style.SUCCESS('Done'))
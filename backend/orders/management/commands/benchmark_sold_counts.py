@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+
+
+class Command(BaseCommand):
+    help = 'Benchmark sold_count maintenance on synthetic order items (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000000, help='Synthetic OrderItem rows')
+        parser.add_argument('--products', type=int, default=5000, help='Synthetic products')
+        parser.add_argument('--items-per-order', type=int, default=4)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def _seed(self, items, products, items_per_order):
+        from categories.models import Category
+        from orders.models import Order, OrderItem
+        from products.models import Product
+        from users.models import User
+
+        user = User.objects.create_user(username='bench_sold_counts', email='bench@example.com',
+                                        password='unused', phone='0999999990')
+        category = Category.objects.create(name='Benchmark sold_count')
+        Product.objects.bulk_create([
+            Product(name=f'Bench {index}', slug=f'bench-sold-count-{index}', category=category,
+                    price=100000, stock=100, status='active')
+            for index in range(products)
+        ], batch_size=2000)
+        product_ids = list(Product.objects.filter(category=category).values_list('id', flat=True))
+
+        order_count = (items + items_per_order - 1) // items_per_order
+        statuses = ['delivered', 'delivered', 'delivered', 'shipping', 'cancelled']
+        for start in range(0, order_count, 5000):
+            batch = range(start, min(start + 5000, order_count))
+            orders = Order.objects.bulk_create([
+                Order(user=user, order_code=f'BENCH{index:09d}', status=statuses[index % len(statuses)],
+                      full_name='Bench', phone='0999999990', email='bench@example.com', address='-',
+                      city='-', district='-', payment_method='cod', subtotal=0, total_amount=0)
+                for index in batch
+            ])
+            if orders[0].pk is None:
+                codes = [f'BENCH{index:09d}' for index in batch]
+                orders = list(Order.objects.filter(order_code__in=codes).order_by('order_code'))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_ids[(order_index * items_per_order + line) % len(product_ids)],
+                          product_name='Bench', product_price=100000, quantity=1 + line, unit='cai')
+                for order_index, order in zip(batch, orders)
+                for line in range(items_per_order)
+                if order_index * items_per_order + line < items
+            ], batch_size=5000)
+        return category
+
+    def _legacy_recalculate(self, category):
+        """Cách cũ: một lần save() cho mỗi sản phẩm lệch số liệu"""
+        from orders.models import OrderItem
+        from products.models import Product
+
+        counts = dict(
+            OrderItem.objects.filter(order__status='delivered', product__isnull=False)
+            .values('product').annotate(total=Sum('quantity')).values_list('product', 'total')
+        )
+        for product in Product.objects.filter(category=category):
+            new_count = counts.get(product.id, 0) or 0
+            if product.sold_count != new_count:
+                product.sold_count = new_count
+                product.save(update_fields=['sold_count'])
+
+    def _timed(self, label, func):
+        connection.queries_log.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            result = func()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label:<34} {elapsed * 1000:10.1f} ms  {len(queries):>7} queries")
+        return result
+
+    def handle(self, *args, **options):
+        from orders.models import Order
+        from orders.sold_counts import recompute_sold_counts
+        from products.models import Product
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            category = self._seed(options['items'], options['products'], options['items_per_order'])
+            self.stdout.write(f"Seeded {options['items']} order items in {time.perf_counter() - started:.1f}s")
+
+            self._timed('legacy per-product save()', lambda: self._legacy_recalculate(category))
+            Product.objects.filter(category=category).update(sold_count=0)
+            self._timed('recompute_sold_counts (chunked)', lambda: recompute_sold_counts(options['chunk_size']))
+
+            order = Order.objects.filter(order_code__startswith='BENCH', status='shipping').first()
+            order.status = 'delivered'
+            self._timed('single delivered transition', order.save)
+            order.refund_status = 'refunded'
+            self._timed('single refund reversal', order.save)
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Done (synthetic data rolled back)'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the co-purchase ("frequently bought together") index from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows fetched per DB round trip')
+
+    def handle(self, *args, **options):
+        from orders.recommendations import rebuild_co_purchase_index
+
+        result = rebuild_co_purchase_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {result['orders']} orders: {result['rows']} neighbor rows for {result['products']} products"
+        ))
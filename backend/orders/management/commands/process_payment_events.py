@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Apply queued payment gateway events (MoMo IPN / PayOS webhook) to orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling every --interval seconds')
+        parser.add_argument('--interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        from orders.payment_events import process_payment_events
+
+        while True:
+            result = process_payment_events(batch_size=options['batch_size'])
+            if result['processed'] or result['failed'] or not options['loop']:
+                self.stdout.write(f"Processed {result['processed']} events, {result['failed']} failed")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
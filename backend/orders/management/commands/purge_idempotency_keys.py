@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        from orders.idempotency import purge_expired_keys
+
+        deleted = purge_expired_keys(chunk_size=options['chunk_size'])
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete report jobs (and files) superseded by a newer result for the same report'
+
+    def handle(self, *args, **options):
+        from orders.report_jobs import purge_stale_report_jobs
+
+        deleted = purge_stale_report_jobs()
+        self.stdout.write(f"Deleted {deleted} superseded report jobs")
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Poll MoMo / PayOS for pending online payments in batches, with per-order backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent gateway requests per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep polling every --interval seconds')
+        parser.add_argument('--interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        from orders.payment_reconciler import reconcile_payments
+
+        while True:
+            result = reconcile_payments(batch_size=options['batch_size'], workers=options['workers'])
+            if result['checked'] or result['dropped'] or not options['loop']:
+                self.stdout.write(
+                    f"Checked {result['checked']} payments: {result['completed']} completed, "
+                    f"{result['failed']} failed, {result['dropped']} no longer tracked"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Return stock held by expired online-payment reservations and cancel the unpaid orders (run every minute)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations released per transaction')
+
+    def handle(self, *args, **options):
+        from orders.reservations import release_expired_reservations
+
+        result = release_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Released {result['released']} reservations, cancelled {result['cancelled']} orders"
+        ))
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:25
+
+import django.db.models.deletion
+import orders.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_order_user_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spec_hash', models.CharField(max_length=64)),
+                ('watermark', models.CharField(max_length=64)),
+                ('report_format', models.CharField(choices=[('xlsx', 'Excel'), ('pdf', 'PDF')], max_length=10)),
+                ('spec', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Đang chờ'), ('running', 'Đang xử lý'), ('done', 'Hoàn tất'), ('failed', 'Lỗi')], default='pending', max_length=20)),
+                ('file', models.FileField(blank=True, storage=orders.models.report_storage, upload_to='reports/')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Job báo cáo',
+                'verbose_name_plural': 'Job báo cáo',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='requested_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='report_jobs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='reportjob',
+            constraint=models.UniqueConstraint(fields=('spec_hash', 'watermark'), name='unique_report_job_result'),
+        ),
+    ]
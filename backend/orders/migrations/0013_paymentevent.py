@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('momo', 'MoMo'), ('payos', 'PayOS')], max_length=20)),
+                ('transaction_id', models.CharField(max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Chờ xử lý'), ('processed', 'Đã xử lý'), ('failed', 'Lỗi')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='orders.order')),
+            ],
+            options={
+                'verbose_name': 'Sự kiện thanh toán',
+                'verbose_name_plural': 'Sự kiện thanh toán',
+                'indexes': [models.Index(fields=['status', 'id'], name='payment_event_queue_idx')],
+                'constraints': [models.UniqueConstraint(fields=('provider', 'transaction_id'), name='unique_payment_event')],
+            },
+        ),
+    ]
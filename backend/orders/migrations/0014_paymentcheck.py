@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_paymentevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_check_at', models.DateTimeField()),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_result', models.JSONField(blank=True, default=dict)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment_check', to='orders.order')),
+            ],
+            options={
+                'verbose_name': 'Lịch đối soát thanh toán',
+                'verbose_name_plural': 'Lịch đối soát thanh toán',
+                'indexes': [models.Index(fields=['next_check_at'], name='payment_check_due_idx')],
+            },
+        ),
+    ]
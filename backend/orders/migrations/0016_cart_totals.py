@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:49
+
+from django.db import migrations, models
+
+
+def fill_cart_totals(apps, schema_editor):
+    """Tính tổng cho các giỏ hàng đã có"""
+    Cart = apps.get_model('orders', 'Cart')
+    CartItem = apps.get_model('orders', 'CartItem')
+    totals = {}
+    for cart_id, quantity, price, product_price in CartItem.objects.values_list(
+        'cart_id', 'quantity', 'price', 'product__price'
+    ).iterator():
+        total_price, total_quantity = totals.get(cart_id, (0, 0))
+        totals[cart_id] = (total_price + (price or product_price) * quantity, total_quantity + quantity)
+    carts = [
+        Cart(id=cart_id, total_price=total_price, total_quantity=total_quantity)
+        for cart_id, (total_price, total_quantity) in totals.items()
+    ]
+    Cart.objects.bulk_update(carts, ['total_price', 'total_quantity'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0015_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=0, default=0, max_digits=15),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
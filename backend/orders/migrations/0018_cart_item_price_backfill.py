@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+def fill_missing_item_prices(apps, schema_editor):
+    """Mục giỏ chưa có giá: chốt theo giá sản phẩm hiện tại (bằng giá tổng giỏ đang dùng)"""
+    CartItem = apps.get_model('orders', 'CartItem')
+    Product = apps.get_model('products', 'Product')
+    CartItem.objects.filter(price=0).update(
+        price=models.Subquery(Product.objects.filter(pk=models.OuterRef('product_id')).values('price')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_payment_event_retry'),
+        ('products', '0015_json_images_specifications'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_item_prices, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,16 @@
+import os
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.files.storage import FileSystemStorage
 from django.db import models
+from django.db.models.functions import Coalesce
+from backend.tracking import FieldTrackerMixin
 from products.models import Product
 from users.models import User
 
 
-class Order(models.Model):
+class Order(FieldTrackerMixin, models.Model):
     STATUS_CHOICES = [
         ('pending', 'Chờ xử lý'),
         ('confirmed', 'Đã xác nhận'),
@@ -18,6 +25,9 @@ class Order(models.Model):
         ('banking', 'Chuyển khoản ngân hàng'),
     ]
 
+    # Field theo dõi thay đổi cho các hook chuyển trạng thái (orders/signals.py)
+    tracked_fields = ('status', 'payment_status', 'refund_status')
+
 
     # Order info
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
@@ -64,6 +74,19 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Danh sách admin phân trang keyset theo (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='order_status_created_idx'),
+            models.Index(fields=['payment_status', '-created_at', '-id'], name='order_paystatus_created_idx'),
+            # Lịch sử đơn của một khách (my_orders)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            # Watermark dữ liệu cho cache báo cáo (MAX(updated_at))
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+            # Tìm kiếm theo tiền tố số điện thoại / email (order_code đã unique)
+            models.Index(fields=['phone'], name='order_phone_idx'),
+            models.Index(fields=['email'], name='order_email_idx'),
+        ]
     
     def __str__(self):
         return f"{self.order_code} - {self.full_name}"
@@ -72,6 +95,10 @@ class Order(models.Model):
 class Cart(models.Model):
     """Giỏ hàng của khách hàng"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    # Tổng giỏ lưu sẵn (cập nhật bởi recalculate_totals khi CartItem đổi, xem orders/signals.py)
+    # để badge mini-cart không phải cộng từng mục mỗi lần tải trang
+    total_price = models.DecimalField(max_digits=15, decimal_places=0, default=0)
+    total_quantity = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -81,16 +108,30 @@ class Cart(models.Model):
     
     def __str__(self):
         return f"Cart of {self.user.username}"
-    
-    @property
-    def total_price(self):
-        """Tính tổng giá trị giỏ hàng"""
-        return sum(item.total_price for item in self.items.all())
-    
-    @property
-    def total_quantity(self):
-        """Tính tổng số lượng sản phẩm"""
-        return sum(item.quantity for item in self.items.all())
+
+    @staticmethod
+    def recalculate_totals(cart_id):
+        """
+        Tính lại tổng giỏ từ các mục bằng một câu UPDATE (subquery SUM).
+
+        Chỉ dùng giá đã chốt trên mục (CartItem.price), không đọc giá sản phẩm hiện
+        tại: đổi giá sản phẩm không làm tổng đã lưu lệch với các mục.
+        """
+        items = CartItem.objects.filter(cart_id=cart_id).order_by().values('cart_id')
+        line_total = models.ExpressionWrapper(
+            models.F('price') * models.F('quantity'),
+            output_field=models.DecimalField(max_digits=15, decimal_places=0),
+        )
+        Cart.objects.filter(pk=cart_id).update(
+            total_price=Coalesce(
+                models.Subquery(items.annotate(total=models.Sum(line_total)).values('total')),
+                models.Value(0), output_field=models.DecimalField(max_digits=15, decimal_places=0),
+            ),
+            total_quantity=Coalesce(
+                models.Subquery(items.annotate(total=models.Sum('quantity')).values('total')),
+                models.Value(0),
+            ),
+        )
 
 
 class CartItem(models.Model):
@@ -110,6 +151,15 @@ class CartItem(models.Model):
     
     def __str__(self):
         return f"{self.product.name} ({self.unit}) x {self.quantity}"
+
+    def save(self, *args, **kwargs):
+        # Mục chưa có giá (tạo từ admin / code cũ) chốt theo giá sản phẩm lúc thêm
+        if not self.price and self.product_id:
+            self.price = self.product.price
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'price'}
+        super().save(*args, **kwargs)
     
     @property
     def total_price(self):
@@ -127,3 +177,199 @@ class OrderItem(models.Model):
     
     def __str__(self):
         return f"{self.product_name} x {self.quantity}"
+
+
+class ReportStorage(FileSystemStorage):
+    """Kho lưu file báo cáo - ngoài MEDIA_ROOT để không public, chỉ tải qua API"""
+
+    @property
+    def base_location(self):
+        # Đọc setting mỗi lần dùng thay vì cố định lúc import
+        return getattr(settings, 'REPORT_STORAGE_ROOT', settings.BASE_DIR / 'private_reports')
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def report_storage():
+    return ReportStorage()
+
+
+class ReportJob(models.Model):
+    """Job xuất báo cáo chạy nền, kết quả dùng lại theo spec_hash + watermark dữ liệu"""
+    STATUS_CHOICES = [
+        ('pending', 'Đang chờ'),
+        ('running', 'Đang xử lý'),
+        ('done', 'Hoàn tất'),
+        ('failed', 'Lỗi'),
+    ]
+
+    FORMAT_CHOICES = [
+        ('xlsx', 'Excel'),
+        ('pdf', 'PDF'),
+    ]
+
+    spec_hash = models.CharField(max_length=64)
+    watermark = models.CharField(max_length=64)
+    report_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    spec = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    file = models.FileField(upload_to='reports/', storage=report_storage, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='report_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Job báo cáo'
+        verbose_name_plural = 'Job báo cáo'
+        constraints = [
+            models.UniqueConstraint(fields=['spec_hash', 'watermark'], name='unique_report_job_result'),
+        ]
+
+    def __str__(self):
+        return f"{self.spec.get('report_type')}.{self.report_format} - {self.status}"
+
+
+class StockReservation(models.Model):
+    """
+    Giữ hàng có thời hạn cho đơn thanh toán online (MoMo / chuyển khoản).
+
+    Tồn kho đã được trừ (ghi sổ 'reserve') khi tạo đơn; thanh toán thành công thì
+    chuyển thành bán ('converted'), quá hạn thì job quét trả lại kho ('released').
+    """
+    STATUS_CHOICES = [
+        ('active', 'Đang giữ'),
+        ('converted', 'Đã bán'),
+        ('released', 'Đã trả kho'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    size = models.CharField(max_length=20, blank=True, default='')  # '' = tồn kho của sản phẩm, khác = biến thể
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Giữ hàng'
+        verbose_name_plural = 'Giữ hàng'
+        indexes = [
+            # Job quét chỉ đọc các dòng active đã hết hạn: O(số dòng hết hạn)
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id}: {self.product_id}/{self.size or '-'} x {self.quantity} ({self.status})"
+
+
+class PaymentEvent(models.Model):
+    """
+    Hộp thư sự kiện thanh toán từ cổng (MoMo IPN / PayOS webhook).
+
+    Webhook chỉ xác thực chữ ký, ghi sự kiện thô rồi trả lời ngay; worker
+    (orders/payment_events.py) áp dụng vào đơn hàng theo lô. Khóa duy nhất
+    (provider, transaction_id) loại bỏ các lần cổng gửi lại.
+    """
+    PROVIDER_CHOICES = [
+        ('momo', 'MoMo'),
+        ('payos', 'PayOS'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Chờ xử lý'),
+        ('processed', 'Đã xử lý'),
+        ('failed', 'Lỗi'),
+    ]
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    transaction_id = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_events')
+    # Lỗi tạm thời khi lưu đơn (deadlock...): giữ 'pending' và thử lại sau next_attempt_at
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Sự kiện thanh toán'
+        verbose_name_plural = 'Sự kiện thanh toán'
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'transaction_id'], name='unique_payment_event'),
+        ]
+        indexes = [
+            # Worker đọc các sự kiện pending theo thứ tự nhận
+            models.Index(fields=['status', 'id'], name='payment_event_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider}:{self.transaction_id} ({self.status})"
+
+
+class PaymentCheck(models.Model):
+    """
+    Lịch đối soát trạng thái thanh toán online với cổng (MoMo / PayOS).
+
+    Job reconcile_payments quét các dòng đến hạn theo index next_check_at, hỏi
+    cổng theo lô và giãn dần khoảng cách giữa các lần hỏi (backoff). Endpoint
+    kiểm tra trạng thái chỉ đọc dữ liệu local, không gọi cổng.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='payment_check')
+    attempts = models.PositiveIntegerField(default=0)
+    next_check_at = models.DateTimeField()
+    last_checked_at = models.DateTimeField(blank=True, null=True)
+    last_result = models.JSONField(default=dict, blank=True)  # Phản hồi gần nhất của cổng
+
+    class Meta:
+        verbose_name = 'Lịch đối soát thanh toán'
+        verbose_name_plural = 'Lịch đối soát thanh toán'
+        indexes = [
+            models.Index(fields=['next_check_at'], name='payment_check_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.order_id} @ {self.next_check_at:%H:%M:%S} (#{self.attempts})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Kết quả đã lưu của các request có header Idempotency-Key (orders/idempotency.py).
+
+    Khóa duy nhất (owner, scope, key): một lần đọc theo unique index là biết
+    request trùng hay mới. Dòng hết hạn được xóa bởi lệnh purge_idempotency_keys.
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'Đang xử lý'),
+        ('completed', 'Hoàn tất'),
+    ]
+
+    owner = models.CharField(max_length=64)  # "user:<id>" hoặc "conversation:<session_id>"
+    scope = models.CharField(max_length=50)  # Endpoint, vd "orders.create_order"
+    key = models.CharField(max_length=128)
+    fingerprint = models.CharField(max_length=64)  # sha256 nội dung request
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()  # in_progress: hạn thuê; completed: hạn phát lại
+
+    class Meta:
+        verbose_name = 'Idempotency key'
+        verbose_name_plural = 'Idempotency keys'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
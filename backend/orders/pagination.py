@@ -0,0 +1,109 @@
+"""
+Phân trang keyset (cursor) cho danh sách đơn hàng.
+
+Sắp xếp cố định theo (-created_at, -id); cursor là vị trí (created_at, id) của
+dòng cuối trang trước nên mỗi trang chỉ là một lần quét index
+(..., created_at, id) với LIMIT, không dùng OFFSET. Thời gian trả về không phụ
+thuộc số đơn trong bảng hay trang đang xem.
+"""
+import base64
+import binascii
+from typing import List, Optional, Tuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+ORDERING = ('-created_at', '-id')
+
+
+class InvalidCursor(ValueError):
+    """Cursor không giải mã được"""
+
+
+def encode_cursor(created_at, pk: int) -> str:
+    raw = f"{created_at.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[object, int]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_raw, pk_raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|', 1)
+        created_at = parse_datetime(created_raw)
+        pk = int(pk_raw)
+    except (ValueError, UnicodeError, binascii.Error) as exc:
+        raise InvalidCursor(str(exc)) from exc
+    if created_at is None:
+        raise InvalidCursor(cursor)
+    return created_at, pk
+
+
+def keyset_after(created_at, pk: int) -> Q:
+    """Điều kiện "đứng sau (created_at, id)" theo thứ tự ORDERING"""
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+
+
+def iter_keyset(queryset, fields, chunk_size: int = 2000):
+    """
+    Duyệt toàn bộ queryset theo ORDERING, mỗi lần lấy `chunk_size` dòng dạng dict.
+
+    Khác iterator(): driver MySQL mặc định nạp cả result set vào bộ nhớ client,
+    còn ở đây mỗi chunk là một truy vấn LIMIT riêng nên bộ nhớ không phụ thuộc
+    số dòng.
+    """
+    fields = list(dict.fromkeys(list(fields) + ['created_at', 'id']))
+    queryset = queryset.order_by(*ORDERING).values(*fields)
+    position = None
+    while True:
+        chunk_query = queryset.filter(keyset_after(*position)) if position else queryset
+        rows = list(chunk_query[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        position = (rows[-1]['created_at'], rows[-1]['id'])
+
+
+class OrderKeysetPagination:
+    """
+    Dùng trong action của OrderViewSet:
+
+        paginator = OrderKeysetPagination()
+        page = paginator.paginate_queryset(queryset, request)   # có thể raise InvalidCursor
+        return Response(paginator.get_paginated_data(serializer.data))
+    """
+    page_size = 50
+    max_page_size = 200
+
+    def __init__(self):
+        self.next_cursor: Optional[str] = None
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params.get('page_size', self.page_size))
+        except (TypeError, ValueError):
+            size = self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request) -> List:
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*ORDERING)
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            queryset = queryset.filter(keyset_after(created_at, pk))
+
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        if len(rows) > page_size:
+            last = page[-1]
+            self.next_cursor = encode_cursor(last.created_at, last.id)
+        return page
+
+    def get_paginated_data(self, data) -> dict:
+        return {
+            'results': data,
+            'next_cursor': self.next_cursor,
+            'has_more': self.next_cursor is not None,
+        }
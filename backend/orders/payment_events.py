@@ -0,0 +1,196 @@
+"""
+Hộp thư webhook thanh toán (MoMo IPN, PayOS webhook).
+
+- record_payment_event(): gọi trong view sau khi xác thực chữ ký. Một câu INSERT
+  bỏ qua trùng khóa (provider, transaction_id): cổng gửi lại chỉ tốn một lần
+  đụng unique index, không đọc/ghi đơn hàng. View trả lời cổng ngay sau đó.
+- process_payment_events(): worker lấy sự kiện pending theo thứ tự id từng lô
+  (SELECT ... FOR UPDATE SKIP LOCKED), gộp theo đơn và lưu mỗi đơn một lần.
+  Chạy trong thread nền của web process sau khi commit, và bằng lệnh
+  process_payment_events (cron / supervisor) để bắt các sự kiện bị bỏ lỡ.
+
+Quy tắc áp dụng có tính đơn điệu: đơn đã 'completed' không bị sự kiện thất bại
+đến muộn ghi đè, nên thứ tự giữa các lô xử lý song song không làm sai kết quả.
+
+Lưu đơn lỗi (deadlock, lỗi trong signal chuyển hàng giữ...) là lỗi tạm thời: sự
+kiện vẫn 'pending', tăng attempts và hẹn next_attempt_at (backoff lũy thừa), lệnh
+process_payment_events --loop sẽ thử lại. Chỉ lỗi vĩnh viễn (không tìm thấy đơn)
+hoặc quá PAYMENT_EVENT_MAX_ATTEMPTS lần mới đánh dấu 'failed'.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY_SECONDS = 300
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def momo_event_key(data: dict) -> str:
+    trans_id = str(data.get('transId') or '')
+    if trans_id and trans_id != '0':
+        return trans_id
+    return f"{data.get('orderId')}:{data.get('requestId')}:{data.get('resultCode')}"
+
+
+def payos_event_key(data: dict) -> str:
+    return str(data.get('reference') or f"{data.get('orderCode')}:{data.get('code')}")
+
+
+def record_payment_event(provider: str, transaction_id: str, payload: dict) -> None:
+    """Ghi sự kiện (bỏ qua nếu đã có) và hẹn xử lý sau khi commit"""
+    PaymentEvent.objects.bulk_create(
+        [PaymentEvent(provider=provider, transaction_id=transaction_id[:100], payload=payload)],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(dispatch_payment_events)
+
+
+def dispatch_payment_events():
+    if getattr(settings, 'PAYMENT_EVENTS_RUN_INLINE', False):
+        process_payment_events()
+        return
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Một thread: các lần dispatch liên tiếp xếp hàng thay vì tranh cùng một lô
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='payment-events')
+    _executor.submit(_process_in_thread)
+
+
+def _process_in_thread():
+    close_old_connections()
+    try:
+        process_payment_events()
+    except Exception:
+        logger.exception("❌ Payment event worker failed")
+    finally:
+        close_old_connections()
+
+
+def _find_order(event: PaymentEvent) -> Optional[Order]:
+    payload = event.payload
+    if event.provider == 'momo':
+        order_ref = str(payload.get('orderId') or '')
+        # orderId gửi sang MoMo có dạng "<order.id>-<hex>" (momo_order_id)
+        order = Order.objects.filter(momo_order_id=order_ref).first()
+        if order is None:
+            order_ref = order_ref.split('-', 1)[0]
+    else:
+        order = None
+        order_ref = str((payload.get('data') or {}).get('orderCode') or '')
+    if order is None and order_ref.isdigit():
+        order = Order.objects.filter(id=int(order_ref)).first()
+    return order
+
+
+def _event_outcome(event: PaymentEvent) -> Tuple[bool, dict]:
+    """(thành công?, các field cần ghi thêm khi thành công)"""
+    payload = event.payload
+    if event.provider == 'momo':
+        return str(payload.get('resultCode')) == '0', {'momo_transaction_id': str(payload.get('transId') or '')}
+    data = payload.get('data') or {}
+    return payload.get('success') is True and data.get('code') == '00', {}
+
+
+def _apply_event(order: Order, event: PaymentEvent) -> bool:
+    """Cập nhật đơn trong bộ nhớ theo sự kiện. Trả về True nếu đơn thay đổi."""
+    success, extra = _event_outcome(event)
+    if success:
+        if order.payment_status == 'completed':
+            return False
+        order.payment_status = 'completed'
+        for field, value in extra.items():
+            setattr(order, field, value)
+        logger.info(f"Order {order.order_code} payment completed via {event.provider}")
+        return True
+    if order.payment_status in ('completed', 'failed'):
+        return False
+    order.payment_status = 'failed'
+    logger.warning(f"Order {order.order_code} payment failed via {event.provider}")
+    return True
+
+
+def _retry_later(event: PaymentEvent, error: str, now) -> bool:
+    """Hẹn thử lại sự kiện; False nếu đã hết số lần thử (đánh dấu failed)"""
+    event.attempts += 1
+    event.error = error
+    if event.attempts >= getattr(settings, 'PAYMENT_EVENT_MAX_ATTEMPTS', 10):
+        event.status = 'failed'
+        return False
+    event.status = 'pending'
+    event.next_attempt_at = now + timedelta(seconds=min(2 ** event.attempts, MAX_RETRY_DELAY_SECONDS))
+    return True
+
+
+def process_payment_events(batch_size: int = 100, max_batches: Optional[int] = None) -> Dict[str, int]:
+    """
+    Áp dụng các sự kiện pending (đã đến hạn thử) vào đơn hàng.
+
+    Trả về số sự kiện đã xử lý / lỗi vĩnh viễn; sự kiện hẹn thử lại không tính vào đâu.
+    """
+    processed = failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            events = list(
+                PaymentEvent.objects.filter(status='pending')
+                .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now()))
+                .order_by('id')
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            if not events:
+                break
+            batches += 1
+
+            orders: Dict[int, Order] = {}
+            changed: Dict[int, set] = {}
+            now = timezone.now()
+            for event in events:
+                order = _find_order(event)
+                if order is None:
+                    event.status, event.error = 'failed', 'Order not found'
+                    failed += 1
+                    continue
+                # Các sự kiện của cùng một đơn trong lô dùng chung một instance
+                order = orders.setdefault(order.pk, order)
+                before = {field: getattr(order, field) for field in ('payment_status', 'momo_transaction_id')}
+                if _apply_event(order, event):
+                    changed.setdefault(order.pk, set()).update(
+                        field for field, value in before.items() if getattr(order, field) != value
+                    )
+                event.order_id, event.status = order.pk, 'processed'
+                processed += 1
+
+            for order_id, fields in changed.items():
+                try:
+                    with transaction.atomic():
+                        orders[order_id].save(update_fields=[*fields, 'updated_at'])
+                except Exception as e:
+                    logger.exception(f"❌ Failed to apply payment events to order {order_id}, will retry")
+                    for event in events:
+                        if event.order_id == order_id:
+                            processed -= 1
+                            if not _retry_later(event, str(e), now):
+                                failed += 1
+
+            for event in events:
+                if event.status != 'pending':
+                    event.processed_at = now
+            PaymentEvent.objects.bulk_update(
+                events, ['status', 'error', 'order', 'processed_at', 'attempts', 'next_attempt_at'],
+            )
+
+    return {'processed': processed, 'failed': failed}
@@ -0,0 +1,168 @@
+"""
+Đối soát trạng thái thanh toán online (MoMo / PayOS) chạy nền.
+
+Trước đây mỗi lần trang checkout poll endpoint kiểm tra trạng thái lại gọi cổng
+đồng bộ (timeout 30s): N khách đang chờ = N lần gọi cổng mỗi vài giây và N
+worker bị giữ. Nay:
+- Mỗi đơn online chờ thanh toán có một PaymentCheck; reconcile_payments() lấy
+  các dòng đến hạn theo lô, gọi cổng song song bằng thread pool rồi ghi kết quả.
+  Chưa có kết quả thì hẹn lần sau với backoff lũy thừa có jitter.
+- Endpoint poll chỉ đọc đơn + phản hồi cổng gần nhất, có cache vài giây.
+"""
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, PaymentCheck
+from .payment_utils import MoMoPayment, PayOSPayment
+from .reservations import ONLINE_PAYMENT_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Thời gian giữ lượt xử lý khi đang gọi cổng (reconciler khác bỏ qua dòng này)
+LEASE_SECONDS = 60
+
+
+def status_cache_key(user_id: int, order_id: int) -> str:
+    return f"payment_status:{user_id}:{order_id}"
+
+
+def invalidate_status_cache(order: Order):
+    cache.delete(status_cache_key(order.user_id, order.pk))
+
+
+def backoff_delay(attempts: int) -> timedelta:
+    base = getattr(settings, 'PAYMENT_RECONCILE_BASE_SECONDS', 5)
+    ceiling = getattr(settings, 'PAYMENT_RECONCILE_MAX_SECONDS', 300)
+    seconds = min(base * (2 ** min(attempts, 16)), ceiling)
+    return timedelta(seconds=seconds * random.uniform(0.8, 1.2))
+
+
+def schedule_payment_check(order: Order) -> PaymentCheck:
+    """Đảm bảo đơn online đang chờ thanh toán có lịch đối soát"""
+    check, _ = PaymentCheck.objects.get_or_create(
+        order=order, defaults={'next_check_at': timezone.now() + backoff_delay(0)}
+    )
+    return check
+
+
+def _needs_check(order: Order, now) -> bool:
+    give_up = timedelta(hours=getattr(settings, 'PAYMENT_RECONCILE_GIVE_UP_HOURS', 24))
+    return (
+        order.payment_method in ONLINE_PAYMENT_METHODS
+        and order.payment_status == 'pending'
+        and order.status != 'cancelled'
+        and order.created_at >= now - give_up
+    )
+
+
+def query_gateway(order: Order) -> Tuple[str, dict]:
+    """
+    Hỏi trạng thái thanh toán từ cổng (không đụng DB, chạy được trong thread).
+
+    Returns:
+        ('completed' | 'failed' | 'pending', phản hồi của cổng)
+    """
+    if order.payment_method == 'momo':
+        if not order.momo_request_id:
+            return 'pending', {}
+        response = MoMoPayment.check_transaction_status(
+            order_id=order.momo_order_id or str(order.id),
+            request_id=order.momo_request_id
+        )
+        return ('completed' if response.get('resultCode') == 0 else 'pending'), response
+
+    response = PayOSPayment.get_payment_link_info(order.id)
+    payos_status = (response.get('data') or {}).get('status') if response.get('code') == '00' else None
+    if payos_status == 'PAID':
+        return 'completed', response
+    if payos_status == 'CANCELLED':
+        return 'failed', response
+    return 'pending', response
+
+
+def _claim_due(batch_size: int, now):
+    with transaction.atomic():
+        checks = list(
+            PaymentCheck.objects.filter(next_check_at__lte=now)
+            .select_related('order')
+            .order_by('next_check_at')
+            .select_for_update(skip_locked=True, of=('self',))[:batch_size]
+        )
+        if checks:
+            PaymentCheck.objects.filter(id__in=[check.id for check in checks]).update(
+                next_check_at=now + timedelta(seconds=LEASE_SECONDS)
+            )
+    return checks
+
+
+def _apply_result(check: PaymentCheck, state: str, response: dict, now) -> Optional[str]:
+    order = check.order
+    if state == 'pending':
+        check.attempts += 1
+        check.last_checked_at = now
+        check.last_result = response
+        check.next_check_at = now + backoff_delay(check.attempts)
+        check.save(update_fields=['attempts', 'last_checked_at', 'last_result', 'next_check_at'])
+        return None
+
+    # Đọc lại trạng thái mới nhất: webhook có thể đã cập nhật trong lúc gọi cổng
+    order.refresh_from_db(fields=['payment_status', 'momo_transaction_id'])
+    if order.payment_status == 'pending':
+        order.payment_status = state
+        fields = ['payment_status', 'updated_at']
+        if state == 'completed' and order.payment_method == 'momo':
+            order.momo_transaction_id = response.get('transId')
+            fields.append('momo_transaction_id')
+        order.save(update_fields=fields)
+    check.delete()
+    return state
+
+
+def reconcile_payments(batch_size: int = 50, workers: int = 8, max_batches: Optional[int] = None) -> Dict[str, int]:
+    """Đối soát các đơn đến hạn. Trả về số lần gọi cổng và số đơn đã chốt trạng thái."""
+    stats = {'checked': 0, 'completed': 0, 'failed': 0, 'dropped': 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        now = timezone.now()
+        checks = _claim_due(batch_size, now)
+        if not checks:
+            break
+        batches += 1
+
+        active = []
+        for check in checks:
+            if _needs_check(check.order, now):
+                active.append(check)
+            else:
+                check.delete()
+                stats['dropped'] += 1
+
+        # Gọi cổng song song: thời gian một lô ~ một lần gọi chậm nhất
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(active) or 1))) as pool:
+            results = list(pool.map(lambda check: _safe_query(check.order), active))
+
+        for check, (state, response) in zip(active, results):
+            stats['checked'] += 1
+            outcome = _apply_result(check, state, response, now)
+            if outcome:
+                stats[outcome] += 1
+
+    if stats['checked'] or stats['dropped']:
+        logger.info(f"💳 Payment reconcile: {stats}")
+    return stats
+
+
+def _safe_query(order: Order) -> Tuple[str, dict]:
+    try:
+        return query_gateway(order)
+    except Exception as e:
+        logger.warning(f"⚠️ Payment status query failed for order {order.pk}: {e}")
+        return 'pending', {'error': str(e)}
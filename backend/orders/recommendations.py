@@ -0,0 +1,166 @@
+"""
+Chỉ mục gợi ý "thường được mua cùng" (item-to-item co-purchase).
+
+Điểm tương đồng giữa hai sản phẩm a, b (cosine trên tập đơn hàng):
+
+    score(a, b) = co(a, b) / sqrt(n(a) * n(b))
+
+trong đó co(a, b) là số đơn chứa cả a và b, n(x) là số đơn chứa x. Chỉ tính
+các đơn chưa hủy. Mỗi sản phẩm lưu top-K lân cận vào ProductNeighbor
+(kind='co_purchase').
+
+- rebuild_co_purchase_index(): tính lại toàn bộ (chạy định kỳ / lần đầu)
+- refresh_co_purchase_for_products(): cập nhật tăng dần khi một đơn chuyển
+  trạng thái (giao thành công / hủy), chỉ đụng tới các sản phẩm liên quan
+"""
+import logging
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+
+from django.conf import settings
+from django.db.models import Count
+
+from products.neighbors import load_neighbor_scores, rank_neighbors, replace_neighbor_lists
+from .models import OrderItem
+
+logger = logging.getLogger(__name__)
+
+KIND = 'co_purchase'
+
+
+def _top_k() -> int:
+    return int(getattr(settings, 'CO_PURCHASE_TOP_K', 10))
+
+
+def _valid_items():
+    """OrderItem thuộc đơn chưa hủy và còn gắn với sản phẩm"""
+    return OrderItem.objects.filter(product__isnull=False).exclude(order__status='cancelled')
+
+
+def _score(co_count: int, count_a: int, count_b: int) -> float:
+    if not co_count or not count_a or not count_b:
+        return 0.0
+    return co_count / math.sqrt(count_a * count_b)
+
+
+def rebuild_co_purchase_index(chunk_size: int = 5000) -> Dict[str, int]:
+    """
+    Tính lại toàn bộ chỉ mục từ lịch sử đơn hàng.
+
+    Duyệt OrderItem theo order_id bằng iterator() để gom từng giỏ hàng mà không
+    nạp toàn bộ bảng vào bộ nhớ.
+    """
+    order_counts: Dict[int, int] = defaultdict(int)
+    co_counts: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def _consume(basket: Set[int]):
+        for product_id in basket:
+            order_counts[product_id] += 1
+            for other_id in basket:
+                if other_id != product_id:
+                    co_counts[product_id][other_id] += 1
+
+    current_order = None
+    basket: Set[int] = set()
+    rows = _valid_items().order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=chunk_size)
+    orders_seen = 0
+    for order_id, product_id in rows:
+        if order_id != current_order:
+            if basket:
+                _consume(basket)
+            current_order = order_id
+            basket = set()
+            orders_seen += 1
+        basket.add(product_id)
+    if basket:
+        _consume(basket)
+
+    top_k = _top_k()
+    lists = {
+        product_id: rank_neighbors({
+            other_id: _score(co, order_counts[product_id], order_counts[other_id])
+            for other_id, co in partners.items()
+        }, top_k)
+        for product_id, partners in co_counts.items()
+    }
+    rows_written = replace_neighbor_lists(KIND, lists, full_rebuild=True)
+
+    return {
+        'orders': orders_seen,
+        'products': len(lists),
+        'rows': rows_written,
+    }
+
+
+def refresh_co_purchase_for_products(product_ids: Iterable[int]) -> int:
+    """
+    Cập nhật tăng dần cho các sản phẩm trong một đơn vừa đổi trạng thái.
+
+    - Sản phẩm bị ảnh hưởng (trong đơn): tính lại đầy đủ danh sách lân cận.
+    - Sản phẩm từng mua cùng với chúng: chỉ cập nhật điểm của cặp liên quan
+      rồi xếp hạng lại danh sách đang lưu. Các cặp khác không đổi vì n() của
+      chúng không đổi. Lệnh build_copurchase_index định kỳ sẽ làm mới toàn bộ.
+
+    Returns:
+        Số sản phẩm có danh sách được ghi lại
+    """
+    affected = {pid for pid in product_ids if pid}
+    if not affected:
+        return 0
+
+    # co(a, b) cho mọi a thuộc affected: self-join OrderItem qua order
+    co_rows = _valid_items().filter(
+        product_id__in=affected,
+        order__items__product__isnull=False,
+    ).values('product_id', 'order__items__product_id').annotate(
+        co=Count('order_id', distinct=True)
+    )
+    co_counts: Dict[int, Dict[int, int]] = defaultdict(dict)
+    partner_ids: Set[int] = set()
+    for row in co_rows:
+        product_id = row['product_id']
+        other_id = row['order__items__product_id']
+        if other_id == product_id:
+            continue
+        co_counts[product_id][other_id] = row['co']
+        partner_ids.add(other_id)
+
+    order_counts = dict(
+        _valid_items().filter(
+            product_id__in=affected | partner_ids
+        ).values('product_id').annotate(
+            n=Count('order_id', distinct=True)
+        ).values_list('product_id', 'n')
+    )
+
+    top_k = _top_k()
+    lists = {
+        product_id: rank_neighbors({
+            other_id: _score(co, order_counts.get(product_id, 0), order_counts.get(other_id, 0))
+            for other_id, co in co_counts.get(product_id, {}).items()
+        }, top_k)
+        for product_id in affected
+    }
+
+    # Cập nhật cặp (partner -> affected) trong danh sách của partner, gồm cả
+    # partner cũ để gỡ cặp không còn mua cùng (vd đơn duy nhất chứa cặp bị hủy)
+    previous_partners = {
+        neighbor_id
+        for neighbors in load_neighbor_scores(KIND, affected).values()
+        for neighbor_id in neighbors
+    }
+    outside_partners = (partner_ids | previous_partners) - affected
+    current_lists = load_neighbor_scores(KIND, outside_partners)
+    for partner_id in outside_partners:
+        scores = dict(current_lists.get(partner_id, {}))
+        for product_id in affected:
+            co = co_counts.get(product_id, {}).get(partner_id)
+            if co:
+                scores[product_id] = _score(co, order_counts.get(product_id, 0), order_counts.get(partner_id, 0))
+            else:
+                scores.pop(product_id, None)
+        lists[partner_id] = rank_neighbors(scores, top_k)
+
+    replace_neighbor_lists(KIND, lists)
+    return len(lists)
@@ -0,0 +1,199 @@
+"""
+Hàng đợi job xuất báo cáo (Excel / PDF) chạy nền.
+
+- submit_report_job(): tạo (hoặc dùng lại) job theo spec_hash + watermark. Watermark
+  là MAX(Order.updated_at) + phiên bản catalog (giá, tên sản phẩm / danh mục trong
+  báo cáo): dữ liệu chưa đổi thì nhiều admin xuất cùng một báo cáo chỉ tốn một lần render.
+- Kết quả của watermark cũ chỉ bị dọn sau REPORT_JOB_TIMEOUT_SECONDS kể từ khi có
+  kết quả mới (purge_stale_report_jobs, lệnh purge_report_jobs): client đang poll /
+  tải job cũ không bị 404.
+- Job chạy trong ProcessPoolExecutor giới hạn REPORT_JOB_WORKERS process (spawn),
+  nên render PDF nặng CPU không chiếm web worker và không vượt timeout của proxy.
+- File kết quả lưu ở report_storage(); client poll trạng thái rồi tải về qua API.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import report_worker
+from .models import Order, ReportJob
+from .reports import ReportSpec, excel_report_file, pdf_report_file
+
+logger = logging.getLogger(__name__)
+
+REPORT_WRITERS = {
+    'xlsx': excel_report_file,
+    'pdf': pdf_report_file,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+# Job đã đưa vào pool của process này và chưa chạy xong
+_in_flight = set()
+
+
+def spec_hash(spec: ReportSpec, report_format: str) -> str:
+    payload = {
+        'report_type': spec.report_type,
+        'start_date': spec.start_date,
+        'end_date': spec.end_date,
+        'category_id': spec.category_id,
+        'format': report_format,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def report_watermark() -> str:
+    """Mốc dữ liệu hiện tại - đổi khi có đơn mới / đơn được cập nhật hoặc catalog thay đổi"""
+    from products.catalog import current_catalog_version
+
+    latest = Order.objects.aggregate(latest=Max('updated_at'))['latest']
+    catalog_version, _ = current_catalog_version()
+    return f"{latest.isoformat() if latest else 'empty'}|c{catalog_version}"
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, int(getattr(settings, 'REPORT_JOB_WORKERS', 2))),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=report_worker.init_worker,
+            )
+        return _executor
+
+
+def dispatch_report_job(job_id: int):
+    """Đưa job vào process pool (hoặc chạy ngay nếu REPORT_JOBS_RUN_INLINE)"""
+    if getattr(settings, 'REPORT_JOBS_RUN_INLINE', False):
+        run_report_job(job_id)
+        return
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    with _executor_lock:
+        if job_id in _in_flight:
+            return
+        _in_flight.add(job_id)
+    future = _get_executor().submit(report_worker.run_job, job_id)
+    future.add_done_callback(lambda _: _in_flight.discard(job_id))
+
+
+def submit_report_job(spec: ReportSpec, report_format: str, user=None):
+    """
+    Tạo job mới hoặc trả về job đã có cho cùng spec và cùng watermark dữ liệu.
+
+    Returns:
+        (job, created)
+    """
+    if report_format not in REPORT_WRITERS:
+        raise ValueError(f'format không hợp lệ. Chọn từ: {", ".join(REPORT_WRITERS)}')
+
+    job, created = ReportJob.objects.get_or_create(
+        spec_hash=spec_hash(spec, report_format),
+        watermark=report_watermark(),
+        defaults={
+            'report_format': report_format,
+            'spec': {
+                'report_type': spec.report_type,
+                'start_date': spec.start_date,
+                'end_date': spec.end_date,
+                'category_id': spec.category_id,
+                'category_name': spec.category_name,
+            },
+            'requested_by': user if user is not None and user.is_authenticated else None,
+        }
+    )
+
+    if not created and job.status == 'failed':
+        # Job lỗi trước đó: cho chạy lại thay vì trả lỗi cũ
+        created = bool(ReportJob.objects.filter(id=job.id, status='failed').update(
+            status='pending', error='', started_at=None, finished_at=None
+        ))
+        job.refresh_from_db()
+
+    if created:
+        transaction.on_commit(lambda: dispatch_report_job(job.id))
+    return job, created
+
+
+def run_report_job(job_id: int):
+    """Render báo cáo của job và lưu file. Chạy trong worker của process pool."""
+    claimed = ReportJob.objects.filter(id=job_id, status='pending').update(
+        status='running', started_at=timezone.now()
+    )
+    if not claimed:
+        return
+
+    job = ReportJob.objects.get(id=job_id)
+    spec = ReportSpec(**job.spec)
+    try:
+        with REPORT_WRITERS[job.report_format](spec) as report_file:
+            job.file.save(spec.filename(job.report_format), File(report_file), save=False)
+        job.status = 'done'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['file', 'status', 'finished_at'])
+    except Exception as e:
+        logger.exception(f"❌ Report job {job_id} failed")
+        ReportJob.objects.filter(id=job_id).update(status='failed', error=str(e), finished_at=timezone.now())
+        return
+
+    purge_stale_report_jobs(spec_hash=job.spec_hash)
+    logger.info(f"📄 Report job {job_id} done: {job.file.name}")
+
+
+def purge_stale_report_jobs(spec_hash: str = None) -> int:
+    """
+    Xóa job (và file) của watermark cũ đã có kết quả mới hơn cùng spec quá
+    REPORT_JOB_TIMEOUT_SECONDS, để client còn poll / tải job cũ kịp xong.
+    Trả về số job đã xóa.
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'REPORT_JOB_TIMEOUT_SECONDS', 1800))
+    newest = ReportJob.objects.filter(status='done', finished_at__lt=cutoff)
+    if spec_hash is not None:
+        newest = newest.filter(spec_hash=spec_hash)
+    superseded = {}
+    for job_hash, created_at in newest.values_list('spec_hash', 'created_at'):
+        superseded[job_hash] = max(created_at, superseded.get(job_hash, created_at))
+
+    deleted = 0
+    for job_hash, created_at in superseded.items():
+        stale_jobs = ReportJob.objects.filter(
+            spec_hash=job_hash, status__in=('done', 'failed'), created_at__lt=created_at
+        )
+        for stale in stale_jobs:
+            stale.file.delete(save=False)
+            stale.delete()
+            deleted += 1
+    if deleted:
+        logger.info(f"🧹 Purged {deleted} superseded report jobs")
+    return deleted
+
+
+def ensure_progress(job: ReportJob) -> ReportJob:
+    """
+    Gọi khi client poll trạng thái: đưa lại vào pool job pending bị bỏ rơi
+    (vd web process khởi động lại) và đánh dấu lỗi job chạy quá thời hạn.
+    Job bị đưa vào pool hai lần cũng chỉ chạy một lần (claim pending -> running).
+    """
+    timeout = timedelta(seconds=getattr(settings, 'REPORT_JOB_TIMEOUT_SECONDS', 1800))
+    now = timezone.now()
+    if job.status == 'pending' and job.created_at < now - timedelta(minutes=1):
+        dispatch_report_job(job.id)
+        job.refresh_from_db()
+    elif job.status == 'running' and job.started_at and job.started_at < now - timeout:
+        ReportJob.objects.filter(id=job.id, status='running').update(
+            status='failed', error='Quá thời gian xử lý', finished_at=now
+        )
+        job.refresh_from_db()
+    return job
@@ -0,0 +1,21 @@
+"""
+Hàm chạy trong process của pool báo cáo (spawn).
+
+Module này không import model ở mức module: process con unpickle các hàm dưới
+đây trước khi Django được setup.
+"""
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def run_job(job_id: int):
+    from django.db import connections
+    from .report_jobs import run_report_job
+
+    try:
+        run_report_job(job_id)
+    finally:
+        connections.close_all()
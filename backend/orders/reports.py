@@ -0,0 +1,460 @@
+"""
+Engine xuất báo cáo (Excel streaming và PDF), dùng chung cho export trực tiếp
+và report job chạy nền (orders/report_jobs.py).
+
+- Workbook openpyxl chế độ write_only: mỗi dòng append() được ghi thẳng ra
+  file tạm của sheet, không giữ cell trong bộ nhớ.
+- Dữ liệu đơn hàng đọc theo từng chunk keyset (orders.pagination.iter_keyset),
+  lookup phụ (giá sản phẩm) nạp một lần bằng in_bulk.
+- Kết quả ghi vào file tạm trên đĩa rồi trả về bằng FileResponse (một
+  StreamingHttpResponse), nên bộ nhớ đỉnh không phụ thuộc khoảng ngày.
+"""
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+
+from django.db.models import Count, Exists, OuterRef, Sum
+
+from .models import Order, OrderItem
+from .pagination import iter_keyset
+
+REPORT_TYPES = ('revenue', 'orders', 'products', 'customers')
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+DEFAULT_CHUNK_SIZE = 2000
+TOP_PRODUCTS_LIMIT = 50
+
+STATUS_LABELS = dict(Order.STATUS_CHOICES)
+PAYMENT_METHOD_LABELS = dict(Order.PAYMENT_METHOD_CHOICES)
+
+
+@dataclass(frozen=True)
+class ReportSpec:
+    """Tham số một báo cáo (loại, khoảng ngày YYYY-MM-DD, danh mục)"""
+    report_type: str = 'revenue'
+    start_date: str = ''
+    end_date: str = ''
+    category_id: Optional[int] = None
+    category_name: str = 'Tất cả'
+
+    def filename(self, extension: str = 'xlsx') -> str:
+        return f"bao_cao_{self.report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+@dataclass
+class SheetSpec:
+    """Nội dung một sheet: tiêu đề, header, độ rộng cột và nguồn dòng (iterable)"""
+    title: str
+    heading: str
+    headers: List[str]
+    widths: List[float]
+    rows: Iterable[list]
+    subtitles: List[str] = field(default_factory=list)
+    footer: Optional[Callable[[], list]] = None
+
+
+def filtered_orders(spec: ReportSpec):
+    """Đơn hàng trong khoảng ngày / danh mục của báo cáo"""
+    orders = Order.objects.all()
+    if spec.start_date:
+        orders = orders.filter(created_at__gte=spec.start_date)
+    if spec.end_date:
+        orders = orders.filter(created_at__lte=spec.end_date + ' 23:59:59')
+    if spec.category_id:
+        # EXISTS thay cho join + DISTINCT trên toàn bộ khoảng ngày
+        orders = orders.filter(Exists(OrderItem.objects.filter(
+            order_id=OuterRef('pk'),
+            product__category_id=spec.category_id,
+        )))
+    return orders
+
+
+def write_sheet(workbook, sheet: SheetSpec) -> int:
+    """Ghi một sheet write-only, trả về số dòng dữ liệu đã ghi"""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
+
+    ws = workbook.create_sheet(sheet.title)
+    # Write-only: độ rộng cột phải đặt trước khi ghi dòng
+    for index, width in enumerate(sheet.widths, start=1):
+        ws.column_dimensions[get_column_letter(index)].width = width
+
+    heading = WriteOnlyCell(ws, value=sheet.heading)
+    heading.font = Font(bold=True, size=16)
+    ws.append([heading])
+    for subtitle in sheet.subtitles:
+        ws.append([subtitle])
+
+    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    header_fill = PatternFill(start_color="FF69B4", end_color="FF69B4", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF", size=12)
+    header_cells = []
+    for header in sheet.headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal="center")
+        cell.border = border
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    # Dòng dữ liệu ghi giá trị thô (không style từng cell) để giữ tốc độ ghi
+    count = 0
+    for row in sheet.rows:
+        ws.append(row)
+        count += 1
+
+    if sheet.footer:
+        footer_cells = []
+        for value in sheet.footer():
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = Font(bold=True)
+            footer_cells.append(cell)
+        ws.append(footer_cells)
+    return count
+
+
+def write_workbook(output, sheets: Iterable[SheetSpec]) -> int:
+    """Ghi các sheet vào `output` (đường dẫn hoặc file nhị phân)"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    total = sum(write_sheet(workbook, sheet) for sheet in sheets)
+    workbook.save(output)
+    return total
+
+
+def _date_subtitles(spec: ReportSpec) -> List[str]:
+    return [
+        f'Từ ngày: {spec.start_date or "Tất cả"} - Đến ngày: {spec.end_date or "Tất cả"}',
+        f'Danh mục: {spec.category_name}',
+    ]
+
+
+def _revenue_sheet(spec: ReportSpec, chunk_size: int) -> SheetSpec:
+    totals = {'revenue': 0.0}
+
+    def rows():
+        fields = ['order_code', 'full_name', 'total_amount', 'status', 'payment_method']
+        for order in iter_keyset(filtered_orders(spec), fields, chunk_size):
+            amount = float(order['total_amount'])
+            # Chỉ tính tổng doanh thu nếu đơn hàng không bị hủy
+            if order['status'] != 'cancelled':
+                totals['revenue'] += amount
+            yield [
+                order['order_code'],
+                order['full_name'],
+                order['created_at'].strftime('%d/%m/%Y'),
+                amount,
+                STATUS_LABELS.get(order['status'], order['status']),
+                PAYMENT_METHOD_LABELS.get(order['payment_method'], order['payment_method']),
+            ]
+
+    return SheetSpec(
+        title='Doanh Thu',
+        heading='BÁO CÁO DOANH THU - WEB_TEDDY',
+        subtitles=_date_subtitles(spec),
+        headers=['Mã ĐH', 'Khách hàng', 'Ngày', 'Tổng tiền', 'Trạng thái', 'Thanh toán'],
+        widths=[20] * 6,
+        rows=rows(),
+        footer=lambda: ['TỔNG CỘNG', None, None, totals['revenue']],
+    )
+
+
+def _orders_sheet(spec: ReportSpec, chunk_size: int) -> SheetSpec:
+    def rows():
+        fields = ['order_code', 'full_name', 'phone', 'address', 'district', 'city', 'total_amount', 'status']
+        for order in iter_keyset(filtered_orders(spec), fields, chunk_size):
+            yield [
+                order['order_code'],
+                order['full_name'],
+                order['phone'],
+                f"{order['address']}, {order['district']}, {order['city']}",
+                float(order['total_amount']),
+                STATUS_LABELS.get(order['status'], order['status']),
+                order['created_at'].strftime('%d/%m/%Y'),
+            ]
+
+    return SheetSpec(
+        title='Đơn Hàng',
+        heading='BÁO CÁO ĐƠN HÀNG - WEB_TEDDY',
+        subtitles=_date_subtitles(spec),
+        headers=['Mã ĐH', 'Khách hàng', 'SĐT', 'Địa chỉ', 'Tổng tiền', 'Trạng thái', 'Ngày'],
+        widths=[20, 20, 20, 40, 20, 20, 20],
+        rows=rows(),
+    )
+
+
+def _products_sheet(spec: ReportSpec, chunk_size: int) -> SheetSpec:
+    from products.models import Product
+
+    def rows():
+        order_items = OrderItem.objects.filter(order__in=filtered_orders(spec))
+        if spec.category_id:
+            order_items = order_items.filter(product__category_id=spec.category_id)
+        product_stats = list(
+            order_items.values('product__id', 'product__name', 'product__category__name')
+            .annotate(total_sold=Sum('quantity'))
+            .order_by('-total_sold')[:TOP_PRODUCTS_LIMIT]
+        )
+        # Giá hiện tại của cả top sản phẩm trong một truy vấn
+        prices = {
+            product_id: product.price
+            for product_id, product in Product.objects.only('id', 'price').in_bulk(
+                [stat['product__id'] for stat in product_stats if stat['product__id']]
+            ).items()
+        }
+        for index, stat in enumerate(product_stats, start=1):
+            price = prices.get(stat['product__id'])
+            yield [
+                index,
+                stat['product__name'],
+                stat['product__category__name'] or 'N/A',
+                stat['total_sold'],
+                float(price) if price is not None else 0,
+                float(price * stat['total_sold']) if price is not None else 0,
+            ]
+
+    return SheetSpec(
+        title='Sản Phẩm Bán Chạy',
+        heading='BÁO CÁO SẢN PHẨM BÁN CHẠY - WEB_TEDDY',
+        subtitles=_date_subtitles(spec),
+        headers=['STT', 'Sản phẩm', 'Danh mục', 'Đã bán', 'Giá', 'Doanh thu'],
+        widths=[18, 35, 18, 18, 18, 18],
+        rows=rows(),
+    )
+
+
+def _customers_sheet(spec: ReportSpec, chunk_size: int) -> SheetSpec:
+    def rows():
+        # Kết quả đã gom nhóm theo khách (loại bỏ đơn hàng bị hủy)
+        customer_stats = filtered_orders(spec).exclude(status='cancelled').values(
+            'user__username', 'email', 'phone', 'user__date_joined'
+        ).annotate(
+            order_count=Count('id'),
+            total_spent=Sum('total_amount')
+        ).order_by('-total_spent')
+        for stat in customer_stats.iterator(chunk_size=chunk_size):
+            yield [
+                stat['user__username'] or 'Khách',
+                stat['email'],
+                stat['phone'],
+                stat['order_count'],
+                float(stat['total_spent']),
+                stat['user__date_joined'].strftime('%d/%m/%Y') if stat['user__date_joined'] else 'N/A',
+            ]
+
+    return SheetSpec(
+        title='Khách Hàng',
+        heading='BÁO CÁO KHÁCH HÀNG - WEB_TEDDY',
+        subtitles=_date_subtitles(spec),
+        headers=['Khách hàng', 'Email', 'SĐT', 'Số đơn', 'Tổng chi tiêu', 'Ngày đầu'],
+        widths=[22] * 6,
+        rows=rows(),
+    )
+
+
+SHEET_BUILDERS = {
+    'revenue': _revenue_sheet,
+    'orders': _orders_sheet,
+    'products': _products_sheet,
+    'customers': _customers_sheet,
+}
+
+
+def write_excel_report(spec: ReportSpec, output, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Ghi báo cáo Excel của `spec` vào `output`, trả về số dòng dữ liệu"""
+    builder = SHEET_BUILDERS.get(spec.report_type)
+    if builder is None:
+        raise ValueError(f'report_type không hợp lệ: {spec.report_type}')
+    return write_workbook(output, [builder(spec, chunk_size)])
+
+
+def excel_report_file(spec: ReportSpec, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Ghi báo cáo ra file tạm (tự xóa khi đóng) và trả về file đã tua về đầu"""
+    report_file = tempfile.TemporaryFile()
+    try:
+        write_excel_report(spec, report_file, chunk_size)
+    except Exception:
+        report_file.close()
+        raise
+    report_file.seek(0)
+    return report_file
+
+
+def parse_report_spec(params) -> ReportSpec:
+    """
+    Đọc ReportSpec từ query params / body (report_type, start_date, end_date, category_id).
+
+    Raises:
+        ValueError: tham số không hợp lệ (message dùng trả về cho client)
+    """
+    report_type = params.get('report_type') or 'revenue'
+    if report_type not in REPORT_TYPES:
+        raise ValueError(f'report_type không hợp lệ. Chọn từ: {", ".join(REPORT_TYPES)}')
+
+    category_id = None
+    category_id_str = str(params.get('category_id') or '').strip()
+    if category_id_str:
+        try:
+            category_id = int(category_id_str)
+        except ValueError:
+            raise ValueError('category_id không hợp lệ. Vui lòng truyền số nguyên')
+
+    category_name = 'Tất cả'
+    if category_id:
+        from categories.models import Category
+        category_name = Category.objects.filter(id=category_id).values_list('name', flat=True).first() or 'Không xác định'
+
+    return ReportSpec(
+        report_type=report_type,
+        start_date=params.get('start_date') or '',
+        end_date=params.get('end_date') or '',
+        category_id=category_id,
+        category_name=category_name,
+    )
+
+
+PDF_ROW_LIMIT = 100
+
+
+def write_pdf_report(spec: ReportSpec, output) -> None:
+    """Vẽ báo cáo PDF (reportlab) của `spec` vào `output` (file nhị phân)"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    from products.models import Product
+
+    doc = SimpleDocTemplate(output, pagesize=landscape(A4))
+    styles = getSampleStyleSheet()
+    titles = {
+        'revenue': 'BAO CAO DOANH THU - WEB_TEDDY',
+        'orders': 'BAO CAO DON HANG - WEB_TEDDY',
+        'products': 'BAO CAO SAN PHAM BAN CHAY - WEB_TEDDY',
+        'customers': 'BAO CAO KHACH HANG - WEB_TEDDY',
+    }
+
+    elements = [
+        Paragraph(f'<para align=center><b>{titles[spec.report_type]}</b></para>', styles['Title']),
+        Paragraph(
+            f'<para align=center>Tu ngay: {spec.start_date or "Tat ca"} - Den ngay: {spec.end_date or "Tat ca"}</para>',
+            styles['Normal']
+        ),
+    ]
+    # Báo cáo khách hàng là thống kê tổng thể, không lọc theo danh mục
+    if spec.category_id and spec.report_type != 'customers':
+        elements.append(Paragraph(f'<para align=center>Danh muc: {spec.category_name}</para>', styles['Normal']))
+    elements.append(Spacer(1, 0.3 * inch))
+
+    header_font_size = 9
+    style_commands = []
+    if spec.report_type in ('revenue', 'orders'):
+        orders = filtered_orders(spec).order_by('-created_at')[:PDF_ROW_LIMIT]
+        if spec.report_type == 'revenue':
+            data = [['Ma DH', 'Khach hang', 'Ngay', 'Tong tien', 'Trang thai', 'Thanh toan']]
+            total_revenue = 0
+            for order in orders:
+                data.append([
+                    order.order_code,
+                    order.full_name[:15],
+                    order.created_at.strftime('%d/%m/%y'),
+                    f'{order.total_amount:,.0f}',
+                    order.get_status_display()[:10],
+                    order.get_payment_method_display()[:10],
+                ])
+                # Chỉ tính tổng doanh thu nếu đơn hàng không bị hủy
+                if order.status != 'cancelled':
+                    total_revenue += float(order.total_amount)
+            data.append(['', '', 'TONG CONG:', f'{total_revenue:,.0f}', '', ''])
+            style_commands = [
+                ('FONTSIZE', (0, 1), (-1, -2), 7),
+                ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, -1), (-1, -1), 9),
+            ]
+        else:
+            data = [['Ma DH', 'Khach', 'SDT', 'Tong tien', 'TT', 'Ngay']]
+            for order in orders:
+                data.append([
+                    order.order_code,
+                    order.full_name[:12],
+                    order.phone,
+                    f'{order.total_amount:,.0f}',
+                    order.get_status_display()[:10],
+                    order.created_at.strftime('%d/%m/%y'),
+                ])
+
+    elif spec.report_type == 'products':
+        order_items = OrderItem.objects.filter(order__in=filtered_orders(ReportSpec(
+            report_type=spec.report_type, start_date=spec.start_date, end_date=spec.end_date
+        )))
+        if spec.category_id:
+            order_items = order_items.filter(product__category_id=spec.category_id)
+        product_stats = list(
+            order_items.values('product__id', 'product__name', 'product__category__name')
+            .annotate(total_sold=Sum('quantity'))
+            .order_by('-total_sold')[:TOP_PRODUCTS_LIMIT]
+        )
+        prices = {
+            product_id: product.price
+            for product_id, product in Product.objects.only('id', 'price').in_bulk(
+                [stat['product__id'] for stat in product_stats if stat['product__id']]
+            ).items()
+        }
+        data = [['STT', 'San pham', 'Danh muc', 'Da ban', 'Gia', 'Doanh thu']]
+        for index, stat in enumerate(product_stats, 1):
+            price = prices.get(stat['product__id'])
+            data.append([
+                str(index),
+                (stat['product__name'] or '')[:25],
+                (stat['product__category__name'] or 'N/A')[:15],
+                str(stat['total_sold']),
+                f'{price:,.0f}' if price is not None else '0',
+                f'{(price * stat["total_sold"]):,.0f}' if price is not None else '0',
+            ])
+        header_font_size = 8
+
+    else:
+        # Loại bỏ đơn hàng bị hủy khỏi thống kê khách hàng, không lọc theo danh mục
+        customer_stats = filtered_orders(ReportSpec(
+            report_type=spec.report_type, start_date=spec.start_date, end_date=spec.end_date
+        )).exclude(status='cancelled').values('user__username', 'email', 'phone').annotate(
+            order_count=Count('id'),
+            total_spent=Sum('total_amount')
+        ).order_by('-total_spent')[:TOP_PRODUCTS_LIMIT]
+        data = [['Khach hang', 'Email', 'SDT', 'So don', 'Tong chi tieu']]
+        for stat in customer_stats:
+            data.append([
+                (stat['user__username'] or 'Khach')[:15],
+                stat['email'][:20],
+                stat['phone'],
+                str(stat['order_count']),
+                f'{stat["total_spent"]:,.0f}',
+            ])
+
+    table = Table(data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FF69B4')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+        *(style_commands or [('FONTSIZE', (0, 1), (-1, -1), 7)]),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]))
+    elements.append(table)
+    doc.build(elements)
+
+
+def pdf_report_file(spec: ReportSpec):
+    """Giống excel_report_file nhưng cho PDF"""
+    report_file = tempfile.TemporaryFile()
+    try:
+        write_pdf_report(spec, report_file)
+    except Exception:
+        report_file.close()
+        raise
+    report_file.seek(0)
+    return report_file
@@ -0,0 +1,155 @@
+"""
+Giữ hàng có thời hạn (TTL) cho đơn thanh toán online.
+
+- create_order (MoMo / chuyển khoản): trừ kho bằng dòng sổ 'reserve' và tạo
+  StockReservation hết hạn sau STOCK_RESERVATION_TTL_MINUTES.
+- Thanh toán thành công (callback / webhook / kiểm tra trạng thái đều đi qua
+  post_save của Order): reservation -> 'converted', ghi sổ 'release' + 'sale'
+  (bù trừ nhau, số tồn không đổi).
+- release_expired_reservations(): quét theo index (status, expires_at) từng lô,
+  trả hàng về kho ('release') và hủy đơn chưa thanh toán.
+"""
+import logging
+from datetime import timedelta
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from products.inventory import apply_movements, movement
+from .models import Order, StockReservation
+
+logger = logging.getLogger(__name__)
+
+ONLINE_PAYMENT_METHODS = ('momo', 'banking')
+
+
+def reservation_ttl() -> timedelta:
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 20))
+
+
+def reserve_order_stock(order: Order, items: Iterable[dict]) -> List[StockReservation]:
+    """
+    Giữ hàng cho các dòng của đơn (gọi trong transaction tạo đơn).
+
+    Args:
+        items: [{'product_id', 'size', 'quantity'}]
+
+    Raises:
+        InsufficientStock: không đủ hàng để giữ
+    """
+    items = list(items)
+    apply_movements([
+        movement(item['product_id'], -item['quantity'], 'reserve', size=item['size'], reference=order.order_code)
+        for item in items
+    ], check_stock=True)
+    expires_at = timezone.now() + reservation_ttl()
+    return StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order, product_id=item['product_id'], size=item['size'],
+            quantity=item['quantity'], expires_at=expires_at,
+        )
+        for item in items
+    ])
+
+
+def _claim(queryset, new_status: str, now) -> List[StockReservation]:
+    """Khóa các reservation còn active và chuyển trạng thái; dòng đã bị xử lý ở nơi khác bị bỏ qua"""
+    reservations = list(queryset.filter(status='active').select_for_update())
+    if reservations:
+        StockReservation.objects.filter(id__in=[item.id for item in reservations]).update(
+            status=new_status, closed_at=now
+        )
+    return reservations
+
+
+@transaction.atomic
+def convert_order_reservations(order: Order) -> int:
+    """Thanh toán thành công: hàng đang giữ thành hàng đã bán"""
+    reservations = _claim(StockReservation.objects.filter(order=order), 'converted', timezone.now())
+    apply_movements([
+        entry
+        for item in reservations
+        for entry in (
+            movement(item.product_id, item.quantity, 'release', size=item.size, reference=order.order_code),
+            movement(item.product_id, -item.quantity, 'sale', size=item.size, reference=order.order_code),
+        )
+    ])
+    return len(reservations)
+
+
+@transaction.atomic
+def release_order_reservations(order: Order, note: str = '') -> int:
+    """Trả lại hàng đang giữ của đơn (hủy đơn / hết hạn). Trả về số reservation đã trả."""
+    reservations = _claim(StockReservation.objects.filter(order=order), 'released', timezone.now())
+    apply_movements([
+        movement(item.product_id, item.quantity, 'release', size=item.size, reference=order.order_code, note=note)
+        for item in reservations
+    ])
+    return len(reservations)
+
+
+def release_expired_reservations(batch_size: int = 500, now=None) -> dict:
+    """
+    Trả kho các reservation hết hạn, mỗi lô một transaction.
+
+    Đơn tương ứng còn 'pending' và chưa thanh toán thì bị hủy. Thanh toán đến
+    muộn sau đó được xử lý như đơn đã hủy có thanh toán (yêu cầu hoàn tiền).
+    """
+    now = now or timezone.now()
+    released = 0
+    cancelled = 0
+    while True:
+        with transaction.atomic():
+            reservations = _claim(
+                StockReservation.objects.filter(
+                    id__in=list(
+                        StockReservation.objects.filter(status='active', expires_at__lte=now)
+                        .order_by('expires_at')
+                        .values_list('id', flat=True)[:batch_size]
+                    )
+                ),
+                'released',
+                now,
+            )
+            if not reservations:
+                break
+            order_codes = dict(Order.objects.filter(
+                id__in={item.order_id for item in reservations}
+            ).values_list('id', 'order_code'))
+            apply_movements([
+                movement(item.product_id, item.quantity, 'release', size=item.size,
+                         reference=order_codes.get(item.order_id, ''), note='Hết hạn giữ hàng')
+                for item in reservations
+            ])
+            # save() từng đơn để các signal chuyển trạng thái vẫn chạy
+            for order in Order.objects.filter(id__in=order_codes, status='pending').exclude(payment_status='completed'):
+                order.status = 'cancelled'
+                order.payment_status = 'failed'
+                order.save(update_fields=['status', 'payment_status', 'updated_at'])
+                cancelled += 1
+            released += len(reservations)
+
+    if released:
+        logger.info(f"⏳ Released {released} expired stock reservations, cancelled {cancelled} orders")
+    return {'released': released, 'cancelled': cancelled}
+
+
+def handle_payment_completed(order: Order):
+    """Gọi khi payment_status chuyển sang 'completed' (orders/signals.py)"""
+    if convert_order_reservations(order):
+        return
+    if order.status == 'cancelled' and order.refund_status == 'none':
+        # Thanh toán đến sau khi đơn đã hủy do hết hạn giữ hàng -> cần hoàn tiền.
+        # save() trên bản nạp lại (khóa dòng) để updated_at và các signal Order vẫn chạy
+        # (ETag, watermark báo cáo, cache phản hồi) mà receiver của lần lưu hiện tại không chạy lại
+        with transaction.atomic():
+            fresh = Order.objects.select_for_update().filter(pk=order.pk, refund_status='none').first()
+            if fresh is None:
+                return
+            fresh.refund_status = 'requested'
+            fresh.save(update_fields=['refund_status', 'updated_at'])
+        order.refund_status = fresh.refund_status
+        order.updated_at = fresh.updated_at
+        logger.warning(f"⚠️ Order {order.order_code} paid after its reservation expired; refund requested")
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Order, OrderItem, Cart, CartItem
+from .models import Order, OrderItem, Cart, CartItem, ReportJob
 
 
 class CartItemDetailSerializer(serializers.ModelSerializer):
@@ -33,12 +33,15 @@ class CartItemDetailSerializer(serializers.ModelSerializer):
     
     def get_available_stock(self, obj):
         """Lấy số lượng tồn kho hiện tại"""
-        if obj.unit and obj.product.variants.exists():
-            variant = obj.product.variants.filter(size=obj.unit).first()
-            if variant:
-                return variant.stock
-            return 0
-        return obj.product.stock
+        if not hasattr(obj, '_available_stock'):
+            # variants.all() dùng dữ liệu prefetch (xem orders/views.py: CART_ITEMS_PREFETCH)
+            variants = obj.product.variants.all() if obj.unit else []
+            if variants:
+                variant = next((v for v in variants if v.size == obj.unit), None)
+                obj._available_stock = variant.stock if variant else 0
+            else:
+                obj._available_stock = obj.product.stock
+        return obj._available_stock
     
     def get_is_available(self, obj):
         """Kiểm tra sản phẩm còn đủ hàng không"""
@@ -58,11 +61,11 @@ class CartSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
     
     def get_total_price(self, obj):
-        """Tính tổng giá trị giỏ hàng"""
+        """Tổng giá trị giỏ hàng (lưu sẵn trên Cart)"""
         return obj.total_price
     
     def get_total_quantity(self, obj):
-        """Tính tổng số lượng sản phẩm"""
+        """Tổng số lượng sản phẩm (lưu sẵn trên Cart)"""
         return obj.total_quantity
 
 
@@ -87,6 +90,20 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'order_code', 'created_at', 'updated_at']
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    """Thông tin đơn hàng không kèm items (danh sách lịch sử đơn)"""
+    items_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_code', 'status', 'payment_method', 'payment_status',
+            'refund_status', 'subtotal', 'shipping_fee', 'total_amount', 'items_count',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
 class OrderCreateSerializer(serializers.Serializer):
     full_name = serializers.CharField(max_length=255)
     phone = serializers.CharField(max_length=20)
@@ -101,3 +118,19 @@ class OrderCreateSerializer(serializers.Serializer):
             child=serializers.CharField()
         )
     )
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Trạng thái job xuất báo cáo"""
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['job_id', 'status', 'report_format', 'spec', 'error', 'download_url', 'created_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != 'done':
+            return None
+        return f"/api/orders/download_report/?job_id={obj.id}"
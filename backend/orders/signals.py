@@ -1,44 +1,100 @@
-from django.db.models.signals import pre_save, post_save
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.db.models import F
-from .models import Order, OrderItem
-from products.models import Product
+from .models import Cart, CartItem, Order, OrderItem
 
+_state = threading.local()
 
-@receiver(pre_save, sender=Order)
-def store_previous_status(sender, instance, **kwargs):
-    """Store previous status on the instance before saving so post_save can compare."""
-    if instance.pk:
-        try:
-            prev = Order.objects.get(pk=instance.pk)
-            instance._previous_status = prev.status
-        except Order.DoesNotExist:
-            instance._previous_status = None
-    else:
-        instance._previous_status = None
+
+@contextmanager
+def deferred_cart_totals():
+    """
+    Gom việc tính lại tổng giỏ trong khối này (thread hiện tại): mỗi giỏ có mục
+    bị đổi chỉ tính lại một lần khi thoát khối, thay vì một lần mỗi mục (vd
+    clear_cart xóa N mục). Khối lỗi thì bỏ qua (transaction đã rollback).
+    """
+    if getattr(_state, 'pending', None) is not None:
+        yield
+        return
+    pending = _state.pending = set()
+    try:
+        yield
+    finally:
+        _state.pending = None
+    for cart_id in sorted(pending):
+        Cart.recalculate_totals(cart_id)
 
 
 @receiver(post_save, sender=Order)
-def update_product_sold_count_on_delivered(sender, instance, created, **kwargs):
-    """When an order transitions to 'delivered', increment product.sold_count by quantities in order items.
+def update_product_sold_count(sender, instance, created, **kwargs):
+    """Keep product.sold_count in sync when an order starts or stops counting as sold.
 
-    This ensures sold_count reflects only completed (delivered) purchases.
+    Delivered (and not refunded) orders add their quantities; a delivered order that is
+    later cancelled or refunded subtracts them again. See orders/sold_counts.py.
     """
     try:
-        previous = getattr(instance, '_previous_status', None)
-        # Only update when newly delivered
-        if instance.status == 'delivered' and previous != 'delivered':
-            items = OrderItem.objects.filter(order=instance)
-            per_product = {}
-            for it in items:
-                if not it.product:
-                    continue
-                per_product.setdefault(it.product.id, 0)
-                per_product[it.product.id] += it.quantity
-
-            # Bulk update using F expressions
-            for pid, qty in per_product.items():
-                Product.objects.filter(pk=pid).update(sold_count=F('sold_count') + qty)
+        from .sold_counts import apply_order_transition
+        apply_order_transition(instance)
     except Exception:
         import logging
         logging.getLogger(__name__).exception('Failed to update sold_count for order %s', getattr(instance, 'pk', None))
+
+
+@receiver(post_save, sender=Order)
+def convert_reservations_on_payment(sender, instance, created, **kwargs):
+    """Thanh toán online thành công (callback, webhook hay kiểm tra trạng thái): hàng đang giữ thành hàng đã bán."""
+    if created or instance.payment_status != 'completed' or not instance.has_changed('payment_status'):
+        return
+    from .reservations import handle_payment_completed
+    handle_payment_completed(instance)
+
+
+@receiver(post_save, sender=Order)
+def refresh_co_purchase_on_status_change(sender, instance, created, **kwargs):
+    """Cập nhật chỉ mục "thường mua cùng" cho sản phẩm trong đơn khi đơn được giao/bị hủy."""
+    if created or not instance.has_changed('status') or instance.status not in ('delivered', 'cancelled'):
+        return
+
+    order_id = instance.pk
+
+    def _refresh():
+        try:
+            from .recommendations import refresh_co_purchase_for_products
+            product_ids = OrderItem.objects.filter(order_id=order_id).values_list('product_id', flat=True)
+            refresh_co_purchase_for_products(list(product_ids))
+        except Exception:
+            import logging
+            logging.getLogger(__name__).exception('Failed to refresh co-purchase index for order %s', order_id)
+
+    transaction.on_commit(_refresh)
+
+
+@receiver(post_save, sender=Order)
+def invalidate_payment_status_cache(sender, instance, created, **kwargs):
+    """Trang checkout thấy ngay kết quả thanh toán thay vì chờ cache trạng thái hết hạn."""
+    if created or not instance.has_changed('payment_status'):
+        return
+    from .payment_reconciler import invalidate_status_cache
+    invalidate_status_cache(instance)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_order_responses(sender, **kwargs):
+    """Thống kê đơn hàng (cache phản hồi gắn tag 'order') tính lại sau mỗi thay đổi đơn."""
+    from backend.response_cache import invalidate_tags
+    invalidate_tags('order')
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def refresh_cart_totals(sender, instance, **kwargs):
+    """Giữ Cart.total_price / total_quantity khớp với các mục (giỏ hàng, chatbot, admin)."""
+    pending = getattr(_state, 'pending', None)
+    if pending is not None:
+        pending.add(instance.cart_id)
+    else:
+        Cart.recalculate_totals(instance.cart_id)
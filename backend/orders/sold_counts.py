@@ -0,0 +1,114 @@
+"""
+Duy trì Product.sold_count theo tập (set-based).
+
+Một đơn "tính vào lượt bán" khi đã giao và chưa hoàn tiền. Khi đơn đổi trạng
+thái (lấy giá trị cũ từ field tracker của Order, không SELECT lại):
+- bắt đầu được tính (-> delivered): cộng số lượng từng sản phẩm
+- thôi được tính (delivered -> cancelled / refunded): trừ đối xứng, không xuống dưới 0
+
+Mỗi lần chuyển trạng thái chỉ gồm một SELECT gom số lượng theo sản phẩm và một
+UPDATE ... CASE cho mọi sản phẩm trong đơn. recompute_sold_counts() tính lại từ
+đầu theo từng khối sản phẩm và ghi bằng bulk_update.
+"""
+import logging
+from typing import Dict, Optional
+
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from products.models import Product
+from .models import OrderItem
+
+logger = logging.getLogger(__name__)
+
+SOLD_ORDER_FILTER = Q(order__status='delivered') & ~Q(order__refund_status='refunded')
+
+
+def counts_as_sold(status: Optional[str], refund_status: Optional[str]) -> bool:
+    return status == 'delivered' and refund_status != 'refunded'
+
+
+def _order_quantities(order_id: int) -> Dict[int, int]:
+    rows = (
+        OrderItem.objects.filter(order_id=order_id, product__isnull=False)
+        .values('product_id')
+        .annotate(quantity=Sum('quantity'))
+        .order_by()
+    )
+    return {row['product_id']: row['quantity'] for row in rows}
+
+
+def apply_sold_delta(order_id: int, sign: int) -> int:
+    """
+    Cộng (sign=1) hoặc trừ (sign=-1) số lượng của đơn vào sold_count bằng một UPDATE.
+
+    Returns:
+        Số sản phẩm được cập nhật
+    """
+    quantities = _order_quantities(order_id)
+    if not quantities:
+        return 0
+
+    delta = Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    if sign > 0:
+        new_value = F('sold_count') + delta
+    else:
+        new_value = Greatest(F('sold_count') - delta, Value(0))
+    return Product.objects.filter(pk__in=quantities.keys()).update(sold_count=new_value)
+
+
+def apply_order_transition(order) -> int:
+    """Áp dụng thay đổi sold_count cho lần lưu vừa rồi của order (gọi trong post_save)"""
+    was_sold = counts_as_sold(order.previous('status'), order.previous('refund_status'))
+    is_sold = counts_as_sold(order.status, order.refund_status)
+    if was_sold == is_sold:
+        return 0
+    return apply_sold_delta(order.pk, 1 if is_sold else -1)
+
+
+def recompute_sold_counts(chunk_size: int = 2000) -> Dict[str, int]:
+    """
+    Tính lại sold_count của mọi sản phẩm từ các đơn đã giao, chưa hoàn tiền.
+
+    Duyệt sản phẩm theo khối id (keyset); mỗi khối một truy vấn SUM theo khoảng
+    product_id (quét theo index khóa ngoại của order_items) và một bulk_update cho
+    các sản phẩm có giá trị lệch. Bộ nhớ chỉ phụ thuộc chunk_size.
+    """
+    products_seen = 0
+    updated = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk').only('id', 'sold_count')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_id = chunk[-1].pk
+        products_seen += len(chunk)
+
+        totals = dict(
+            OrderItem.objects.filter(SOLD_ORDER_FILTER, product_id__gt=chunk[0].pk - 1, product_id__lte=last_id)
+            .values('product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+            .values_list('product_id', 'total')
+        )
+        changed = []
+        for product in chunk:
+            total = totals.get(product.pk) or 0
+            if product.sold_count != total:
+                product.sold_count = total
+                changed.append(product)
+        if changed:
+            Product.objects.bulk_update(changed, ['sold_count'], batch_size=500)
+            updated += len(changed)
+
+        if len(chunk) < chunk_size:
+            break
+
+    logger.info(f"🔢 Recomputed sold_count: {updated}/{products_seen} products changed")
+    return {'products': products_seen, 'updated': updated}
@@ -1 +1,861 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from categories.models import Category
+from products.models import InventoryMovement, Product, ProductNeighbor, ProductVariant
+
+from .idempotency import purge_expired_keys
+from .models import Cart, CartItem, IdempotencyKey, Order, OrderItem, PaymentCheck, PaymentEvent, StockReservation
+from .payment_events import process_payment_events
+from .payment_reconciler import reconcile_payments
+from .reservations import release_expired_reservations
+
+User = get_user_model()
+
+
+class OrderTestMixin:
+    """Dữ liệu dùng chung cho các test của app orders"""
+
+    def create_product(self, name, price=100000, stock=100, category=None):
+        if category is None:
+            category, _ = Category.objects.get_or_create(name='Gau Bong')
+        return Product.objects.create(name=name, category=category, price=price, stock=stock, status='active')
+
+    def create_order(self, user, products, status='pending', code=None, **extra):
+        subtotal = sum(int(p.price) for p in products)
+        fields = {
+            'full_name': 'Nguyen Van A',
+            'phone': '0900000000',
+            'email': 'a@example.com',
+            'address': '1 Le Loi',
+            'city': 'HCM',
+            'district': 'Q1',
+            'payment_method': 'cod',
+            'subtotal': subtotal,
+            'total_amount': subtotal,
+        }
+        fields.update(extra)
+        order = Order.objects.create(
+            user=user,
+            order_code=code or f'DH{Order.objects.count() + 1:06d}',
+            status=status,
+            **fields
+        )
+        for product in products:
+            OrderItem.objects.create(
+                order=order,
+                product=product,
+                product_name=product.name,
+                product_price=product.price,
+                quantity=1,
+                unit='30cm',
+            )
+        return order
+
+
+class CoPurchaseIndexTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.teddy = self.create_product('Gau Teddy')
+        self.panda = self.create_product('Gau Panda')
+        self.bunny = self.create_product('Tho Bunny')
+        self.card = self.create_product('Thiep Chuc Mung')
+
+    def neighbors(self, product):
+        return list(
+            ProductNeighbor.objects.filter(product=product, kind='co_purchase')
+            .order_by('rank').values_list('neighbor_id', flat=True)
+        )
+
+    def test_rebuild_scores_pairs_from_non_cancelled_orders(self):
+        from .recommendations import rebuild_co_purchase_index
+
+        self.create_order(self.user, [self.teddy, self.card])
+        self.create_order(self.user, [self.teddy, self.card])
+        self.create_order(self.user, [self.teddy, self.panda])
+        self.create_order(self.user, [self.teddy, self.bunny], status='cancelled')
+
+        result = rebuild_co_purchase_index()
+
+        self.assertEqual(result['orders'], 3)
+        self.assertEqual(self.neighbors(self.teddy), [self.card.id, self.panda.id])
+        self.assertEqual(self.neighbors(self.bunny), [])
+        # co=2, n(teddy)=3, n(card)=2 -> 2 / sqrt(6)
+        score = ProductNeighbor.objects.get(product=self.teddy, neighbor=self.card, kind='co_purchase').score
+        self.assertAlmostEqual(score, 2 / 6 ** 0.5, places=5)
+
+    def test_delivered_and_cancelled_orders_refresh_index_incrementally(self):
+        order = self.create_order(self.user, [self.panda, self.bunny])
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'delivered'
+            order.save()
+
+        self.assertEqual(self.neighbors(self.panda), [self.bunny.id])
+        self.assertEqual(self.neighbors(self.bunny), [self.panda.id])
+
+        order.status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+
+        self.assertEqual(self.neighbors(self.panda), [])
+        self.assertEqual(self.neighbors(self.bunny), [])
+
+    def test_product_recommendations_endpoint_uses_index(self):
+        from .recommendations import rebuild_co_purchase_index
+
+        self.create_order(self.user, [self.teddy, self.card])
+        rebuild_co_purchase_index()
+
+        response = self.client.get(f'/api/products/{self.teddy.slug}/recommendations/?limit=2')
+
+        self.assertEqual(response.status_code, 200)
+        ids = [item['id'] for item in response.json()]
+        # Sản phẩm mua cùng đứng đầu, phần còn lại bổ sung cùng danh mục
+        self.assertEqual(ids[0], self.card.id)
+        self.assertEqual(len(ids), 2)
+        self.assertNotIn(self.teddy.id, ids)
+
+
+class AdminOrderListingTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@example.com', password='testpass123', role='admin'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.product = self.create_product('Gau Teddy')
+        self.orders = [
+            self.create_order(self.admin, [self.product], status='delivered' if i % 2 else 'pending',
+                              phone=f'09{i:08d}', email=f'khach{i}@example.com')
+            for i in range(7)
+        ]
+
+    def test_keyset_pages_cover_all_orders_with_fixed_queries(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 3}
+            if cursor:
+                params['cursor'] = cursor
+            # 1 truy vấn đơn hàng + 1 truy vấn prefetch items, không phụ thuộc số đơn
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/orders/all_orders/', params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            seen.extend(order['id'] for order in body['results'])
+            self.assertTrue(all(order['items'] for order in body['results']))
+            cursor = body['next_cursor']
+            if not body['has_more']:
+                break
+
+        expected = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_search_and_status_filters(self):
+        target = self.orders[3]
+
+        response = self.client.get('/api/orders/all_orders/', {'search': target.order_code.lower()})
+        self.assertEqual([o['id'] for o in response.json()['results']], [target.id])
+
+        response = self.client.get('/api/orders/all_orders/', {'search': target.phone})
+        self.assertEqual([o['id'] for o in response.json()['results']], [target.id])
+
+        response = self.client.get('/api/orders/all_orders/', {'search': 'khach3@'})
+        self.assertEqual([o['id'] for o in response.json()['results']], [target.id])
+
+        response = self.client.get('/api/orders/all_orders/', {'status': 'delivered'})
+        self.assertEqual(len(response.json()['results']), 3)
+
+        response = self.client.get('/api/orders/all_orders/', {'cursor': 'khong-hop-le'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MyOrdersTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='khach', email='khach@example.com', password='testpass123', phone='0911111111')
+        other = User.objects.create_user(username='khac', email='khac@example.com', password='testpass123', phone='0922222222')
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        teddy = self.create_product('Gau Teddy')
+        panda = self.create_product('Gau Panda')
+        self.orders = [self.create_order(self.customer, [teddy, panda]) for _ in range(4)]
+        self.create_order(other, [teddy])
+
+    def test_summary_and_paginated_modes(self):
+        response = self.client.get('/api/orders/my_orders/', {'summary': '1'})
+        body = response.json()
+        self.assertEqual(len(body), 4)
+        self.assertNotIn('items', body[0])
+        self.assertEqual(body[0]['items_count'], 2)
+
+        with self.assertNumQueries(3):  # ETag + đơn hàng + prefetch items
+            response = self.client.get('/api/orders/my_orders/', {'page_size': 3})
+        body = response.json()
+        self.assertEqual(len(body['results']), 3)
+        self.assertEqual(len(body['results'][0]['items']), 2)
+        self.assertTrue(body['has_more'])
+
+        response = self.client.get('/api/orders/my_orders/', {'page_size': 3, 'cursor': body['next_cursor']})
+        self.assertEqual([o['id'] for o in response.json()['results']], [self.orders[0].id])
+
+    def test_etag_returns_not_modified_until_an_order_changes(self):
+        response = self.client.get('/api/orders/my_orders/')
+        etag = response['ETag']
+        self.assertEqual(len(response.json()), 4)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/orders/my_orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Tham số khác (summary) có ETag khác
+        response = self.client.get('/api/orders/my_orders/', {'summary': '1'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        order = self.orders[1]
+        order.status = 'confirmed'
+        order.save()
+        response = self.client.get('/api/orders/my_orders/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class StreamingExcelExportTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@example.com', password='testpass123', role='admin'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _read_rows(self, response):
+        import io
+        from openpyxl import load_workbook
+
+        content = b''.join(response.streaming_content)
+        workbook = load_workbook(io.BytesIO(content), read_only=True)
+        return [list(row) for row in workbook.active.iter_rows(values_only=True)]
+
+    def test_revenue_and_products_reports(self):
+        from categories.models import Category
+
+        toys = Category.objects.create(name='Do Choi')
+        teddy = self.create_product('Gau Teddy', price=200000)
+        robot = self.create_product('Robot', price=300000, category=toys)
+        self.create_order(self.admin, [teddy], status='delivered')
+        self.create_order(self.admin, [teddy, robot], status='cancelled')
+        self.create_order(self.admin, [robot], status='pending')
+
+        response = self.client.get('/api/orders/export_excel/', {'report_type': 'revenue'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = self._read_rows(response)
+        self.assertEqual(rows[3][0], 'Mã ĐH')
+        self.assertEqual(len(rows), 4 + 3 + 1)
+        self.assertEqual(rows[-1][0], 'TỔNG CỘNG')
+        self.assertEqual(rows[-1][3], 500000)
+
+        response = self.client.get('/api/orders/export_excel/', {'report_type': 'revenue', 'category_id': toys.id})
+        self.assertEqual(len(self._read_rows(response)), 4 + 2 + 1)
+
+        response = self.client.get('/api/orders/export_excel/', {'report_type': 'products'})
+        rows = self._read_rows(response)
+        self.assertEqual([row[1] for row in rows[4:]], ['Gau Teddy', 'Robot'])
+        self.assertEqual(rows[4][5], 400000)
+
+        response = self.client.get('/api/orders/export_excel/', {'report_type': 'khac'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_peak_memory_does_not_grow_with_row_count(self):
+        import tempfile
+        import tracemalloc
+        from .management.commands.benchmark_excel_export import synthetic_order_rows
+        from .reports import SheetSpec, write_workbook
+
+        def peak_for(count):
+            sheet = SheetSpec(
+                title='Doanh Thu', heading='BÁO CÁO', headers=['Mã ĐH', 'Khách hàng', 'Ngày', 'Tổng tiền', 'Trạng thái', 'Thanh toán'],
+                widths=[20] * 6, rows=synthetic_order_rows(count),
+            )
+            with tempfile.TemporaryFile() as output:
+                tracemalloc.start()
+                write_workbook(output, [sheet])
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            return peak
+
+        peak_for(200)  # nạp module / cache của openpyxl
+        small = peak_for(1500)
+        large = peak_for(9000)
+        # Gấp 6 lần số dòng nhưng bộ nhớ đỉnh gần như không đổi
+        self.assertLess(large, small * 1.5 + 256 * 1024)
+
+
+class ReportJobTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.storage_dir.cleanup)
+        self.settings_override = self.settings(REPORT_JOBS_RUN_INLINE=True, REPORT_STORAGE_ROOT=self.storage_dir.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@example.com', password='testpass123', role='admin'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.order = self.create_order(self.admin, [self.create_product('Gau Teddy')], status='delivered')
+
+    def submit(self, **data):
+        payload = {'report_type': 'revenue', 'start_date': '2000-01-01', 'format': 'xlsx'}
+        payload.update(data)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/orders/submit_report/', payload, format='json')
+
+    def test_job_runs_and_result_is_reused_until_data_changes(self):
+        from .models import ReportJob
+
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+
+        status_body = self.client.get('/api/orders/report_status/', {'job_id': job_id}).json()
+        self.assertEqual(status_body['status'], 'done')
+        download = self.client.get(status_body['download_url'])
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'PK'))
+
+        # Cùng spec, dữ liệu chưa đổi: dùng lại kết quả
+        response = self.submit()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['job_id'], job_id)
+
+        # Đơn hàng thay đổi -> watermark mới -> job mới; job cũ vẫn tải được trong thời hạn
+        self.order.status = 'cancelled'
+        self.order.save()
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        new_job_id = response.json()['job_id']
+        self.assertNotEqual(new_job_id, job_id)
+        self.assertEqual(self.client.get(status_body['download_url']).status_code, 200)
+
+        # Catalog thay đổi (giá / tên trong báo cáo) cũng đổi watermark
+        self.order.items.first().product.save()
+        self.assertNotEqual(self.submit().json()['job_id'], new_job_id)
+
+        # Quá REPORT_JOB_TIMEOUT_SECONDS sau khi có kết quả mới thì job cũ bị dọn
+        ReportJob.objects.update(finished_at=timezone.now() - timedelta(hours=1))
+        out = StringIO()
+        with self.settings(REPORT_JOB_TIMEOUT_SECONDS=60):
+            call_command('purge_report_jobs', stdout=out)
+        self.assertIn('Deleted 2 superseded report jobs', out.getvalue())
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    def test_pdf_job_and_validation(self):
+        response = self.submit(format='pdf', report_type='products')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+        job_id = response.json()['job_id']
+        download = self.client.get('/api/orders/download_report/', {'job_id': job_id})
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'%PDF'))
+
+        self.assertEqual(self.submit(format='docx').status_code, 400)
+        self.assertEqual(self.submit(report_type='khac').status_code, 400)
+        self.assertEqual(self.client.get('/api/orders/report_status/', {'job_id': 999}).status_code, 404)
+
+
+class OrderFieldTrackerTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.product = self.create_product('Gau Teddy')
+        self.order = self.create_order(self.user, [self.product])
+
+    def test_tracks_changes_from_loaded_values(self):
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.dirty_fields, {})
+
+        order.status = 'confirmed'
+        order.payment_status = 'completed'
+        self.assertTrue(order.has_changed('status'))
+        self.assertFalse(order.has_changed('refund_status'))
+        self.assertEqual(order.dirty_fields, {'status': 'pending', 'payment_status': 'pending'})
+
+        order.save(update_fields=['status'])
+        self.assertEqual(order.previous('status'), 'confirmed')
+        # payment_status chưa được lưu nên vẫn là thay đổi chưa ghi
+        self.assertEqual(order.dirty_fields, {'payment_status': 'pending'})
+
+    def test_save_does_not_reselect_order(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'confirmed'
+        with self.assertNumQueries(1):  # chỉ UPDATE, không SELECT trạng thái cũ
+            order.save()
+
+    def test_delivered_transition_counts_once(self):
+        order = Order.objects.get(pk=self.order.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'delivered'
+            order.save()
+            order.note = 'Giao lai lan 2'
+            order.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_count, 1)
+
+
+class SoldCountTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.bear = self.create_product('Gau Teddy')
+        self.bunny = self.create_product('Tho Bong')
+        self.order = self.create_order(self.user, [self.bear, self.bunny], status='shipping')
+        OrderItem.objects.create(order=self.order, product=self.bear, product_name=self.bear.name,
+                                 product_price=self.bear.price, quantity=2, unit='cai')
+
+    def sold_counts(self):
+        return dict(Product.objects.filter(pk__in=[self.bear.pk, self.bunny.pk]).values_list('pk', 'sold_count'))
+
+    def test_delivery_updates_all_products_in_one_statement(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'delivered'
+        # UPDATE đơn + SELECT gom số lượng + một UPDATE ... CASE cho mọi sản phẩm
+        with self.assertNumQueries(3):
+            order.save()
+        self.assertEqual(self.sold_counts(), {self.bear.pk: 3, self.bunny.pk: 1})
+
+    def test_refund_and_cancel_reverse_delivered_order(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'delivered'
+        order.save()
+
+        order.refund_status = 'refunded'
+        order.save(update_fields=['refund_status'])
+        self.assertEqual(self.sold_counts(), {self.bear.pk: 0, self.bunny.pk: 0})
+
+        # Hủy một đơn đã hoàn tiền không trừ thêm lần nữa
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.sold_counts(), {self.bear.pk: 0, self.bunny.pk: 0})
+
+    def test_decrement_never_goes_below_zero(self):
+        Order.objects.filter(pk=self.order.pk).update(status='delivered')
+        order = Order.objects.get(pk=self.order.pk)
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.sold_counts(), {self.bear.pk: 0, self.bunny.pk: 0})
+
+    def test_recalculate_command_rebuilds_counts(self):
+        refunded = self.create_order(self.user, [self.bunny], status='delivered')
+        Order.objects.filter(pk__in=[self.order.pk, refunded.pk]).update(status='delivered')
+        Order.objects.filter(pk=refunded.pk).update(refund_status='refunded')
+        Product.objects.filter(pk=self.bunny.pk).update(sold_count=99)
+
+        out = StringIO()
+        call_command('recalculate_sold_counts', '--chunk-size', '1', stdout=out)
+
+        self.assertEqual(self.sold_counts(), {self.bear.pk: 3, self.bunny.pk: 1})
+        self.assertIn('Recalculated sold_count', out.getvalue())
+
+
+class StockReservationTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.product = self.create_product('Gau Teddy', stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_online_order(self, quantity=2):
+        payload = {
+            'full_name': 'Nguyen Van A', 'phone': '0900000000', 'email': 'buyer@example.com',
+            'address': '1 Le Loi', 'city': 'HCM', 'district': 'Q1', 'payment_method': 'banking',
+            'items': [{'id': str(self.product.id), 'quantity': str(quantity), 'price': '100000'}],
+        }
+        payos_response = {'code': '00', 'data': {'checkoutUrl': 'https://pay.example/x', 'orderCode': 1}}
+        with mock.patch('orders.views.PayOSPayment.create_payment_link', return_value=payos_response):
+            response = self.client.post('/api/orders/create_order/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data['id'])
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+    def test_online_order_holds_stock_until_paid(self):
+        order = self.place_online_order()
+        reservation = StockReservation.objects.get(order=order)
+        self.assertEqual((reservation.status, reservation.quantity), ('active', 2))
+        self.assertEqual(self.stock(), 3)
+
+        order.payment_status = 'completed'
+        order.save(update_fields=['payment_status'])
+
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'converted')
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(
+            list(InventoryMovement.objects.values_list('kind', 'quantity')),
+            [('reserve', -2), ('release', 2), ('sale', -2)],
+        )
+
+    def test_sweeper_releases_only_expired_reservations_in_batches(self):
+        expired = [self.place_online_order(1), self.place_online_order(1)]
+        fresh = self.place_online_order(1)
+        StockReservation.objects.filter(order__in=expired).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.stock(), 2)
+
+        result = release_expired_reservations(batch_size=1)
+
+        self.assertEqual(result, {'released': 2, 'cancelled': 2})
+        self.assertEqual(self.stock(), 4)
+        self.assertEqual(set(Order.objects.filter(status='cancelled')), set(expired))
+        self.assertEqual(StockReservation.objects.get(order=fresh).status, 'active')
+        self.assertEqual(release_expired_reservations(), {'released': 0, 'cancelled': 0})
+
+    def test_late_payment_after_expiry_requests_refund(self):
+        order = self.place_online_order()
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        release_expired_reservations()
+
+        order = Order.objects.get(pk=order.pk)
+        cancelled_at = order.updated_at
+        order.payment_status = 'completed'
+        with mock.patch('backend.response_cache.invalidate_tags') as invalidate:
+            order.save(update_fields=['payment_status'])
+
+        # Yêu cầu hoàn tiền là một lần lưu riêng: updated_at (ETag / watermark) và cache 'order' đều đổi
+        self.assertEqual(invalidate.call_count, 2)
+        self.assertEqual(order.refund_status, 'requested')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.refund_status), ('cancelled', 'requested'))
+        self.assertGreater(order.updated_at, cancelled_at)
+        self.assertEqual(self.stock(), 5)
+
+    def test_customer_cancel_releases_reservation_once(self):
+        order = self.place_online_order()
+        response = self.client.post('/api/orders/cancel_order/', {'order_id': order.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), 5)
+        self.assertEqual(StockReservation.objects.get(order=order).status, 'released')
+
+        self.assertEqual(release_expired_reservations(now=timezone.now() + timedelta(days=1))['released'], 0)
+        self.assertEqual(self.stock(), 5)
+
+
+class PaymentEventInboxTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.product = self.create_product('Gau Teddy')
+        self.order = self.create_order(self.user, [self.product], payment_method='momo', momo_order_id='')
+        self.order.momo_order_id = f'{self.order.id}-abc123'
+        self.order.save(update_fields=['momo_order_id'])
+        self.client = APIClient()
+
+    def momo_ipn(self, result_code, trans_id):
+        return {'orderId': self.order.momo_order_id, 'requestId': 'req-1', 'resultCode': result_code,
+                'transId': trans_id, 'signature': 'sig'}
+
+    def post_momo(self, payload):
+        with mock.patch('orders.views.MoMoPayment.verify_signature', return_value=True):
+            return self.client.post('/api/orders/momo-callback/', payload, format='json')
+
+    def test_callback_only_records_event_and_dedupes(self):
+        response = self.post_momo(self.momo_ipn(0, 555))
+        self.assertEqual(response.status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+
+        # Cổng gửi lại: chỉ một câu INSERT bị bỏ qua do trùng khóa
+        with self.assertNumQueries(1):
+            response = self.post_momo(self.momo_ipn(0, 555))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+
+        self.assertEqual(process_payment_events(), {'processed': 1, 'failed': 0})
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.momo_transaction_id), ('completed', '555'))
+        self.assertEqual(PaymentEvent.objects.get().order, self.order)
+
+    def test_late_failure_does_not_override_completed_payment(self):
+        self.post_momo(self.momo_ipn(0, 555))
+        self.post_momo(self.momo_ipn(1006, 0))
+        with mock.patch('orders.views.PayOSPayment.verify_webhook_signature', return_value=True):
+            self.client.post('/api/orders/payos-webhook/', {
+                'success': True, 'signature': 'sig', 'data': {'orderCode': 999999, 'code': '00', 'reference': 'R1'},
+            }, format='json')
+
+        self.assertEqual(process_payment_events(batch_size=2), {'processed': 2, 'failed': 1})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertEqual(PaymentEvent.objects.get(provider='payos').error, 'Order not found')
+
+    def test_transient_save_error_keeps_event_pending_for_retry(self):
+        self.post_momo(self.momo_ipn(0, 555))
+        with mock.patch.object(Order, 'save', side_effect=RuntimeError('deadlock')):
+            self.assertEqual(process_payment_events(), {'processed': 0, 'failed': 0})
+
+        event = PaymentEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.error), ('pending', 1, 'deadlock'))
+        # Chưa đến hạn thử lại
+        self.assertEqual(process_payment_events(), {'processed': 0, 'failed': 0})
+
+        PaymentEvent.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(process_payment_events(), {'processed': 1, 'failed': 0})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+
+    def test_event_fails_after_max_attempts(self):
+        self.post_momo(self.momo_ipn(0, 555))
+        PaymentEvent.objects.update(attempts=2)
+        with self.settings(PAYMENT_EVENT_MAX_ATTEMPTS=3), \
+                mock.patch.object(Order, 'save', side_effect=RuntimeError('deadlock')):
+            self.assertEqual(process_payment_events(), {'processed': 0, 'failed': 1})
+        self.assertEqual(PaymentEvent.objects.get().status, 'failed')
+
+    def test_inline_mode_applies_after_commit(self):
+        with self.settings(PAYMENT_EVENTS_RUN_INLINE=True), self.captureOnCommitCallbacks(execute=True):
+            self.post_momo(self.momo_ipn(1006, 0))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'failed')
+
+
+class PaymentReconcilerTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.product = self.create_product('Gau Teddy')
+        self.order = self.create_order(self.user, [self.product], payment_method='banking')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def make_due(self):
+        PaymentCheck.objects.update(next_check_at=timezone.now() - timedelta(seconds=1))
+
+    def test_status_poll_reads_local_state_only(self):
+        with mock.patch('orders.payment_reconciler.PayOSPayment.get_payment_link_info') as gateway:
+            first = self.client.get(f'/api/orders/payos-status/{self.order.id}/')
+            with self.assertNumQueries(0):
+                second = self.client.get(f'/api/orders/payos-status/{self.order.id}/')
+        gateway.assert_not_called()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(first.data['payos_status'], {})
+        self.assertTrue(PaymentCheck.objects.filter(order=self.order).exists())
+
+    def test_reconciler_backs_off_then_applies_paid(self):
+        self.client.get(f'/api/orders/payos-status/{self.order.id}/')
+        self.make_due()
+        pending = {'code': '00', 'data': {'status': 'PENDING'}}
+        with mock.patch('orders.payment_reconciler.PayOSPayment.get_payment_link_info', return_value=pending):
+            self.assertEqual(reconcile_payments()['checked'], 1)
+            # Chưa đến hạn lần sau -> không gọi cổng lại
+            self.assertEqual(reconcile_payments()['checked'], 0)
+        check = PaymentCheck.objects.get()
+        self.assertEqual((check.attempts, check.last_result), (1, pending))
+        self.assertGreater(check.next_check_at, timezone.now())
+
+        self.make_due()
+        paid = {'code': '00', 'data': {'status': 'PAID'}}
+        with mock.patch('orders.payment_reconciler.PayOSPayment.get_payment_link_info', return_value=paid):
+            self.assertEqual(reconcile_payments()['completed'], 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertFalse(PaymentCheck.objects.exists())
+
+        # Cache trạng thái bị xóa khi thanh toán xong
+        response = self.client.get(f'/api/orders/payos-status/{self.order.id}/')
+        self.assertEqual(response.data['order']['payment_status'], 'completed')
+
+    def test_settled_orders_are_dropped_without_gateway_call(self):
+        PaymentCheck.objects.create(order=self.order, next_check_at=timezone.now())
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        with mock.patch('orders.payment_reconciler.PayOSPayment.get_payment_link_info') as gateway:
+            self.assertEqual(reconcile_payments()['dropped'], 1)
+        gateway.assert_not_called()
+        self.assertFalse(PaymentCheck.objects.exists())
+
+
+class IdempotencyKeyTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.product = self.create_product('Gau Teddy', stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def place_order(self, key, quantity=1):
+        return self.client.post('/api/orders/create_order/', {
+            'full_name': 'Nguyen Van A', 'phone': '0900000001', 'email': 'buyer@example.com',
+            'address': '1 Le Loi', 'city': 'HCM', 'district': 'Q1', 'payment_method': 'cod',
+            'items': [{'id': str(self.product.id), 'quantity': str(quantity), 'price': '100000'}],
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_stored_response(self):
+        first = self.place_order('key-1')
+        second = self.place_order('key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((second.status_code, second.data), (201, first.data))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+
+        self.assertEqual(self.place_order('key-1', quantity=2).status_code, 422)
+        self.assertEqual(self.place_order('key-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_gateway_error_after_order_commit_is_replayed(self):
+        payload = {
+            'full_name': 'Nguyen Van A', 'phone': '0900000001', 'email': 'buyer@example.com',
+            'address': '1 Le Loi', 'city': 'HCM', 'district': 'Q1', 'payment_method': 'momo',
+            'items': [{'id': str(self.product.id), 'quantity': '1', 'price': '100000'}],
+        }
+        with mock.patch('orders.views.MoMoPayment.create_payment', side_effect=RuntimeError('timeout')) as gateway:
+            first = self.client.post('/api/orders/create_order/', payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+            second = self.client.post('/api/orders/create_order/', payload, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(first.status_code, 500)
+        self.assertEqual((second.status_code, second.data), (500, first.data))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(gateway.call_count, 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(StockReservation.objects.filter(status='active').count(), 1)
+        self.assertEqual(self.product.inventory_movements.filter(quantity__lt=0).count(), 1)
+
+    def test_duplicate_of_in_flight_request_gets_conflict(self):
+        IdempotencyKey.objects.create(
+            owner=f'user:{self.user.id}', scope='orders.create_order', key='key-1',
+            fingerprint='', expires_at=timezone.now() + timedelta(hours=1),
+        )
+        with mock.patch('orders.idempotency._fingerprint', return_value=''), self.settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            response = self.place_order('key-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+
+    def test_abandoned_in_flight_key_is_taken_over_after_lease(self):
+        # Worker chết khi đang xử lý: dòng in_progress không bao giờ được xóa
+        record = IdempotencyKey.objects.create(
+            owner=f'user:{self.user.id}', scope='orders.create_order', key='key-1',
+            fingerprint='', expires_at=timezone.now() + timedelta(seconds=30),
+        )
+        with mock.patch('orders.idempotency._fingerprint', return_value=''), self.settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(self.place_order('key-1').status_code, 409)
+
+            IdempotencyKey.objects.filter(pk=record.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+            response = self.place_order('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+        record.refresh_from_db()
+        self.assertEqual(record.status, 'completed')
+        self.assertGreater(record.expires_at, timezone.now() + timedelta(hours=1))
+
+    def test_expired_keys_are_reused_and_purged(self):
+        self.place_order('key-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.place_order('key-1').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+
+
+class CartTotalsTest(OrderTestMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.plain = self.create_product('Gau Teddy', price=100000, stock=10)
+        self.sized = self.create_product('Gau Panda', price=150000, stock=10)
+        ProductVariant.objects.create(product=self.sized, size='60cm', price=200000, stock=1)
+        ProductVariant.objects.create(product=self.sized, size='90cm', price=300000, stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, product, quantity, unit=''):
+        return self.client.post('/api/orders/cart/add_item/', {
+            'product_id': product.id, 'quantity': quantity, 'unit': unit,
+        }, format='json')
+
+    def test_totals_follow_add_update_remove(self):
+        self.add(self.plain, 2)
+        response = self.add(self.sized, 1, '90cm')
+        self.assertEqual((response.data['total_price'], response.data['total_quantity']), (500000, 3))
+
+        item = next(item for item in response.data['items'] if item['unit'] == '90cm')
+        response = self.client.post('/api/orders/cart/update_item/', {'item_id': item['id'], 'quantity': 3}, format='json')
+        self.assertEqual((response.data['total_price'], response.data['total_quantity']), (1100000, 5))
+
+        response = self.client.post('/api/orders/cart/remove_item/', {'item_id': item['id']}, format='json')
+        self.assertEqual((response.data['total_price'], response.data['total_quantity']), (200000, 2))
+
+        response = self.client.get('/api/orders/cart/my_cart/', {'summary': '1'})
+        self.assertEqual((response.data['total_price'], response.data['total_quantity']), (200000, 2))
+
+        self.client.post('/api/orders/cart/clear_cart/')
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.total_price, cart.total_quantity), (0, 0))
+
+    def test_clear_cart_recalculates_once_and_totals_use_item_prices(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.add(self.plain, 2)
+        self.add(self.sized, 1, '60cm')
+        self.add(self.sized, 1, '90cm')
+        cart = Cart.objects.get(user=self.user)
+
+        # Mục không có giá được chốt theo giá sản phẩm; đổi giá sau đó không làm lệch tổng
+        CartItem.objects.create(cart=cart, product=self.create_product('Gau Moi', price=50000), quantity=1)
+        Product.objects.filter(pk=self.plain.pk).update(price=999000)
+        Cart.recalculate_totals(cart.id)
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_price, cart.total_quantity), (750000, 5))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/orders/cart/clear_cart/')
+        cart_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "orders_cart"')]
+        self.assertEqual(len(cart_updates), 1)
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_price, cart.total_quantity), (0, 0))
+
+    def test_my_cart_query_count_does_not_grow_with_items(self):
+        # giỏ + mục (kèm sản phẩm) + biến thể + tổng shard tồn kho
+        self.add(self.plain, 1)
+        with self.assertNumQueries(4):
+            self.client.get('/api/orders/cart/my_cart/')
+
+        self.add(self.sized, 1, '60cm')
+        self.add(self.sized, 1, '90cm')
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/orders/cart/my_cart/')
+        stock = {item['unit']: (item['available_stock'], item['is_available']) for item in response.data['items']}
+        self.assertEqual(stock, {'': (10, True), '60cm': (1, True), '90cm': (5, True)})
+
+    def test_sync_merges_local_cart_in_one_request(self):
+        self.add(self.plain, 2)
+        other = self.create_product('Gau Ngung', stock=0)
+        response = self.client.post('/api/orders/cart/sync_items/', {'items': [
+            {'product_id': self.plain.id, 'quantity': 3, 'unit': ''},
+            {'product_id': self.sized.id, 'quantity': 1, 'unit': '90cm'},
+            {'product_id': self.sized.id, 'quantity': 2, 'unit': '90cm'},
+            {'product_id': self.sized.id, 'quantity': 4, 'unit': '60cm'},
+            {'product_id': self.sized.id, 'quantity': 1, 'unit': '120cm'},
+            {'product_id': other.id, 'quantity': 1, 'unit': ''},
+            {'product_id': 999999, 'quantity': 1, 'unit': ''},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        quantities = {item['unit'] or item['product_name']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {'Gau Teddy': 5, '90cm': 3, '60cm': 1})
+        self.assertEqual(response.data['adjusted'], [{'product_id': self.sized.id, 'unit': '60cm', 'requested': 4, 'quantity': 1}])
+        self.assertEqual(
+            sorted(item['reason'] for item in response.data['skipped']),
+            ['invalid_size', 'not_found', 'out_of_stock'],
+        )
+        self.assertEqual((response.data['total_price'], response.data['total_quantity']), (1600000, 9))
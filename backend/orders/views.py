@@ -5,19 +5,89 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Sum, Count, F, DecimalField, ExpressionWrapper
+from django.db import connection, transaction
+from django.db.models import Q, Sum, Count, Max, F, DecimalField, ExpressionWrapper, Prefetch
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from uuid import uuid4
 from decimal import Decimal
 from datetime import datetime, date, time, timedelta
-from .models import Order, OrderItem, Cart, CartItem
-from .serializers import OrderSerializer, OrderCreateSerializer, CartSerializer, CartItemDetailSerializer
+from .models import Order, OrderItem, Cart, CartItem, ReportJob
+from .serializers import (
+    OrderSerializer, OrderSummarySerializer, OrderCreateSerializer, CartSerializer, CartItemDetailSerializer,
+    ReportJobSerializer,
+)
+from .pagination import InvalidCursor, OrderKeysetPagination
+from .idempotency import idempotent, mark_committed
+from .signals import deferred_cart_totals
+from .payment_events import momo_event_key, payos_event_key, record_payment_event
+from .payment_reconciler import schedule_payment_check
+from .reservations import ONLINE_PAYMENT_METHODS, release_order_reservations, reserve_order_stock
+from backend.response_cache import cached_response
 from products.models import Product, ProductVariant
+from products.inventory import (
+    InsufficientStock, apply_movements, available_stock, movement as inventory_movement, overlay_sharded_stock,
+)
 from .payment_utils import MoMoPayment, PayOSPayment
+import hashlib
 import logging
+import os
 import json
+import re
 
 logger = logging.getLogger(__name__)
 
+ORDER_CODE_PATTERN = re.compile(r'^DH\d+$', re.IGNORECASE)
+
+
+def _my_orders_etag(request, orders) -> str:
+    """ETag cho danh sách đơn của user: đổi khi có đơn mới / đơn được cập nhật / tham số khác"""
+    state = orders.aggregate(latest=Max('updated_at'), count=Count('id'))
+    params = sorted(request.query_params.items())
+    raw = f"{request.user.pk}:{state['latest'] and state['latest'].isoformat()}:{state['count']}:{params}"
+    return quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+def _with_private_etag(response, etag: str):
+    """Gắn ETag, buộc trình duyệt revalidate (If-None-Match) thay vì dùng cache cũ"""
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _order_search_filter(search_query: str) -> Q:
+    """
+    Chọn cột tìm kiếm theo dạng từ khóa để dùng được index thay vì
+    icontains trên cả 4 cột: mã đơn / số điện thoại / email tìm theo tiền tố.
+    """
+    if ORDER_CODE_PATTERN.match(search_query):
+        return Q(order_code__istartswith=search_query)
+    if search_query.isdigit():
+        return Q(phone__startswith=search_query)
+    if '@' in search_query:
+        return Q(email__istartswith=search_query)
+    return Q(full_name__icontains=search_query)
+
+
+# Mục giỏ + sản phẩm + toàn bộ biến thể của các sản phẩm đó: 3 query cho cả giỏ,
+# CartItemDetailSerializer chọn biến thể theo size trong bộ nhớ
+CART_ITEMS_PREFETCH = Prefetch(
+    'items',
+    queryset=CartItem.objects.select_related('product').prefetch_related('product__variants').order_by('id'),
+)
+
+
+def _cart_data(request, cart_id):
+    """Serialize giỏ hàng sau khi thay đổi (đọc lại tổng đã được cập nhật)"""
+    cart = Cart.objects.prefetch_related(CART_ITEMS_PREFETCH).get(pk=cart_id)
+    return _serialize_cart(request, cart)
+
+
+def _serialize_cart(request, cart):
+    # Tồn kho hiển thị: tổng shard cho hàng đang bật shard (cột stock có thể chưa được rebalance)
+    overlay_sharded_stock(item.product for item in cart.items.all())
+    return CartSerializer(cart, context={'request': request}).data
+
 
 class CartViewSet(viewsets.ViewSet):
     """ViewSet cho giỏ hàng"""
@@ -32,7 +102,12 @@ class CartViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def my_cart(self, request):
-        """Lấy giỏ hàng của user hiện tại"""
+        """
+        Lấy giỏ hàng của user hiện tại
+
+        Query params:
+            summary=1: chỉ trả tổng tiền / tổng số lượng (badge mini-cart), một query
+        """
         try:
             # Nếu user là anonymous, trả về cart trống
             if not request.user.is_authenticated:
@@ -43,10 +118,15 @@ class CartViewSet(viewsets.ViewSet):
                     'total_price': 0,
                     'total_quantity': 0
                 }, status=status.HTTP_200_OK)
-            
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data)
+
+            if request.query_params.get('summary') in ('1', 'true'):
+                totals = Cart.objects.filter(user=request.user).values('id', 'total_price', 'total_quantity').first()
+                return Response(totals or {'id': None, 'total_price': 0, 'total_quantity': 0})
+
+            cart = Cart.objects.prefetch_related(CART_ITEMS_PREFETCH).filter(user=request.user).first()
+            if cart is None:
+                cart = Cart.objects.create(user=request.user)
+            return Response(_serialize_cart(request, cart))
         except Exception as e:
             logger.error(f"Error getting cart: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -79,18 +159,15 @@ class CartViewSet(viewsets.ViewSet):
                         {'error': f'Kích thước {unit} không tồn tại'},
                         status=status.HTTP_400_BAD_REQUEST
                     )
-                if variant.stock < quantity:
-                    return Response(
-                        {'error': f'Số lượng tồn kho không đủ. Tồn kho: {variant.stock}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                stock = available_stock(product.id, unit, variant.stock)
             else:
-                # Kiểm tra số lượng tồn kho từ product.stock
-                if product.stock < quantity:
-                    return Response(
-                        {'error': f'Số lượng tồn kho không đủ. Tồn kho: {product.stock}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                # Tồn kho của sản phẩm (tổng shard nếu đang bật shard)
+                stock = available_stock(product.id, fallback=product.stock)
+            if stock < quantity:
+                return Response(
+                    {'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             # Lấy hoặc tạo giỏ hàng
             cart, created = Cart.objects.get_or_create(user=request.user)
@@ -102,39 +179,32 @@ class CartViewSet(viewsets.ViewSet):
                 if variant:
                     item_price = variant.price
             
-            # Thêm hoặc cập nhật sản phẩm trong giỏ hàng
-            cart_item, item_created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                unit=unit,
-                defaults={'quantity': quantity, 'price': item_price}
-            )
-            
-            if not item_created:
-                # Nếu sản phẩm đã có trong giỏ, cập nhật số lượng
-                new_quantity = cart_item.quantity + quantity
+            # Thêm hoặc cập nhật sản phẩm trong giỏ hàng; mục và tổng giỏ
+            # (signal refresh_cart_totals) được ghi trong cùng transaction
+            with transaction.atomic():
+                cart_item, item_created = CartItem.objects.select_for_update().get_or_create(
+                    cart=cart,
+                    product=product,
+                    unit=unit,
+                    defaults={'quantity': quantity, 'price': item_price}
+                )
                 
-                # Kiểm tra stock của variant mới
-                if unit and product.variants.exists():
-                    variant = product.variants.filter(size=unit).first()
-                    if variant and variant.stock < new_quantity:
-                        return Response(
-                            {'error': f'Số lượng tồn kho không đủ. Tồn kho: {variant.stock}'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                else:
-                    if product.stock < new_quantity:
+                if not item_created:
+                    # Nếu sản phẩm đã có trong giỏ, cập nhật số lượng
+                    new_quantity = cart_item.quantity + quantity
+                    
+                    # Kiểm tra tồn kho cho tổng số lượng mới
+                    if stock < new_quantity:
                         return Response(
-                            {'error': f'Số lượng tồn kho không đủ. Tồn kho: {product.stock}'},
+                            {'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}'},
                             status=status.HTTP_400_BAD_REQUEST
                         )
-                
-                cart_item.quantity = new_quantity
-                cart_item.save()
+                    
+                    cart_item.quantity = new_quantity
+                    cart_item.save(update_fields=['quantity', 'updated_at'])
             
             # Trả về giỏ hàng được cập nhật
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(_cart_data(request, cart.id), status=status.HTTP_200_OK)
         
         except ValueError as e:
             return Response({'error': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
@@ -161,26 +231,31 @@ class CartViewSet(viewsets.ViewSet):
             except Cart.DoesNotExist:
                 return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
             
-            # Lấy mục trong giỏ hàng
-            try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            except CartItem.DoesNotExist:
-                return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
-            
-            # Kiểm tra số lượng tồn kho
-            if cart_item.product.stock < quantity:
-                return Response(
-                    {'error': f'Số lượng tồn kho không đủ. Tồn kho: {cart_item.product.stock}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Cập nhật số lượng
-            cart_item.quantity = quantity
-            cart_item.save()
+            with transaction.atomic():
+                # Lấy mục trong giỏ hàng
+                try:
+                    cart_item = CartItem.objects.select_related('product').select_for_update().get(id=item_id, cart=cart)
+                except CartItem.DoesNotExist:
+                    return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
+                
+                # Kiểm tra số lượng tồn kho (của biến thể nếu mục có kích thước)
+                variant = cart_item.product.variants.filter(size=cart_item.unit).first() if cart_item.unit else None
+                if variant:
+                    stock = available_stock(cart_item.product_id, variant.size, variant.stock)
+                else:
+                    stock = available_stock(cart_item.product_id, fallback=cart_item.product.stock)
+                if stock < quantity:
+                    return Response(
+                        {'error': f'Số lượng tồn kho không đủ. Tồn kho: {stock}'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                # Cập nhật số lượng (tổng giỏ cập nhật trong cùng transaction)
+                cart_item.quantity = quantity
+                cart_item.save(update_fields=['quantity', 'updated_at'])
             
             # Trả về giỏ hàng được cập nhật
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(_cart_data(request, cart.id), status=status.HTTP_200_OK)
         
         except ValueError as e:
             return Response({'error': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
@@ -203,21 +278,121 @@ class CartViewSet(viewsets.ViewSet):
             except Cart.DoesNotExist:
                 return Response({'error': 'Cart not found'}, status=status.HTTP_404_NOT_FOUND)
             
-            # Xóa mục trong giỏ hàng
+            # Xóa mục trong giỏ hàng (tổng giỏ cập nhật trong cùng transaction)
             try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-                cart_item.delete()
+                with transaction.atomic():
+                    CartItem.objects.get(id=item_id, cart=cart).delete()
             except CartItem.DoesNotExist:
                 return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
             
             # Trả về giỏ hàng được cập nhật
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(_cart_data(request, cart.id), status=status.HTTP_200_OK)
         
         except Exception as e:
             logger.error(f"Error removing cart item: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
+    @action(detail=False, methods=['post'])
+    def sync_items(self, request):
+        """
+        Gộp giỏ hàng local (localStorage của khách chưa đăng nhập) vào giỏ trên server
+
+        Body:
+            items: [{product_id, quantity, unit}]
+            mode: 'merge' (mặc định, cộng dồn số lượng) | 'replace' (ghi đè số lượng)
+
+        Thay cho N lần gọi add_item sau khi đăng nhập: sản phẩm + biến thể được
+        kiểm tra một lượt, các mục được upsert bằng một câu bulk_create.
+        Mục không hợp lệ bị bỏ qua (skipped), số lượng vượt tồn kho bị giảm về
+        mức tồn (adjusted).
+        """
+        items = request.data.get('items')
+        mode = request.data.get('mode', 'merge')
+        if not isinstance(items, list):
+            return Response({'error': 'items must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        if mode not in ('merge', 'replace'):
+            return Response({'error': "mode must be 'merge' or 'replace'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Gộp các dòng trùng (product, unit) trong payload
+        wanted = {}
+        skipped = []
+        for entry in items:
+            try:
+                product_id = int(entry.get('product_id'))
+                quantity = int(entry.get('quantity', 1))
+            except (AttributeError, TypeError, ValueError):
+                skipped.append({'item': entry, 'reason': 'invalid'})
+                continue
+            if quantity <= 0:
+                skipped.append({'item': entry, 'reason': 'invalid'})
+                continue
+            key = (product_id, str(entry.get('unit') or ''))
+            wanted[key] = wanted.get(key, 0) + quantity
+
+        try:
+            products = Product.objects.filter(
+                id__in={product_id for product_id, _ in wanted}, status='active'
+            ).prefetch_related('variants').in_bulk()
+            overlay_sharded_stock(products.values())
+
+            with transaction.atomic():
+                cart, _ = Cart.objects.get_or_create(user=request.user)
+                existing = {}
+                if mode == 'merge':
+                    existing = {
+                        (product_id, unit): quantity
+                        for product_id, unit, quantity in CartItem.objects.filter(cart=cart)
+                        .select_for_update().values_list('product_id', 'unit', 'quantity')
+                    }
+
+                upserts = []
+                adjusted = []
+                for (product_id, unit), quantity in wanted.items():
+                    product = products.get(product_id)
+                    if product is None:
+                        skipped.append({'product_id': product_id, 'unit': unit, 'reason': 'not_found'})
+                        continue
+                    variants = list(product.variants.all()) if unit else []
+                    if variants:
+                        variant = next((v for v in variants if v.size == unit), None)
+                        if variant is None:
+                            skipped.append({'product_id': product_id, 'unit': unit, 'reason': 'invalid_size'})
+                            continue
+                        stock, price = variant.stock, variant.price
+                    else:
+                        stock, price = product.stock, product.price
+
+                    if stock <= 0:
+                        skipped.append({'product_id': product_id, 'unit': unit, 'reason': 'out_of_stock'})
+                        continue
+                    total = existing.get((product_id, unit), 0) + quantity
+                    if total > stock:
+                        adjusted.append({'product_id': product_id, 'unit': unit, 'requested': total, 'quantity': stock})
+                        total = stock
+                    upserts.append(CartItem(cart=cart, product=product, unit=unit, quantity=total, price=price))
+
+                if upserts:
+                    conflict_target = {}
+                    if connection.features.supports_update_conflicts_with_target:
+                        # MySQL (ON DUPLICATE KEY UPDATE) không nhận unique_fields
+                        conflict_target['unique_fields'] = ['cart', 'product', 'unit']
+                    CartItem.objects.bulk_create(
+                        upserts,
+                        update_conflicts=True,
+                        update_fields=['quantity', 'price', 'updated_at'],
+                        **conflict_target,
+                    )
+                # bulk_create không phát post_save: tính lại tổng giỏ một lần
+                Cart.recalculate_totals(cart.id)
+
+            data = _cart_data(request, cart.id)
+            data.update({'skipped': skipped, 'adjusted': adjusted})
+            return Response(data, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.error(f"Error syncing cart: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=False, methods=['post'])
     def clear_cart(self, request):
         """Xóa tất cả sản phẩm khỏi giỏ hàng"""
@@ -225,14 +400,15 @@ class CartViewSet(viewsets.ViewSet):
             # Lấy giỏ hàng của user
             try:
                 cart = Cart.objects.get(user=request.user)
-                cart.items.all().delete()
+                # Một lần tính lại tổng giỏ cho cả N mục bị xóa
+                with transaction.atomic(), deferred_cart_totals():
+                    cart.items.all().delete()
             except Cart.DoesNotExist:
                 pass
             
             # Tạo giỏ hàng mới rỗng
             cart, created = Cart.objects.get_or_create(user=request.user)
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(_cart_data(request, cart.id), status=status.HTTP_200_OK)
         
         except Exception as e:
             logger.error(f"Error clearing cart: {str(e)}")
@@ -244,10 +420,45 @@ class OrderViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def my_orders(self, request):
-        """Lấy đơn hàng của user hiện tại"""
+        """
+        Lấy đơn hàng của user hiện tại
+
+        Query params:
+            summary=1: chỉ trả thông tin đơn (không kèm items), có items_count
+            cursor, page_size: bật phân trang keyset, trả {results, next_cursor, has_more}
+
+        Có ETag theo updated_at mới nhất + số đơn của user: trang lịch sử đơn
+        poll lại sẽ nhận 304 mà không cần serialize.
+        """
         orders = Order.objects.filter(user=request.user)
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+
+        etag = _my_orders_etag(request, orders)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            return _with_private_etag(response, etag)
+
+        summary = request.query_params.get('summary') in ('1', 'true')
+        if summary:
+            orders = orders.annotate(items_count=Count('items'))
+            serializer_class = OrderSummarySerializer
+        else:
+            orders = orders.prefetch_related('items')
+            serializer_class = OrderSerializer
+
+        if 'cursor' in request.query_params or 'page_size' in request.query_params:
+            paginator = OrderKeysetPagination()
+            try:
+                page = paginator.paginate_queryset(orders, request)
+            except InvalidCursor:
+                return Response(
+                    {'error': 'Cursor không hợp lệ'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            data = paginator.get_paginated_data(serializer_class(page, many=True).data)
+        else:
+            data = serializer_class(orders.order_by('-created_at', '-id'), many=True).data
+
+        return _with_private_etag(Response(data), etag)
 
     @action(detail=False, methods=['post'])
     def cancel_order(self, request):
@@ -293,27 +504,37 @@ class OrderViewSet(viewsets.ViewSet):
                 order.refund_status = 'none'
                 if refund_note:
                     order.refund_note = refund_note
-            order.save()
             
-            # Hoàn trả tồn kho khi hủy đơn
-            for order_item in order.items.all():
-                product = order_item.product
-                if product:
+            # Đổi trạng thái và hoàn kho cùng một transaction
+            with transaction.atomic():
+                order.save()
+
+                # Đơn đang giữ hàng (chưa thanh toán online): chỉ cần trả lại hàng giữ
+                if release_order_reservations(order, note='Khách hủy đơn'):
+                    items = []
+                else:
+                    # Hoàn trả tồn kho khi hủy đơn (ghi sổ 'cancel', cộng bằng F())
+                    items = [item for item in order.items.all() if item.product_id]
+                variant_sizes = set(ProductVariant.objects.filter(
+                    product_id__in={item.product_id for item in items}
+                ).values_list('product_id', 'size'))
+                products_with_variants = {product_id for product_id, _ in variant_sizes}
+                movements = []
+                for order_item in items:
                     unit = order_item.unit
-                    quantity = order_item.quantity
-                    
-                    # Nếu có unit (variant), hoàn trả stock cho variant
-                    if unit and product.variants.exists():
-                        variant = product.variants.filter(size=unit).first()
-                        if variant:
-                            variant.stock += quantity
-                            variant.save()
-                            logger.info(f"Restored variant {variant.size} stock: +{quantity}")
+                    # Nếu có unit (variant), hoàn trả stock cho variant; không thì cho product
+                    if unit and order_item.product_id in products_with_variants:
+                        if (order_item.product_id, unit) not in variant_sizes:
+                            continue
+                        size = unit
                     else:
-                        # Hoàn trả stock cho product
-                        product.stock += quantity
-                        product.save()
-                        logger.info(f"Restored product {product.name} stock: +{quantity}")
+                        size = ''
+                    movements.append(inventory_movement(
+                        order_item.product_id, order_item.quantity, 'cancel', size=size, reference=order.order_code
+                    ))
+                if movements:
+                    apply_movements(movements)
+                    logger.info(f"Restored stock for cancelled order {order.order_code}: {len(movements)} lines")
             
             serializer = OrderSerializer(order)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -326,6 +547,7 @@ class OrderViewSet(viewsets.ViewSet):
             )
 
     @action(detail=False, methods=['post'])
+    @idempotent('orders.create_order')
     def create_order(self, request):
         """Tạo đơn hàng mới"""
         serializer = OrderCreateSerializer(data=request.data)
@@ -360,22 +582,26 @@ class OrderViewSet(viewsets.ViewSet):
                             product = Product.objects.get(id=product_id)
                         
                         # Validate stock trước khi tạo order
+                        stock_size = ''
                         if unit and product.variants.exists():
                             variant = product.variants.filter(size=unit).first()
+                            stock_size = unit
                             if not variant:
                                 return Response(
                                     {'error': f'Kích thước {unit} của sản phẩm {product.name} không tồn tại'},
                                     status=status.HTTP_400_BAD_REQUEST
                                 )
-                            if variant.stock < quantity:
+                            stock = available_stock(product.id, unit, variant.stock)
+                            if stock < quantity:
                                 return Response(
-                                    {'error': f'Sản phẩm {product.name} (Size {unit}) không đủ hàng. Còn lại: {variant.stock}'},
+                                    {'error': f'Sản phẩm {product.name} (Size {unit}) không đủ hàng. Còn lại: {stock}'},
                                     status=status.HTTP_400_BAD_REQUEST
                                 )
                         else:
-                            if product.stock < quantity:
+                            stock = available_stock(product.id, fallback=product.stock)
+                            if stock < quantity:
                                 return Response(
-                                    {'error': f'Sản phẩm {product.name} không đủ hàng. Còn lại: {product.stock}'},
+                                    {'error': f'Sản phẩm {product.name} không đủ hàng. Còn lại: {stock}'},
                                     status=status.HTTP_400_BAD_REQUEST
                                 )
                         
@@ -386,6 +612,7 @@ class OrderViewSet(viewsets.ViewSet):
                             'product_price': item_price,
                             'quantity': quantity,
                             'unit': unit or product.unit or '',
+                            'stock_size': stock_size,
                         })
                     except (ValueError, Product.DoesNotExist):
                         return Response(
@@ -397,60 +624,67 @@ class OrderViewSet(viewsets.ViewSet):
                 shipping_fee = Decimal(0) if subtotal >= Decimal(500000) else Decimal(30000)
                 total_amount = subtotal + shipping_fee
                 
-                # Tạo order
+                # Tạo order, order items và trừ tồn kho trong một transaction:
+                # thiếu hàng (bị request khác mua trước) thì không để lại đơn dở dang
                 payment_status = 'pending'
-                order = Order.objects.create(
-                    user=request.user,
-                    order_code='',  # Sẽ được cập nhật sau khi có ID
-                    status='pending',
-                    full_name=serializer.validated_data['full_name'],
-                    phone=serializer.validated_data['phone'],
-                    email=serializer.validated_data['email'],
-                    address=serializer.validated_data['address'],
-                    city=serializer.validated_data['city'],
-                    district=serializer.validated_data['district'],
-                    note=serializer.validated_data.get('note', ''),
-                    payment_method=serializer.validated_data['payment_method'],
-                    payment_status=payment_status,
-                    subtotal=subtotal,
-                    shipping_fee=shipping_fee,
-                    total_amount=total_amount,
-                )
-                
-                # Cập nhật order_code với format DH + 3 chữ số ID
-                order.order_code = f"DH{order.id:03d}"
-                order.save(update_fields=['order_code'])
-                
-                # Tạo order items và cập nhật stock
-                for item in order_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=item['product'],
-                        product_name=item['product_name'],
-                        product_price=item['product_price'],
-                        quantity=item['quantity'],
-                        unit=item['unit'],
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(
+                            user=request.user,
+                            order_code='',  # Sẽ được cập nhật sau khi có ID
+                            status='pending',
+                            full_name=serializer.validated_data['full_name'],
+                            phone=serializer.validated_data['phone'],
+                            email=serializer.validated_data['email'],
+                            address=serializer.validated_data['address'],
+                            city=serializer.validated_data['city'],
+                            district=serializer.validated_data['district'],
+                            note=serializer.validated_data.get('note', ''),
+                            payment_method=serializer.validated_data['payment_method'],
+                            payment_status=payment_status,
+                            subtotal=subtotal,
+                            shipping_fee=shipping_fee,
+                            total_amount=total_amount,
+                        )
+
+                        # Cập nhật order_code với format DH + 3 chữ số ID
+                        order.order_code = f"DH{order.id:03d}"
+                        order.save(update_fields=['order_code'])
+
+                        for item in order_items:
+                            OrderItem.objects.create(
+                                order=order,
+                                product=item['product'],
+                                product_name=item['product_name'],
+                                product_price=item['product_price'],
+                                quantity=item['quantity'],
+                                unit=item['unit'],
+                            )
+
+                        # Trừ tồn kho qua sổ cái (UPDATE stock = stock - n WHERE stock >= n).
+                        # Thanh toán online chỉ giữ hàng có thời hạn, chuyển thành bán khi thanh toán xong
+                        # Lưu ý: sold_count sẽ được cập nhật khi order được delivered, không phải lúc tạo
+                        if order.payment_method in ONLINE_PAYMENT_METHODS:
+                            reserve_order_stock(order, [
+                                {'product_id': item['product'].id, 'size': item['stock_size'], 'quantity': item['quantity']}
+                                for item in order_items
+                            ])
+                            schedule_payment_check(order)
+                        else:
+                            apply_movements([
+                                inventory_movement(item['product'].id, -item['quantity'], 'sale',
+                                                   size=item['stock_size'], reference=order.order_code)
+                                for item in order_items
+                            ], check_stock=True)
+                except InsufficientStock as e:
+                    product_name = next(
+                        (item['product_name'] for item in order_items if item['product'].id == e.product_id), ''
+                    )
+                    size_label = f' (Size {e.size})' if e.size else ''
+                    return Response(
+                        {'error': f'Sản phẩm {product_name}{size_label} không đủ hàng'},
+                        status=status.HTTP_400_BAD_REQUEST
                     )
-                    
-                    # Cập nhật tồn kho
-                    product = item['product']
-                    unit = item['unit']
-                    quantity = item['quantity']
-                    
-                    # Nếu có unit (variant), cập nhật stock của variant
-                    if unit and product.variants.exists():
-                        variant = product.variants.filter(size=unit).first()
-                        if variant:
-                            variant.stock -= quantity
-                            variant.save()
-                            logger.info(f"Updated variant {variant.size} stock: {variant.stock + quantity} -> {variant.stock}")
-                    else:
-                        # Cập nhật stock của product
-                        product.stock -= quantity
-                        product.save()
-                        logger.info(f"Updated product {product.name} stock: {product.stock + quantity} -> {product.stock}")
-                    
-                    # Lưu ý: sold_count sẽ được cập nhật khi order được delivered, không phải lúc tạo
                 
                 # Xử lý thanh toán MoMo
                 if order.payment_method == 'momo':
@@ -487,13 +721,14 @@ class OrderViewSet(viewsets.ViewSet):
                             )
                     except Exception as e:
                         logger.error(f"Error creating MoMo payment: {str(e)}")
-                        return Response(
+                        # Đơn và hàng giữ đã commit: retry cùng Idempotency-Key nhận lại phản hồi này
+                        return mark_committed(Response(
                             {
                                 'error': f'Lỗi kết nối MoMo: {str(e)}',
                                 'order': OrderSerializer(order).data
                             },
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
+                        ))
 
                 if order.payment_method == 'banking':
                     try:
@@ -535,13 +770,13 @@ class OrderViewSet(viewsets.ViewSet):
                         )
                     except Exception as e:
                         logger.error(f"Error creating PayOS payment: {str(e)}")
-                        return Response(
+                        return mark_committed(Response(
                             {
                                 'error': f'Lỗi kết nối PayOS: {str(e)}',
                                 'order': OrderSerializer(order).data
                             },
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
+                        ))
                 
                 response_serializer = OrderSerializer(order)
                 return Response(response_serializer.data, status=status.HTTP_201_CREATED)
@@ -557,7 +792,14 @@ class OrderViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def all_orders(self, request):
-        """Admin - Lấy tất cả đơn hàng"""
+        """
+        Admin - Lấy danh sách đơn hàng (phân trang keyset theo created_at, id)
+
+        Query params:
+            search: mã đơn (DH...), số điện thoại, email hoặc tên khách
+            status, payment_status: lọc theo trạng thái (dùng index ghép)
+            cursor, page_size: phân trang, xem orders/pagination.py
+        """
         # Check if user is admin (has is_staff or role='admin')
         if not (request.user.is_staff or getattr(request.user, 'role', None) == 'admin'):
             return Response(
@@ -565,22 +807,30 @@ class OrderViewSet(viewsets.ViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
+        orders = Order.objects.prefetch_related('items')
+
+        order_status = request.query_params.get('status')
+        if order_status:
+            orders = orders.filter(status=order_status)
+        payment_status = request.query_params.get('payment_status')
+        if payment_status:
+            orders = orders.filter(payment_status=payment_status)
+
         # Tìm kiếm đơn hàng
-        search_query = request.query_params.get('search', None)
-        orders = Order.objects.all()
-        
+        search_query = (request.query_params.get('search') or '').strip()
         if search_query:
-            from django.db.models import Q
-            orders = orders.filter(
-                Q(order_code__icontains=search_query) |
-                Q(full_name__icontains=search_query) |
-                Q(phone__icontains=search_query) |
-                Q(email__icontains=search_query)
-            )
+            orders = orders.filter(_order_search_filter(search_query))
         
-        orders = orders.order_by('-created_at')
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        paginator = OrderKeysetPagination()
+        try:
+            page = paginator.paginate_queryset(orders, request)
+        except InvalidCursor:
+            return Response(
+                {'error': 'Cursor không hợp lệ'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = OrderSerializer(page, many=True)
+        return Response(paginator.get_paginated_data(serializer.data))
 
     @action(detail=False, methods=['post'])
     def update_order_status(self, request):
@@ -767,6 +1017,7 @@ class OrderViewSet(viewsets.ViewSet):
             )
 
     @action(detail=False, methods=['get'])
+    @cached_response('orders.stats', ('order', 'product'), condition=lambda request: request.user.is_staff)
     def stats(self, request):
         """Admin - Thống kê đơn hàng"""
         if not request.user.is_staff:
@@ -987,466 +1238,112 @@ class OrderViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def export_excel(self, request):
-        """Xuất báo cáo Excel"""
-        from django.http import HttpResponse
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-        from datetime import datetime
-        from django.db.models import Sum, Count, Q
-        from products.models import Product
-        
-        # Get parameters
-        report_type = request.GET.get('report_type', 'revenue')
-        start_date = request.GET.get('start_date', '')
-        end_date = request.GET.get('end_date', '')
-        category_id_str = request.GET.get('category_id', '').strip()
-        
-        wb = Workbook()
-        ws = wb.active
-        
-        header_fill = PatternFill(start_color="FF69B4", end_color="FF69B4", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        category_id = None
-        if category_id_str:
-            try:
-                category_id = int(category_id_str)
-            except ValueError:
-                return Response(
-                    {'error': 'category_id không hợp lệ. Vui lòng truyền số nguyên'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        """Xuất báo cáo Excel (streaming, bộ nhớ không phụ thuộc khoảng ngày - xem orders/reports.py)"""
+        from django.http import FileResponse
+        from .reports import XLSX_CONTENT_TYPE, excel_report_file, parse_report_spec
 
-        category_name = 'Tất cả'
-        if category_id:
-            from categories.models import Category
-            category_name = Category.objects.filter(id=category_id).values_list('name', flat=True).first() or 'Không xác định'
+        try:
+            spec = parse_report_spec(request.GET)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Filter orders by date range
-        orders_query = Order.objects.all()
-        if start_date:
-            orders_query = orders_query.filter(created_at__gte=start_date)
-        if end_date:
-            orders_query = orders_query.filter(created_at__lte=end_date + ' 23:59:59')
-        if category_id:
-            orders_query = orders_query.filter(items__product__category_id=category_id).distinct()
-        
-        if report_type == 'revenue':
-            ws.title = "Doanh Thu"
-            ws.merge_cells('A1:F1')
-            ws['A1'] = 'BÁO CÁO DOANH THU - WEB_TEDDY'
-            ws['A1'].font = Font(bold=True, size=16)
-            ws['A1'].alignment = Alignment(horizontal="center")
-            
-            # Date range info
-            ws['A2'] = f'Từ ngày: {start_date if start_date else "Tất cả"} - Đến ngày: {end_date if end_date else "Tất cả"}'
-            ws['A2'].alignment = Alignment(horizontal="center")
-            ws['A3'] = f'Danh mục: {category_name}'
-            ws['A3'].alignment = Alignment(horizontal="center")
-            
-            headers = ['Mã ĐH', 'Khách hàng', 'Ngày', 'Tổng tiền', 'Trạng thái', 'Thanh toán']
-            for col, header in enumerate(headers, start=1):
-                cell = ws.cell(row=4, column=col)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal="center")
-                cell.border = border
-            
-            orders = orders_query.order_by('-created_at')
-            total_revenue = 0
-            for row, order in enumerate(orders, start=5):
-                ws.cell(row=row, column=1, value=order.order_code).border = border
-                ws.cell(row=row, column=2, value=order.full_name).border = border
-                ws.cell(row=row, column=3, value=order.created_at.strftime('%d/%m/%Y')).border = border
-                ws.cell(row=row, column=4, value=float(order.total_amount)).border = border
-                ws.cell(row=row, column=5, value=order.get_status_display()).border = border
-                ws.cell(row=row, column=6, value=order.get_payment_method_display()).border = border
-                # Chỉ tính tổng doanh thu nếu đơn hàng không bị hủy
-                if order.status != 'cancelled':
-                    total_revenue += float(order.total_amount)
-            
-            # Summary row
-            summary_row = len(orders) + 5
-            ws.cell(row=summary_row, column=1, value='TỔNG CỘNG').font = Font(bold=True)
-            ws.cell(row=summary_row, column=4, value=total_revenue).font = Font(bold=True)
-            
-            for col in ['A', 'B', 'C', 'D', 'E', 'F']:
-                ws.column_dimensions[col].width = 20
-        
-        elif report_type == 'orders':
-            ws.title = "Đơn Hàng"
-            ws.merge_cells('A1:G1')
-            ws['A1'] = 'BÁO CÁO ĐƠN HÀNG - WEB_TEDDY'
-            ws['A1'].font = Font(bold=True, size=16)
-            ws['A1'].alignment = Alignment(horizontal="center")
-            
-            ws['A2'] = f'Từ ngày: {start_date if start_date else "Tất cả"} - Đến ngày: {end_date if end_date else "Tất cả"}'
-            ws['A2'].alignment = Alignment(horizontal="center")
-            ws['A3'] = f'Danh mục: {category_name}'
-            ws['A3'].alignment = Alignment(horizontal="center")
-            
-            headers = ['Mã ĐH', 'Khách hàng', 'SĐT', 'Địa chỉ', 'Tổng tiền', 'Trạng thái', 'Ngày']
-            for col, header in enumerate(headers, start=1):
-                cell = ws.cell(row=4, column=col)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal="center")
-                cell.border = border
-            
-            orders = orders_query.order_by('-created_at')
-            for row, order in enumerate(orders, start=5):
-                ws.cell(row=row, column=1, value=order.order_code).border = border
-                ws.cell(row=row, column=2, value=order.full_name).border = border
-                ws.cell(row=row, column=3, value=order.phone).border = border
-                ws.cell(row=row, column=4, value=f"{order.address}, {order.district}, {order.city}").border = border
-                ws.cell(row=row, column=5, value=float(order.total_amount)).border = border
-                ws.cell(row=row, column=6, value=order.get_status_display()).border = border
-                ws.cell(row=row, column=7, value=order.created_at.strftime('%d/%m/%Y')).border = border
-            
-            for col in ['A', 'B', 'C', 'E', 'F', 'G']:
-                ws.column_dimensions[col].width = 20
-            ws.column_dimensions['D'].width = 40
-        
-        elif report_type == 'products':
-            ws.title = "Sản Phẩm Bán Chạy"
-            ws.merge_cells('A1:F1')
-            ws['A1'] = 'BÁO CÁO SẢN PHẨM BÁN CHẠY - WEB_TEDDY'
-            ws['A1'].font = Font(bold=True, size=16)
-            ws['A1'].alignment = Alignment(horizontal="center")
-            
-            ws['A2'] = f'Từ ngày: {start_date if start_date else "Tất cả"} - Đến ngày: {end_date if end_date else "Tất cả"}'
-            ws['A2'].alignment = Alignment(horizontal="center")
-            ws['A3'] = f'Danh mục: {category_name}'
-            ws['A3'].alignment = Alignment(horizontal="center")
-            
-            headers = ['STT', 'Sản phẩm', 'Danh mục', 'Đã bán', 'Giá', 'Doanh thu']
-            for col, header in enumerate(headers, start=1):
-                cell = ws.cell(row=4, column=col)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal="center")
-                cell.border = border
-            
-            # Get order items in date range
-            order_items_query = OrderItem.objects.filter(order__in=orders_query)
-            if category_id:
-                order_items_query = order_items_query.filter(product__category_id=category_id)
-            if category_id:
-                order_items_query = order_items_query.filter(product__category_id=category_id)
-            product_stats = order_items_query.values('product__id', 'product__name', 'product__category__name').annotate(
-                total_sold=Sum('quantity'),
-                total_revenue=Sum('quantity') * Sum('product_price')
-            ).order_by('-total_sold')
-            
-            for row, stat in enumerate(product_stats[:50], start=5):
-                product = Product.objects.filter(id=stat['product__id']).first()
-                ws.cell(row=row, column=1, value=row-4).border = border
-                ws.cell(row=row, column=2, value=stat['product__name']).border = border
-                ws.cell(row=row, column=3, value=stat['product__category__name'] or 'N/A').border = border
-                ws.cell(row=row, column=4, value=stat['total_sold']).border = border
-                ws.cell(row=row, column=5, value=float(product.price) if product else 0).border = border
-                ws.cell(row=row, column=6, value=float(product.price * stat['total_sold']) if product else 0).border = border
-            
-            for col in ['A', 'C', 'D', 'E', 'F']:
-                ws.column_dimensions[col].width = 18
-            ws.column_dimensions['B'].width = 35
-        
-        elif report_type == 'customers':
-            ws.title = "Khách Hàng"
-            ws.merge_cells('A1:F1')
-            ws['A1'] = 'BÁO CÁO KHÁCH HÀNG - WEB_TEDDY'
-            ws['A1'].font = Font(bold=True, size=16)
-            ws['A1'].alignment = Alignment(horizontal="center")
-            
-            ws['A2'] = f'Từ ngày: {start_date if start_date else "Tất cả"} - Đến ngày: {end_date if end_date else "Tất cả"}'
-            ws['A2'].alignment = Alignment(horizontal="center")
-            ws['A3'] = f'Danh mục: {category_name}'
-            ws['A3'].alignment = Alignment(horizontal="center")
-            
-            headers = ['Khách hàng', 'Email', 'SĐT', 'Số đơn', 'Tổng chi tiêu', 'Ngày đầu']
-            for col, header in enumerate(headers, start=1):
-                cell = ws.cell(row=4, column=col)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal="center")
-                cell.border = border
-            
-            # Get customer statistics (loại bỏ đơn hàng bị hủy)
-            customer_stats = orders_query.exclude(status='cancelled').values('user__username', 'email', 'phone', 'user__date_joined').annotate(
-                order_count=Count('id'),
-                total_spent=Sum('total_amount')
-            ).order_by('-total_spent')
-            
-            for row, stat in enumerate(customer_stats, start=5):
-                ws.cell(row=row, column=1, value=stat['user__username'] or 'Khách').border = border
-                ws.cell(row=row, column=2, value=stat['email']).border = border
-                ws.cell(row=row, column=3, value=stat['phone']).border = border
-                ws.cell(row=row, column=4, value=stat['order_count']).border = border
-                ws.cell(row=row, column=5, value=float(stat['total_spent'])).border = border
-                ws.cell(row=row, column=6, value=stat['user__date_joined'].strftime('%d/%m/%Y') if stat['user__date_joined'] else 'N/A').border = border
-            
-            for col in ['A', 'B', 'C', 'D', 'E', 'F']:
-                ws.column_dimensions[col].width = 22
-        
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename=bao_cao_{report_type}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        wb.save(response)
-        return response
+        return FileResponse(
+            excel_report_file(spec),
+            as_attachment=True,
+            filename=spec.filename('xlsx'),
+            content_type=XLSX_CONTENT_TYPE,
+        )
     
     @action(detail=False, methods=['get'])
     def export_pdf(self, request):
-        """Xuất báo cáo PDF"""
-        from django.http import HttpResponse
-        from reportlab.lib import colors
-        from reportlab.lib.pagesizes import A4, landscape
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-        from datetime import datetime
-        from django.db.models import Sum, Count
-        from products.models import Product
-        import io
-        
-        # Get parameters
-        report_type = request.GET.get('report_type', 'revenue')
-        start_date = request.GET.get('start_date', '')
-        end_date = request.GET.get('end_date', '')
-        category_id_str = request.GET.get('category_id', '')
-        
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=landscape(A4))
-        elements = []
-        styles = getSampleStyleSheet()
+        """Xuất báo cáo PDF (trong request - khoảng dài nên dùng submit_report)"""
+        from django.http import FileResponse
+        from .reports import parse_report_spec, pdf_report_file
 
-        # Parse category_id
-        category_id = None
-        if category_id_str:
-            try:
-                category_id = int(category_id_str)
-            except ValueError:
-                return Response(
-                    {'error': 'category_id không hợp lệ. Vui lòng truyền số nguyên'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        try:
+            spec = parse_report_spec(request.GET)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get category name for display
-        category_name = 'Tat ca'
-        if category_id:
-            from categories.models import Category
-            category_name = Category.objects.filter(id=category_id).values_list('name', flat=True).first() or 'Khong xac dinh'
-        
-        if report_type == 'revenue':
-            # Báo cáo doanh thu - có thể lọc theo danh mục
-            title = Paragraph('<para align=center><b>BAO CAO DOANH THU - WEB_TEDDY</b></para>', styles['Title'])
-            elements.append(title)
-            date_range = Paragraph(f'<para align=center>Tu ngay: {start_date if start_date else "Tat ca"} - Den ngay: {end_date if end_date else "Tat ca"}</para>', styles['Normal'])
-            elements.append(date_range)
-            if category_id:
-                category_line = Paragraph(f'<para align=center>Danh muc: {category_name}</para>', styles['Normal'])
-                elements.append(category_line)
-            elements.append(Spacer(1, 0.3*inch))
-            
-            # Filter orders by date range and category
-            orders_query = Order.objects.all()
-            if start_date:
-                orders_query = orders_query.filter(created_at__gte=start_date)
-            if end_date:
-                orders_query = orders_query.filter(created_at__lte=end_date + ' 23:59:59')
-            if category_id:
-                orders_query = orders_query.filter(items__product__category_id=category_id).distinct()
-            
-            orders = orders_query.order_by('-created_at')[:100]
-            data = [['Ma DH', 'Khach hang', 'Ngay', 'Tong tien', 'Trang thai', 'Thanh toan']]
-            
-            total_revenue = 0
-            for order in orders:
-                data.append([
-                    order.order_code,
-                    order.full_name[:15],
-                    order.created_at.strftime('%d/%m/%y'),
-                    f'{order.total_amount:,.0f}',
-                    order.get_status_display()[:10],
-                    order.get_payment_method_display()[:10],
-                ])
-                # Chỉ tính tổng doanh thu nếu đơn hàng không bị hủy
-                if order.status != 'cancelled':
-                    total_revenue += float(order.total_amount)
-            
-            data.append(['', '', 'TONG CONG:', f'{total_revenue:,.0f}', '', ''])
-            
-            table = Table(data, repeatRows=1)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FF69B4')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 9),
-                ('FONTSIZE', (0, 1), (-1, -2), 7),
-                ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, -1), (-1, -1), 9),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-        
-        elif report_type == 'orders':
-            # Báo cáo đơn hàng - có thể lọc theo danh mục
-            title = Paragraph('<para align=center><b>BAO CAO DON HANG - WEB_TEDDY</b></para>', styles['Title'])
-            elements.append(title)
-            date_range = Paragraph(f'<para align=center>Tu ngay: {start_date if start_date else "Tat ca"} - Den ngay: {end_date if end_date else "Tat ca"}</para>', styles['Normal'])
-            elements.append(date_range)
-            if category_id:
-                category_line = Paragraph(f'<para align=center>Danh muc: {category_name}</para>', styles['Normal'])
-                elements.append(category_line)
-            elements.append(Spacer(1, 0.3*inch))
-            
-            # Filter orders by date range and category
-            orders_query = Order.objects.all()
-            if start_date:
-                orders_query = orders_query.filter(created_at__gte=start_date)
-            if end_date:
-                orders_query = orders_query.filter(created_at__lte=end_date + ' 23:59:59')
-            if category_id:
-                orders_query = orders_query.filter(items__product__category_id=category_id).distinct()
-            
-            orders = orders_query.order_by('-created_at')[:100]
-            data = [['Ma DH', 'Khach', 'SDT', 'Tong tien', 'TT', 'Ngay']]
-            
-            for order in orders:
-                data.append([
-                    order.order_code,
-                    order.full_name[:12],
-                    order.phone,
-                    f'{order.total_amount:,.0f}',
-                    order.get_status_display()[:10],
-                    order.created_at.strftime('%d/%m/%y')
-                ])
-            
-            table = Table(data, repeatRows=1)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FF69B4')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 9),
-                ('FONTSIZE', (0, 1), (-1, -1), 7),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-        
-        elif report_type == 'products':
-            # Báo cáo sản phẩm bán chạy - có thể lọc theo danh mục
-            title = Paragraph('<para align=center><b>BAO CAO SAN PHAM BAN CHAY - WEB_TEDDY</b></para>', styles['Title'])
-            elements.append(title)
-            date_range = Paragraph(f'<para align=center>Tu ngay: {start_date if start_date else "Tat ca"} - Den ngay: {end_date if end_date else "Tat ca"}</para>', styles['Normal'])
-            elements.append(date_range)
-            if category_id:
-                category_line = Paragraph(f'<para align=center>Danh muc: {category_name}</para>', styles['Normal'])
-                elements.append(category_line)
-            elements.append(Spacer(1, 0.3*inch))
-            
-            # Filter orders by date range
-            orders_query = Order.objects.all()
-            if start_date:
-                orders_query = orders_query.filter(created_at__gte=start_date)
-            if end_date:
-                orders_query = orders_query.filter(created_at__lte=end_date + ' 23:59:59')
-            
-            # Get order items and filter by category if needed
-            order_items_query = OrderItem.objects.filter(order__in=orders_query)
-            if category_id:
-                order_items_query = order_items_query.filter(product__category_id=category_id)
-            
-            product_stats = order_items_query.values('product__id', 'product__name', 'product__category__name').annotate(
-                total_sold=Sum('quantity')
-            ).order_by('-total_sold')[:50]
-            
-            data = [['STT', 'San pham', 'Danh muc', 'Da ban', 'Gia', 'Doanh thu']]
-            
-            for idx, stat in enumerate(product_stats, 1):
-                product = Product.objects.filter(id=stat['product__id']).first()
-                data.append([
-                    str(idx),
-                    stat['product__name'][:25],
-                    (stat['product__category__name'] or 'N/A')[:15],
-                    str(stat['total_sold']),
-                    f'{product.price:,.0f}' if product else '0',
-                    f'{(product.price * stat["total_sold"]):,.0f}' if product else '0'
-                ])
-            
-            table = Table(data, repeatRows=1)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FF69B4')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 8),
-                ('FONTSIZE', (0, 1), (-1, -1), 7),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-        
-        elif report_type == 'customers':
-            # Báo cáo khách hàng - KHÔNG lọc theo danh mục (vì đây là thống kê khách hàng tổng thể)
-            title = Paragraph('<para align=center><b>BAO CAO KHACH HANG - WEB_TEDDY</b></para>', styles['Title'])
-            elements.append(title)
-            date_range = Paragraph(f'<para align=center>Tu ngay: {start_date if start_date else "Tat ca"} - Den ngay: {end_date if end_date else "Tat ca"}</para>', styles['Normal'])
-            elements.append(date_range)
-            elements.append(Spacer(1, 0.3*inch))
-            
-            # Filter orders by date range only (không lọc theo category vì đây là báo cáo khách hàng)
-            orders_query = Order.objects.all()
-            if start_date:
-                orders_query = orders_query.filter(created_at__gte=start_date)
-            if end_date:
-                orders_query = orders_query.filter(created_at__lte=end_date + ' 23:59:59')
-            
-            # Loại bỏ đơn hàng bị hủy khỏi thống kê khách hàng
-            customer_stats = orders_query.exclude(status='cancelled').values('user__username', 'email', 'phone').annotate(
-                order_count=Count('id'),
-                total_spent=Sum('total_amount')
-            ).order_by('-total_spent')[:50]
-            
-            data = [['Khach hang', 'Email', 'SDT', 'So don', 'Tong chi tieu']]
-            
-            for stat in customer_stats:
-                data.append([
-                    (stat['user__username'] or 'Khach')[:15],
-                    stat['email'][:20],
-                    stat['phone'],
-                    str(stat['order_count']),
-                    f'{stat["total_spent"]:,.0f}'
-                ])
-            
-            table = Table(data, repeatRows=1)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#FF69B4')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 9),
-                ('FONTSIZE', (0, 1), (-1, -1), 7),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
-        
-        elements.append(table)
-        doc.build(elements)
-        
-        pdf = buffer.getvalue()
-        buffer.close()
-        
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename=bao_cao_{report_type}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-        response.write(pdf)
-        return response
+        return FileResponse(
+            pdf_report_file(spec),
+            as_attachment=True,
+            filename=spec.filename('pdf'),
+            content_type='application/pdf',
+        )
+
+    @action(detail=False, methods=['post'])
+    def submit_report(self, request):
+        """
+        Admin - Tạo job xuất báo cáo chạy nền
+
+        Body: report_type, start_date, end_date, category_id, format (xlsx | pdf)
+        Cùng spec và dữ liệu chưa đổi thì trả lại job đã có (kể cả đã xong).
+        """
+        if not (request.user.is_staff or getattr(request.user, 'role', None) == 'admin'):
+            return Response(
+                {'error': 'Bạn không có quyền truy cập'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        from .report_jobs import submit_report_job
+        from .reports import parse_report_spec
+
+        try:
+            spec = parse_report_spec(request.data)
+            job, created = submit_report_job(spec, request.data.get('format') or 'xlsx', request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            ReportJobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK
+        )
+
+    def _get_report_job(self, request):
+        if not (request.user.is_staff or getattr(request.user, 'role', None) == 'admin'):
+            return None, Response(
+                {'error': 'Bạn không có quyền truy cập'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            return ReportJob.objects.get(id=int(request.query_params.get('job_id'))), None
+        except (TypeError, ValueError, ReportJob.DoesNotExist):
+            return None, Response(
+                {'error': 'Không tìm thấy job báo cáo'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+    @action(detail=False, methods=['get'])
+    def report_status(self, request):
+        """Admin - Trạng thái job báo cáo (?job_id=)"""
+        from .report_jobs import ensure_progress
+
+        job, error_response = self._get_report_job(request)
+        if error_response:
+            return error_response
+        return Response(ReportJobSerializer(ensure_progress(job)).data)
+
+    @action(detail=False, methods=['get'])
+    def download_report(self, request):
+        """Admin - Tải file kết quả của job báo cáo (?job_id=)"""
+        from django.http import FileResponse
+        from .reports import XLSX_CONTENT_TYPE
+
+        job, error_response = self._get_report_job(request)
+        if error_response:
+            return error_response
+        if job.status != 'done' or not job.file:
+            return Response(
+                {'error': 'Báo cáo chưa sẵn sàng'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return FileResponse(
+            job.file.open('rb'),
+            as_attachment=True,
+            filename=os.path.basename(job.file.name),
+            content_type=XLSX_CONTENT_TYPE if job.report_format == 'xlsx' else 'application/pdf',
+        )
 
 
 @api_view(['POST'])
@@ -1454,7 +1351,9 @@ class OrderViewSet(viewsets.ViewSet):
 @csrf_exempt
 def momo_callback(request):
     """
-    Nhận callback từ MoMo sau khi thanh toán
+    Nhận callback (IPN) từ MoMo sau khi thanh toán.
+    Chỉ xác thực chữ ký và ghi vào hộp thư sự kiện rồi trả lời ngay;
+    đơn hàng được cập nhật bởi worker (orders/payment_events.py).
     """
     try:
         data = request.data
@@ -1468,40 +1367,14 @@ def momo_callback(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Lấy thông tin từ callback
-        result_code = data.get('resultCode')
-        order_id = data.get('orderId')
-        trans_id = data.get('transId')
-        message = data.get('message')
-        
-        # Tìm order
-        try:
-            order = Order.objects.get(id=int(order_id))
-        except (Order.DoesNotExist, ValueError):
-            logger.error(f"Order not found: {order_id}")
+        if not data.get('orderId'):
             return Response(
-                {'message': 'Order not found'},
-                status=status.HTTP_404_NOT_FOUND
+                {'message': 'Missing orderId'},
+                status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Cập nhật trạng thái thanh toán
-        if result_code == 0:
-            # Thanh toán thành công
-            order.payment_status = 'completed'
-            order.momo_transaction_id = trans_id
-            order.save(update_fields=['payment_status', 'momo_transaction_id'])
-            
-            logger.info(f"Order {order.order_code} payment completed via MoMo")
-            
-            return Response({'message': 'Success'}, status=status.HTTP_200_OK)
-        else:
-            # Thanh toán thất bại
-            order.payment_status = 'failed'
-            order.save(update_fields=['payment_status'])
-            
-            logger.warning(f"Order {order.order_code} payment failed: {message}")
-            
-            return Response({'message': 'Payment failed'}, status=status.HTTP_200_OK)
+        record_payment_event('momo', momo_event_key(data), dict(data))
+        return Response({'message': 'Success'}, status=status.HTTP_200_OK)
     
     except Exception as e:
         logger.error(f"Error processing MoMo callback: {str(e)}")
@@ -1511,6 +1384,40 @@ def momo_callback(request):
         )
 
 
+def _local_payment_status(request, order_id, payment_method, status_key, method_error, missing_error=None):
+    """
+    Trạng thái thanh toán cho trang checkout poll: chỉ đọc dữ liệu local.
+
+    Không gọi cổng thanh toán ở đây; job reconcile_payments đối soát nền và
+    lưu phản hồi gần nhất vào PaymentCheck.last_result. Kết quả được cache vài
+    giây theo (user, đơn) và bị xóa khi payment_status đổi (orders/signals.py).
+    """
+    from django.conf import settings
+    from django.core.cache import cache
+    from .payment_reconciler import status_cache_key
+
+    cache_key = status_cache_key(request.user.id, order_id)
+    cached = cache.get(cache_key)
+    if cached is not None and status_key in cached:
+        return Response(cached)
+
+    order = Order.objects.select_related('payment_check').get(id=order_id, user=request.user)
+    if order.payment_method != payment_method:
+        return Response({'error': method_error}, status=status.HTTP_400_BAD_REQUEST)
+    if missing_error and not order.momo_request_id:
+        return Response({'error': missing_error}, status=status.HTTP_400_BAD_REQUEST)
+
+    check = getattr(order, 'payment_check', None)
+    if check is None and order.payment_status == 'pending' and order.status != 'cancelled':
+        check = schedule_payment_check(order)
+    data = {
+        'order': OrderSerializer(order).data,
+        status_key: check.last_result if check else {},
+    }
+    cache.set(cache_key, data, getattr(settings, 'PAYMENT_STATUS_CACHE_SECONDS', 3))
+    return Response(data)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def check_momo_payment_status(request, order_id):
@@ -1518,39 +1425,12 @@ def check_momo_payment_status(request, order_id):
     Kiểm tra trạng thái thanh toán MoMo của đơn hàng
     """
     try:
-        # Lấy đơn hàng
-        order = Order.objects.get(id=order_id, user=request.user)
-        
-        # Kiểm tra xem đơn hàng có dùng MoMo không
-        if order.payment_method != 'momo':
-            return Response(
-                {'error': 'Đơn hàng không sử dụng thanh toán MoMo'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Kiểm tra trạng thái từ MoMo
-        if order.momo_request_id:
-            momo_response = MoMoPayment.check_transaction_status(
-                order_id=order.momo_order_id or str(order.id),
-                request_id=order.momo_request_id
-            )
-            
-            if momo_response.get('resultCode') == 0:
-                # Cập nhật trạng thái thanh toán
-                order.payment_status = 'completed'
-                order.momo_transaction_id = momo_response.get('transId')
-                order.save(update_fields=['payment_status', 'momo_transaction_id'])
-            
-            return Response({
-                'order': OrderSerializer(order).data,
-                'momo_status': momo_response
-            })
-        else:
-            return Response(
-                {'error': 'Chưa có thông tin thanh toán MoMo'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-    
+        return _local_payment_status(
+            request, order_id, 'momo', 'momo_status',
+            method_error='Đơn hàng không sử dụng thanh toán MoMo',
+            missing_error='Chưa có thông tin thanh toán MoMo',
+        )
+
     except Order.DoesNotExist:
         return Response(
             {'error': 'Đơn hàng không tồn tại'},
@@ -1569,7 +1449,9 @@ def check_momo_payment_status(request, order_id):
 @csrf_exempt
 def payos_webhook(request):
     """
-    Nhận webhook từ PayOS sau khi thanh toán
+    Nhận webhook từ PayOS sau khi thanh toán.
+    Chỉ xác thực chữ ký và ghi vào hộp thư sự kiện rồi trả lời ngay;
+    đơn hàng được cập nhật bởi worker (orders/payment_events.py).
     """
     try:
         payload = request.data
@@ -1592,25 +1474,7 @@ def payos_webhook(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            order = Order.objects.get(id=int(order_code))
-        except (Order.DoesNotExist, ValueError):
-            logger.error(f"Order not found: {order_code}")
-            return Response(
-                {'message': 'Order not found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        success = payload.get('success') is True and data.get('code') == '00'
-
-        if success:
-            order.payment_status = 'completed'
-            logger.info(f"Order {order.order_code} payment completed via PayOS")
-        else:
-            order.payment_status = 'failed'
-            logger.warning(f"Order {order.order_code} payment failed via PayOS")
-
-        order.save(update_fields=['payment_status'])
+        record_payment_event('payos', payos_event_key(data), dict(payload))
         return Response({'message': 'Success'}, status=status.HTTP_200_OK)
 
     except Exception as e:
@@ -1628,29 +1492,10 @@ def check_payos_payment_status(request, order_id):
     Kiểm tra trạng thái thanh toán PayOS của đơn hàng
     """
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
-
-        if order.payment_method != 'banking':
-            return Response(
-                {'error': 'Đơn hàng không sử dụng thanh toán PayOS'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        payos_response = PayOSPayment.get_payment_link_info(order.id)
-        if payos_response.get('code') == '00':
-            data = payos_response.get('data', {})
-            payos_status = data.get('status')
-            if payos_status == 'PAID':
-                order.payment_status = 'completed'
-                order.save(update_fields=['payment_status'])
-            elif payos_status == 'CANCELLED':
-                order.payment_status = 'failed'
-                order.save(update_fields=['payment_status'])
-
-        return Response({
-            'order': OrderSerializer(order).data,
-            'payos_status': payos_response
-        })
+        return _local_payment_status(
+            request, order_id, 'banking', 'payos_status',
+            method_error='Đơn hàng không sử dụng thanh toán PayOS',
+        )
 
     except Order.DoesNotExist:
         return Response(
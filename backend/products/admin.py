@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, ProductImage
+from .models import InventoryMovement, Product, ProductImage
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -46,3 +46,20 @@ class ProductImageAdmin(admin.ModelAdmin):
     list_filter = ['is_main', 'created_at']
     search_fields = ['product__name']
     ordering = ['product', 'order']
+
+@admin.register(InventoryMovement)
+class InventoryMovementAdmin(admin.ModelAdmin):
+    """Sổ cái tồn kho - chỉ xem"""
+    list_display = ['id', 'product', 'size', 'kind', 'quantity', 'reference', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['product__name', 'reference']
+    raw_id_fields = ['product']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
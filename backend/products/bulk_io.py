@@ -0,0 +1,585 @@
+"""
+Import / export sản phẩm hàng loạt (CSV hoặc XLSX).
+
+Mỗi dòng một sản phẩm, cột theo COLUMNS. Dòng có slug đã tồn tại là cập nhật
+(ô trống = giữ giá trị cũ), còn lại là sản phẩm mới (bắt buộc name, category,
+price; danh mục chưa có thì được tạo). Cột variants dạng
+"30cm:150000:5|60cm:250000:3" (size:giá:tồn); có giá trị thì thay toàn bộ biến
+thể của sản phẩm như save_variants, để trống thì giữ nguyên.
+
+Import:
+- Đọc file kiểu streaming (csv.DictReader / openpyxl read_only), xử lý theo lô
+  PRODUCT_IMPORT_CHUNK_SIZE dòng, mỗi lô một transaction: vài câu SELECT theo
+  slug / danh mục / biến thể, bulk_create + bulk_update, slug cấp theo lô.
+- Tồn kho vẫn đi qua sổ cái: chênh lệch so với số tồn hiện tại (khóa dòng) ghi
+  bằng một apply_movements() cho cả lô.
+- Signal catalog tắt trong lúc import; hết import mới bump catalog version /
+  cache phản hồi, dựng lại chỉ mục facet và đồng bộ ChromaDB một lần.
+
+Dòng lỗi được bỏ qua và báo lại theo số dòng, không làm hỏng cả lô.
+"""
+import csv
+import io
+import json
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from categories.models import Category
+
+from .inventory import apply_movements, movement, set_stock
+from .models import Product, ProductVariant, StockShard, coerce_json
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    'slug', 'name', 'category', 'price', 'old_price', 'stock', 'unit', 'status',
+    'description', 'detail_description', 'origin', 'color', 'weight', 'preservation',
+    'expiry', 'certification', 'specifications', 'images', 'variants',
+]
+TEXT_FIELDS = [
+    'name', 'unit', 'description', 'detail_description', 'origin', 'color', 'weight',
+    'preservation', 'expiry', 'certification',
+]
+FORMATS = ('csv', 'xlsx')
+CSV_CONTENT_TYPE = 'text/csv'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MAX_REPORTED_ERRORS = 100
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def detect_format(filename: str) -> str:
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in FORMATS:
+        raise ValueError('Chỉ hỗ trợ file .csv hoặc .xlsx')
+    return extension
+
+
+def _chunk_size() -> int:
+    return max(1, getattr(settings, 'PRODUCT_IMPORT_CHUNK_SIZE', 500))
+
+
+# ---------------------------------------------------------------------------
+# Đọc file
+# ---------------------------------------------------------------------------
+
+def iter_rows(fileobj, file_format: str) -> Iterator[Tuple[int, dict]]:
+    """(số dòng trong file, dict cột -> giá trị) theo kiểu streaming"""
+    if file_format == 'csv':
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+        try:
+            for line_number, row in enumerate(csv.DictReader(text), start=2):
+                yield line_number, row
+        finally:
+            # Trả lại file nhị phân cho bên gọi thay vì đóng theo wrapper
+            text.detach()
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(value).strip() if value is not None else '' for value in next(rows, [])]
+        for line_number, values in enumerate(rows, start=2):
+            if not any(value not in (None, '') for value in values):
+                continue
+            yield line_number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _decimal(value, column: str) -> Decimal:
+    try:
+        number = Decimal(_text(value).replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f'{column} không hợp lệ: {value}')
+    if number < 0:
+        raise ValueError(f'{column} không được âm')
+    return number
+
+
+def _int(value, column: str) -> int:
+    number = _decimal(value, column)
+    if number != number.to_integral_value():
+        raise ValueError(f'{column} phải là số nguyên')
+    return int(number)
+
+
+def _json(value, expected, column: str):
+    if isinstance(value, (list, dict)):
+        return coerce_json(value, expected)
+    try:
+        parsed = json.loads(_text(value))
+    except json.JSONDecodeError:
+        raise ValueError(f'{column} không phải JSON hợp lệ')
+    if not isinstance(parsed, expected):
+        raise ValueError(f'{column} phải là JSON {"array" if expected is list else "object"}')
+    return parsed
+
+
+def parse_variants(value) -> List[dict]:
+    """'30cm:150000:5|60cm:250000:3' -> [{'size', 'price', 'stock'}, ...]"""
+    variants, sizes = [], set()
+    for part in _text(value).split('|'):
+        if not part.strip():
+            continue
+        pieces = [piece.strip() for piece in part.split(':')]
+        if len(pieces) != 3 or not pieces[0]:
+            raise ValueError(f'variants không hợp lệ: "{part}" (định dạng size:giá:tồn)')
+        if pieces[0] in sizes:
+            raise ValueError(f'variants trùng size {pieces[0]}')
+        sizes.add(pieces[0])
+        variants.append({
+            'size': pieces[0][:20],
+            'price': _decimal(pieces[1], 'Giá biến thể'),
+            'stock': _int(pieces[2], 'Tồn biến thể'),
+        })
+    return variants
+
+
+def parse_row(raw: dict) -> dict:
+    """
+    Chuẩn hóa một dòng; chỉ chứa các cột có giá trị.
+
+    Raises:
+        ValueError: giá trị sai định dạng (message trả về cho người import)
+    """
+    data = {}
+    for column in ['slug', 'category'] + TEXT_FIELDS:
+        text = _text(raw.get(column))
+        if text:
+            data[column] = text
+    for column in ('price', 'old_price'):
+        if _text(raw.get(column)):
+            data[column] = _decimal(raw[column], column)
+    if _text(raw.get('stock')):
+        data['stock'] = _int(raw['stock'], 'stock')
+    status = _text(raw.get('status'))
+    if status:
+        if status not in dict(Product.STATUS_CHOICES):
+            raise ValueError(f'status phải là active hoặc inactive, nhận "{status}"')
+        data['status'] = status
+    if _text(raw.get('specifications')):
+        data['specifications'] = _json(raw['specifications'], dict, 'specifications')
+    if _text(raw.get('images')):
+        data['images'] = _json(raw['images'], list, 'images')
+    if _text(raw.get('variants')):
+        data['variants'] = parse_variants(raw['variants'])
+    if 'price' in data and data['price'] <= 0:
+        raise ValueError('price phải lớn hơn 0')
+    if data.get('old_price') and data.get('price') and data['old_price'] <= data['price']:
+        raise ValueError('old_price phải lớn hơn price')
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Ghi theo lô
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    variants_created: int = 0
+    variants_updated: int = 0
+    variants_deleted: int = 0
+    stock_movements: int = 0
+    error_count: int = 0
+    errors: List[dict] = field(default_factory=list)
+    # Cache id danh mục theo tên, dùng lại giữa các lô
+    categories: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self) -> dict:
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'variants_created': self.variants_created,
+            'variants_updated': self.variants_updated,
+            'variants_deleted': self.variants_deleted,
+            'stock_movements': self.stock_movements,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def merge(self, other: 'ImportResult'):
+        """Cộng kết quả của một lô đã commit (lô lỗi bị rollback thì bỏ cả số đếm lẫn cache danh mục)"""
+        for name in ('created', 'updated', 'variants_created', 'variants_updated', 'variants_deleted', 'stock_movements'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.error_count += other.error_count
+        self.errors.extend(other.errors[:max(MAX_REPORTED_ERRORS - len(self.errors), 0)])
+        self.categories.update(other.categories)
+
+
+def _resolve_categories(names: Iterable[str], result: ImportResult):
+    missing = {name for name in names if name not in result.categories}
+    if not missing:
+        return
+    found = dict(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+    new = [Category(name=name) for name in missing if name not in found]
+    if new:
+        Category.objects.bulk_create(new, ignore_conflicts=True)
+        found = dict(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+    result.categories.update(found)
+
+
+def allocate_slugs(names: List[str], reserved: Iterable[str] = ()) -> List[str]:
+    """
+    Slug không trùng cho một lô tên, tối đa hai câu SELECT cho cả lô (thay vì
+    một exists() cho mỗi lần trùng như Product.save()).
+    """
+    bases = [(slugify(name, allow_unicode=True) or 'san-pham')[:240] for name in names]
+    taken = set(Product.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+    collided = {base for base in bases if base in taken} | (set(bases) & set(reserved))
+    if collided:
+        condition = Q()
+        for base in collided:
+            condition |= Q(slug__startswith=f'{base}-')
+        taken.update(Product.objects.filter(condition).values_list('slug', flat=True))
+    taken.update(reserved)
+
+    slugs = []
+    for base in bases:
+        slug, counter = base, 1
+        while slug in taken:
+            slug = f'{base}-{counter}'
+            counter += 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def _import_chunk(chunk: List[Tuple[int, dict]], result: ImportResult, reference: str):
+    # Dòng trùng slug trong cùng lô: dòng sau thắng
+    rows: List[Tuple[int, dict]] = []
+    by_slug: Dict[str, int] = {}
+    for line, data in chunk:
+        if data.get('slug') in by_slug:
+            rows[by_slug[data['slug']]] = (line, data)
+            continue
+        if data.get('slug'):
+            by_slug[data['slug']] = len(rows)
+        rows.append((line, data))
+
+    existing = Product.objects.in_bulk([data['slug'] for _, data in rows if data.get('slug')], field_name='slug')
+    _resolve_categories({data['category'] for _, data in rows if data.get('category')}, result)
+
+    creates, updates, update_fields = [], [], {'updated_at'}
+    pending = []
+    for line, data in rows:
+        product = existing.get(data.get('slug'))
+        if product is None:
+            missing = [column for column in ('name', 'category', 'price') if column not in data]
+            if missing:
+                result.add_error(line, f'Sản phẩm mới thiếu cột {", ".join(missing)}')
+                continue
+            product = Product(stock=0, slug=data.get('slug', ''))
+            creates.append(product)
+        else:
+            updates.append(product)
+        for column, value in data.items():
+            if column in ('slug', 'stock', 'variants'):
+                continue
+            if column == 'category':
+                product.category_id = result.categories[value]
+            else:
+                setattr(product, column, value)
+            if product.pk:
+                update_fields.add(column)
+        pending.append((product, data))
+
+    unnamed = [product for product in creates if not product.slug]
+    reserved = {product.slug for product in creates if product.slug}
+    for product, slug in zip(unnamed, allocate_slugs([product.name for product in unnamed], reserved)):
+        product.slug = slug
+
+    if creates:
+        Product.objects.bulk_create(creates, batch_size=_chunk_size())
+    if updates:
+        now = timezone.now()
+        for product in updates:
+            product.updated_at = now
+        Product.objects.bulk_update(updates, sorted(update_fields), batch_size=_chunk_size())
+    result.created += len(creates)
+    result.updated += len(updates)
+
+    # bulk_create không trả id trên MySQL: đọc lại theo slug
+    ids = dict(Product.objects.filter(slug__in=[product.slug for product, _ in pending]).values_list('slug', 'id'))
+    targets: Dict[Tuple[int, str], int] = {}
+    variant_rows = {}
+    for product, data in pending:
+        product_id = ids[product.slug]
+        if 'stock' in data:
+            targets[(product_id, '')] = data['stock']
+        if 'variants' in data:
+            variant_rows[product_id] = data['variants']
+
+    deleted_ids = _sync_variants(variant_rows, targets, result)
+    _apply_stock(targets, result, reference)
+    if deleted_ids:
+        ProductVariant.objects.filter(id__in=deleted_ids).delete()
+        result.variants_deleted += len(deleted_ids)
+
+
+def _sync_variants(variant_rows: Dict[int, List[dict]], targets: dict, result: ImportResult) -> List[int]:
+    """Tạo / sửa giá biến thể và ghi số tồn cần đạt; trả về id biến thể cần xóa (sau khi xuất hết tồn)"""
+    if not variant_rows:
+        return []
+    existing = {
+        (variant.product_id, variant.size): variant
+        for variant in ProductVariant.objects.filter(product_id__in=variant_rows)
+    }
+    creates, updates, deleted = [], [], []
+    for product_id, variants in variant_rows.items():
+        sizes = set()
+        for item in variants:
+            sizes.add(item['size'])
+            targets[(product_id, item['size'])] = item['stock']
+            variant = existing.get((product_id, item['size']))
+            if variant is None:
+                creates.append(ProductVariant(product_id=product_id, size=item['size'], price=item['price'], stock=0))
+            elif variant.price != item['price']:
+                variant.price = item['price']
+                updates.append(variant)
+        for (owner_id, size), variant in existing.items():
+            if owner_id == product_id and size not in sizes:
+                targets[(product_id, size)] = 0
+                deleted.append(variant.id)
+
+    if creates:
+        ProductVariant.objects.bulk_create(creates, batch_size=_chunk_size())
+    if updates:
+        ProductVariant.objects.bulk_update(updates, ['price'], batch_size=_chunk_size())
+    result.variants_created += len(creates)
+    result.variants_updated += len(updates)
+    return deleted
+
+
+def _apply_stock(targets: Dict[Tuple[int, str], int], result: ImportResult, reference: str):
+    """Ghi sổ chênh lệch giữa số tồn trong file và số tồn hiện tại (khóa dòng trong transaction của lô)"""
+    if not targets:
+        return
+    product_ids = {product_id for product_id, _ in targets}
+    sharded = set(StockShard.objects.filter(product_id__in=product_ids).values_list('product_id', 'size').distinct())
+    current = {
+        (product_id, ''): stock
+        for product_id, stock in Product.objects.select_for_update()
+        .filter(id__in={product_id for product_id, size in targets if not size}).values_list('id', 'stock')
+    }
+    current.update({
+        (product_id, size): stock
+        for product_id, size, stock in ProductVariant.objects.select_for_update()
+        .filter(product_id__in={product_id for product_id, size in targets if size})
+        .values_list('product_id', 'size', 'stock')
+    })
+
+    movements = []
+    for (product_id, size), stock in sorted(targets.items()):
+        if (product_id, size) in sharded:
+            # Hiếm: hàng bật shard đi qua set_stock để chia lại các shard
+            if set_stock(product_id, stock, size=size, reference=reference, note='Import sản phẩm'):
+                result.stock_movements += 1
+            continue
+        delta = stock - current.get((product_id, size), 0)
+        if delta:
+            movements.append(movement(
+                product_id, delta, 'restock' if delta > 0 else 'adjust', size,
+                reference=reference, note='Import sản phẩm',
+            ))
+    result.stock_movements += len(apply_movements(movements))
+
+
+def import_products(fileobj, file_format: str, chunk_size: Optional[int] = None, reindex: str = 'inline') -> ImportResult:
+    """
+    Import sản phẩm từ file CSV / XLSX (file nhị phân đang mở).
+
+    Args:
+        reindex: 'inline' đồng bộ ChromaDB trước khi trả về (lệnh quản trị),
+            'background' chạy ở thread nền sau commit (API), 'none' bỏ qua
+    """
+    from .signals import catalog_signals_suppressed
+
+    result = ImportResult()
+    reference = f"import:{timezone.now():%Y%m%d%H%M%S}"
+    touched = False
+    try:
+        with catalog_signals_suppressed():
+            for chunk in _chunks(iter_rows(fileobj, file_format), chunk_size or _chunk_size()):
+                parsed = []
+                for line, raw in chunk:
+                    try:
+                        parsed.append((line, parse_row(raw)))
+                    except ValueError as e:
+                        result.add_error(line, str(e))
+                if not parsed:
+                    continue
+                chunk_result = ImportResult(categories=dict(result.categories))
+                try:
+                    with transaction.atomic():
+                        _import_chunk(parsed, chunk_result, reference)
+                    result.merge(chunk_result)
+                    touched = True
+                except Exception as e:
+                    logger.exception(f"❌ Product import chunk starting at line {parsed[0][0]} failed")
+                    result.add_error(parsed[0][0], f'Lô dòng {parsed[0][0]}-{parsed[-1][0]} lỗi: {e}')
+    finally:
+        if touched:
+            refresh_indexes(reindex)
+
+    logger.info(
+        f"📦 Product import: {result.created} created, {result.updated} updated, "
+        f"{result.stock_movements} stock movements, {result.error_count} errors"
+    )
+    return result
+
+
+def refresh_indexes(reindex: str = 'inline'):
+    """Làm một lần những gì các signal catalog đã bị tắt trong lúc import"""
+    from .catalog import bump_catalog_version
+    from .facets import record_full_rebuild
+
+    bump_catalog_version(('category', 'product'))
+    record_full_rebuild()
+    if reindex == 'inline':
+        reindex_semantic()
+    elif reindex == 'background':
+        transaction.on_commit(_dispatch_reindex)
+
+
+def reindex_semantic():
+    """Đồng bộ embedding ChromaDB + sản phẩm tương tự (chỉ tài liệu đổi hash được upsert)"""
+    try:
+        from ai_agent.semantic_neighbors import build_semantic_neighbors
+        return build_semantic_neighbors()
+    except Exception as e:
+        # ChromaDB không bắt buộc (chưa cài / chưa khởi tạo): chạy build_similar_products sau
+        logger.warning(f"⚠️ Skipped ChromaDB reindex after product import: {e}")
+        return None
+
+
+def _dispatch_reindex():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-import-reindex')
+    _executor.submit(_reindex_in_thread)
+
+
+def _reindex_in_thread():
+    close_old_connections()
+    try:
+        reindex_semantic()
+    finally:
+        close_old_connections()
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def _format_variants(variants) -> str:
+    return '|'.join(f'{variant.size}:{variant.price}:{variant.stock}' for variant in variants)
+
+
+def iter_export_rows(queryset=None, chunk_size: int = 1000) -> Iterator[list]:
+    """Các dòng export (không gồm header), đọc theo chunk kèm biến thể"""
+    queryset = queryset if queryset is not None else Product.objects.all()
+    products = (
+        queryset.select_related('category').prefetch_related('variants')
+        .order_by('id').iterator(chunk_size=chunk_size)
+    )
+    for product in products:
+        specifications = product.specifications_dict
+        images = product.images_list
+        yield [
+            product.slug,
+            product.name,
+            product.category.name,
+            str(product.price),
+            str(product.old_price) if product.old_price is not None else '',
+            product.stock,
+            product.unit,
+            product.status,
+            product.description,
+            product.detail_description,
+            product.origin,
+            product.color,
+            product.weight,
+            product.preservation,
+            product.expiry,
+            product.certification,
+            json.dumps(specifications, ensure_ascii=False) if specifications else '',
+            json.dumps(images, ensure_ascii=False) if images else '',
+            _format_variants(product.variants.all()),
+        ]
+
+
+def export_products(output, file_format: str, queryset=None) -> int:
+    """Ghi toàn bộ sản phẩm vào `output` (file nhị phân). Trả về số dòng dữ liệu."""
+    count = 0
+    if file_format == 'csv':
+        text = io.TextIOWrapper(output, encoding='utf-8-sig', newline='')
+        writer = csv.writer(text)
+        writer.writerow(COLUMNS)
+        for row in iter_export_rows(queryset):
+            writer.writerow(row)
+            count += 1
+        text.flush()
+        text.detach()
+        return count
+
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sản phẩm')
+    sheet.append(COLUMNS)
+    for row in iter_export_rows(queryset):
+        sheet.append(row)
+        count += 1
+    workbook.save(output)
+    return count
+
+
+def export_file(file_format: str, queryset=None):
+    """Export ra file tạm (tự xóa khi đóng), đã tua về đầu, như orders/reports.py"""
+    export = tempfile.TemporaryFile()
+    try:
+        export_products(export, file_format, queryset)
+    except Exception:
+        export.close()
+        raise
+    export.seek(0)
+    return export
@@ -0,0 +1,104 @@
+"""
+HTTP cache theo phiên bản catalog cho các endpoint đọc sản phẩm / danh mục.
+
+- bump_catalog_version(): gọi khi sản phẩm, biến thể, ảnh hoặc danh mục thay
+  đổi (signals.py + các chỗ ghi bằng queryset.update()); đồng thời vô hiệu hóa
+  cache phản hồi phía server gắn tag tương ứng (backend/response_cache.py).
+- @catalog_cached: ETag = hash(version, khung thời gian, URL). If-None-Match
+  khớp thì trả 304 ngay, trước khi queryset nào được chạy. Phản hồi cho khách
+  vãng lai có Cache-Control public để CDN / trình duyệt dùng lại; request có
+  Authorization nhận private, no-cache (revalidate mỗi lần).
+
+Tồn kho và lượt bán đổi theo từng đơn hàng (F() update, không qua signal) nên
+không tăng version, tránh biến dòng version thành điểm nóng. Thay vào đó ETag
+đổi theo khung CATALOG_CACHE_MAX_AGE giây: số tồn hiển thị trễ tối đa chừng đó,
+giống với max-age của CDN. Tồn kho thật vẫn được kiểm tra lúc đặt hàng.
+"""
+import functools
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from backend.response_cache import invalidate_tags
+
+from .models import CatalogVersion
+
+SINGLETON_ID = 1
+
+
+def bump_catalog_version(tags=('product',)):
+    """Tăng phiên bản catalog (một câu UPDATE theo khóa chính) và vô hiệu hóa cache theo tags"""
+    invalidate_tags(*tags)
+    now = timezone.now()
+    updated = CatalogVersion.objects.filter(pk=SINGLETON_ID).update(version=F('version') + 1, updated_at=now)
+    if not updated:
+        CatalogVersion.objects.get_or_create(pk=SINGLETON_ID, defaults={'version': 1, 'updated_at': now})
+
+
+def current_catalog_version():
+    """(version, updated_at) hiện tại"""
+    row = CatalogVersion.objects.filter(pk=SINGLETON_ID).values_list('version', 'updated_at').first()
+    return row or (0, datetime(2000, 1, 1, tzinfo=dt_timezone.utc))
+
+
+def _max_age() -> int:
+    return getattr(settings, 'CATALOG_CACHE_MAX_AGE', 60)
+
+
+def catalog_validators(request):
+    """(ETag, Last-Modified dạng timestamp) cho request hiện tại"""
+    version, updated_at = current_catalog_version()
+    max_age = max(_max_age(), 1)
+    window = int(time.time()) // max_age
+    raw = f"{version}:{window}:{request.get_full_path()}"
+    etag = f'W/"{hashlib.md5(raw.encode("utf-8")).hexdigest()}"'
+    last_modified = max(updated_at.timestamp(), window * max_age)
+    return etag, last_modified
+
+
+def _apply_headers(request, response, etag: str, last_modified: float):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if 'HTTP_AUTHORIZATION' in request.META:
+        # Request có đăng nhập (vd admin vừa sửa sản phẩm): luôn revalidate, vẫn được 304 rẻ
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=_max_age(),
+            stale_while_revalidate=getattr(settings, 'CATALOG_CACHE_STALE_WHILE_REVALIDATE', 300),
+        )
+    return response
+
+
+def catalog_cached(view_method):
+    """Decorator cho action GET của ViewSet catalog: ETag / 304 / Cache-Control"""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_method(self, request, *args, **kwargs)
+
+        etag, last_modified = catalog_validators(request)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            not_modified = etag in parse_etags(if_none_match)
+        else:
+            since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            not_modified = since is not None and int(last_modified) <= since
+        if not_modified:
+            return _apply_headers(request, Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            _apply_headers(request, response, etag, last_modified)
+        return response
+    return wrapper
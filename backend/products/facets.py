@@ -0,0 +1,260 @@
+"""
+Chỉ mục facet dạng bitmap cho lọc catalog (danh mục, khoảng giá, kích thước, màu, xuất xứ).
+
+Mỗi giá trị facet là một bitmap (int Python, bit thứ i = sản phẩm id i) của các
+sản phẩm đang bán. Lọc = AND giữa các facet, OR giữa các giá trị cùng facet;
+số đếm = popcount, nên thêm bộ lọc không thêm câu SQL nào. Số đếm của một facet
+bỏ qua chính bộ lọc của facet đó (chọn "Hồng" vẫn thấy số lượng các màu khác).
+
+Chỉ mục nằm trong bộ nhớ từng process. Sản phẩm / biến thể thay đổi thì
+record_product_change() ghi id vào nhật ký thay đổi trong cache dùng chung
+(facets:seq + facets:change:<n>); lần tra cứu sau mỗi process chỉ nạp lại các
+sản phẩm trong nhật ký. Nhật ký bị mất (evict) hoặc quá dài, hay danh mục đổi
+tên, thì dựng lại toàn bộ (2 câu SQL).
+"""
+import re
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+FACETS = ('category', 'price', 'size', 'color', 'origin')
+
+SEQ_KEY = 'facets:seq'
+CHANGE_KEY = 'facets:change:{}'
+CHANGE_TTL = 24 * 3600
+REBUILD = 'rebuild'
+# Quá số thay đổi này thì dựng lại toàn bộ thay vì nạp từng sản phẩm
+MAX_REPLAY = 500
+
+_index = None
+_lock = threading.Lock()
+
+
+def price_boundaries():
+    return sorted(getattr(settings, 'FACET_PRICE_BUCKETS', [100000, 200000, 500000, 1000000]))
+
+
+def price_bucket(price) -> str:
+    """Nhãn khoảng giá chứa price, vd '100000-200000' hoặc '1000000+'"""
+    lower = 0
+    for upper in price_boundaries():
+        if Decimal(price) < upper:
+            return f"{lower}-{upper}"
+        lower = upper
+    return f"{lower}+"
+
+
+def price_buckets():
+    """Các nhãn khoảng giá theo thứ tự tăng dần"""
+    labels, lower = [], 0
+    for upper in price_boundaries():
+        labels.append(f"{lower}-{upper}")
+        lower = upper
+    return labels + [f"{lower}+"]
+
+
+def _natural_key(value: str):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', value)]
+
+
+def _load(product_ids=None):
+    """{product_id: {facet: set(giá trị)}} và {category_id: tên} của sản phẩm đang bán"""
+    from .models import Product, ProductVariant
+
+    products = Product.objects.filter(status='active')
+    variants = ProductVariant.objects.filter(product__status='active')
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+        variants = variants.filter(product_id__in=product_ids)
+
+    values, labels = {}, {}
+    for row in products.values('id', 'category_id', 'category__name', 'price', 'color', 'origin'):
+        entry = {facet: set() for facet in FACETS}
+        if row['category_id']:
+            entry['category'].add(str(row['category_id']))
+            labels[str(row['category_id'])] = row['category__name']
+        entry['price'].add(price_bucket(row['price']))
+        for facet in ('color', 'origin'):
+            if (row[facet] or '').strip():
+                entry[facet].add(row[facet].strip())
+        values[row['id']] = entry
+    for product_id, size in variants.values_list('product_id', 'size'):
+        if product_id in values and (size or '').strip():
+            values[product_id]['size'].add(size.strip())
+    return values, labels
+
+
+class FacetIndex:
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.universe = 0
+        self.bitmaps = {facet: {} for facet in FACETS}
+        self.labels = {}
+        self.values = {}
+
+    @classmethod
+    def build(cls, seq: int) -> 'FacetIndex':
+        index = cls(seq)
+        values, index.labels = _load()
+        for product_id, entry in values.items():
+            index._add(product_id, entry)
+        return index
+
+    def _add(self, product_id: int, entry: dict):
+        bit = 1 << product_id
+        self.universe |= bit
+        for facet, facet_values in entry.items():
+            bitmaps = self.bitmaps[facet]
+            for value in facet_values:
+                bitmaps[value] = bitmaps.get(value, 0) | bit
+        self.values[product_id] = entry
+
+    def _remove(self, product_id: int):
+        mask = ~(1 << product_id)
+        self.universe &= mask
+        for facet, facet_values in self.values.pop(product_id, {}).items():
+            bitmaps = self.bitmaps[facet]
+            for value in facet_values:
+                bitmap = bitmaps.get(value, 0) & mask
+                if bitmap:
+                    bitmaps[value] = bitmap
+                else:
+                    bitmaps.pop(value, None)
+
+    def refresh(self, product_ids):
+        """Nạp lại một số sản phẩm (2 câu SQL với id__in)"""
+        values, labels = _load(product_ids)
+        for product_id in product_ids:
+            self._remove(product_id)
+        for product_id, entry in values.items():
+            self._add(product_id, entry)
+        self.labels.update(labels)
+
+    def search(self, selected: dict, base: int = None):
+        """
+        Args:
+            selected: {facet: [giá trị, ...]} đang chọn
+            base: bitmap giới hạn thêm (vd kết quả tìm kiếm theo tên), None = tất cả
+
+        Returns:
+            (bitmap sản phẩm khớp, {facet: {giá trị: số sản phẩm}})
+        """
+        universe = self.universe if base is None else self.universe & base
+        masks = {}
+        for facet, chosen in selected.items():
+            if facet in self.bitmaps and chosen:
+                mask = 0
+                for value in chosen:
+                    mask |= self.bitmaps[facet].get(value, 0)
+                masks[facet] = mask
+
+        matched = universe
+        for mask in masks.values():
+            matched &= mask
+
+        counts = {}
+        for facet in FACETS:
+            scope = universe
+            for other, mask in masks.items():
+                if other != facet:
+                    scope &= mask
+            counts[facet] = {value: (bitmap & scope).bit_count() for value, bitmap in self.bitmaps[facet].items()}
+        return matched, counts
+
+
+def bitmap_ids(bitmap: int):
+    """Danh sách id (tăng dần) có bit bật trong bitmap"""
+    ids = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        ids.append(lowest.bit_length() - 1)
+        bitmap ^= lowest
+    return ids
+
+
+def ids_bitmap(ids) -> int:
+    bitmap = 0
+    for product_id in ids:
+        bitmap |= 1 << product_id
+    return bitmap
+
+
+def _current_seq() -> int:
+    seq = cache.get(SEQ_KEY)
+    if seq is None:
+        # Khởi tạo theo thời gian: nhật ký bị mất rồi tạo lại không trùng số thứ tự cũ
+        cache.add(SEQ_KEY, int(time.time() * 1000), timeout=None)
+        seq = cache.get(SEQ_KEY)
+    return seq
+
+
+def _sync() -> FacetIndex:
+    global _index
+    seq = _current_seq()
+    if _index is None or not (0 <= seq - _index.seq <= MAX_REPLAY):
+        _index = FacetIndex.build(seq)
+    elif seq > _index.seq:
+        keys = [CHANGE_KEY.format(n) for n in range(_index.seq + 1, seq + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys) or REBUILD in changes.values():
+            _index = FacetIndex.build(seq)
+        else:
+            _index.refresh(set(changes.values()))
+            _index.seq = seq
+    return _index
+
+
+def facet_search(selected: dict, base: int = None):
+    """Tra cứu trên chỉ mục đã đồng bộ, trả về (danh sách id khớp, số đếm kèm nhãn theo facet)"""
+    with _lock:
+        index = _sync()
+        matched, counts = index.search(selected, base)
+        labels = dict(index.labels)
+
+    positions = {label: position for position, label in enumerate(price_buckets())}
+    ordering = {
+        'category': lambda value: labels.get(value, value).lower(),
+        'price': lambda value: positions.get(value, len(positions)),
+    }
+    facets = {}
+    for facet in FACETS:
+        sort_key = ordering.get(facet, _natural_key)
+        facets[facet] = [
+            {
+                'value': value,
+                'label': labels.get(value, value) if facet == 'category' else value,
+                'count': count,
+            }
+            for value, count in sorted(counts[facet].items(), key=lambda item: sort_key(item[0]))
+        ]
+    return bitmap_ids(matched), facets
+
+
+def _append_change(value):
+    try:
+        seq = cache.incr(SEQ_KEY)
+    except ValueError:
+        _current_seq()
+        seq = cache.incr(SEQ_KEY)
+    cache.set(CHANGE_KEY.format(seq), value, timeout=CHANGE_TTL)
+
+
+def _record(value):
+    # Ghi ngay và thêm một lần sau commit: process đọc dữ liệu trước commit sẽ nạp lại lần nữa
+    _append_change(value)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _append_change(value))
+
+
+def record_product_change(product_id: int):
+    """Sản phẩm hoặc biến thể của nó thay đổi (signals.py)"""
+    _record(product_id)
+
+
+def record_full_rebuild():
+    """Thay đổi ảnh hưởng nhiều sản phẩm (danh mục đổi tên / bị xóa, import hàng loạt)"""
+    _record(REBUILD)
@@ -0,0 +1,185 @@
+"""
+Ảnh thu nhỏ (derivative) cho ảnh sản phẩm.
+
+Ảnh gốc upload lên được giữ nguyên; sau khi lưu, ảnh được thu nhỏ về các độ
+rộng PRODUCT_IMAGE_WIDTHS ở hai định dạng WebP và JPEG (fallback). Tên file
+chứa hash nội dung (products/derived/<tên>-<w>w.<hash>.webp) nên có thể cache
+vĩnh viễn (immutable): ảnh đổi thì tên đổi.
+
+Thông tin ảnh thu nhỏ lưu trong Product.main_image_variants / ProductImage.variants:
+    {'source': <tên ảnh gốc>, 'width': ..., 'height': ...,
+     'webp': [{'width': 200, 'path': ...}, ...], 'jpeg': [...]}
+'source' khác tên ảnh hiện tại nghĩa là ảnh đã đổi và cần xử lý lại.
+
+Xử lý chạy sau khi commit ở thread nền (signals.py), lệnh
+build_image_derivatives xử lý bù cho ảnh đã có.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = 'products/derived'
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivative_widths():
+    return sorted(set(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', [200, 400, 800])))
+
+
+def needs_refresh(field_file, variants) -> bool:
+    """Ảnh có nhưng chưa có ảnh thu nhỏ tương ứng (mới upload hoặc vừa đổi)"""
+    return bool(field_file) and (variants or {}).get('source') != field_file.name
+
+
+def _encode(image, pil_format, options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def build_derivatives(field_file) -> dict:
+    """Sinh và lưu ảnh thu nhỏ cho một ảnh gốc. Trả về dict lưu vào *_variants."""
+    from PIL import Image, ImageOps
+
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    stem = os.path.splitext(os.path.basename(field_file.name))[0][:60]
+
+    # Ảnh nhỏ hơn độ rộng yêu cầu thì không phóng to; luôn có ít nhất một bản
+    widths = [width for width in derivative_widths() if width < image.width] or [image.width]
+    result = {'source': field_file.name, 'width': image.width, 'height': image.height}
+    for ext, pil_format, options in FORMATS:
+        entries = []
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+            if pil_format == 'JPEG' and resized.mode == 'RGBA':
+                background = Image.new('RGB', resized.size, (255, 255, 255))
+                background.paste(resized, mask=resized.getchannel('A'))
+                resized = background
+            content = _encode(resized, pil_format, options)
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            path = f"{DERIVED_DIR}/{stem}-{width}w.{digest}.{ext}"
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(content))
+            entries.append({'width': width, 'path': path})
+        result[ext] = entries
+    return result
+
+
+def _delete_stale(storage, old: dict, new: dict):
+    keep = {entry['path'] for ext, _, _ in FORMATS for entry in new.get(ext, [])}
+    for ext, _, _ in FORMATS:
+        for entry in (old or {}).get(ext, []):
+            if entry['path'] not in keep:
+                storage.delete(entry['path'])
+
+
+def refresh_product_images(product_id: int, force: bool = False) -> int:
+    """Sinh ảnh thu nhỏ còn thiếu cho ảnh chính + ảnh phụ của sản phẩm. Trả về số ảnh đã xử lý."""
+    from .models import Product, ProductImage
+
+    product = Product.objects.filter(pk=product_id).only('id', 'main_image', 'main_image_variants').first()
+    if product is None:
+        return 0
+
+    targets = [(Product, product, 'main_image', 'main_image_variants')]
+    targets += [
+        (ProductImage, image, 'image', 'variants')
+        for image in ProductImage.objects.filter(product_id=product_id).only('id', 'image', 'variants')
+    ]
+
+    processed = 0
+    for model, obj, image_field, variants_field in targets:
+        field_file = getattr(obj, image_field)
+        old = getattr(obj, variants_field)
+        if not (force and field_file) and not needs_refresh(field_file, old):
+            continue
+        try:
+            new = build_derivatives(field_file)
+        except Exception as e:
+            # Ghi nhận lỗi để các lần save sau không xếp hàng xử lý lại mãi một file hỏng
+            logger.exception(f"❌ Failed to build image derivatives for {field_file.name}")
+            new = {'source': field_file.name, 'error': str(e)[:200]}
+        # update() có điều kiện: không ghi đè nếu ảnh đã bị đổi tiếp trong lúc xử lý
+        model.objects.filter(pk=obj.pk, **{image_field: field_file.name}).update(**{variants_field: new})
+        _delete_stale(field_file.storage, old, new)
+        processed += 1
+    if processed:
+        from .catalog import bump_catalog_version
+        bump_catalog_version()
+    return processed
+
+
+def schedule_image_processing(product_id: int):
+    """Hẹn xử lý ảnh của sản phẩm sau khi transaction hiện tại commit"""
+    transaction.on_commit(lambda: _dispatch(product_id))
+
+
+def _dispatch(product_id: int):
+    if getattr(settings, 'IMAGE_PROCESSING_RUN_INLINE', False):
+        refresh_product_images(product_id)
+        return
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+    _executor.submit(_process_in_thread, product_id)
+
+
+def _process_in_thread(product_id: int):
+    close_old_connections()
+    try:
+        refresh_product_images(product_id)
+    except Exception:
+        logger.exception(f"❌ Image derivative worker failed for product {product_id}")
+    finally:
+        close_old_connections()
+
+
+def image_srcset(variants, request=None, base_url: str = '') -> Optional[dict]:
+    """
+    URL sẵn cho thẻ <img srcset> / <picture>.
+
+    Returns:
+        {'webp': 'url 200w, url 400w', 'jpeg': '...', 'thumbnail': <JPEG nhỏ nhất>}
+        hoặc None nếu ảnh chưa được xử lý
+    """
+    if not variants or not variants.get('jpeg'):
+        return None
+    from django.core.files.storage import default_storage
+
+    def url(path):
+        value = default_storage.url(path)
+        if value.startswith('http'):
+            return value
+        return request.build_absolute_uri(value) if request else base_url.rstrip('/') + value
+
+    result = {
+        ext: ', '.join(f"{url(entry['path'])} {entry['width']}w" for entry in variants.get(ext, []))
+        for ext, _, _ in FORMATS
+    }
+    result['thumbnail'] = url(variants['jpeg'][0]['path'])
+    return result
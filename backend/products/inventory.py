@@ -0,0 +1,368 @@
+"""
+Sổ cái tồn kho: mọi thay đổi tồn kho đi qua đây thay vì product.save().
+
+- apply_movements(): ghi các dòng InventoryMovement (một INSERT) và cộng số dư
+  bằng UPDATE ... SET stock = stock + delta cho từng sản phẩm / biến thể, trong
+  cùng transaction. Hai request đồng thời không còn ghi đè số tồn của nhau.
+- set_stock(): admin đặt số tồn tuyệt đối -> ghi một dòng điều chỉnh theo chênh lệch.
+- compact_ledger(): chốt số dư (InventorySnapshot) theo định kỳ.
+- stock_at(): dựng lại số tồn tại một thời điểm bất kỳ từ snapshot + sổ cái.
+
+Sản phẩm / biến thể bán chạy có thể bật chế độ shard (enable_stock_shards):
+tồn kho chia ra N dòng StockShard, mỗi lượt bán trừ một shard ngẫu nhiên nên các
+checkout đồng thời không cùng chờ khóa một dòng. rebalance_stock_shards() chạy
+nền để san đều các shard và cập nhật số hiển thị trên dòng gốc; giữa hai lần chạy
+cột stock có thể lệch, nên kiểm tra đủ hàng dùng available_stock() và phần hiển
+thị dùng overlay_sharded_stock().
+"""
+import logging
+import random
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .models import InventoryMovement, InventorySnapshot, Product, ProductVariant, StockShard
+
+logger = logging.getLogger(__name__)
+
+StockKey = Tuple[int, str]
+
+
+class InsufficientStock(Exception):
+    """Không đủ tồn kho để xuất"""
+
+    def __init__(self, product_id: int, size: str = ''):
+        self.product_id = product_id
+        self.size = size
+        super().__init__(f'Không đủ tồn kho cho sản phẩm {product_id}' + (f' (Size {size})' if size else ''))
+
+
+def _stock_queryset(product_id: int, size: str):
+    if size:
+        return ProductVariant.objects.filter(product_id=product_id, size=size)
+    return Product.objects.filter(pk=product_id)
+
+
+def movement(product_id: int, quantity: int, kind: str, size: str = '', reference: str = '', note: str = '') -> InventoryMovement:
+    return InventoryMovement(
+        product_id=product_id, size=size or '', kind=kind, quantity=quantity,
+        reference=reference, note=note,
+    )
+
+
+@transaction.atomic
+def apply_movements(movements: Iterable[InventoryMovement], check_stock: bool = False) -> List[InventoryMovement]:
+    """
+    Cộng các biến động vào số dư và ghi sổ.
+
+    Args:
+        movements: các InventoryMovement chưa lưu (xem movement())
+        check_stock: True thì chỉ xuất khi đủ hàng (UPDATE ... WHERE stock >= n),
+            thiếu hàng -> InsufficientStock và rollback toàn bộ
+
+    Returns:
+        Các dòng đã ghi sổ. Biến động của sản phẩm / biến thể không còn tồn tại bị bỏ qua.
+    """
+    movements = [item for item in movements if item.quantity]
+    deltas: Dict[StockKey, int] = defaultdict(int)
+    for item in movements:
+        deltas[(item.product_id, item.size)] += item.quantity
+
+    sharded = _shard_counts(key for key, delta in deltas.items() if delta)
+    missing = set()
+    # Cập nhật theo thứ tự khóa cố định để các transaction đồng thời không deadlock
+    for (product_id, size), delta in sorted(deltas.items()):
+        if not delta:
+            # Các dòng bù trừ nhau (vd giữ hàng -> bán): chỉ ghi sổ, số dư không đổi
+            continue
+        if (product_id, size) in sharded:
+            if not _apply_sharded(product_id, size, delta, sharded[(product_id, size)], check_stock):
+                raise InsufficientStock(product_id, size)
+            continue
+        queryset = _stock_queryset(product_id, size)
+        if check_stock and delta < 0:
+            queryset = queryset.filter(stock__gte=-delta)
+        if queryset.update(stock=F('stock') + delta):
+            continue
+        if check_stock and delta < 0:
+            raise InsufficientStock(product_id, size)
+        logger.warning(f"⚠️ Bỏ qua biến động tồn kho của {product_id}/{size or '-'}: không còn tồn tại")
+        missing.add((product_id, size))
+
+    recorded = [item for item in movements if (item.product_id, item.size) not in missing]
+    InventoryMovement.objects.bulk_create(recorded)
+    return recorded
+
+
+@transaction.atomic
+def set_stock(product_id: int, stock: int, size: str = '', reference: str = '', note: str = '') -> int:
+    """
+    Đặt số tồn tuyệt đối (admin nhập tay). Khóa dòng để tính chênh lệch chính xác,
+    ghi 'restock' nếu tăng, 'adjust' nếu giảm.
+
+    Returns:
+        Chênh lệch đã ghi sổ
+    """
+    shards = _lock_shards(product_id, size)
+    if shards:
+        current = sum(shard.stock for shard in shards)
+    else:
+        current = _stock_queryset(product_id, size).select_for_update().values_list('stock', flat=True).first()
+        if current is None:
+            return 0
+    delta = int(stock) - current
+    if not delta:
+        return 0
+
+    entry = movement(product_id, delta, 'restock' if delta > 0 else 'adjust', size, reference, note)
+    if shards:
+        _spread(shards, int(stock))
+        _stock_queryset(product_id, size).update(stock=int(stock))
+        entry.save()
+    else:
+        apply_movements([entry])
+    return delta
+
+
+# ---------------------------------------------------------------------------
+# Shard tồn kho cho hàng bán chạy
+# ---------------------------------------------------------------------------
+
+def _shard_counts(keys: Iterable[StockKey]) -> Dict[StockKey, int]:
+    """{(product_id, size): số shard} cho các key đang bật shard (một truy vấn)"""
+    keys = list(keys)
+    if not keys:
+        return {}
+    condition = Q()
+    for product_id, size in keys:
+        condition |= Q(product_id=product_id, size=size)
+    rows = StockShard.objects.filter(condition).values('product_id', 'size').annotate(count=Count('id')).order_by()
+    return {(row['product_id'], row['size']): row['count'] for row in rows}
+
+
+def _lock_shards(product_id: int, size: str) -> List[StockShard]:
+    return list(StockShard.objects.filter(product_id=product_id, size=size).select_for_update().order_by('shard'))
+
+
+def _spread(shards: List[StockShard], total: int):
+    """Chia đều total cho các shard (phần dư dồn vào các shard đầu)"""
+    base, remainder = divmod(total, len(shards))
+    for index, shard in enumerate(shards):
+        shard.stock = base + (1 if index < remainder else 0)
+    StockShard.objects.bulk_update(shards, ['stock'])
+
+
+def _apply_sharded(product_id: int, size: str, delta: int, shard_count: int, check_stock: bool) -> bool:
+    """
+    Cộng / trừ tồn kho trên shard. Nhập: cộng vào một shard ngẫu nhiên. Xuất:
+    thử lần lượt từ một shard ngẫu nhiên (UPDATE ... WHERE stock >= n); không
+    shard nào đủ một mình thì khóa tất cả và lấy dần. False nếu tổng không đủ.
+    """
+    shards = StockShard.objects.filter(product_id=product_id, size=size)
+    start = random.randrange(shard_count)
+    if delta > 0 or not check_stock:
+        return bool(shards.filter(shard=start).update(stock=F('stock') + delta))
+
+    need = -delta
+    for offset in range(shard_count):
+        if shards.filter(shard=(start + offset) % shard_count, stock__gte=need).update(stock=F('stock') - need):
+            return True
+
+    locked = _lock_shards(product_id, size)
+    if sum(shard.stock for shard in locked) < need:
+        return False
+    for shard in locked:
+        take = min(max(shard.stock, 0), need)
+        shard.stock -= take
+        need -= take
+    StockShard.objects.bulk_update(locked, ['stock'])
+    return True
+
+
+def available_stock(product_id: int, size: str = '', fallback: Optional[int] = None) -> int:
+    """
+    Tồn kho thật: tổng các shard nếu đang bật shard, không thì cột stock.
+
+    Cột stock của key đang bật shard chỉ là số hiển thị (rebalance_stock_shards()
+    mới cập nhật), nên mọi kiểm tra đủ hàng phải đi qua đây. fallback: số stock
+    đã đọc sẵn trên instance, dùng khi key không bật shard (khỏi đọc lại).
+    """
+    total = StockShard.objects.filter(product_id=product_id, size=size or '').aggregate(total=Sum('stock'))['total']
+    if total is not None:
+        return total
+    if fallback is not None:
+        return fallback
+    return _stock_queryset(product_id, size or '').values_list('stock', flat=True).first() or 0
+
+
+def sharded_stock_totals(product_ids: Iterable[int]) -> Dict[StockKey, int]:
+    """{(product_id, size): tổng shard} của các key đang bật shard (một truy vấn)"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+    rows = (
+        StockShard.objects.filter(product_id__in=product_ids)
+        .values('product_id', 'size').annotate(total=Sum('stock')).order_by()
+    )
+    return {(row['product_id'], row['size']): row['total'] for row in rows}
+
+
+def overlay_sharded_stock(products: Iterable[Product]) -> List[Product]:
+    """
+    Thay stock (trong bộ nhớ) của sản phẩm / biến thể đã prefetch bằng tổng
+    shard cho các key đang bật shard, để giỏ hàng / chatbot hiển thị số thật.
+    Ghi thêm product.shard_stock = {size: tổng} cho biến thể chưa prefetch.
+    """
+    products = [product for product in products if product is not None]
+    totals = sharded_stock_totals(product.pk for product in products)
+    for product in products:
+        product.shard_stock = {size: total for (product_id, size), total in totals.items() if product_id == product.pk}
+        if '' in product.shard_stock:
+            product.stock = product.shard_stock['']
+        for variant in getattr(product, '_prefetched_objects_cache', {}).get('variants', ()):
+            if variant.size in product.shard_stock:
+                variant.stock = product.shard_stock[variant.size]
+    return products
+
+
+@transaction.atomic
+def enable_stock_shards(product_id: int, shard_count: int, size: str = '') -> int:
+    """Bật (hoặc đổi số) shard: chuyển toàn bộ tồn kho hiện có sang shard_count shard"""
+    if shard_count < 1:
+        raise ValueError('shard_count phải >= 1')
+    shards = _lock_shards(product_id, size)
+    if shards:
+        total = sum(shard.stock for shard in shards)
+    else:
+        total = _stock_queryset(product_id, size).select_for_update().values_list('stock', flat=True).first()
+        if total is None:
+            raise ValueError(f'Không tìm thấy tồn kho {product_id}/{size or "-"}')
+    StockShard.objects.filter(product_id=product_id, size=size).delete()
+    shards = StockShard.objects.bulk_create([
+        StockShard(product_id=product_id, size=size, shard=index) for index in range(shard_count)
+    ])
+    _spread(shards, total)
+    _stock_queryset(product_id, size).update(stock=total)
+    return total
+
+
+@transaction.atomic
+def disable_stock_shards(product_id: int, size: str = '') -> int:
+    """Gộp các shard về lại cột stock của dòng gốc"""
+    shards = _lock_shards(product_id, size)
+    if not shards:
+        return _stock_queryset(product_id, size).values_list('stock', flat=True).first() or 0
+    total = sum(shard.stock for shard in shards)
+    _stock_queryset(product_id, size).update(stock=total)
+    StockShard.objects.filter(product_id=product_id, size=size).delete()
+    return total
+
+
+def rebalance_stock_shards() -> int:
+    """
+    San đều tồn kho giữa các shard của từng sản phẩm / biến thể (shard cạn làm
+    lượt bán phải thử nhiều shard) và cập nhật số hiển thị trên dòng gốc.
+    Mỗi key một transaction ngắn. Trả về số key đã xử lý.
+    """
+    keys = list(StockShard.objects.values_list('product_id', 'size').distinct().order_by('product_id', 'size'))
+    for product_id, size in keys:
+        with transaction.atomic():
+            shards = _lock_shards(product_id, size)
+            if not shards:
+                continue
+            total = sum(shard.stock for shard in shards)
+            if any(shard.stock != total // len(shards) + (1 if index < total % len(shards) else 0)
+                   for index, shard in enumerate(shards)):
+                _spread(shards, total)
+            _stock_queryset(product_id, size).exclude(stock=total).update(stock=total)
+    return len(keys)
+
+
+def _latest_snapshots(keys: Iterable[StockKey], before=None) -> Dict[StockKey, InventorySnapshot]:
+    keys = list(keys)
+    if not keys:
+        return {}
+    condition = Q()
+    for product_id, size in keys:
+        condition |= Q(product_id=product_id, size=size)
+    queryset = InventorySnapshot.objects.filter(condition)
+    if before is not None:
+        queryset = queryset.filter(taken_at__lte=before)
+    latest = {}
+    for snapshot in queryset.order_by('taken_at', 'id'):
+        latest[(snapshot.product_id, snapshot.size)] = snapshot
+    return latest
+
+
+def compact_ledger(settle_seconds: int = 300, chunk_size: int = 500) -> Dict[str, int]:
+    """
+    Chốt số dư mới cho các sản phẩm / biến thể có biến động kể từ lần chốt trước.
+
+    Chỉ cộng biến động cũ hơn settle_seconds: transaction đang chạy có thể đã cấp
+    id nhỏ hơn nhưng chưa commit, bỏ qua chúng sẽ làm lệch snapshot.
+
+    Returns:
+        {'snapshots': số snapshot mới, 'movements': số biến động được cộng}
+    """
+    now = timezone.now()
+    previous_watermark = InventorySnapshot.objects.aggregate(value=Max('last_movement_id'))['value'] or 0
+    watermark = InventoryMovement.objects.filter(
+        id__gt=previous_watermark, created_at__lte=now - timedelta(seconds=settle_seconds)
+    ).aggregate(value=Max('id'))['value']
+    if not watermark:
+        return {'snapshots': 0, 'movements': 0}
+
+    rows = list(
+        InventoryMovement.objects.filter(id__gt=previous_watermark, id__lte=watermark)
+        .values('product_id', 'size')
+        .annotate(total=Sum('quantity'), count=Count('id'))
+        .order_by('product_id', 'size')
+    )
+    created = 0
+    with transaction.atomic():
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            latest = _latest_snapshots((row['product_id'], row['size']) for row in chunk)
+            snapshots = []
+            for row in chunk:
+                previous = latest.get((row['product_id'], row['size']))
+                snapshots.append(InventorySnapshot(
+                    product_id=row['product_id'],
+                    size=row['size'],
+                    balance=(previous.balance if previous else 0) + row['total'],
+                    last_movement_id=watermark,
+                    taken_at=now,
+                ))
+            InventorySnapshot.objects.bulk_create(snapshots)
+            created += len(chunk)
+
+    movements = sum(row['count'] for row in rows)
+    logger.info(f"📦 Compacted inventory ledger: {movements} movements -> {created} snapshots (<= #{watermark})")
+    return {'snapshots': created, 'movements': movements}
+
+
+def stock_at(product_id: int, at, size: str = '') -> Optional[int]:
+    """
+    Số tồn của sản phẩm / biến thể tại thời điểm `at` (audit).
+
+    = snapshot gần nhất trước `at` + tổng biến động sau snapshot đó đến `at`.
+    Trả về None nếu `at` trước khi bắt đầu ghi sổ cho sản phẩm này.
+    """
+    key = (product_id, size or '')
+    snapshot = _latest_snapshots([key], before=at).get(key)
+    if snapshot is None:
+        # Sản phẩm có số dư đầu kỳ nhưng `at` trước lúc mở sổ -> không dựng lại được
+        if InventorySnapshot.objects.filter(product_id=product_id, size=key[1], last_movement_id=0).exists():
+            return None
+        base, after_id = 0, 0
+    else:
+        base, after_id = snapshot.balance, snapshot.last_movement_id
+
+    total = InventoryMovement.objects.filter(
+        product_id=product_id, size=key[1], id__gt=after_id, created_at__lte=at
+    ).aggregate(total=Sum('quantity'))['total'] or 0
+    return base + total
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+
+class Command(BaseCommand):
+    help = 'Measure concurrent checkout throughput on one hot product versus stock shard count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 1, 2, 4, 8, 16],
+                            help='Shard counts to compare (0 = single stock row)')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent checkout workers')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+
+    def _run(self, product_id, threads, seconds):
+        from products.inventory import InsufficientStock, apply_movements, movement
+
+        done = []
+        conflicts = []
+        deadline = time.perf_counter() + seconds
+
+        def worker():
+            count = failed = 0
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        apply_movements([movement(product_id, -1, 'sale', reference='benchmark')], check_stock=True)
+                        count += 1
+                    except (OperationalError, InsufficientStock):
+                        failed += 1
+            finally:
+                connection.close()
+            done.append(count)
+            conflicts.append(failed)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return sum(done), sum(conflicts), elapsed
+
+    def handle(self, *args, **options):
+        from categories.models import Category
+        from products.inventory import available_stock, disable_stock_shards, enable_stock_shards
+        from products.models import Product
+
+        category, _ = Category.objects.get_or_create(name='Benchmark stock shards')
+        product = Product.objects.create(name='Benchmark hot product', category=category, price=100000,
+                                         stock=10 ** 9, status='inactive')
+        self.stdout.write(f"{options['threads']} threads, {options['seconds']}s per run, backend {connection.vendor}")
+        try:
+            for shard_count in options['shards']:
+                if shard_count:
+                    enable_stock_shards(product.id, shard_count)
+                else:
+                    disable_stock_shards(product.id)
+                checkouts, failed, elapsed = self._run(product.id, options['threads'], options['seconds'])
+                self.stdout.write(
+                    f"shards={shard_count:>3}: {checkouts / elapsed:9.1f} checkouts/s "
+                    f"({checkouts} ok, {failed} lock errors), stock left {available_stock(product.id)}"
+                )
+        finally:
+            product.delete()
+            if not category.products.exists():
+                category.delete()
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP/JPEG thumbnails for existing product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if thumbnails are up to date')
+        parser.add_argument('--chunk-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        from django.db.models import Q
+        from products.images import refresh_product_images
+        from products.models import Product
+
+        products = Product.objects.filter(
+            Q(main_image__gt='') | Q(product_images__isnull=False)
+        ).order_by('id')
+
+        last_id = 0
+        processed = 0
+        while True:
+            ids = list(
+                products.filter(id__gt=last_id).values_list('id', flat=True).distinct()[:options['chunk_size']]
+            )
+            if not ids:
+                break
+            for product_id in ids:
+                processed += refresh_product_images(product_id, force=options['force'])
+            last_id = ids[-1]
+            self.stdout.write(f"... up to product {last_id}: {processed} images processed")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} images"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Snapshot inventory balances from the movement ledger (run periodically, e.g. hourly cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settle-seconds', type=int, default=300,
+                            help='Only fold movements older than this (in-flight transactions may still commit)')
+
+    def handle(self, *args, **options):
+        from products.inventory import compact_ledger
+
+        result = compact_ledger(settle_seconds=options['settle_seconds'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {result['movements']} movements into {result['snapshots']} snapshots"
+        ))
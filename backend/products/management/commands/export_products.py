@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Export all products and variants to a CSV or XLSX file (re-importable with import_products)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output .csv or .xlsx file')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help='File format (default: from the extension)')
+
+    def handle(self, *args, **options):
+        from products.bulk_io import detect_format, export_products
+
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        with open(options['path'], 'wb') as output:
+            count = export_products(output, file_format)
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} products to {options['path']}"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Bulk import/update products and variants from a CSV or XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file (columns as in products/bulk_io.py COLUMNS)')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help='File format (default: from the extension)')
+        parser.add_argument('--chunk-size', type=int, help='Rows per transaction (default PRODUCT_IMPORT_CHUNK_SIZE)')
+        parser.add_argument('--no-reindex', action='store_true', help='Skip the ChromaDB reindex at the end')
+
+    def handle(self, *args, **options):
+        from products.bulk_io import detect_format, import_products
+
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        with open(options['path'], 'rb') as source:
+            result = import_products(
+                source, file_format,
+                chunk_size=options['chunk_size'],
+                reindex='none' if options['no_reindex'] else 'inline',
+            )
+
+        for error in result.errors:
+            self.stdout.write(self.style.WARNING(f"line {error['line']}: {error['error']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result.created}, updated {result.updated} products; "
+            f"variants +{result.variants_created} ~{result.variants_updated} -{result.variants_deleted}; "
+            f"{result.stock_movements} stock movements; {result.error_count} rows with errors"
+        ))
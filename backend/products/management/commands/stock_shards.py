@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Manage sharded stock counters for hot products/variants (enable, disable, rebalance)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['enable', 'disable', 'rebalance'])
+        parser.add_argument('--product', type=int, help='Product id (enable/disable)')
+        parser.add_argument('--size', default='', help='Variant size, empty for product-level stock')
+        parser.add_argument('--shards', type=int, default=8, help='Number of counter rows (enable)')
+        parser.add_argument('--loop', action='store_true', help='Keep rebalancing every --interval seconds')
+        parser.add_argument('--interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        from products.inventory import disable_stock_shards, enable_stock_shards, rebalance_stock_shards
+
+        action = options['action']
+        if action in ('enable', 'disable') and not options['product']:
+            raise CommandError('--product is required')
+
+        if action == 'enable':
+            try:
+                total = enable_stock_shards(options['product'], options['shards'], size=options['size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"Split stock {total} across {options['shards']} shards"))
+        elif action == 'disable':
+            total = disable_stock_shards(options['product'], size=options['size'])
+            self.stdout.write(self.style.SUCCESS(f"Merged shards back into a single counter (stock {total})"))
+        else:
+            while True:
+                keys = rebalance_stock_shards()
+                self.stdout.write(f"Rebalanced {keys} sharded counters")
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_alter_product_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('co_purchase', 'Thường được mua cùng'), ('semantic', 'Tương tự về nội dung')], max_length=20, verbose_name='Loại')),
+                ('score', models.FloatField(default=0, verbose_name='Điểm tương đồng')),
+                ('rank', models.PositiveSmallIntegerField(default=0, verbose_name='Thứ hạng')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product', verbose_name='Sản phẩm lân cận')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='products.product', verbose_name='Sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Sản phẩm lân cận',
+                'verbose_name_plural': 'Sản phẩm lân cận',
+                'db_table': 'product_neighbors',
+                'ordering': ['product', 'kind', 'rank'],
+                'indexes': [models.Index(fields=['product', 'kind', 'rank'], name='product_nei_product_c41d3b_idx')],
+                'unique_together': {('product', 'kind', 'neighbor')},
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    """Số dư đầu kỳ = tồn kho hiện tại, để audit dựng lại được số tồn từ lúc mở sổ"""
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    InventorySnapshot = apps.get_model('products', 'InventorySnapshot')
+    now = django.utils.timezone.now()
+    snapshots = [
+        InventorySnapshot(product_id=product_id, size='', balance=stock, last_movement_id=0, taken_at=now)
+        for product_id, stock in Product.objects.values_list('id', 'stock')
+    ] + [
+        InventorySnapshot(product_id=product_id, size=size, balance=stock, last_movement_id=0, taken_at=now)
+        for product_id, size, stock in ProductVariant.objects.values_list('product_id', 'size', 'stock')
+    ]
+    InventorySnapshot.objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_productneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(blank=True, default='', max_length=20, verbose_name='Kích thước (biến thể)')),
+                ('kind', models.CharField(choices=[('sale', 'Bán hàng'), ('cancel', 'Hủy đơn - hoàn kho'), ('restock', 'Nhập kho'), ('adjust', 'Điều chỉnh')], max_length=20, verbose_name='Loại')),
+                ('quantity', models.IntegerField(verbose_name='Số lượng (+ nhập / - xuất)')),
+                ('reference', models.CharField(blank=True, default='', max_length=100, verbose_name='Tham chiếu')),
+                ('note', models.CharField(blank=True, default='', max_length=255, verbose_name='Ghi chú')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Thời điểm')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movements', to='products.product', verbose_name='Sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Biến động tồn kho',
+                'verbose_name_plural': 'Biến động tồn kho',
+                'db_table': 'inventory_movements',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['product', 'size', 'id'], name='inv_move_product_size_idx'), models.Index(fields=['reference'], name='inv_move_reference_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(blank=True, default='', max_length=20, verbose_name='Kích thước (biến thể)')),
+                ('balance', models.IntegerField(verbose_name='Số dư')),
+                ('last_movement_id', models.BigIntegerField(default=0, verbose_name='Biến động cuối đã cộng')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Thời điểm chốt')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_snapshots', to='products.product', verbose_name='Sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Số dư tồn kho',
+                'verbose_name_plural': 'Số dư tồn kho',
+                'db_table': 'inventory_snapshots',
+                'ordering': ['product', 'size', 'taken_at'],
+                'indexes': [models.Index(fields=['product', 'size', 'taken_at'], name='inv_snap_product_size_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
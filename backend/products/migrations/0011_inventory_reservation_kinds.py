@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='inventorymovement',
+            name='kind',
+            field=models.CharField(choices=[('sale', 'Bán hàng'), ('cancel', 'Hủy đơn - hoàn kho'), ('restock', 'Nhập kho'), ('adjust', 'Điều chỉnh'), ('reserve', 'Giữ hàng chờ thanh toán'), ('release', 'Trả lại hàng giữ')], max_length=20, verbose_name='Loại'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_inventory_reservation_kinds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(blank=True, default='', max_length=20, verbose_name='Kích thước (biến thể)')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Số thứ tự shard')),
+                ('stock', models.IntegerField(default=0, verbose_name='Tồn kho của shard')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='products.product', verbose_name='Sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Shard tồn kho',
+                'verbose_name_plural': 'Shard tồn kho',
+                'db_table': 'stock_shards',
+                'ordering': ['product', 'size', 'shard'],
+                'unique_together': {('product', 'size', 'shard')},
+            },
+        ),
+    ]
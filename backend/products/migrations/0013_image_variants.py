@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_stockshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='main_image_variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Ảnh thu nhỏ'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Ảnh thu nhỏ'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Phiên bản catalog',
+                'verbose_name_plural': 'Phiên bản catalog',
+                'db_table': 'catalog_version',
+            },
+        ),
+    ]
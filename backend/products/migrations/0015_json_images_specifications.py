@@ -0,0 +1,107 @@
+import json
+
+import django.db.models.fields.json
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def _parse(raw, expected):
+    if not raw or not raw.strip():
+        return expected()
+    try:
+        value = json.loads(raw)
+    except json.JSONDecodeError:
+        return expected()
+    return value if isinstance(value, expected) else expected()
+
+
+def copy_text_to_json(apps, schema_editor):
+    """Chuyển chuỗi JSON cũ sang cột JSON mới theo lô; chuỗi hỏng thành []/{}"""
+    Product = apps.get_model('products', 'Product')
+    batch = []
+    rows = Product.objects.only('id', 'images', 'specifications').order_by('pk').iterator(chunk_size=BATCH_SIZE)
+    for product in rows:
+        product.images_json = _parse(product.images, list)
+        product.specifications_json = _parse(product.specifications, dict)
+        batch.append(product)
+        if len(batch) >= BATCH_SIZE:
+            Product.objects.bulk_update(batch, ['images_json', 'specifications_json'])
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ['images_json', 'specifications_json'])
+
+
+def copy_json_to_text(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    batch = []
+    rows = Product.objects.only('id', 'images_json', 'specifications_json').order_by('pk').iterator(chunk_size=BATCH_SIZE)
+    for product in rows:
+        product.images = json.dumps(product.images_json) if product.images_json else ''
+        product.specifications = json.dumps(product.specifications_json) if product.specifications_json else ''
+        batch.append(product)
+        if len(batch) >= BATCH_SIZE:
+            Product.objects.bulk_update(batch, ['images', 'specifications'])
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ['images', 'specifications'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='images_json',
+            field=models.JSONField(blank=True, default=list, help_text='JSON array of image URLs', verbose_name='Hình ảnh phụ'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='specifications_json',
+            field=models.JSONField(blank=True, default=dict, help_text='JSON object with specifications', verbose_name='Thông số kỹ thuật'),
+        ),
+        migrations.RunPython(copy_text_to_json, copy_json_to_text),
+        migrations.RemoveField(
+            model_name='product',
+            name='images',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='specifications',
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='images_json',
+            new_name='images',
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='specifications_json',
+            new_name='specifications',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(
+                django.db.models.functions.comparison.Cast(
+                    django.db.models.fields.json.KeyTextTransform('size', 'specifications'),
+                    output_field=models.CharField(max_length=100),
+                ),
+                name='product_spec_size_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(
+                django.db.models.functions.comparison.Cast(
+                    django.db.models.fields.json.KeyTextTransform('material', 'specifications'),
+                    output_field=models.CharField(max_length=100),
+                ),
+                name='product_spec_material_idx',
+            ),
+        ),
+    ]
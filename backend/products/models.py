@@ -1,8 +1,32 @@
 from django.db import models
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from categories.models import Category
 import json
 
+# Khóa thông số kỹ thuật được lọc trong danh sách sản phẩm (?spec_<key>=...), mỗi khóa có một functional index
+INDEXED_SPEC_KEYS = ('size', 'material')
+
+
+def spec_value(key):
+    """
+    Biểu thức specifications->>key (varchar) dùng chung cho index và truy vấn lọc:
+    index theo biểu thức chỉ được dùng khi câu truy vấn lặp lại đúng biểu thức đó.
+    """
+    return Cast(KeyTextTransform(key, 'specifications'), output_field=models.CharField(max_length=100))
+
+
+def coerce_json(value, expected):
+    """Giá trị JSON dạng chuỗi (form multipart, client cũ) -> list/dict; sai kiểu thì trả về rỗng"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value) if value.strip() else expected()
+        except json.JSONDecodeError:
+            return expected()
+    return value if isinstance(value, expected) else expected()
+
 class Product(models.Model):
     STATUS_CHOICES = [
         ('active', 'Đang bán'),
@@ -81,14 +105,18 @@ class Product(models.Model):
         blank=True,
         verbose_name='Hình ảnh chính'
     )
-    images = models.TextField(
+    # Ảnh thu nhỏ WebP/JPEG của main_image (products/images.py)
+    main_image_variants = models.JSONField(default=dict, blank=True, verbose_name='Ảnh thu nhỏ')
+    images = models.JSONField(
+        default=list,
         blank=True,
         help_text='JSON array of image URLs',
         verbose_name='Hình ảnh phụ'
     )
     
-    # Thông số kỹ thuật (lưu dưới dạng JSON)
-    specifications = models.TextField(
+    # Thông số kỹ thuật (cột JSON, giải mã một lần khi đọc từ DB)
+    specifications = models.JSONField(
+        default=dict,
         blank=True,
         help_text='JSON object with specifications',
         verbose_name='Thông số kỹ thuật'
@@ -147,6 +175,9 @@ class Product(models.Model):
             models.Index(fields=['category', 'status']),
             models.Index(fields=['status', '-created_at']),
             models.Index(fields=['slug']),
+        ] + [
+            models.Index(spec_value(key), name=f'product_spec_{key}_idx')
+            for key in INDEXED_SPEC_KEYS
         ]
     
     def __str__(self):
@@ -164,27 +195,23 @@ class Product(models.Model):
                 counter += 1
             self.slug = slug
         
+        self.images = coerce_json(self.images, list)
+        self.specifications = coerce_json(self.specifications, dict)
         super().save(*args, **kwargs)
     
     @property
     def images_list(self):
-        """Convert JSON string to list"""
-        if self.images:
-            try:
-                return json.loads(self.images)
-            except json.JSONDecodeError:
-                return []
-        return []
+        """Danh sách ảnh phụ (giá trị gán dạng chuỗi được parse một lần rồi giữ trên instance)"""
+        if not isinstance(self.images, list):
+            self.images = coerce_json(self.images, list)
+        return self.images
     
     @property
     def specifications_dict(self):
-        """Convert JSON string to dict"""
-        if self.specifications:
-            try:
-                return json.loads(self.specifications)
-            except json.JSONDecodeError:
-                return {}
-        return {}
+        """Thông số kỹ thuật dạng dict"""
+        if not isinstance(self.specifications, dict):
+            self.specifications = coerce_json(self.specifications, dict)
+        return self.specifications
     
     @property
     def discount_percentage(self):
@@ -253,6 +280,7 @@ class ProductImage(models.Model):
         upload_to='products/%Y/%m/',
         verbose_name='Hình ảnh'
     )
+    variants = models.JSONField(default=dict, blank=True, verbose_name='Ảnh thu nhỏ')
     is_main = models.BooleanField(
         default=False,
         verbose_name='Ảnh chính'
@@ -271,3 +299,174 @@ class ProductImage(models.Model):
     
     def __str__(self):
         return f"Image for {self.product.name}"
+
+
+class ProductNeighbor(models.Model):
+    """
+    Top-K sản phẩm lân cận đã tính sẵn cho mỗi sản phẩm.
+    Đọc bằng một truy vấn theo index (product, kind, rank).
+    """
+    KIND_CHOICES = [
+        ('co_purchase', 'Thường được mua cùng'),
+        ('semantic', 'Tương tự về nội dung'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='neighbors',
+        verbose_name='Sản phẩm'
+    )
+    neighbor = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Sản phẩm lân cận'
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Loại')
+    score = models.FloatField(default=0, verbose_name='Điểm tương đồng')
+    rank = models.PositiveSmallIntegerField(default=0, verbose_name='Thứ hạng')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_neighbors'
+        verbose_name = 'Sản phẩm lân cận'
+        verbose_name_plural = 'Sản phẩm lân cận'
+        ordering = ['product', 'kind', 'rank']
+        unique_together = ['product', 'kind', 'neighbor']
+        indexes = [
+            models.Index(fields=['product', 'kind', 'rank']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.neighbor_id} ({self.kind}, {self.score:.3f})"
+
+
+class InventoryMovement(models.Model):
+    """
+    Sổ cái tồn kho (chỉ thêm, không sửa/xóa).
+
+    Mỗi dòng là một biến động có dấu của tồn kho sản phẩm (size='') hoặc biến
+    thể (size='30cm', ...). Product.stock / ProductVariant.stock là số dư, được
+    cộng dồn bằng F() trong cùng transaction với dòng ghi sổ (products/inventory.py).
+    """
+    KIND_CHOICES = [
+        ('sale', 'Bán hàng'),
+        ('cancel', 'Hủy đơn - hoàn kho'),
+        ('restock', 'Nhập kho'),
+        ('adjust', 'Điều chỉnh'),
+        ('reserve', 'Giữ hàng chờ thanh toán'),
+        ('release', 'Trả lại hàng giữ'),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='inventory_movements',
+        verbose_name='Sản phẩm'
+    )
+    size = models.CharField(max_length=20, blank=True, default='', verbose_name='Kích thước (biến thể)')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Loại')
+    quantity = models.IntegerField(verbose_name='Số lượng (+ nhập / - xuất)')
+    reference = models.CharField(max_length=100, blank=True, default='', verbose_name='Tham chiếu')
+    note = models.CharField(max_length=255, blank=True, default='', verbose_name='Ghi chú')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Thời điểm')
+
+    class Meta:
+        db_table = 'inventory_movements'
+        verbose_name = 'Biến động tồn kho'
+        verbose_name_plural = 'Biến động tồn kho'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['product', 'size', 'id'], name='inv_move_product_size_idx'),
+            models.Index(fields=['reference'], name='inv_move_reference_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Sổ cái tồn kho chỉ cho phép thêm dòng mới')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        target = f"{self.product_id}/{self.size}" if self.size else str(self.product_id)
+        return f"{target} {self.kind} {self.quantity:+d}"
+
+
+class InventorySnapshot(models.Model):
+    """
+    Số dư tồn kho đã chốt sau lần nén sổ cái (compact_inventory).
+
+    balance = số dư sau khi cộng mọi biến động có id <= last_movement_id.
+    Snapshot với last_movement_id = 0 là số dư đầu kỳ lúc bắt đầu ghi sổ.
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='inventory_snapshots',
+        verbose_name='Sản phẩm'
+    )
+    size = models.CharField(max_length=20, blank=True, default='', verbose_name='Kích thước (biến thể)')
+    balance = models.IntegerField(verbose_name='Số dư')
+    last_movement_id = models.BigIntegerField(default=0, verbose_name='Biến động cuối đã cộng')
+    taken_at = models.DateTimeField(default=timezone.now, verbose_name='Thời điểm chốt')
+
+    class Meta:
+        db_table = 'inventory_snapshots'
+        verbose_name = 'Số dư tồn kho'
+        verbose_name_plural = 'Số dư tồn kho'
+        ordering = ['product', 'size', 'taken_at']
+        indexes = [
+            models.Index(fields=['product', 'size', 'taken_at'], name='inv_snap_product_size_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}/{self.size or '-'} = {self.balance} @ {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class StockShard(models.Model):
+    """
+    Bộ đếm tồn kho chia nhỏ cho sản phẩm / biến thể bán chạy (flash sale).
+
+    Khi có shard, tồn kho thật = tổng stock các shard; mỗi lượt bán chỉ khóa một
+    shard ngẫu nhiên thay vì cùng một dòng Product / ProductVariant. Cột stock
+    trên dòng gốc là số hiển thị, được job cân bằng (rebalance) cập nhật lại.
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='stock_shards',
+        verbose_name='Sản phẩm'
+    )
+    size = models.CharField(max_length=20, blank=True, default='', verbose_name='Kích thước (biến thể)')
+    shard = models.PositiveSmallIntegerField(verbose_name='Số thứ tự shard')
+    stock = models.IntegerField(default=0, verbose_name='Tồn kho của shard')
+
+    class Meta:
+        db_table = 'stock_shards'
+        verbose_name = 'Shard tồn kho'
+        verbose_name_plural = 'Shard tồn kho'
+        ordering = ['product', 'size', 'shard']
+        unique_together = ['product', 'size', 'shard']
+
+    def __str__(self):
+        return f"{self.product_id}/{self.size or '-'}#{self.shard} = {self.stock}"
+
+
+class CatalogVersion(models.Model):
+    """
+    Số phiên bản của catalog (sản phẩm, biến thể, ảnh, danh mục), một dòng duy nhất.
+
+    Mỗi lần ghi vào catalog tăng version (products/catalog.py); ETag của các
+    endpoint đọc catalog được tính từ version nên kiểm tra If-None-Match chỉ
+    tốn một lần đọc dòng này.
+    """
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'catalog_version'
+        verbose_name = 'Phiên bản catalog'
+        verbose_name_plural = 'Phiên bản catalog'
+
+    def __str__(self):
+        return f"v{self.version} @ {self.updated_at:%Y-%m-%d %H:%M:%S}"
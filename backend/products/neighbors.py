@@ -0,0 +1,81 @@
+"""
+Đọc/ghi bảng ProductNeighbor (top-K sản phẩm lân cận đã tính sẵn).
+
+Dùng chung cho nhiều loại lân cận: co_purchase (thường mua cùng, tính từ đơn
+hàng) và semantic (tương tự nội dung, tính từ embedding).
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+
+from .models import Product, ProductNeighbor
+
+
+def rank_neighbors(scores: Dict[int, float], top_k: int) -> List[Tuple[int, float]]:
+    """Sắp xếp theo điểm giảm dần (hòa điểm thì id nhỏ trước) và cắt top-K"""
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+
+@transaction.atomic
+def replace_neighbor_lists(kind: str, lists: Dict[int, List[Tuple[int, float]]], full_rebuild: bool = False) -> int:
+    """
+    Ghi đè danh sách lân cận của các sản phẩm trong `lists`.
+
+    Args:
+        kind: 'co_purchase' hoặc 'semantic'
+        lists: {product_id: [(neighbor_id, score), ...]} đã sắp xếp theo rank
+        full_rebuild: True thì xóa toàn bộ dữ liệu cũ của kind trước khi ghi
+
+    Returns:
+        Số dòng đã ghi
+    """
+    queryset = ProductNeighbor.objects.filter(kind=kind)
+    if full_rebuild:
+        queryset.delete()
+    elif lists:
+        queryset.filter(product_id__in=list(lists.keys())).delete()
+
+    rows = [
+        ProductNeighbor(
+            product_id=product_id,
+            neighbor_id=neighbor_id,
+            kind=kind,
+            score=round(float(score), 6),
+            rank=rank,
+        )
+        for product_id, neighbors in lists.items()
+        for rank, (neighbor_id, score) in enumerate(neighbors)
+    ]
+    ProductNeighbor.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def load_neighbor_scores(kind: str, product_ids: Iterable[int]) -> Dict[int, Dict[int, float]]:
+    """Lấy danh sách lân cận hiện có dạng {product_id: {neighbor_id: score}}"""
+    result: Dict[int, Dict[int, float]] = {}
+    rows = ProductNeighbor.objects.filter(
+        kind=kind,
+        product_id__in=list(product_ids)
+    ).values_list('product_id', 'neighbor_id', 'score')
+    for product_id, neighbor_id, score in rows:
+        result.setdefault(product_id, {})[neighbor_id] = score
+    return result
+
+
+def get_neighbor_products(product_id: int, kind: str, limit: int = 10) -> List[Product]:
+    """
+    Lấy sản phẩm lân cận đang bán của một sản phẩm, theo thứ tự rank.
+    Chỉ một truy vấn theo index (product, kind, rank) + join sang products.
+    """
+    queryset = ProductNeighbor.objects.filter(
+        product_id=product_id,
+        kind=kind,
+        neighbor__status='active'
+    ).select_related('neighbor__category').order_by('rank')[:limit]
+
+    products = []
+    for row in queryset:
+        neighbor = row.neighbor
+        neighbor.neighbor_score = row.score
+        products.append(neighbor)
+    return products
@@ -1,7 +1,9 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import Product, ProductImage, ProductVariant
+from .images import image_srcset
+from .inventory import set_stock
+from .models import Product, ProductImage, ProductVariant, coerce_json
 from categories.serializers import CategorySerializer
-import json
 
 
 class ProductVariantSerializer(serializers.ModelSerializer):
@@ -14,10 +16,15 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'image_url', 'is_main', 'order']
+        fields = ['id', 'image', 'image_url', 'image_srcset', 'is_main', 'order']
+    
+    def get_image_srcset(self, obj):
+        """Ảnh thu nhỏ WebP/JPEG (None khi ảnh chưa được xử lý xong)"""
+        return image_srcset(obj.variants, self.context.get('request'))
     
     def get_image_url(self, obj):
         if obj.image:
@@ -32,6 +39,7 @@ class ProductListSerializer(serializers.ModelSerializer):
     """Serializer cho danh sách sản phẩm (không cần tất cả thông tin)"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     main_image_url = serializers.SerializerMethodField()
+    main_image_srcset = serializers.SerializerMethodField()
     discount_percentage = serializers.ReadOnlyField()
     in_stock = serializers.ReadOnlyField()
     variants = ProductVariantSerializer(many=True, read_only=True)
@@ -44,7 +52,7 @@ class ProductListSerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'category', 'category_name',
             'price', 'old_price', 'discount_percentage', 'stock', 'unit',
             'rating', 'reviews_count', 'sold_count',
-            'main_image', 'main_image_url', 'description',
+            'main_image', 'main_image_url', 'main_image_srcset', 'description',
             'status', 'in_stock', 'variants', 'min_price', 'max_price',
             'created_at', 'updated_at'
         ]
@@ -57,6 +65,10 @@ class ProductListSerializer(serializers.ModelSerializer):
             return obj.main_image.url
         return None
     
+    def get_main_image_srcset(self, obj):
+        """Ảnh thu nhỏ WebP/JPEG cho srcset (None khi ảnh chưa được xử lý xong)"""
+        return image_srcset(obj.main_image_variants, self.context.get('request'))
+    
     def get_min_price(self, obj):
         """Lấy giá tối thiểu từ variants"""
         variants = obj.variants.all()
@@ -77,6 +89,7 @@ class ProductSerializer(serializers.ModelSerializer):
     category_detail = CategorySerializer(source='category', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
     main_image_url = serializers.SerializerMethodField()
+    main_image_srcset = serializers.SerializerMethodField()
     product_images = ProductImageSerializer(many=True, read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
     images_list = serializers.ReadOnlyField()
@@ -106,7 +119,7 @@ class ProductSerializer(serializers.ModelSerializer):
             'price', 'old_price', 'discount_percentage', 'stock', 'unit',
             'rating', 'reviews_count', 'sold_count',
             'description', 'detail_description',
-            'main_image', 'main_image_url', 'images', 'images_list', 'images_data',
+            'main_image', 'main_image_url', 'main_image_srcset', 'images', 'images_list', 'images_data',
             'product_images', 'variants', 'min_price', 'max_price',
             'specifications', 'specifications_dict', 'specifications_data',
             'origin', 'color', 'weight', 'preservation', 'expiry', 'certification',
@@ -123,6 +136,10 @@ class ProductSerializer(serializers.ModelSerializer):
             return obj.main_image.url
         return None
     
+    def get_main_image_srcset(self, obj):
+        """Ảnh thu nhỏ WebP/JPEG cho srcset (None khi ảnh chưa được xử lý xong)"""
+        return image_srcset(obj.main_image_variants, self.context.get('request'))
+    
     def get_min_price(self, obj):
         """Lấy giá tối thiểu từ variants"""
         variants = obj.variants.all()
@@ -166,11 +183,11 @@ class ProductSerializer(serializers.ModelSerializer):
         images_data = validated_data.pop('images_data', [])
         specifications_data = validated_data.pop('specifications_data', {})
         
-        # Convert to JSON strings
+        # Cột JSON: lưu thẳng list / dict
         if images_data:
-            validated_data['images'] = json.dumps(images_data)
+            validated_data['images'] = images_data
         if specifications_data:
-            validated_data['specifications'] = json.dumps(specifications_data)
+            validated_data['specifications'] = coerce_json(specifications_data, dict)
         
         product = Product.objects.create(**validated_data)
         return product
@@ -180,11 +197,10 @@ class ProductSerializer(serializers.ModelSerializer):
         images_data = validated_data.pop('images_data', None)
         specifications_data = validated_data.pop('specifications_data', None)
         
-        # Convert to JSON strings if provided
         if images_data is not None:
-            validated_data['images'] = json.dumps(images_data)
+            validated_data['images'] = images_data
         if specifications_data is not None:
-            validated_data['specifications'] = json.dumps(specifications_data)
+            validated_data['specifications'] = coerce_json(specifications_data, dict)
         
         # Update instance
         for attr, value in validated_data.items():
@@ -207,6 +223,13 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
             'status'
         ]
     
+    def validate_images(self, value):
+        # Form multipart gửi JSON dạng chuỗi
+        return coerce_json(value, list)
+    
+    def validate_specifications(self, value):
+        return coerce_json(value, dict)
+    
     def validate_price(self, value):
         if value <= 0:
             raise serializers.ValidationError("Giá sản phẩm phải lớn hơn 0")
@@ -223,6 +246,30 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
         
         return data
 
+    def create(self, validated_data):
+        # Tồn kho ban đầu đi qua sổ cái thay vì ghi thẳng vào dòng sản phẩm
+        stock = validated_data.pop('stock', 0)
+        with transaction.atomic():
+            product = super().create({**validated_data, 'stock': 0})
+            set_stock(product.pk, stock, note='Tạo sản phẩm')
+        product.stock = stock
+        return product
+
+    def update(self, instance, validated_data):
+        """
+        Chỉ ghi các field được gửi lên; tồn kho đổi bằng dòng điều chỉnh trong sổ cái
+        (save() cả dòng sẽ ghi đè số tồn mà đơn hàng đồng thời vừa trừ).
+        """
+        stock = validated_data.pop('stock', None)
+        with transaction.atomic():
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save(update_fields=[*validated_data.keys(), 'updated_at'])
+            if stock is not None:
+                set_stock(instance.pk, stock, note='Admin cập nhật tồn kho')
+                instance.stock = stock
+        return instance
+
 
 class ProductQuestionAnalysisSerializer(serializers.Serializer):
     """Serializer cho câu hỏi phân tích sản phẩm"""
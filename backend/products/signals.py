@@ -0,0 +1,91 @@
+import functools
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from categories.models import Category
+
+from .catalog import bump_catalog_version
+from .facets import record_full_rebuild, record_product_change
+from .images import needs_refresh, schedule_image_processing
+from .models import Product, ProductImage, ProductVariant
+
+_state = threading.local()
+
+
+@contextmanager
+def catalog_signals_suppressed():
+    """
+    Tắt các receiver catalog trong khối này (thread hiện tại). Dùng cho import hàng
+    loạt: thay vì mỗi dòng một lần bump version / ghi nhật ký facet, bên gọi tự làm
+    lại một lần ở cuối (products/bulk_io.py).
+    """
+    previous = getattr(_state, 'suppressed', False)
+    _state.suppressed = True
+    try:
+        yield
+    finally:
+        _state.suppressed = previous
+
+
+def _unless_suppressed(handler):
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not getattr(_state, 'suppressed', False):
+            handler(*args, **kwargs)
+    return wrapper
+
+
+@receiver(post_save, sender=Product)
+@_unless_suppressed
+def process_main_image(sender, instance, **kwargs):
+    """Ảnh chính mới / vừa đổi: sinh ảnh thu nhỏ sau khi commit (không chặn request upload)."""
+    if needs_refresh(instance.main_image, instance.main_image_variants):
+        schedule_image_processing(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@_unless_suppressed
+def process_gallery_image(sender, instance, **kwargs):
+    if needs_refresh(instance.image, instance.variants):
+        schedule_image_processing(instance.product_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@_unless_suppressed
+def catalog_changed(sender, **kwargs):
+    """Catalog thay đổi: ETag và cache phản hồi của các endpoint đọc catalog đổi theo (products/catalog.py)."""
+    # Danh mục xuất hiện trong dữ liệu sản phẩm (category_name) nên đổi danh mục cũng vô hiệu hóa tag 'product'
+    bump_catalog_version(('category', 'product') if sender is Category else ('product',))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@_unless_suppressed
+def product_facets_changed(sender, instance, **kwargs):
+    """Cập nhật chỉ mục facet (products/facets.py) cho riêng sản phẩm này."""
+    record_product_change(instance.pk)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@_unless_suppressed
+def variant_facets_changed(sender, instance, **kwargs):
+    record_product_change(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@_unless_suppressed
+def category_facets_changed(sender, **kwargs):
+    # Nhãn danh mục / sản phẩm được chuyển danh mục bằng queryset.update(): dựng lại chỉ mục
+    record_full_rebuild()
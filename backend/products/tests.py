@@ -1,3 +1,434 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from categories.models import Category
+from orders.models import Order
+
+from .images import refresh_product_images
+from .inventory import (
+    InsufficientStock, apply_movements, available_stock, compact_ledger, disable_stock_shards,
+    enable_stock_shards, movement, rebalance_stock_shards, set_stock, stock_at,
+)
+from .models import InventoryMovement, InventorySnapshot, Product, ProductVariant, StockShard
+
+User = get_user_model()
+
+
+class InventoryLedgerTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Gau Bong')
+        self.product = Product.objects.create(name='Gau Teddy', category=self.category, price=100000, stock=5, status='active')
+        self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123', phone='0900000001')
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='testpass123', phone='0900000002', role='admin')
+        self.client = APIClient()
+
+    def order_payload(self, quantity):
+        return {
+            'full_name': 'Nguyen Van A', 'phone': '0900000001', 'email': 'buyer@example.com',
+            'address': '1 Le Loi', 'city': 'HCM', 'district': 'Q1', 'payment_method': 'cod',
+            'items': [{'id': str(self.product.id), 'quantity': str(quantity), 'price': '100000'}],
+        }
+
+    def test_order_and_cancel_write_ledger_and_deltas(self):
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post('/api/orders/create_order/', self.order_payload(3), format='json')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+        response = self.client.post('/api/orders/cancel_order/', {'order_id': order.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+        self.assertEqual(
+            list(InventoryMovement.objects.values_list('kind', 'quantity', 'reference')),
+            [('sale', -3, order.order_code), ('cancel', 3, order.order_code)],
+        )
+
+    def test_sale_without_enough_stock_leaves_no_order(self):
+        # Request khác đã mua gần hết sau khi bước kiểm tra tồn kho chạy
+        original_apply = apply_movements
+
+        def sell_first(movements, check_stock=False):
+            Product.objects.filter(pk=self.product.pk).update(stock=1)
+            return original_apply(movements, check_stock=check_stock)
+
+        self.client.force_authenticate(self.buyer)
+        with mock.patch('orders.views.apply_movements', side_effect=sell_first):
+            response = self.client.post('/api/orders/create_order/', self.order_payload(3), format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(InventoryMovement.objects.exists())
+        # Cả transaction (kể cả lần bán giả lập) được rollback
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+    def test_admin_stock_edit_records_adjustment(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.patch(f'/api/products/{self.product.slug}/', {'stock': 12}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(f'/api/products/{self.product.slug}/', {'stock': 10}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(list(InventoryMovement.objects.values_list('kind', 'quantity')), [('restock', 7), ('adjust', -2)])
+
+    def test_save_variants_updates_in_place(self):
+        variant = ProductVariant.objects.create(product=self.product, size='30cm', price=100000, stock=4)
+        ProductVariant.objects.create(product=self.product, size='90cm', price=300000, stock=2)
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(f'/api/products/{self.product.slug}/save_variants/', {'variants': [
+            {'size': '30cm', 'price': 120000, 'stock': 6},
+            {'size': '60cm', 'price': 200000, 'stock': 3},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        variant.refresh_from_db()
+        self.assertEqual((variant.price, variant.stock), (120000, 6))
+        self.assertFalse(ProductVariant.objects.filter(size='90cm').exists())
+        self.assertEqual(
+            sorted(InventoryMovement.objects.values_list('size', 'quantity')),
+            [('30cm', 2), ('60cm', 3), ('90cm', -2)],
+        )
+
+    def test_variant_price_edit_changes_catalog_etag(self):
+        ProductVariant.objects.create(product=self.product, size='30cm', price=100000, stock=4)
+        url = f'/api/products/{self.product.slug}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_authenticate(self.admin)
+        self.client.post(f'/api/products/{self.product.slug}/save_variants/', {'variants': [
+            {'size': '30cm', 'price': 120000, 'stock': 4},
+        ]}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['variants'][0]['price'], '120000')
+
+    def test_compaction_and_stock_at(self):
+        opened = timezone.now() - timedelta(hours=1)
+        InventorySnapshot.objects.create(product=self.product, balance=5, last_movement_id=0, taken_at=opened)
+        apply_movements([movement(self.product.id, -2, 'sale')])
+        apply_movements([movement(self.product.id, 10, 'restock')])
+        InventoryMovement.objects.update(created_at=opened + timedelta(seconds=1))
+        InventoryMovement.objects.filter(kind='restock').update(created_at=opened + timedelta(seconds=3))
+        after_sale = opened + timedelta(seconds=2)
+
+        self.assertIsNone(stock_at(self.product.id, opened - timedelta(seconds=1)))
+        self.assertEqual(stock_at(self.product.id, after_sale), 3)
+
+        self.assertEqual(compact_ledger(settle_seconds=0), {'snapshots': 1, 'movements': 2})
+        self.assertEqual(InventorySnapshot.objects.latest('taken_at').balance, 13)
+        self.assertEqual(compact_ledger(settle_seconds=0), {'snapshots': 0, 'movements': 0})
+
+        # Audit sau khi nén vẫn cho cùng kết quả
+        self.assertEqual(stock_at(self.product.id, after_sale), 3)
+        self.assertEqual(stock_at(self.product.id, timezone.now()), 13)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 13)
+
+
+class StockShardTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Gau Bong')
+        self.product = Product.objects.create(name='Gau Flash Sale', category=category, price=100000, stock=5, status='active')
+        self.variant = ProductVariant.objects.create(product=self.product, size='60cm', price=200000, stock=5)
+
+    def shard_stocks(self):
+        return list(StockShard.objects.filter(product=self.product, size='60cm').values_list('stock', flat=True))
+
+    def test_sales_spread_over_shards_and_fall_back_to_total(self):
+        enable_stock_shards(self.product.id, 4, size='60cm')
+        self.assertEqual(self.shard_stocks(), [2, 1, 1, 1])
+
+        # Không shard nào có đủ 4 một mình -> lấy dần từ nhiều shard
+        apply_movements([movement(self.product.id, -4, 'sale', size='60cm')], check_stock=True)
+        self.assertEqual(available_stock(self.product.id, '60cm'), 1)
+        with self.assertRaises(InsufficientStock):
+            apply_movements([movement(self.product.id, -2, 'sale', size='60cm')], check_stock=True)
+
+        # Dòng gốc không bị khóa / ghi ở mỗi lượt bán; rebalance cập nhật số hiển thị
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 5)
+        rebalance_stock_shards()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 1)
+        self.assertEqual(self.shard_stocks(), [1, 0, 0, 0])
+
+    def test_set_stock_and_disable_keep_totals(self):
+        enable_stock_shards(self.product.id, 3, size='60cm')
+        self.assertEqual(set_stock(self.product.id, 10, size='60cm'), 5)
+        self.assertEqual(self.shard_stocks(), [4, 3, 3])
+        apply_movements([movement(self.product.id, 2, 'cancel', size='60cm')])
+
+        self.assertEqual(disable_stock_shards(self.product.id, size='60cm'), 12)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 12)
+        self.assertFalse(StockShard.objects.exists())
+        self.assertEqual(
+            list(InventoryMovement.objects.values_list('kind', 'quantity')), [('restock', 5), ('cancel', 2)]
+        )
+
+    def test_cart_checks_use_shard_totals_not_display_column(self):
+        buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123', phone='0900000001')
+        client = APIClient()
+        client.force_authenticate(buyer)
+        add = lambda quantity: client.post(
+            '/api/orders/cart/add_item/', {'product_id': self.product.id, 'quantity': quantity, 'unit': '60cm'}, format='json',
+        )
+        enable_stock_shards(self.product.id, 2, size='60cm')
+
+        # Bán hết trên shard: cột stock vẫn là 5 nhưng không còn hàng thật
+        apply_movements([movement(self.product.id, -5, 'sale', size='60cm')], check_stock=True)
+        response = add(1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Tồn kho: 0', response.data['error'])
+
+        # Hủy đơn trả 3 vào shard sau khi rebalance đã đưa cột stock về 0
+        rebalance_stock_shards()
+        apply_movements([movement(self.product.id, 3, 'cancel', size='60cm')])
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 0)
+        response = add(3)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['items'][0]['available_stock'], 3)
+        self.assertTrue(response.data['items'][0]['is_available'])
+
+
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings = self.settings(MEDIA_ROOT=self.media_root, PRODUCT_IMAGE_WIDTHS=[200, 400], IMAGE_PROCESSING_RUN_INLINE=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        category = Category.objects.create(name='Gau Bong')
+        self.product = Product.objects.create(name='Gau Teddy', category=category, price=100000, stock=5, status='active')
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='testpass123', phone='0900000002', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, width=1000, height=500):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), (200, 120, 80)).save(buffer, 'PNG')
+        return SimpleUploadedFile('teddy.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_builds_hashed_webp_and_jpeg_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/products/{self.product.slug}/upload_image/', {'image': self.upload()})
+        self.assertEqual(response.status_code, 200)
+        # Phản hồi upload không chờ xử lý ảnh
+        self.assertIsNone(response.data['data']['main_image_srcset'])
+
+        self.product.refresh_from_db()
+        variants = self.product.main_image_variants
+        self.assertEqual(variants['source'], self.product.main_image.name)
+        self.assertEqual([entry['width'] for entry in variants['webp']], [200, 400])
+        self.assertRegex(variants['jpeg'][0]['path'], r'^products/derived/teddy[^/]*-200w\.[0-9a-f]{12}\.jpeg$')
+
+        response = self.client.get(f'/api/products/{self.product.slug}/')
+        srcset = response.data['data']['main_image_srcset']
+        self.assertIn('-200w.', srcset['thumbnail'])
+        self.assertTrue(srcset['webp'].endswith(' 400w'))
+
+    def test_small_images_are_not_upscaled_and_backfill_is_idempotent(self):
+        Product.objects.filter(pk=self.product.pk).update(
+            main_image=self.product.main_image.storage.save('products/old.png', self.upload(width=150, height=150))
+        )
+        call_command('build_image_derivatives', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual([entry['width'] for entry in self.product.main_image_variants['jpeg']], [150])
+        self.assertEqual(refresh_product_images(self.product.id), 0)
+
+
+
+class FacetSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bears = Category.objects.create(name='Gau Bong')
+        self.dolls = Category.objects.create(name='Bup Be')
+        self.pink = Product.objects.create(name='Gau Hong', category=self.bears, price=150000, color='Hồng', origin='Việt Nam', status='active')
+        self.white = Product.objects.create(name='Gau Trang', category=self.bears, price=450000, color='Trắng', origin='Trung Quốc', status='active')
+        self.doll = Product.objects.create(name='Bup Be Hong', category=self.dolls, price=90000, color='Hồng', origin='Việt Nam', status='active')
+        Product.objects.create(name='Gau An', category=self.bears, price=150000, color='Hồng', status='inactive')
+        ProductVariant.objects.create(product=self.pink, size='30cm', price=150000, stock=3)
+        ProductVariant.objects.create(product=self.white, size='1m', price=450000, stock=1)
+        self.client = APIClient()
+
+    def counts(self, response, facet):
+        return {entry['value']: entry['count'] for entry in response.data['facets'][facet]}
+
+    def test_counts_ignore_own_facet_and_extra_filters_add_no_queries(self):
+        response = self.client.get('/api/products/facets/', {'color': 'Hồng'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['id'] for item in response.data['results']}, {self.pink.id, self.doll.id})
+        self.assertEqual(self.counts(response, 'color'), {'Hồng': 2, 'Trắng': 1})
+        self.assertEqual(self.counts(response, 'category'), {str(self.bears.id): 1, str(self.dolls.id): 1})
+        self.assertEqual(self.counts(response, 'price'), {'0-100000': 1, '100000-200000': 1, '200000-500000': 0})
+
+        # Phiên bản catalog, COUNT, trang sản phẩm, biến thể: không phụ thuộc số bộ lọc
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/products/facets/', {'color': 'Hồng', 'origin': 'Việt Nam', 'size': '30cm'})
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/products/facets/', {'color': 'Hồng', 'origin': 'Việt Nam', 'size': ['30cm', '1m'], 'price': '100000-200000'})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.pink.id])
+
+    def test_product_changes_update_index_incrementally(self):
+        self.client.get('/api/products/facets/')
+        self.white.color = 'Hồng'
+        self.white.save()
+        ProductVariant.objects.create(product=self.doll, size='30cm', price=90000, stock=2)
+
+        with mock.patch('products.facets.FacetIndex.build') as build:
+            response = self.client.get('/api/products/facets/', {'size': '30cm'})
+        build.assert_not_called()
+        self.assertEqual(self.counts(response, 'color'), {'Hồng': 2})
+        self.assertEqual(response.data['count'], 2)
+
+        self.bears.name = 'Gau Teddy'
+        self.bears.save()
+        response = self.client.get('/api/products/facets/')
+        self.assertIn({'value': str(self.bears.id), 'label': 'Gau Teddy', 'count': 2}, response.data['facets']['category'])
+
+
+class ProductJsonFieldTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Gau Bong')
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='testpass123', phone='0900000002', role='admin')
+        self.client = APIClient()
+
+    def test_string_values_are_stored_as_json_and_spec_filter_uses_expression(self):
+        legacy = Product.objects.create(
+            name='Gau Cu', category=self.category, price=100000, status='active',
+            images='["a.jpg"]', specifications='{"size": "30cm", "material": "Bông"}',
+        )
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.images, ['a.jpg'])
+        self.assertEqual(legacy.specifications_dict['size'], '30cm')
+        Product.objects.create(name='Gau Moi', category=self.category, price=100000, status='active', specifications={'size': '1m'})
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/products/', {
+            'name': 'Gau Form', 'category': self.category.id, 'price': 120000, 'stock': 0,
+            'status': 'active', 'specifications': '{"size": "30cm"}', 'images': '["b.jpg"]',
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        created = Product.objects.get(name='Gau Form')
+        self.assertEqual((created.specifications, created.images), ({'size': '30cm'}, ['b.jpg']))
+
+        response = self.client.get('/api/products/', {'spec_size': '30cm'})
+        self.assertEqual({item['name'] for item in response.data['results']}, {'Gau Cu', 'Gau Form'})
+
+
+class ProductBulkImportTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Gau Bong')
+        self.product = Product.objects.create(name='Gau Teddy', slug='gau-teddy', category=self.category, price=100000, status='active')
+        ProductVariant.objects.create(product=self.product, size='30cm', price=100000, stock=0)
+        ProductVariant.objects.create(product=self.product, size='90cm', price=300000, stock=0)
+        set_stock(self.product.id, 2, size='90cm')
+        Product.objects.create(name='Gau Moi', slug='gau-moi', category=self.category, price=50000, status='active')
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='testpass123', phone='0900000002', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, content):
+        upload = SimpleUploadedFile('products.csv', content.encode('utf-8'), content_type='text/csv')
+        return self.client.post('/api/products/import_file/', {'file': upload}, format='multipart')
+
+    def test_csv_import_batches_writes_and_reindexes_once(self):
+        content = (
+            'slug,name,category,price,stock,variants,specifications\n'
+            'gau-teddy,,,120000,,30cm:110000:4|60cm:200000:3,\n'
+            ',Gau Moi,Gau Truc,90000,5,,"{""size"": ""1m""}"\n'
+            ',Gau Moi,Gau Truc,95000,1,,\n'
+            ',Thieu Gia,Gau Truc,,1,,\n'
+            ',Sai Bien The,Gau Truc,90000,1,30cm-1,\n'
+        )
+        with mock.patch('products.catalog.bump_catalog_version') as bump, \
+                mock.patch('products.signals.bump_catalog_version') as signal_bump, \
+                mock.patch('products.signals.record_product_change') as facet_change:
+            response = self.upload(content)
+        self.assertEqual(response.status_code, 200, response.data)
+        data = response.data['data']
+        self.assertEqual((data['created'], data['updated'], data['error_count']), (2, 1, 2))
+        self.assertEqual(sorted(error['line'] for error in data['errors']), [5, 6])
+        bump.assert_called_once()
+        signal_bump.assert_not_called()
+        facet_change.assert_not_called()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 120000)
+        self.assertEqual(self.product.name, 'Gau Teddy')
+        self.assertEqual(
+            sorted(self.product.variants.values_list('size', 'price', 'stock')),
+            [('30cm', 110000, 4), ('60cm', 200000, 3)],
+        )
+        self.assertIn(('90cm', -2), InventoryMovement.objects.filter(product=self.product).values_list('size', 'quantity'))
+
+        created = Product.objects.filter(category__name='Gau Truc').order_by('slug')
+        self.assertEqual(list(created.values_list('slug', 'stock')), [('gau-moi-1', 5), ('gau-moi-2', 1)])
+        self.assertEqual(created[0].specifications, {'size': '1m'})
+        self.assertEqual(created[1].stock, sum(created[1].inventory_movements.values_list('quantity', flat=True)))
+
+    def test_export_round_trip_changes_nothing(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        out = StringIO()
+        call_command('export_products', f'{path}/products.xlsx', stdout=out)
+        self.assertIn('Exported 2 products', out.getvalue())
+
+        movements = InventoryMovement.objects.count()
+        call_command('import_products', f'{path}/products.xlsx', '--no-reindex', stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(InventoryMovement.objects.count(), movements)
+        self.assertEqual(
+            sorted(self.product.variants.values_list('size', 'stock')),
+            [('30cm', 0), ('90cm', 2)],
+        )
+
+        response = self.client.get('/api/products/export_file/', {'file_format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['slug', 'name', 'category'])
+        self.assertEqual(len(lines), 3)
+
+    def test_failed_chunk_rolls_back_counters_and_categories(self):
+        from . import bulk_io
+
+        real_apply_stock = bulk_io._apply_stock
+        calls = []
+
+        def flaky_apply_stock(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('deadlock')
+            return real_apply_stock(*args, **kwargs)
+
+        content = (
+            'name,category,price,stock\n'
+            'Gau A,Gau Truc,90000,1\n'
+            'Gau B,Gau Truc,90000,1\n'
+            'Gau C,Gau Truc,90000,2\n'
+        )
+        with mock.patch.object(bulk_io, '_apply_stock', side_effect=flaky_apply_stock):
+            result = bulk_io.import_products(BytesIO(content.encode('utf-8')), 'csv', chunk_size=2, reindex='none')
 
-# Create your tests here.
+        self.assertEqual((result.created, result.stock_movements, result.error_count), (1, 1, 1))
+        self.assertEqual(result.errors[0]['line'], 2)
+        self.assertEqual(list(Product.objects.filter(category__name='Gau Truc').values_list('name', 'stock')), [('Gau C', 2)])
@@ -3,9 +3,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Product, ProductImage, ProductVariant
+from backend.response_cache import cached_response
+from . import bulk_io
+from .catalog import bump_catalog_version, catalog_cached
+from .facets import FACETS, facet_search, ids_bitmap
+from .models import INDEXED_SPEC_KEYS, Product, ProductImage, ProductNeighbor, ProductVariant, spec_value
+from .inventory import set_stock
+from .neighbors import get_neighbor_products
 from .serializers import (
     ProductSerializer,
     ProductListSerializer,
@@ -16,6 +25,15 @@ from .serializers import (
     ProductAnalysisResponseSerializer
 )
 from ai_agent.services import AIAgentService
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _catalog_cache_ttl():
+    # Tồn kho / lượt bán đổi không qua signal: giữ cache không lâu hơn max-age của ETag
+    return getattr(settings, 'CATALOG_CACHE_MAX_AGE', 60)
+
 
 class ProductViewSet(viewsets.ModelViewSet):
     """
@@ -46,12 +64,14 @@ class ProductViewSet(viewsets.ModelViewSet):
         Cho phép mọi người xem danh sách và chi tiết sản phẩm
         Chỉ admin mới được tạo, sửa, xóa
         """
-        if self.action in ['list', 'retrieve', 'featured', 'by_category', 'low_stock', 'out_of_stock', 'analyze_product_question']:
+        if self.action in ['list', 'retrieve', 'featured', 'by_category', 'facets', 'low_stock', 'out_of_stock', 'analyze_product_question', 'recommendations', 'similar']:
             permission_classes = [AllowAny]
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
     
+    @catalog_cached
+    @cached_response('products.list', ('product',), timeout=_catalog_cache_ttl)
     def list(self, request, *args, **kwargs):
         """Lấy danh sách sản phẩm với filter và search"""
         queryset = self.filter_queryset(self.get_queryset())
@@ -74,6 +94,12 @@ class ProductViewSet(viewsets.ModelViewSet):
         if low_stock:
             queryset = queryset.filter(stock__lt=50)
         
+        # Filter theo thông số kỹ thuật (?spec_size=30cm), dùng functional index của từng khóa
+        for key in INDEXED_SPEC_KEYS:
+            spec = request.query_params.get(f'spec_{key}')
+            if spec:
+                queryset = queryset.alias(**{f'spec_{key}': spec_value(key)}).filter(**{f'spec_{key}': spec})
+        
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -107,6 +133,8 @@ class ProductViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, obj)
         return obj
     
+    @catalog_cached
+    @cached_response('products.retrieve', ('product',), timeout=_catalog_cache_ttl)
     def retrieve(self, request, *args, **kwargs):
         """Lấy chi tiết sản phẩm theo slug hoặc ID"""
         instance = self.get_object()
@@ -161,6 +189,8 @@ class ProductViewSet(viewsets.ModelViewSet):
         )
     
     @action(detail=False, methods=['get'])
+    @catalog_cached
+    @cached_response('products.featured', ('product',), timeout=_catalog_cache_ttl)
     def featured(self, request):
         """Lấy danh sách sản phẩm nổi bật (deprecated - trả về sản phẩm active)"""
         products = self.queryset.filter(status='active')[:10]
@@ -168,6 +198,8 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @catalog_cached
+    @cached_response('products.by_category', ('product',), timeout=_catalog_cache_ttl)
     def by_category(self, request):
         """Lấy sản phẩm theo danh mục"""
         category_id = request.query_params.get('category_id')
@@ -186,6 +218,90 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductListSerializer(products, many=True, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    @catalog_cached
+    @cached_response('products.facets', ('product', 'category'), timeout=_catalog_cache_ttl)
+    def facets(self, request):
+        """
+        Lọc sản phẩm theo facet kèm số lượng theo từng giá trị (products/facets.py)
+
+        Query params:
+            category, price, size, color, origin: lặp lại để chọn nhiều giá trị (OR trong
+                cùng facet, AND giữa các facet), vd ?color=Hồng&color=Trắng&price=0-100000
+            search, ordering, page: như danh sách sản phẩm
+        """
+        selected = {facet: request.query_params.getlist(facet) for facet in FACETS}
+
+        base = None
+        if request.query_params.get('search'):
+            searched = filters.SearchFilter().filter_queryset(request, Product.objects.filter(status='active'), self)
+            base = ids_bitmap(searched.values_list('id', flat=True))
+
+        ids, facet_counts = facet_search(selected, base)
+
+        products = Product.objects.select_related('category').prefetch_related('variants').filter(id__in=ids)
+        products = filters.OrderingFilter().filter_queryset(request, products, self)
+        page = self.paginate_queryset(products)
+        serializer = ProductListSerializer(page, many=True, context={'request': request})
+        response = self.get_paginated_response(serializer.data)
+        response.data['facets'] = facet_counts
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, slug=None):
+        """Sản phẩm thường được mua cùng (chỉ mục co-purchase), thiếu thì bổ sung cùng danh mục"""
+        product = self.get_object()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 8)), 1), 20)
+        except (TypeError, ValueError):
+            limit = 8
+
+        products = get_neighbor_products(product.id, 'co_purchase', limit)
+        if len(products) < limit:
+            exclude_ids = [product.id] + [p.id for p in products]
+            products.extend(
+                self.queryset.filter(category_id=product.category_id, status='active')
+                .exclude(id__in=exclude_ids)
+                .order_by('-sold_count', '-rating')[:limit - len(products)]
+            )
+        prefetch_related_objects(products, 'variants')
+
+        serializer = ProductListSerializer(products, many=True, context={'request': request})
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, slug=None):
+        """
+        Sản phẩm tương tự theo nội dung (chỉ mục semantic tính sẵn bởi build_similar_products).
+        Một truy vấn theo index (product, kind, rank) + một truy vấn biến thể, không gọi ChromaDB.
+        Cùng định dạng với recommendations (ProductListSerializer) kèm similarity_score.
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', 8)), 1), 20)
+        except (TypeError, ValueError):
+            limit = 8
+
+        lookup = Q(product__slug=slug)
+        if slug.isdigit():
+            lookup |= Q(product_id=int(slug))
+
+        rows = ProductNeighbor.objects.filter(
+            lookup,
+            kind='semantic',
+            neighbor__status='active'
+        ).select_related('neighbor__category').order_by('rank')[:limit]
+
+        products, scores = [], []
+        for row in rows:
+            products.append(row.neighbor)
+            scores.append(row.score)
+        prefetch_related_objects(products, 'variants')
+
+        data = ProductListSerializer(products, many=True, context={'request': request}).data
+        for item, score in zip(data, scores):
+            item['similarity_score'] = score
+        return Response(data)
+    
     @action(detail=True, methods=['post'])
     def upload_image(self, request, slug=None):
         """Upload ảnh chính cho sản phẩm"""
@@ -345,20 +461,34 @@ class ProductViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            # Xóa tất cả biến thể cũ
-            product.variants.all().delete()
-            
-            # Tạo biến thể mới
-            created_variants = []
-            for variant_data in variants_data:
-                variant = ProductVariant.objects.create(
-                    product=product,
-                    size=variant_data.get('size'),
-                    price=variant_data.get('price', 0),
-                    stock=variant_data.get('stock', 0)
-                )
-                created_variants.append(variant)
-            
+            # Cập nhật theo size thay vì xóa và tạo lại: id biến thể được giữ nguyên,
+            # tồn kho đổi qua sổ cái (dòng điều chỉnh) chứ không ghi đè số tồn
+            with transaction.atomic():
+                existing = {variant.size: variant for variant in product.variants.all()}
+                sizes = []
+                for variant_data in variants_data:
+                    size = variant_data.get('size')
+                    sizes.append(size)
+                    if size in existing:
+                        ProductVariant.objects.filter(pk=existing[size].pk).update(price=variant_data.get('price', 0))
+                    else:
+                        ProductVariant.objects.create(
+                            product=product,
+                            size=size,
+                            price=variant_data.get('price', 0),
+                            stock=0
+                        )
+                    set_stock(product.pk, int(variant_data.get('stock', 0) or 0), size=size, note='Admin lưu biến thể')
+
+                # Biến thể bị bỏ: ghi sổ xuất hết tồn rồi xóa
+                for size, variant in existing.items():
+                    if size not in sizes:
+                        set_stock(product.pk, 0, size=size, note='Xóa biến thể')
+                        variant.delete()
+                # Giá sửa bằng update() không qua signal
+                bump_catalog_version()
+
+            created_variants = list(product.variants.filter(size__in=sizes))
             serializer = ProductVariantSerializer(created_variants, many=True)
             return Response({
                 'message': 'Lưu biến thể sản phẩm thành công',
@@ -371,6 +501,62 @@ class ProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=False, methods=['post'])
+    def import_file(self, request):
+        """
+        Admin - Import / cập nhật sản phẩm hàng loạt từ file CSV hoặc XLSX (field 'file').
+        Định dạng cột xem products/bulk_io.py; ChromaDB được đồng bộ ở nền sau khi xong.
+        """
+        if not (request.user.is_staff or getattr(request.user, 'role', None) == 'admin'):
+            return Response(
+                {'error': 'Bạn không có quyền truy cập'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response(
+                {'error': 'Vui lòng chọn file CSV hoặc XLSX'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            file_format = bulk_io.detect_format(upload.name)
+            result = bulk_io.import_products(upload.file, file_format, reindex='background')
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception('Product import failed')
+            return Response(
+                {'error': f'Không đọc được file: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'message': f'Đã tạo {result.created} và cập nhật {result.updated} sản phẩm',
+            'data': result.as_dict()
+        })
+    
+    @action(detail=False, methods=['get'])
+    def export_file(self, request):
+        """Admin - Xuất toàn bộ sản phẩm + biến thể (?file_format=csv|xlsx), import lại được bằng import_file"""
+        from django.http import FileResponse
+
+        if not (request.user.is_staff or getattr(request.user, 'role', None) == 'admin'):
+            return Response(
+                {'error': 'Bạn không có quyền truy cập'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        file_format = request.query_params.get('file_format', 'xlsx')
+        if file_format not in bulk_io.FORMATS:
+            return Response(
+                {'error': 'file_format phải là csv hoặc xlsx'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return FileResponse(
+            bulk_io.export_file(file_format),
+            as_attachment=True,
+            filename=f"san_pham_{timezone.now():%Y%m%d_%H%M%S}.{file_format}",
+            content_type=bulk_io.CSV_CONTENT_TYPE if file_format == 'csv' else bulk_io.XLSX_CONTENT_TYPE,
+        )
+    
     @action(detail=False, methods=['post'])
     def analyze_product_question(self, request):
         """
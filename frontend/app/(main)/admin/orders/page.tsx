@@ -43,6 +43,8 @@ interface Order {
     items: OrderItem[];
 }
 
+const ORDERS_PAGE_SIZE = 50;
+
 const OrdersPage = () => {
     const [orders, setOrders] = useState<Order[]>([]);
     const [loading, setLoading] = useState(false);
@@ -50,6 +52,7 @@ const OrdersPage = () => {
     const [order, setOrder] = useState<Order | null>(null);
     const [globalFilter, setGlobalFilter] = useState('');
     const [searchText, setSearchText] = useState('');
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const toast = useRef<Toast>(null);
     const router = useRouter();
 
@@ -99,7 +102,7 @@ const OrdersPage = () => {
                 loadOrders();
 
                 const refreshId = window.setInterval(() => {
-                    loadOrders(searchText);
+                    loadOrders(searchText, 'refresh');
                 }, 15000);
 
                 return () => window.clearInterval(refreshId);
@@ -128,20 +131,32 @@ const OrdersPage = () => {
         };
     }, [router, searchText]);
 
-    const loadOrders = async (search?: string) => {
+    const loadOrders = async (search?: string, mode: 'replace' | 'refresh' | 'append' = 'replace') => {
         setLoading(true);
         try {
-            console.log('Loading orders with search:', search);
-            const response = await orderAPI.getAllOrders(search);
-            console.log('Orders response:', response);
-            
-            if (Array.isArray(response)) {
-                console.log('Orders are array:', response.length);
-                setOrders(response);
-            } else if (response.data && Array.isArray(response.data)) {
-                console.log('Orders in data:', response.data.length);
-                setOrders(response.data);
-            } else if (response.error) {
+            const response = await orderAPI.getAllOrders(search, {
+                cursor: mode === 'append' ? nextCursor : null,
+                pageSize: ORDERS_PAGE_SIZE
+            });
+
+            if (response && Array.isArray(response.results)) {
+                const page: Order[] = response.results;
+                if (mode === 'append') {
+                    setOrders((current) => [...current, ...page.filter((o) => !current.some((c) => c.id === o.id))]);
+                    setNextCursor(response.next_cursor || null);
+                } else if (mode === 'refresh') {
+                    // Làm mới trang đầu: cập nhật đơn đã có, thêm đơn mới lên đầu, giữ các trang đã tải thêm
+                    setOrders((current) => {
+                        const fresh = new Map(page.map((o) => [o.id, o]));
+                        const merged = current.map((o) => fresh.get(o.id) || o);
+                        const added = page.filter((o) => !current.some((c) => c.id === o.id));
+                        return [...added, ...merged];
+                    });
+                } else {
+                    setOrders(page);
+                    setNextCursor(response.next_cursor || null);
+                }
+            } else if (response?.error) {
                 console.error('API error:', response.error);
                 toast.current?.show({
                     severity: 'error',
@@ -163,6 +178,12 @@ const OrdersPage = () => {
         }
     };
 
+    const loadMoreOrders = () => {
+        if (nextCursor) {
+            loadOrders(searchText, 'append');
+        }
+    };
+
     const handleSearch = () => {
         loadOrders(searchText);
     };
@@ -440,6 +461,12 @@ const OrdersPage = () => {
                         <Column body={actionBodyTemplate} exportable={false} style={{ minWidth: '8rem' }}></Column>
                     </DataTable>
 
+                    {nextCursor && (
+                        <div className="flex justify-content-center mt-3">
+                            <Button label="Tải thêm đơn hàng" icon="pi pi-angle-down" outlined loading={loading} onClick={loadMoreOrders} />
+                        </div>
+                    )}
+
                     <Dialog visible={orderDialog} style={{ width: '70rem' }} breakpoints={{ '960px': '75vw', '641px': '90vw' }} header={`Chi Tiết Đơn Hàng - ${order?.order_code}`} modal className="p-fluid" footer={orderDialogFooter} onHide={hideDialog} maximizable>
                         {order && (
                             <div className="grid">
@@ -15,7 +15,8 @@ import {
   updateLocalCartItemQuantity, 
   removeItemFromLocalCart,
   clearLocalCart,
-  getLocalCartTotalQuantity
+  getLocalCartTotalQuantity,
+  convertLocalCartToApiFormat
 } from '@/services/localCart';
 
 interface CartItem {
@@ -58,7 +59,15 @@ const CartPage = () => {
             if (user) {
                 // User đã đăng nhập - load từ backend API
                 setIsAnonymousCart(false);
-                const response = await cartAPI.getCart();
+                // Giỏ local còn hàng (thêm trước khi đăng nhập): gộp lên server một lần
+                const localItems = convertLocalCartToApiFormat();
+                let response;
+                if (localItems.length > 0) {
+                    response = await cartAPI.syncItems(localItems);
+                    clearLocalCart();
+                } else {
+                    response = await cartAPI.getCart();
+                }
                 if (response) {
                     setCartData(response);
                     setCartCount(response.total_quantity || 0);
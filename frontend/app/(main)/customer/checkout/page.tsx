@@ -28,6 +28,8 @@ const CheckoutPage = () => {
     const router = useRouter();
     const { setCartCount } = useContext(LayoutContext);
     const toast = useRef<Toast>(null);
+    // Idempotency-Key của lượt đặt hàng hiện tại: bấm lại / retry cùng nội dung dùng lại key này
+    const orderAttemptRef = useRef<{ payload: string; key: string } | null>(null);
     const [cartItems, setCartItems] = useState<CartItem[]>([]);
     const [isBuyNow, setIsBuyNow] = useState(false);
     const [selectedItemIds, setSelectedItemIds] = useState<number[]>([]);
@@ -212,7 +214,13 @@ const CheckoutPage = () => {
                 items: itemsForOrder
             };
 
-            const response = await orderAPI.createOrder(orderData);
+            const payload = JSON.stringify(orderData);
+            if (!orderAttemptRef.current || orderAttemptRef.current.payload !== payload) {
+                // Nội dung đơn đổi (sửa địa chỉ, giỏ hàng...) là một lượt đặt hàng mới
+                orderAttemptRef.current = { payload, key: crypto.randomUUID() };
+            }
+
+            const response = await orderAPI.createOrder(orderData, orderAttemptRef.current.key);
 
             if (response && response.id) {
                 // Kiểm tra nếu là thanh toán MoMo
@@ -298,6 +306,8 @@ const CheckoutPage = () => {
                     router.push('/customer/orders');
                 }, 3000);
             } else {
+                // Server đã từ chối đơn: lần bấm sau là lượt mới, không phát lại lỗi cũ
+                orderAttemptRef.current = null;
                 toast.current?.show({
                     severity: 'error',
                     summary: 'Lỗi',
@@ -60,6 +60,7 @@ const ProductDetailPage = ({ params }: { params: { id: string } }) => {
     const [selectedSize, setSelectedSize] = useState<string>('');
     const [product, setProduct] = useState<Product | null>(null);
     const [loading, setLoading] = useState<boolean>(true);
+    const [recommendations, setRecommendations] = useState<any[]>([]);
 
     useEffect(() => {
         const load = async () => {
@@ -146,6 +147,15 @@ const ProductDetailPage = ({ params }: { params: { id: string } }) => {
         load();
     }, [params.id]);
 
+    useEffect(() => {
+        if (!product?.id) return;
+        // Sản phẩm thường được mua cùng
+        productAPI
+            .getRecommendations(product.id, 4)
+            .then((resp: any) => setRecommendations(Array.isArray(resp) ? resp : []))
+            .catch(() => setRecommendations([]));
+    }, [product?.id]);
+
     if (loading) {
         return (
             <div className="p-6 text-center">
@@ -651,7 +661,24 @@ const ProductDetailPage = ({ params }: { params: { id: string } }) => {
                 </div>
             </div>
 
-            {/* Related products section removed */}
+            {recommendations.length > 0 && (
+                <div className="col-12">
+                    <div className="card">
+                        <h3 className="text-900 font-bold mb-4">Thường được mua cùng</h3>
+                        <div className="grid">
+                            {recommendations.map((item: any) => (
+                                <div key={item.id} className="col-6 md:col-3">
+                                    <div className="border-1 surface-border border-round p-3 cursor-pointer h-full" onClick={() => router.push(`/customer/products/${item.id}`)}>
+                                        <img src={item.main_image_url || '/demo/images/product/placeholder.png'} alt={item.name} className="w-full border-round mb-2" style={{ height: '160px', objectFit: 'cover' }} />
+                                        <div className="text-900 font-medium mb-2">{item.name}</div>
+                                        <div className="text-primary font-bold">{Number(item.min_price ?? item.price).toLocaleString('vi-VN')}đ</div>
+                                    </div>
+                                </div>
+                            ))}
+                        </div>
+                    </div>
+                </div>
+            )}
         </div>
     );
 };
@@ -19,7 +19,7 @@ interface ProductCardProps {
   reviews_count: number;
   sold_count: number;
   stock: number;
-  specifications?: string;
+  specifications?: string | Record<string, any>;
   onAddToCart?: (productId: number) => void;
   compact?: boolean;
 }
@@ -47,7 +47,7 @@ export const ProductCard: React.FC<ProductCardProps> = ({
   const getSize = () => {
     try {
       if (specifications) {
-        const specs = JSON.parse(specifications);
+        const specs = typeof specifications === 'string' ? JSON.parse(specifications) : specifications;
         return specs.size || specs.kích_thước || 'N/A';
       }
     } catch (e) {
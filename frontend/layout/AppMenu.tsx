@@ -30,11 +30,11 @@ const AppMenu = () => {
 
         const loadAdminNotifications = async () => {
             try {
-                const ordersResponse = await orderAPI.getAllOrders();
-                const orders = Array.isArray(ordersResponse)
+                const ordersResponse = await orderAPI.getAllOrders(undefined, { pageSize: 100 });
+                const orders = Array.isArray(ordersResponse?.results)
+                    ? ordersResponse.results
+                    : Array.isArray(ordersResponse)
                     ? ordersResponse
-                    : Array.isArray(ordersResponse?.data)
-                    ? ordersResponse.data
                     : [];
 
                 const lastSeenRaw = localStorage.getItem(ADMIN_ORDERS_LAST_SEEN_KEY);
@@ -380,6 +380,38 @@ export const productAPI = {
         return await apiRequest(`/products/by_category/?${queryParams.toString()}`);
     },
 
+    // Lọc theo facet: mỗi facet chọn được nhiều giá trị, kết quả kèm số lượng theo từng giá trị
+    getFacets: async (params?: {
+        category?: (string | number)[];
+        price?: string[];
+        size?: string[];
+        color?: string[];
+        origin?: string[];
+        search?: string;
+        ordering?: string;
+        page?: number;
+    }) => {
+        const queryParams = new URLSearchParams();
+        (['category', 'price', 'size', 'color', 'origin'] as const).forEach((facet) => {
+            params?.[facet]?.forEach((value) => queryParams.append(facet, value.toString()));
+        });
+        if (params?.search) queryParams.append('search', params.search);
+        if (params?.ordering) queryParams.append('ordering', params.ordering);
+        if (params?.page) queryParams.append('page', params.page.toString());
+
+        return await apiRequest(`/products/facets/?${queryParams.toString()}`);
+    },
+
+    getRecommendations: async (idOrSlug: string | number, limit?: number) => {
+        const queryString = limit ? `?limit=${limit}` : '';
+        return await apiRequest(`/products/${idOrSlug}/recommendations/${queryString}`);
+    },
+
+    getSimilar: async (idOrSlug: string | number, limit?: number) => {
+        const queryString = limit ? `?limit=${limit}` : '';
+        return await apiRequest(`/products/${idOrSlug}/similar/${queryString}`);
+    },
+
     getLowStock: async () => {
         return await apiRequest('/products/low_stock/');
     },
@@ -436,6 +468,17 @@ export const productAPI = {
         });
     },
 
+    // Admin - Import / cập nhật hàng loạt từ file CSV hoặc XLSX
+    importFile: async (file: File) => {
+        const formData = new FormData();
+        formData.append('file', file);
+
+        return await apiRequest('/products/import_file/', {
+            method: 'POST',
+            body: formData
+        });
+    },
+
     deleteImage: async (id: number, imageId: number) => {
         return await apiRequest(`/products/${id}/delete_image/${imageId}/`, {
             method: 'DELETE'
@@ -481,7 +524,7 @@ export const orderAPI = {
             unit: string;
             image?: string;
         }>;
-    }) => {
+    }, idempotencyKey: string) => {
         // Transform items to match backend format - include price!
         const items = orderData.items.map(item => ({
             id: item.id.toString(),
@@ -490,8 +533,11 @@ export const orderAPI = {
             price: item.price.toString()  // Include price from checkout
         }));
 
+        // idempotencyKey do trang checkout tạo một lần cho mỗi lượt đặt hàng và gửi lại
+        // nguyên key khi bấm lại / retry, để server không tạo đơn trùng
         return await apiRequest('/orders/create_order/', {
             method: 'POST',
+            headers: { 'Idempotency-Key': idempotencyKey },
             body: JSON.stringify({
                 full_name: orderData.full_name,
                 phone: orderData.phone,
@@ -506,13 +552,24 @@ export const orderAPI = {
         });
     },
 
-    getMyOrders: async () => {
-        return await apiRequest('/orders/my_orders/');
+    // Có ETag: trình duyệt tự gửi If-None-Match khi poll lại, server trả 304 nếu không đổi
+    getMyOrders: async (options?: { summary?: boolean; cursor?: string | null; pageSize?: number }) => {
+        const params = new URLSearchParams();
+        if (options?.summary) params.append('summary', '1');
+        if (options?.cursor) params.append('cursor', options.cursor);
+        if (options?.pageSize) params.append('page_size', String(options.pageSize));
+        const queryString = params.toString();
+        return await apiRequest(`/orders/my_orders/${queryString ? '?' + queryString : ''}`);
     },
 
-    getAllOrders: async (search?: string) => {
+    // Trả về { results, next_cursor, has_more } (phân trang keyset)
+    getAllOrders: async (search?: string, options?: { cursor?: string | null; pageSize?: number; status?: string; paymentStatus?: string }) => {
         const params = new URLSearchParams();
         if (search) params.append('search', search);
+        if (options?.cursor) params.append('cursor', options.cursor);
+        if (options?.pageSize) params.append('page_size', String(options.pageSize));
+        if (options?.status) params.append('status', options.status);
+        if (options?.paymentStatus) params.append('payment_status', options.paymentStatus);
         const queryString = params.toString();
         return await apiRequest(`/orders/all_orders/${queryString ? '?' + queryString : ''}`);
     },
@@ -556,56 +613,61 @@ export const orderAPI = {
         return await apiRequest(`/orders/stats/${queryString ? '?' + queryString : ''}`);
     },
 
-    exportExcel: async (reportType?: string, startDate?: string, endDate?: string, categoryId?: number | null) => {
-        const token = getAuthToken();
-        const params = new URLSearchParams();
-        if (reportType) params.append('report_type', reportType);
-        if (startDate) params.append('start_date', startDate);
-        if (endDate) params.append('end_date', endDate);
-        if (categoryId) params.append('category_id', categoryId.toString());
-        
-        const url = `${API_BASE_URL}/orders/export_excel/${params.toString() ? '?' + params.toString() : ''}`;
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: { 'Authorization': `Bearer ${token}` }
+    // Báo cáo chạy nền: tạo job -> poll trạng thái -> tải file (server dùng lại kết quả nếu dữ liệu chưa đổi)
+    submitReport: async (format: 'xlsx' | 'pdf', reportType?: string, startDate?: string, endDate?: string, categoryId?: number | null) => {
+        return await apiRequest('/orders/submit_report/', {
+            method: 'POST',
+            body: JSON.stringify({
+                format,
+                report_type: reportType || 'revenue',
+                start_date: startDate || '',
+                end_date: endDate || '',
+                category_id: categoryId || ''
+            })
         });
-        if (!response.ok) throw new Error('Không thể xuất Excel');
-        const blob = await response.blob();
-        const downloadUrl = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = downloadUrl;
-        a.download = `bao_cao_${reportType || 'orders'}_${Date.now()}.xlsx`;
-        document.body.appendChild(a);
-        a.click();
-        window.URL.revokeObjectURL(downloadUrl);
-        document.body.removeChild(a);
     },
 
-    exportPDF: async (reportType?: string, startDate?: string, endDate?: string, categoryId?: number | null) => {
+    getReportStatus: async (jobId: number) => {
+        return await apiRequest(`/orders/report_status/?job_id=${jobId}`);
+    },
+
+    downloadReport: async (format: 'xlsx' | 'pdf', reportType?: string, startDate?: string, endDate?: string, categoryId?: number | null): Promise<void> => {
+        let job: any = await orderAPI.submitReport(format, reportType, startDate, endDate, categoryId);
+        if (!job || job.error) throw new Error(job?.error || 'Không thể tạo báo cáo');
+
+        const deadline = Date.now() + 10 * 60 * 1000;
+        while (job.status === 'pending' || job.status === 'running') {
+            if (Date.now() > deadline) throw new Error('Báo cáo xử lý quá lâu, vui lòng thử lại sau');
+            await new Promise((resolve) => setTimeout(resolve, 1500));
+            job = await orderAPI.getReportStatus(job.job_id);
+        }
+        if (job.status !== 'done') throw new Error(job.error || 'Không thể tạo báo cáo');
+
         const token = getAuthToken();
-        const params = new URLSearchParams();
-        if (reportType) params.append('report_type', reportType);
-        if (startDate) params.append('start_date', startDate);
-        if (endDate) params.append('end_date', endDate);
-        if (categoryId) params.append('category_id', categoryId.toString());
-        
-        const url = `${API_BASE_URL}/orders/export_pdf/${params.toString() ? '?' + params.toString() : ''}`;
-        const response = await fetch(url, {
+        const response = await fetch(`${API_BASE_URL}/orders/download_report/?job_id=${job.job_id}`, {
             method: 'GET',
             headers: { 'Authorization': `Bearer ${token}` }
         });
-        if (!response.ok) throw new Error('Không thể xuất PDF');
+        if (!response.ok) throw new Error('Không thể tải báo cáo');
         const blob = await response.blob();
         const downloadUrl = window.URL.createObjectURL(blob);
         const a = document.createElement('a');
         a.href = downloadUrl;
-        a.download = `bao_cao_${reportType || 'orders'}_${Date.now()}.pdf`;
+        a.download = `bao_cao_${reportType || 'orders'}_${Date.now()}.${format}`;
         document.body.appendChild(a);
         a.click();
         window.URL.revokeObjectURL(downloadUrl);
         document.body.removeChild(a);
     },
 
+    exportExcel: async (reportType?: string, startDate?: string, endDate?: string, categoryId?: number | null): Promise<void> => {
+        await orderAPI.downloadReport('xlsx', reportType, startDate, endDate, categoryId);
+    },
+
+    exportPDF: async (reportType?: string, startDate?: string, endDate?: string, categoryId?: number | null): Promise<void> => {
+        await orderAPI.downloadReport('pdf', reportType, startDate, endDate, categoryId);
+    },
+
     checkMoMoStatus: async (orderId: string) => {
         return await apiRequest(`/orders/momo-status/${orderId}/`);
     },
@@ -655,6 +717,14 @@ export const cartAPI = {
         return await apiRequest('/orders/cart/clear_cart/', {
             method: 'POST'
         });
+    },
+
+    // Gộp giỏ local vào giỏ server trong một request (sau khi đăng nhập)
+    syncItems: async (items: Array<{ product_id: number; quantity: number; unit: string }>) => {
+        return await apiRequest('/orders/cart/sync_items/', {
+            method: 'POST',
+            body: JSON.stringify({ items })
+        });
     }
 };
 